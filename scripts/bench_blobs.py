@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from peer_web import PeerCore  # noqa: E402
+from simnet import SimNetwork  # noqa: E402
+from blobs import BlobStore  # noqa: E402
+from bench_engines import rss_kb  # noqa: E402
+from bench_network import topology, cpu_s, TOPOLOGIES  # noqa: E402
+from bench_simnet import node_host  # noqa: E402
+
+
+def run_mode(opts: dict, blob: bool) -> dict:
+    """
+    Mesmo payload de `size_kb` KB por uma SimNetwork: inline (o payload
+    inteiro vai na mensagem e é repassado por todos os enlaces) ou como
+    blob (a malha leva o manifesto e os pedaços são buscados sob demanda).
+    Mede bytes no fio e tempo virtual até todos os nós terem o payload.
+    """
+    n = opts["nodes"]
+    rng = random.Random(opts["seed"])
+    net = SimNetwork(seed=opts["seed"], latency=opts["latency"], jitter=opts["jitter"],
+                     bandwidth=opts["bandwidth"])
+    edges = topology(opts["topology"], n, opts["degree"], opts["seed"])
+    dials = [[] for _ in range(n)]
+    for a, b in edges:
+        dials[b].append((node_host(a), opts["port"]))
+    tmp = tempfile.mkdtemp(prefix="bench_blobs_")
+    got = [0]
+
+    def on_message(msg):
+        if msg.get("type") == "msg":
+            got[0] += 1
+
+    nodes = []
+    for i in range(n):
+        store = BlobStore(os.path.join(tmp, str(i))) if blob else None
+        nodes.append(PeerCore(node_host(i), opts["port"], dials[i], queue_size=opts["queue_size"],
+                              on_message=on_message, node_id="%032x" % rng.getrandbits(128),
+                              transport=net.transport(), blob_store=store, blob_window=opts["window"]))
+    for core in nodes:
+        core.start()
+    net.run_while(lambda: sum(len(c.connections) for c in nodes) < 2 * len(edges), timeout=30.0)
+    net.run(until=net.now + 4 * (opts["latency"] + opts["jitter"]) + 0.01)
+
+    data = os.urandom(opts["size_kb"] * 1024)
+    src = os.path.join(tmp, "payload.bin")
+    with open(src, "wb") as f:
+        f.write(data)
+    bytes0, frames0 = net.bytes, net.frames
+    cpu0, wall0, rss0 = cpu_s(), time.perf_counter(), rss_kb()
+    start = net.now
+    origin = nodes[0]
+    if blob:
+        origin.send_file(src, "bench")
+        done = lambda: sum(c.blobs.completed for c in nodes[1:]) >= n - 1  # noqa: E731
+    else:
+        # Texto do mesmo tamanho: é como um arquivo grande iria hoje numa mensagem.
+        origin.send_text(data.hex()[:len(data)], "bench")
+        done = lambda: got[0] >= n  # noqa: E731
+    ok = net.run_while(lambda: not done(), timeout=opts["timeout"])
+    virtual = net.now - start
+    report = {
+        "complete": ok,
+        "virtual_s": round(virtual, 4),
+        "wire_mb": round((net.bytes - bytes0) / 1e6, 3),
+        "frames": net.frames - frames0,
+        "bytes_per_node_payload": round((net.bytes - bytes0) / (len(data) * (n - 1)), 3),
+        "cpu_s": round(cpu_s() - cpu0, 3),
+        "wall_s": round(time.perf_counter() - wall0, 3),
+        "rss_delta_kb": rss_kb() - rss0,
+    }
+    if blob:
+        st = [c.blob_stats() for c in nodes]
+        report["timeouts"] = sum(s["timeouts"] for s in st)
+        report["misses"] = sum(s["misses"] for s in st)
+        report["duplicate_chunks"] = sum(s["duplicate_chunks"] for s in st)
+    for core in nodes:
+        core.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Payload grande inline x blob em pedaços numa rede simulada (saída JSON).")
+    ap.add_argument("--nodes", "-n", type=int, default=50)
+    ap.add_argument("--topology", choices=TOPOLOGIES, default="random-regular")
+    ap.add_argument("--degree", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--size-kb", type=int, default=4096, help="tamanho do payload (KB)")
+    ap.add_argument("--window", type=int, default=8, help="pedaços em voo por transferência")
+    ap.add_argument("--latency", type=float, default=0.005)
+    ap.add_argument("--jitter", type=float, default=0.001)
+    ap.add_argument("--bandwidth", type=float, default=12.5e6, help="bytes/s por sentido de enlace (0 = sem limite)")
+    ap.add_argument("--queue-size", type=int, default=1024)
+    ap.add_argument("--port", type=int, default=7000)
+    ap.add_argument("--timeout", type=float, default=600.0, help="tempo virtual (s) máximo")
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args()
+
+    opts = {k: getattr(args, k) for k in ("nodes", "topology", "degree", "seed", "size_kb", "window", "latency",
+                                          "jitter", "bandwidth", "queue_size", "port", "timeout")}
+    report = {"config": opts, "inline": run_mode(opts, False), "blob": run_mode(opts, True)}
+    inline, blob = report["inline"], report["blob"]
+    if blob["wire_mb"]:
+        report["gain"] = {"wire_bytes": round(inline["wire_mb"] / blob["wire_mb"], 2),
+                          "virtual_time": round(inline["virtual_s"] / blob["virtual_s"], 2) if blob["virtual_s"] else 0.0}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import sys
+import json
+import timeit
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from common import encode_body, generate_msg  # noqa: E402
+from codec import NodeCodec, BinDecoder, decode_bin, SenderDefiner  # noqa: E402
+
+TEXT = "O peer repassa a mensagem para todos os vizinhos exceto quem enviou. "
+
+
+def payload_of(size: int) -> str:
+    return (TEXT * (size // len(TEXT) + 1))[:size]
+
+
+def per_op_us(fn, min_time: float) -> float:
+    n, t = timeit.Timer(fn).autorange()
+    total = n
+    while t < min_time:
+        k, dt = timeit.Timer(fn).autorange()
+        total += k
+        t += dt
+    return t / total * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Microbenchmark do codec: JSON vs bin1 (com e sem zlib) — tempo e bytes no fio.")
+    ap.add_argument("--sizes", default="16,256,4096,65536", help="tamanhos de payload (chars), separados por vírgula")
+    ap.add_argument("--min-time", type=float, default=0.5, help="tempo mínimo de medição por caso (s)")
+    ap.add_argument("--json", action="store_true", help="imprime o resultado como JSON")
+    args = ap.parse_args()
+
+    variants = [
+        ("json", None),
+        ("bin1", NodeCodec("bin1", compress_threshold=0)),
+        ("bin1+zlib", NodeCodec("bin1", compress_threshold=1024)),
+    ]
+    rows = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        msg = generate_msg("msg", "Peer6000", payload_of(size))
+        for name, node in variants:
+            if node is None:
+                body = encode_body(msg)
+                enc = lambda: encode_body(msg)  # noqa: E731
+                dec = lambda: json.loads(body)  # noqa: E731
+            else:
+                body = node.encode_bin(msg)
+                decoder = BinDecoder()
+                decoder.define(SenderDefiner(node.senders)(body))
+                enc = lambda node=node: node.encode_bin(msg)  # noqa: E731
+                dec = lambda body=body, decoder=decoder: decode_bin(body, decoder)  # noqa: E731
+            rows.append({
+                "payload": size,
+                "codec": name,
+                "wire_bytes": 4 + len(body),
+                "encode_us": round(per_op_us(enc, args.min_time), 3),
+                "decode_us": round(per_op_us(dec, args.min_time), 3),
+            })
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    base = {r["payload"]: r["wire_bytes"] for r in rows if r["codec"] == "json"}
+    cols = ["payload", "codec", "wire_bytes", "vs_json", "encode_us", "decode_us"]
+    print(" | ".join(f"{c:>10}" for c in cols))
+    for r in rows:
+        r["vs_json"] = f"{r['wire_bytes'] / base[r['payload']]:.2f}x"
+        print(" | ".join(f"{str(r[c]):>10}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
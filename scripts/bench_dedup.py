@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from dedup import make_dedup, DEDUP_KINDS  # noqa: E402
+from bench_engines import rss_kb  # noqa: E402
+
+
+def run_single(kind: str, count: int, capacity: int, fp_rate: float, probes: int) -> dict:
+    base_rss = rss_kb()
+    d = make_dedup(kind, capacity=capacity, ttl=1e9, fp_rate=fp_rate)
+
+    # Ids gerados em blocos para o custo do urandom ficar fora da medição.
+    block = 100_000
+    done = 0
+    elapsed = 0.0
+    while done < count:
+        n = min(block, count - done)
+        raw = os.urandom(16 * n)
+        ids = [raw[i:i + 16].hex() for i in range(0, 16 * n, 16)]
+        t0 = time.perf_counter()
+        for mid in ids:
+            d.check_and_add(mid)
+        # Reenvio de uma fração recente: o caminho de duplicata também conta.
+        for mid in ids[-(n // 10):]:
+            d.check_and_add(mid)
+        elapsed += time.perf_counter() - t0
+        done += n
+    ops = count + (count // 10)
+
+    # Falso positivo medido: ids nunca vistos que o filtro diz já ter visto.
+    fresh = [os.urandom(16).hex() for _ in range(probes)]
+    false_pos = sum(1 for mid in fresh if mid in d)
+
+    st = d.stats()
+    return {
+        "kind": kind,
+        "messages": count,
+        "ops_per_s": round(ops / elapsed),
+        "ns_per_op": round(elapsed / ops * 1e9),
+        "entries": st["entries"],
+        "memory_bytes": st["memory_bytes"],
+        "rss_delta_kb": rss_kb() - base_rss,
+        "fp_estimated": st["fp_rate"],
+        "fp_measured": false_pos / probes if probes else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de deduplicação: memória e vazão de lookup após N mensagens.")
+    ap.add_argument("--kind", choices=DEDUP_KINDS, help="roda só esta estrutura (uso interno)")
+    ap.add_argument("--count", type=int, default=10_000_000, help="mensagens distintas inseridas")
+    ap.add_argument("--capacity", type=int, default=1_000_000, help="ids lembrados (por geração no bloom)")
+    ap.add_argument("--fp-rate", type=float, default=1e-4, help="taxa de falso positivo alvo do bloom")
+    ap.add_argument("--probes", type=int, default=100_000, help="ids novos usados para medir falso positivo")
+    args = ap.parse_args()
+
+    if args.kind:
+        print(json.dumps(run_single(args.kind, args.count, args.capacity, args.fp_rate, args.probes)))
+        return
+
+    results = []
+    for kind in DEDUP_KINDS:
+        cmd = [sys.executable, __file__, "--kind", kind, "--count", str(args.count),
+               "--capacity", str(args.capacity), "--fp-rate", str(args.fp_rate), "--probes", str(args.probes)]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    cols = ["kind", "messages", "ops_per_s", "ns_per_op", "entries", "memory_bytes", "rss_delta_kb", "fp_estimated", "fp_measured"]
+    print(" | ".join(f"{c:>12}" for c in cols))
+    for r in results:
+        print(" | ".join(f"{(format(r[c], '.2e') if isinstance(r[c], float) else str(r[c])):>12}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
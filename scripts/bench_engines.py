@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import selectors
+import threading
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from common import send_msg, recv_msg, generate_msg  # noqa: E402
+
+
+def rss_kb() -> int:
+    """RSS atual do processo em KB (Linux: /proc; demais: pico via resource)."""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return 0
+
+
+def make_core(engine: str, host: str, port: int):
+    if engine == "asyncio":
+        from peer_async import AsyncPeerCore
+        return AsyncPeerCore(host, port)
+    from peer_web import PeerCore
+    return PeerCore(host, port)
+
+
+def drain(sel: selectors.DefaultSelector, stop: threading.Event):
+    """Esvazia os sockets que não são a sonda, para não travar o hub por janela TCP cheia."""
+    while not stop.is_set():
+        for key, _ in sel.select(timeout=0.1):
+            try:
+                if not key.fileobj.recv(65536):
+                    sel.unregister(key.fileobj)
+            except OSError:
+                sel.unregister(key.fileobj)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
+
+
+def run_single(engine: str, host: str, port: int, conns: int, msgs: int) -> dict:
+    base_rss = rss_kb()
+    base_threads = threading.active_count()
+
+    core = make_core(engine, host, port)
+    core.start()
+    time.sleep(0.2)
+
+    t0 = time.perf_counter()
+    clients = []
+    for _ in range(conns):
+        s = socket.create_connection((host, port))
+        clients.append(s)
+    while len(core.connections) < conns and time.perf_counter() - t0 < 30:
+        time.sleep(0.01)
+    connect_s = time.perf_counter() - t0
+
+    sender, probe = clients[0], clients[-1]
+    sel = selectors.DefaultSelector()
+    for s in clients[1:-1]:
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ)
+    stop = threading.Event()
+    threading.Thread(target=drain, args=(sel, stop), daemon=True).start()
+
+    latencies = []
+    for i in range(msgs):
+        msg = generate_msg("msg", "bench", f"m{i}")
+        t_send = time.perf_counter()
+        send_msg(sender, msg)
+        while True:
+            got = recv_msg(probe)
+            if got is None:
+                raise RuntimeError("sonda desconectada")
+            if got.get("id") == msg["id"]:
+                break
+        latencies.append((time.perf_counter() - t_send) * 1e6)
+
+    result = {
+        "engine": engine,
+        "connections": len(core.connections),
+        "threads": threading.active_count() - base_threads,
+        "rss_delta_kb": rss_kb() - base_rss,
+        "connect_s": round(connect_s, 4),
+        "msgs": msgs,
+        "lat_us_mean": round(sum(latencies) / len(latencies), 1),
+        "lat_us_p50": round(percentile(latencies, 50), 1),
+        "lat_us_p99": round(percentile(latencies, 99), 1),
+        "lat_us_max": round(max(latencies), 1),
+    }
+
+    stop.set()
+    for s in clients:
+        try:
+            s.close()
+        except OSError:
+            pass
+    core.stop()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark: engine com threads vs engine asyncio (conexões, memória, latência de encaminhamento).")
+    ap.add_argument("--engine", choices=["thread", "asyncio"], help="roda só este engine (uso interno)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=7100, help="porta do hub sob teste")
+    ap.add_argument("--conns", type=int, default=200, help="número de vizinhos conectados ao hub")
+    ap.add_argument("--msgs", type=int, default=1000, help="mensagens encaminhadas para medir latência")
+    args = ap.parse_args()
+
+    if args.engine:
+        res = run_single(args.engine, args.host, args.port, args.conns, args.msgs)
+        print(json.dumps(res))
+        sys.stdout.flush()
+        os._exit(0)
+
+    # Cada engine roda num processo separado para a medição de memória não se contaminar.
+    results = []
+    for i, engine in enumerate(["thread", "asyncio"]):
+        cmd = [sys.executable, __file__, "--engine", engine,
+               "--host", args.host, "--port", str(args.port + i),
+               "--conns", str(args.conns), "--msgs", str(args.msgs)]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    cols = ["engine", "connections", "threads", "rss_delta_kb", "connect_s",
+            "lat_us_mean", "lat_us_p50", "lat_us_p99", "lat_us_max"]
+    print(" | ".join(f"{c:>12}" for c in cols))
+    for r in results:
+        print(" | ".join(f"{str(r[c]):>12}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from peer_web import PeerCore, create_app  # noqa: E402
+
+
+def post(port: int, path: str, body: bytes, ctype: str) -> dict:
+    c = http.client.HTTPConnection("127.0.0.1", port)
+    c.request("POST", path, body=body, headers={"Content-Type": ctype})
+    r = c.getresponse()
+    data = json.loads(r.read())
+    c.close()
+    return data
+
+
+def run_mode(opts: dict, mode: str, base_port: int) -> dict:
+    """
+    Nó A com a UI Flask (servidor werkzeug de verdade) ligado a um nó B.
+    single: um POST /send por mensagem; batch: POST /send_batch com
+    `batch` itens (array JSON) ou ndjson (mesmo lote em NDJSON).
+    Mede mensagens/s aceitas pelo HTTP e o tempo até B receber todas.
+    """
+    from werkzeug.serving import make_server
+    got = [0]
+    done = threading.Event()
+    total = opts["messages"]
+
+    def on_message(msg):
+        got[0] += 1
+        if got[0] >= total:
+            done.set()
+
+    b = PeerCore("127.0.0.1", base_port + 1, [], on_message=on_message, history=None, target_degree=0,
+                 queue_size=opts["queue_size"])
+    b.start()
+    a = PeerCore("127.0.0.1", base_port, [("127.0.0.1", base_port + 1)], history=None, target_degree=0,
+                 queue_size=opts["queue_size"])
+    http_port = base_port + 2
+    app = create_app(a, "bench", "127.0.0.1", base_port, http_port)
+    a.wait_ready(3.0)
+    srv = make_server("127.0.0.1", http_port, app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+
+    texts = [f"m{i:08d}" + "x" * opts["size"] for i in range(total)]
+    acked = 0
+    t0 = time.perf_counter()
+    if mode == "single":
+        for t in texts:
+            acked += post(http_port, "/send", json.dumps({"text": t}).encode(), "application/json")["ok"]
+    else:
+        for k in range(0, total, opts["batch"]):
+            chunk = texts[k:k + opts["batch"]]
+            if mode == "ndjson":
+                body, ctype = "\n".join(json.dumps(t) for t in chunk).encode(), "application/x-ndjson"
+            else:
+                body, ctype = json.dumps(chunk).encode(), "application/json"
+            acked += post(http_port, "/send_batch", body, ctype)["accepted"]
+    http_s = time.perf_counter() - t0
+    done.wait(opts["timeout"])
+    delivered_s = time.perf_counter() - t0
+    srv.shutdown()
+    a.stop()
+    b.stop()
+    return {
+        "acked": acked,
+        "delivered": got[0],
+        "http_s": round(http_s, 3),
+        "http_msgs_per_s": round(acked / http_s, 1),
+        "delivered_s": round(delivered_s, 3),
+        "delivered_msgs_per_s": round(got[0] / delivered_s, 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingestão pela UI: POST /send por mensagem x /send_batch (saída JSON).")
+    ap.add_argument("--messages", type=int, default=5000)
+    ap.add_argument("--batch", type=int, default=1000, help="itens por /send_batch")
+    ap.add_argument("--size", type=int, default=64, help="bytes extras por texto")
+    ap.add_argument("--queue-size", type=int, default=1024)
+    ap.add_argument("--modes", default="single,batch,ndjson")
+    ap.add_argument("--port", type=int, default=7650)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args()
+
+    opts = {k: getattr(args, k) for k in ("messages", "batch", "size", "queue_size", "timeout")}
+    report = {"config": opts}
+    for i, mode in enumerate(m for m in args.modes.split(",") if m):
+        if mode not in ("single", "batch", "ndjson"):
+            ap.error(f"modo inválido: {mode}")
+        report[mode] = run_mode(opts, mode, args.port + 10 * i)
+    if "single" in report and "batch" in report and report["single"]["http_msgs_per_s"]:
+        report["gain"] = {"http": round(report["batch"]["http_msgs_per_s"] / report["single"]["http_msgs_per_s"], 2)}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
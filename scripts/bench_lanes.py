@@ -0,0 +1,169 @@
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from peer_web import PeerCore  # noqa: E402
+from simnet import SimNetwork  # noqa: E402
+from bench_engines import percentile  # noqa: E402
+from bench_network import topology, cpu_s, TOPOLOGIES  # noqa: E402
+from bench_simnet import node_host  # noqa: E402
+
+MODES = ("idle", "fifo", "lanes", "admission")
+
+
+def run_mode(opts: dict, mode: str) -> dict:
+    """
+    Mensagens interativas pequenas ("ping-<nó>") numa SimNetwork com
+    banda limitada, com e sem uma enxurrada de mensagens grandes de
+    `flooders` nós (remetente "bulk-<i>") acima do que os enlaces escoam.
+      idle:      só as interativas (referência)
+      fifo:      enxurrada, tudo numa faixa só (como antes das faixas)
+      lanes:     enxurrada na faixa bulk (--bulk-bytes)
+      admission: faixas + limite por remetente nos vizinhos (--sender-rate)
+    Mede a latência virtual de entrega das interativas nos outros nós.
+    """
+    n = opts["nodes"]
+    rng = random.Random(opts["seed"])
+    net = SimNetwork(seed=opts["seed"], latency=opts["latency"], jitter=opts["jitter"],
+                     bandwidth=opts["bandwidth"])
+    edges = topology(opts["topology"], n, opts["degree"], opts["seed"])
+    dials = [[] for _ in range(n)]
+    for a, b in edges:
+        dials[b].append((node_host(a), opts["port"]))
+    lat = []
+    bulk_got = [0]
+
+    def on_message(i: int, msg: dict):
+        sender = msg.get("sender", "")
+        if sender.startswith("ping-"):
+            if sender != f"ping-{i}":
+                lat.append(net.now - float(msg["payload"]))
+        elif sender.startswith("bulk-") and sender != f"bulk-{i}":
+            bulk_got[0] += 1
+
+    bulk_bytes = 0 if mode == "fifo" else opts["bulk_bytes"]
+    rate = opts["sender_rate"] if mode == "admission" else 0.0
+    nodes = [PeerCore(node_host(i), opts["port"], dials[i], queue_size=opts["queue_size"], history=None,
+                      on_message=lambda msg, i=i: on_message(i, msg), node_id="%032x" % rng.getrandbits(128),
+                      transport=net.transport(),
+                      bulk_bytes=bulk_bytes, sender_rate=rate, sender_burst=opts["sender_burst"])
+             for i in range(n)]
+    for core in nodes:
+        core.start()
+    net.run_while(lambda: sum(len(c.connections) for c in nodes) < 2 * len(edges), timeout=30.0)
+    net.run(until=net.now + 4 * (opts["latency"] + opts["jitter"]) + 0.01)
+
+    start = net.now
+    end = start + opts["duration"]
+    filler = "x" * (opts["bulk_kb"] * 1024)
+    flooders = nodes[:opts["flooders"]] if mode != "idle" else []
+    sent = {"ping": 0, "bulk": 0}
+
+    def flood(i: int, core: PeerCore):
+        if net.now >= end:
+            return
+        core.send_text(filler, f"bulk-{i}")
+        sent["bulk"] += 1
+        net.call_later(1.0 / opts["bulk_rate"], flood, i, core)
+
+    def ping():
+        if net.now >= end:
+            return
+        i = rng.randrange(n)
+        nodes[i].send_text(repr(net.now), f"ping-{i}")
+        sent["ping"] += 1
+        net.call_later(opts["ping_interval"], ping)
+
+    for i, core in enumerate(flooders):
+        net.call_later(0.0, flood, i, core)
+    # As interativas começam com a enxurrada já ocupando os enlaces.
+    net.call_later(opts["warmup"], ping)
+    cpu0, wall0 = cpu_s(), time.perf_counter()
+    net.run(until=end)
+    # Sem novas mensagens: espera as filas escoarem (ou o limite).
+    net.run_while(lambda: any(st["depth"] for c in nodes for st in c.neighbour_stats()), timeout=opts["drain"])
+    stats = [st for c in nodes for st in c.neighbour_stats()]
+    throttled = {}
+    for c in nodes:
+        for reason, v in c.admission_stats().get("throttled", {}).items():
+            throttled[reason] = throttled.get(reason, 0) + v
+    lanes = {}
+    for st in stats:
+        for lane, ls in st["lanes"].items():
+            agg = lanes.setdefault(lane, {"sent": 0, "dropped": 0})
+            agg["sent"] += ls["sent"]
+            agg["dropped"] += ls["dropped"]
+    report = {
+        "pings": sent["ping"],
+        "ping_deliveries": len(lat),
+        "ping_delivery_ratio": round(len(lat) / (sent["ping"] * (n - 1)), 4) if sent["ping"] else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(lat, 50) * 1e3, 2),
+            "p99": round(percentile(lat, 99) * 1e3, 2),
+            "max": round(max(lat) * 1e3, 2) if lat else 0.0,
+        },
+        "bulk_sent": sent["bulk"],
+        "bulk_deliveries": bulk_got[0],
+        "queue_dropped": sum(st["dropped"] for st in stats),
+        "lanes": lanes,
+        "throttled": throttled,
+        "cpu_s": round(cpu_s() - cpu0, 3),
+        "wall_s": round(time.perf_counter() - wall0, 3),
+    }
+    for core in nodes:
+        core.stop()
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Latência de mensagens interativas com enxurrada de bulk na malha: "
+                                             "fila única x faixas x faixas + admissão, numa rede simulada (saída JSON).")
+    ap.add_argument("--nodes", "-n", type=int, default=30)
+    ap.add_argument("--topology", choices=TOPOLOGIES, default="random-regular")
+    ap.add_argument("--degree", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--duration", type=float, default=5.0, help="segundos virtuais de tráfego")
+    ap.add_argument("--warmup", type=float, default=0.5, help="segundos de enxurrada antes da primeira interativa")
+    ap.add_argument("--ping-interval", type=float, default=0.02, help="intervalo virtual entre interativas")
+    ap.add_argument("--flooders", type=int, default=2, help="nós que originam a enxurrada")
+    ap.add_argument("--bulk-kb", type=int, default=32, help="tamanho (KB) de cada mensagem da enxurrada")
+    ap.add_argument("--bulk-rate", type=float, default=50.0, help="mensagens/s de cada nó da enxurrada")
+    ap.add_argument("--bulk-bytes", type=int, default=4096, help="limiar da faixa bulk")
+    ap.add_argument("--sender-rate", type=float, default=10.0, help="modo admission: mensagens/s por remetente")
+    ap.add_argument("--sender-burst", type=float, default=20.0, help="modo admission: rajada por remetente")
+    ap.add_argument("--latency", type=float, default=0.005)
+    ap.add_argument("--jitter", type=float, default=0.001)
+    ap.add_argument("--bandwidth", type=float, default=1.25e6, help="bytes/s por sentido de enlace")
+    ap.add_argument("--queue-size", type=int, default=1024)
+    ap.add_argument("--drain", type=float, default=120.0, help="tempo virtual máximo para as filas escoarem")
+    ap.add_argument("--modes", default=",".join(MODES), help="subconjunto de " + ",".join(MODES))
+    ap.add_argument("--port", type=int, default=7000)
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args()
+
+    opts = {k: getattr(args, k) for k in ("nodes", "topology", "degree", "seed", "duration", "warmup", "ping_interval",
+                                          "flooders", "bulk_kb", "bulk_rate", "bulk_bytes", "sender_rate",
+                                          "sender_burst", "latency", "jitter", "bandwidth", "queue_size", "drain",
+                                          "port")}
+    report = {"config": opts}
+    for mode in (m for m in args.modes.split(",") if m):
+        if mode not in MODES:
+            ap.error(f"modo inválido: {mode}")
+        report[mode] = run_mode(opts, mode)
+    if "fifo" in report and "lanes" in report and report["lanes"]["latency_ms"]["p99"]:
+        report["gain"] = {"p99": round(report["fifo"]["latency_ms"]["p99"] / report["lanes"]["latency_ms"]["p99"], 2)}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
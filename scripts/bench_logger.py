@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from multiprocessing import Queue
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from logger_proc import LoggerProcess  # noqa: E402
+
+# (nome, opções do LoggerProcess). "per_event" reproduz o writer antigo
+# (um write + flush por evento); "per_event+fsync" é o equivalente durável
+# sem group commit.
+VARIANTS = [
+    ("per_event", {"batch_size": 1, "flush_bytes": 0}),
+    ("per_event+fsync", {"batch_size": 1, "flush_bytes": 0, "fsync": "batch"}),
+    ("batch", {}),
+    ("batch+fsync_interval", {"fsync": "interval"}),
+    ("batch+fsync_batch", {"fsync": "batch"}),
+]
+
+
+def run_variant(opts: dict, events: int, payload: str, rotate_mb: int, high_water: int) -> dict:
+    with tempfile.TemporaryDirectory() as d:
+        q = Queue()
+        logger = LoggerProcess(q, os.path.join(d, "bench.jsonl"), rotate_mb=rotate_mb,
+                               high_water=high_water, **opts)
+        logger.start()
+        t0 = time.perf_counter()
+        for i in range(events):
+            logger.submit({"ts": time.time(), "peer": "bench", "kind": "recv",
+                           "data": {"id": f"{i:032x}", "sender": "bench", "payload": payload}})
+        q.put(None)
+        logger.join()
+        dt = time.perf_counter() - t0
+        files = os.listdir(d)
+        disk = sum(os.path.getsize(os.path.join(d, f)) for f in files)
+    written = events - logger.shed
+    return {
+        "events": events,
+        "written": written,
+        "shed": logger.shed,
+        "seconds": round(dt, 3),
+        "events_per_s": round(written / dt) if dt else 0,
+        "files": len(files),
+        "disk_bytes": disk,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Vazão do LoggerProcess (eventos/s, do primeiro submit ao último byte em disco).")
+    ap.add_argument("--events", type=int, default=200_000)
+    ap.add_argument("--payload", type=int, default=64, help="tamanho do payload de cada evento (chars)")
+    ap.add_argument("--rotate-mb", type=int, default=5)
+    ap.add_argument("--high-water", type=int, default=10 ** 9, help="nível de descarte (padrão: sem descarte)")
+    ap.add_argument("--only", help="roda só as variantes listadas (separadas por vírgula)")
+    ap.add_argument("--json", action="store_true", help="imprime o resultado como JSON")
+    args = ap.parse_args()
+
+    only = set(args.only.split(",")) if args.only else None
+    payload = "x" * args.payload
+    rows = []
+    for name, opts in VARIANTS:
+        if only and name not in only:
+            continue
+        r = run_variant(opts, args.events, payload, args.rotate_mb, args.high_water)
+        r["variant"] = name
+        rows.append(r)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    cols = ["variant", "events_per_s", "seconds", "written", "shed", "files", "disk_bytes"]
+    print(" | ".join(f"{c:>20}" for c in cols))
+    for r in rows:
+        print(" | ".join(f"{str(r[c]):>20}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
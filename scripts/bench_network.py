@@ -0,0 +1,426 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from common import generate_msg  # noqa: E402
+from dedup import make_dedup, DEDUP_KINDS  # noqa: E402
+from codec import NodeCodec, CODECS  # noqa: E402
+from plumtree import flood_stats  # noqa: E402
+from bench_engines import rss_kb, percentile  # noqa: E402
+
+TOPOLOGIES = ("mesh", "random-regular", "chain", "star")
+NODES = ("core", "async", "peer")
+
+Edge = Tuple[int, int]
+
+
+# ---- topologias ---------------------------------------------------------
+
+def random_regular(n: int, degree: int, rng: random.Random) -> List[Edge]:
+    """Grafo d-regular aleatório: pareamento de "pontas" com recomeço quando trava."""
+    if degree >= n or (n * degree) % 2:
+        raise ValueError(f"não existe grafo {degree}-regular com {n} nós")
+    for _ in range(200):
+        stubs = [i for i in range(n) for _ in range(degree)]
+        rng.shuffle(stubs)
+        edges = set()
+        while stubs:
+            a = stubs.pop()
+            for _ in range(50):
+                j = rng.randrange(len(stubs))
+                b = stubs[j]
+                e = (min(a, b), max(a, b))
+                if a != b and e not in edges:
+                    stubs[j] = stubs[-1]
+                    stubs.pop()
+                    edges.add(e)
+                    break
+            else:
+                break
+        if not stubs and len(edges) * 2 == n * degree:
+            return sorted(edges)
+    raise RuntimeError("não consegui gerar o grafo regular; tente outra semente")
+
+
+def topology(kind: str, n: int, degree: int = 4, seed: int = 0) -> List[Edge]:
+    """Arestas (a, b) com a < b; quem disca é sempre b."""
+    if kind == "chain":
+        return [(i - 1, i) for i in range(1, n)]
+    if kind == "star":
+        return [(0, i) for i in range(1, n)]
+    if kind == "mesh":
+        return [(a, b) for b in range(n) for a in range(b)]
+    if kind == "random-regular":
+        return random_regular(n, degree, random.Random(seed))
+    raise ValueError(f"topologia desconhecida: {kind}")
+
+
+# ---- nó sob teste (mesmo código no modo in-process e no worker) ---------
+
+class Node:
+    """
+    Um peer sob teste e o que ele mede: latência de cada entrega (relógio de
+    parede do emissor no payload vs. chegada) e contadores de duplicados.
+    O Peer não tem callback de entrega; as latências saem do log JSONL dele.
+    """
+    def __init__(self, index: int, kind: str, host: str, port: int, opts: dict, log_dir: str):
+        self.index = index
+        self.kind = kind
+        self.name = f"N{index}"
+        self.host = host
+        self.port = port
+        self.latencies: List[float] = []
+        self.delivered = 0
+        self._lock = threading.Lock()
+        dedup = make_dedup(opts["dedup"])
+        codec = NodeCodec(opts["codec"])
+        common_opts = dict(queue_size=opts["queue_size"], dedup=dedup, codec=codec)
+        if kind == "peer":
+            from peer import Peer
+            cwd = os.getcwd()
+            os.chdir(log_dir)  # o Peer grava em logs/peer_<porta>.jsonl relativo ao cwd
+            try:
+                self.node = Peer(host, port, name=self.name, dissemination=opts["dissemination"], **common_opts)
+            finally:
+                os.chdir(cwd)
+            self.log_path = os.path.join(log_dir, "logs", f"peer_{port}.jsonl")
+        elif kind == "async":
+            from peer_async import AsyncPeerCore
+            self.node = AsyncPeerCore(host, port, on_message=self._on_message, **common_opts)
+        else:
+            from peer_web import PeerCore
+            self.node = PeerCore(host, port, on_message=self._on_message,
+                                 dissemination=opts["dissemination"], **common_opts)
+
+    def _on_message(self, msg: dict):
+        now = time.time()
+        payload = msg.get("payload")
+        if isinstance(payload, dict) and "t" in payload:
+            with self._lock:
+                self.latencies.append((now - payload["t"]) * 1000)
+                self.delivered += 1
+
+    def start(self):
+        if self.kind == "peer":
+            # Peer.start() prende o terminal no input(); aqui só a parte de rede.
+            self.node.start_network()
+        else:
+            self.node.start()
+
+    def connect(self, peers: List[Tuple[str, int]]):
+        for h, p in peers:
+            self.node.connect_to_peer(h, p)
+
+    def links(self) -> int:
+        return len(self.node.connections)
+
+    def inject(self, count: int, rate: float) -> int:
+        """Origina `count` mensagens a `rate` msg/s (rajada se rate <= 0)."""
+        t0 = time.perf_counter()
+        for k in range(count):
+            if rate > 0:
+                delay = t0 + k / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            msg = generate_msg("msg", self.name, {"t": time.time(), "k": k})
+            self.node.seen_msgs.add(msg["id"])
+            if self.kind == "peer":
+                self.node.log("send", {"id": msg["id"], "payload": msg["payload"]})
+            self.node.broadcast(msg)
+        return count
+
+    def count(self) -> int:
+        if self.kind == "peer":
+            st = self.node.seen_msgs.stats()
+            return st["checks"] - st["duplicates"]
+        return self.delivered
+
+    def stop(self) -> dict:
+        """Para o nó e devolve as medições."""
+        dis = self.node.dissemination_stats() if hasattr(self.node, "dissemination_stats") \
+            else flood_stats(self.node.seen_msgs)
+        if self.kind == "peer":
+            # O dedup conta a entrega antes do log "recv" (feito após o relay): dá tempo a ele.
+            time.sleep(0.2)
+            self.node.shutdown()
+            self.node.logger.join(timeout=10)
+            self.latencies = peer_log_latencies(self.log_path)
+            self.delivered = len(self.latencies)
+        else:
+            self.node.stop()
+        return {
+            "node": self.index,
+            "delivered": self.delivered,
+            "duplicates": dis["duplicates"],
+            "latencies": self.latencies,
+        }
+
+
+def peer_log_latencies(log_path: str) -> List[float]:
+    from log_query import log_files, open_log
+    out = []
+    for path in log_files(log_path):
+        with open_log(path) as f:
+            for line in f:
+                evt = json.loads(line)
+                if evt.get("kind") != "recv":
+                    continue
+                payload = (evt.get("data") or {}).get("payload")
+                if isinstance(payload, dict) and "t" in payload:
+                    out.append((evt["ts"] - payload["t"]) * 1000)
+    return out
+
+
+def cpu_s() -> float:
+    t = os.times()
+    return t.user + t.system
+
+
+# ---- worker (um nó por processo) ----------------------------------------
+
+def worker_main(args):
+    """Recebe comandos JSON por stdin e responde por stdout; a saída do nó vai para /dev/null."""
+    proto = os.fdopen(os.dup(1), "w", buffering=1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    sys.stdout = open(os.devnull, "w")
+    opts = json.loads(args.opts)
+    node = Node(args.index, opts["node"], opts["host"], opts["base_port"] + args.index, opts, args.log_dir)
+    node.start()
+    proto.write(json.dumps({"ok": True}) + "\n")
+    for line in sys.stdin:
+        cmd = json.loads(line)
+        op = cmd["cmd"]
+        if op == "connect":
+            node.connect([tuple(p) for p in cmd["peers"]])
+            res = {"ok": True}
+        elif op == "links":
+            res = {"links": node.links()}
+        elif op == "inject":
+            res = {"sent": node.inject(cmd["count"], cmd["rate"])}
+        elif op == "count":
+            res = {"count": node.count()}
+        elif op == "stop":
+            res = node.stop()
+            res["cpu_s"] = round(cpu_s(), 3)
+            res["rss_kb"] = rss_kb()
+            proto.write(json.dumps(res) + "\n")
+            break
+        else:
+            res = {"error": f"comando desconhecido: {op}"}
+        proto.write(json.dumps(res) + "\n")
+    proto.flush()
+    os._exit(0)
+
+
+class WorkerProxy:
+    """Mesma interface do Node, falando com um worker em outro processo."""
+    def __init__(self, index: int, opts: dict, log_dir: str):
+        self.index = index
+        cmd = [sys.executable, __file__, "--worker", str(index), "--opts", json.dumps(opts), "--log-dir", log_dir]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self._pending: Optional[dict] = None
+
+    def wait_ready(self):
+        self._read()
+
+    def _read(self) -> dict:
+        line = self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"worker {self.index} terminou (código {self.proc.poll()})")
+        return json.loads(line)
+
+    def call(self, cmd: dict) -> dict:
+        self.send(cmd)
+        return self._read()
+
+    def send(self, cmd: dict):
+        self.proc.stdin.write(json.dumps(cmd) + "\n")
+        self.proc.stdin.flush()
+
+    def connect(self, peers):
+        self.call({"cmd": "connect", "peers": peers})
+
+    def links(self) -> int:
+        return self.call({"cmd": "links"})["links"]
+
+    def count(self) -> int:
+        return self.call({"cmd": "count"})["count"]
+
+    def stop(self) -> dict:
+        res = self.call({"cmd": "stop"})
+        self.proc.wait(timeout=30)
+        return res
+
+
+# ---- execução -----------------------------------------------------------
+
+def run(opts: dict) -> dict:
+    n = opts["nodes"]
+    edges = topology(opts["topology"], n, opts["degree"], opts["seed"])
+    host, base = opts["host"], opts["base_port"]
+    log_dir = tempfile.mkdtemp(prefix="bench_network_")
+    base_rss = rss_kb()
+    base_cpu = cpu_s()
+
+    t0 = time.perf_counter()
+    if opts["mode"] == "subprocess":
+        nodes = [WorkerProxy(i, opts, log_dir) for i in range(n)]
+        for w in nodes:
+            w.wait_ready()
+    else:
+        nodes = [Node(i, opts["node"], host, base + i, opts, log_dir) for i in range(n)]
+        for node in nodes:
+            node.start()
+    time.sleep(opts["settle"])
+    dials = [[] for _ in range(n)]
+    for a, b in edges:
+        dials[b].append((host, base + a))
+    for i, node in enumerate(nodes):
+        if dials[i]:
+            node.connect(dials[i])
+    deadline = time.perf_counter() + 30
+    links = 0
+    while time.perf_counter() < deadline:
+        links = sum(node.links() for node in nodes)
+        if links >= 2 * len(edges):
+            break
+        time.sleep(0.05)
+    setup_s = time.perf_counter() - t0
+
+    senders = list(range(n)) if opts["senders"] <= 0 else list(range(min(n, opts["senders"])))
+    per_sender = opts["messages"] // len(senders)
+    rate = opts["rate"] / len(senders) if opts["rate"] > 0 else 0
+    injected = per_sender * len(senders)
+    expected = injected * (n - 1)
+
+    t_inject = time.perf_counter()
+    if opts["mode"] == "subprocess":
+        for i in senders:
+            nodes[i].send({"cmd": "inject", "count": per_sender, "rate": rate})
+        for i in senders:
+            nodes[i]._read()
+    else:
+        threads = [threading.Thread(target=nodes[i].inject, args=(per_sender, rate)) for i in senders]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    inject_s = time.perf_counter() - t_inject
+
+    # Espera a rede esvaziar: tudo entregue ou contagem parada por `quiet` segundos.
+    last, last_change = -1, time.perf_counter()
+    while True:
+        total = sum(node.count() for node in nodes)
+        now = time.perf_counter()
+        if total != last:
+            last, last_change = total, now
+        if total >= expected or now - last_change >= opts["quiet"] or now - t_inject > opts["timeout"]:
+            break
+        time.sleep(0.02)
+    window_s = last_change - t_inject
+
+    results = [node.stop() for node in nodes]
+    shutil.rmtree(log_dir, ignore_errors=True)
+    lat = sorted(x for r in results for x in r.pop("latencies"))
+    delivered = sum(r["delivered"] for r in results)
+    duplicates = sum(r["duplicates"] for r in results)
+    degree = [0] * n
+    for a, b in edges:
+        degree[a] += 1
+        degree[b] += 1
+    for r in results:
+        r["degree"] = degree[r["node"]]
+
+    report = {
+        "config": opts,
+        "edges": len(edges),
+        "links_up": links // 2,
+        "setup_s": round(setup_s, 3),
+        "injected": injected,
+        "inject_s": round(inject_s, 3),
+        "inject_rate": round(injected / inject_s, 1) if inject_s else 0.0,
+        "expected_deliveries": expected,
+        "deliveries": delivered,
+        "delivery_ratio": round(delivered / expected, 4) if expected else 0.0,
+        "throughput_deliveries_per_s": round(delivered / window_s, 1) if window_s > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(lat, 50), 3),
+            "p99": round(percentile(lat, 99), 3),
+            "max": round(lat[-1], 3) if lat else 0.0,
+            "mean": round(sum(lat) / len(lat), 3) if lat else 0.0,
+        },
+        "duplicate_ratio": round(duplicates / delivered, 4) if delivered else 0.0,
+        "nodes": results,
+    }
+    if opts["mode"] != "subprocess":
+        # Todos os nós dividem o processo: só dá para medir o total.
+        report["process"] = {"cpu_s": round(cpu_s() - base_cpu, 3), "rss_delta_kb": rss_kb() - base_rss}
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark headless de propagação em topologias de N peers (saída JSON).")
+    ap.add_argument("--nodes", "-n", type=int, default=10)
+    ap.add_argument("--topology", choices=TOPOLOGIES, default="random-regular")
+    ap.add_argument("--degree", type=int, default=4, help="grau do random-regular")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--node", choices=NODES, default="core", help="core: PeerCore | async: AsyncPeerCore | peer: Peer (com logger)")
+    ap.add_argument("--mode", choices=["inprocess", "subprocess"], default="inprocess",
+                    help="subprocess: um processo por nó (CPU/RSS por nó)")
+    ap.add_argument("--messages", "-m", type=int, default=1000, help="total de mensagens originadas")
+    ap.add_argument("--rate", type=float, default=500.0, help="msg/s somando todos os emissores (0 = rajada)")
+    ap.add_argument("--senders", type=int, default=1, help="quantos nós originam (0 = todos)")
+    ap.add_argument("--dissemination", choices=["flood", "plumtree"], default="flood")
+    ap.add_argument("--codec", choices=CODECS, default="json")
+    ap.add_argument("--dedup", choices=DEDUP_KINDS, default="window")
+    ap.add_argument("--queue-size", type=int, default=1024)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--base-port", type=int, default=7300)
+    ap.add_argument("--settle", type=float, default=0.5, help="espera (s) entre subir os nós e conectar")
+    ap.add_argument("--quiet", type=float, default=1.0, help="fim da medição após (s) sem novas entregas")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    ap.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--opts", help=argparse.SUPPRESS)
+    ap.add_argument("--log-dir", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker is not None:
+        args.index = args.worker
+        worker_main(args)
+        return
+
+    opts = {k: getattr(args, k) for k in ("nodes", "topology", "degree", "seed", "node", "mode", "messages",
+                                          "rate", "senders", "dissemination", "codec", "dedup", "queue_size",
+                                          "host", "base_port", "settle", "quiet", "timeout")}
+    if args.node == "peer" and args.mode == "inprocess":
+        # Peer imprime cada mensagem; no modo in-process isso vira ruído na saída JSON.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = run(opts)
+    else:
+        report = run(opts)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing as mp
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from common import FrameReader  # noqa: E402
+from outbound import make_frame  # noqa: E402
+from relay import ACCEPT_MODES, REUSEPORT  # noqa: E402
+
+
+def sender_main(host: str, port: int, index: int, count: int, size: int, batch: int, copies: int, result, done):
+    """
+    Origina `count` mensagens em rajadas de `batch` frames por sendall. Com
+    copies > 1 cada mensagem vai por `copies` conexões (em geral workers
+    diferentes): o dedup compartilhado tem de descartar as cópias.
+    """
+    conns = [socket.create_connection((host, port)) for _ in range(copies)]
+    for s in conns:
+        # O relay também repassa para estas conexões: descarta o que chega.
+        threading.Thread(target=_drain, args=(s,), daemon=True).start()
+    payload = "x" * size
+    frames = []
+    for k in range(count):
+        body = json.dumps({"type": "msg", "id": uuid.uuid4().hex, "sender": f"bench-{index}",
+                           "payload": payload, "ts": k}).encode()
+        frames.extend(make_frame(body))
+    t0 = time.perf_counter()
+    for k in range(0, len(frames), 2 * batch):
+        chunk = b"".join(frames[k:k + 2 * batch])
+        for s in conns:
+            s.sendall(chunk)
+    result.put(time.perf_counter() - t0)
+    # Fechar com bytes não lidos manda RST, e o relay perderia o que ainda não leu desta conexão.
+    done.wait()
+    for s in conns:
+        s.close()
+
+
+def _drain(s: socket.socket):
+    try:
+        while s.recv(1 << 16):
+            pass
+    except OSError:
+        pass
+
+
+class Receiver:
+    """Conexão que só recebe: conta frames e corpos distintos (entrega exatamente uma vez)."""
+    def __init__(self, host: str, port: int):
+        self.sock = socket.create_connection((host, port))
+        self.frames = 0
+        self.seen = set()
+        self.first = self.last = 0.0
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        reader = FrameReader(self.sock)
+        try:
+            while True:
+                data = reader.read_frame()
+                if data is None:
+                    break
+                if not self.frames:
+                    self.first = time.perf_counter()
+                self.frames += 1
+                self.seen.add(bytes(data))
+                self.last = time.perf_counter()
+        except OSError:
+            pass
+
+
+def wait_port(host: str, port: int, timeout: float = 20.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def run(opts: dict, workers: int) -> dict:
+    host, port = "127.0.0.1", opts["port"]
+    cmd = [sys.executable, str(ROOT / "src" / "relay.py"), "--host", host, "--port", str(port),
+           "--workers", str(workers), "--accept", opts["accept"], "--target-degree", "0",
+           "--px-interval", "0", "--queue-size", str(opts["queue_size"]), "--stats-interval", "3600",
+           "--node-id-file", os.path.join(opts["tmp"], f"node_{port}.id")]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    try:
+        if not wait_port(host, port):
+            raise RuntimeError("relay não subiu")
+        time.sleep(0.5)
+        receivers = [Receiver(host, port) for _ in range(opts["receivers"])]
+        time.sleep(0.5)
+        ctx = mp.get_context("spawn")
+        result, done = ctx.Queue(), ctx.Event()
+        total = opts["senders"] * opts["count"]
+        senders = [ctx.Process(target=sender_main, args=(host, port, i, opts["count"], opts["size"],
+                                                         opts["batch"], opts["copies"], result, done))
+                   for i in range(opts["senders"])]
+        for p in senders:
+            p.start()
+        expected = total * len(receivers)
+        deadline = time.monotonic() + opts["timeout"]
+        while sum(r.frames for r in receivers) < expected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        done.set()
+        for p in senders:
+            p.join()
+        send_s = max(result.get() for _ in senders)
+        frames = sum(r.frames for r in receivers)
+        distinct = sum(len(r.seen) for r in receivers)
+        # Do primeiro frame entregue ao último: sem o tempo de subir os processos.
+        first = min((r.first for r in receivers if r.frames), default=0.0)
+        elapsed = max(max((r.last for r in receivers), default=0.0) - first, 1e-9)
+        for r in receivers:
+            r.sock.close()
+    finally:
+        proc.terminate()
+        out, _ = proc.communicate(timeout=30)
+    stats = {}
+    for line in out.splitlines():
+        if line.startswith("[RELAY] {"):
+            stats = json.loads(line[len("[RELAY] "):])
+    return {
+        "workers": workers,
+        "messages": total,
+        "deliveries": frames,
+        "expected": expected,
+        "duplicates_delivered": frames - distinct,
+        "delivery_ratio": round(distinct / expected, 4) if expected else 0.0,
+        "elapsed_s": round(elapsed, 3),
+        "send_s": round(send_s, 3),
+        "msgs_per_s": round(total / elapsed, 1),
+        "deliveries_per_s": round(frames / elapsed, 1),
+        "relay": {k: stats.get(k) for k in ("received", "duplicates", "forwarded", "ring_messages")},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Vazão do relay multi-core (src/relay.py) por número de workers, "
+                                             "com senders e receivers TCP locais (saída JSON).")
+    ap.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="lista de números de workers a medir")
+    ap.add_argument("--accept", choices=ACCEPT_MODES, default=REUSEPORT)
+    ap.add_argument("--senders", type=int, default=4, help="conexões (processos) que originam mensagens")
+    ap.add_argument("--receivers", type=int, default=8, help="conexões que só recebem")
+    ap.add_argument("--copies", type=int, default=1, help="conexões por sender levando as mesmas mensagens")
+    ap.add_argument("--count", type=int, default=20000, help="mensagens por sender")
+    ap.add_argument("--size", type=int, default=64, help="bytes de payload por mensagem")
+    ap.add_argument("--batch", type=int, default=256, help="frames por sendall no sender")
+    ap.add_argument("--queue-size", type=int, default=1_000_000, help="fila por vizinho no relay (grande: sem descartes)")
+    ap.add_argument("--port", type=int, default=7700)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args()
+
+    opts = {k: getattr(args, k) for k in ("accept", "senders", "copies", "receivers", "count", "size", "batch",
+                                          "queue_size", "port", "timeout")}
+    report = {"config": dict(opts, cpus=os.cpu_count())}
+    with tempfile.TemporaryDirectory(prefix="bench_relay_") as tmp:
+        opts["tmp"] = tmp
+        runs = []
+        for i, w in enumerate(int(x) for x in args.workers.split(",") if x):
+            # Porta nova por rodada: sem esperar o TIME_WAIT da anterior.
+            runs.append(run(dict(opts, port=args.port + i), w))
+    report["runs"] = runs
+    if len(runs) > 1 and runs[0]["msgs_per_s"]:
+        report["scaling"] = round(runs[-1]["msgs_per_s"] / runs[0]["msgs_per_s"], 2)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
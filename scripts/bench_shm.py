@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from common import encode_body  # noqa: E402
+from outbound import make_frame  # noqa: E402
+from peer_web import PeerCore  # noqa: E402
+from transport import TcpTransport  # noqa: E402
+from shmring import ShmRing, host_id  # noqa: E402
+from bench_engines import percentile  # noqa: E402
+
+PING, PONG, BULK, DONE, ACK = "bench_ping", "bench_pong", "bench_bulk", "bench_done", "bench_ack"
+
+
+def make_node(port: int, peers, shm: bool, ring_kb: int) -> PeerCore:
+    return PeerCore("127.0.0.1", port, peers, history=None, px_interval=0, queue_size=4096,
+                    transport=TcpTransport(shm=shm, ring_bytes=ring_kb * 1024))
+
+
+def echo_node(port: int, shm: bool, ring_kb: int, ready, stop):
+    """Processo do outro lado: devolve pings e conta o bulk."""
+    core = make_node(port, [], shm, ring_kb)
+    count = [0, 0]
+
+    def on_ping(out, env):
+        out.enqueue(make_frame(encode_body({"type": PONG, "payload": env.msg.get("payload")})))
+
+    def on_bulk(out, env):
+        count[0] += 1
+        count[1] += len(env.msg.get("payload") or "")
+
+    def on_done(out, env):
+        out.enqueue(make_frame(encode_body({"type": ACK, "payload": {"frames": count[0], "bytes": count[1]}})))
+        count[0] = count[1] = 0
+
+    core.link_handlers.update({PING: on_ping, BULK: on_bulk, DONE: on_done})
+    core.start()
+    ready.set()
+    stop.wait()
+    core.stop()
+
+
+def run_mode(opts: dict, shm: bool, port: int) -> dict:
+    ctx = mp.get_context("spawn")
+    ready, stop = ctx.Event(), ctx.Event()
+    child = ctx.Process(target=echo_node, args=(port, shm, opts["ring_kb"], ready, stop), daemon=True)
+    child.start()
+    try:
+        if not ready.wait(10):
+            raise RuntimeError("nó de eco não subiu")
+        return measure(opts, shm, port)
+    finally:
+        stop.set()
+        child.join(5)
+
+
+def measure(opts: dict, shm: bool, port: int) -> dict:
+    core = make_node(port + 1, [("127.0.0.1", port)], shm, opts["ring_kb"])
+    pong = threading.Event()
+    acks = []
+    acked = threading.Event()
+
+    def on_pong(out, env):
+        pong.set()
+
+    def on_ack(out, env):
+        acks.append(env.msg.get("payload") or {})
+        acked.set()
+
+    core.link_handlers.update({PONG: on_pong, ACK: on_ack})
+    core.start()
+    deadline = time.monotonic() + 5
+    while not core.connections and time.monotonic() < deadline:
+        time.sleep(0.01)
+    out = next(iter(core.connections.values()))
+    # Espera o hello_ack (e a troca para o anel, se houver).
+    time.sleep(0.3)
+    transport = out.stats()["transport"]
+
+    # Latência: ping-pong sequencial.
+    ping = make_frame(encode_body({"type": PING, "payload": "x" * opts["ping_size"]}))
+    rtt = []
+    for i in range(opts["warmup"] + opts["pings"]):
+        pong.clear()
+        t0 = time.perf_counter()
+        out.enqueue(ping)
+        if not pong.wait(5):
+            raise RuntimeError("pong não chegou")
+        if i >= opts["warmup"]:
+            rtt.append(time.perf_counter() - t0)
+
+    # Vazão: frames em sequência, limitados pela fila de saída (sem descartar).
+    bulk = make_frame(encode_body({"type": BULK, "payload": "x" * opts["size"]}))
+    high = out.maxlen // 2
+    syscalls0 = out.syscalls
+    acked.clear()
+    t0 = time.perf_counter()
+    for _ in range(opts["frames"]):
+        while out.depth() >= high:
+            time.sleep(0.0001)
+        out.enqueue(bulk)
+    out.enqueue(make_frame(encode_body({"type": DONE})))
+    if not acked.wait(60):
+        raise RuntimeError("ack do bulk não chegou")
+    wall = time.perf_counter() - t0
+    got = acks[-1]
+    syscalls = out.syscalls - syscalls0
+    core.stop()
+
+    rtt.sort()
+    frame_bytes = 4 + len(bulk[1])
+    return {
+        "transport": transport,
+        "rtt_us": {
+            "p50": round(percentile(rtt, 50) * 1e6, 1),
+            "p99": round(percentile(rtt, 99) * 1e6, 1),
+            "mean": round(sum(rtt) / len(rtt) * 1e6, 1),
+        },
+        "throughput": {
+            "frames": got.get("frames"),
+            "wall_s": round(wall, 3),
+            "frames_per_s": round(opts["frames"] / wall, 1),
+            "mb_per_s": round(opts["frames"] * frame_bytes / wall / 1e6, 2),
+            "send_syscalls": syscalls,
+        },
+    }
+
+
+# ---- só o transporte: anel x socket, sem nó em cima -----------------------
+
+def raw_peer(port: int, rings, pings: int, total: int):
+    """Outro processo: ecoa `pings` mensagens e depois consome `total` bytes e confirma."""
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    rx = tx = sock
+    if rings:
+        (rx_name, rx_fifo), (tx_name, tx_fifo) = rings
+        rx, tx = ShmRing.attach(rx_name, rx_fifo, sock), ShmRing.attach(tx_name, tx_fifo, sock)
+    view = memoryview(bytearray(256 * 1024))
+    for _ in range(pings):
+        n = rx.recv_into(view)
+        send(tx, [view[:n]])
+    got = 0
+    while got < total:
+        got += rx.recv_into(view)
+    send(tx, [b"k"])
+    if rings:
+        rx.close()
+        tx.close()
+    sock.close()
+
+
+def send(dst, bufs):
+    if isinstance(dst, socket.socket):
+        dst.sendmsg(bufs)
+    else:
+        dst.write(bufs)
+
+
+def run_raw(opts: dict, shm: bool) -> dict:
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen()
+    tmpdir = tempfile.mkdtemp(prefix="bench_shm_")
+    size = opts["ring_kb"] * 1024
+    rings = None
+    a2b = b2a = None
+    if shm:
+        a2b = ShmRing.create(size, os.path.join(tmpdir, "a2b"), None)
+        b2a = ShmRing.create(size, os.path.join(tmpdir, "b2a"), None)
+        rings = ((a2b.name, a2b.fifo_path), (b2a.name, b2a.fifo_path))
+    batch = [b"x" * 1024] * 64
+    rounds = opts["raw_mb"] * 1024 * 1024 // (64 * 1024)
+    ctx = mp.get_context("spawn")
+    child = ctx.Process(target=raw_peer, args=(srv.getsockname()[1], rings, opts["pings"], rounds * 64 * 1024),
+                        daemon=True)
+    child.start()
+    sock, _ = srv.accept()
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    tx = rx = sock
+    if shm:
+        a2b.sock = b2a.sock = sock
+        tx, rx = a2b, b2a
+    view = memoryview(bytearray(256 * 1024))
+    ping = [b"x" * (4 + opts["ping_size"])]
+    rtt = []
+    cpu0 = time.process_time()
+    for _ in range(opts["pings"]):
+        t0 = time.perf_counter()
+        send(tx, ping)
+        rx.recv_into(view)
+        rtt.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    cpu1 = time.process_time()
+    for _ in range(rounds):
+        send(tx, batch)
+    rx.recv_into(view)
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu1
+    child.join(5)
+    for ring in (a2b, b2a):
+        if ring is not None:
+            ring.close()
+    sock.close()
+    srv.close()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    rtt.sort()
+    return {
+        "rtt_us": {"p50": round(percentile(rtt, 50) * 1e6, 1), "p99": round(percentile(rtt, 99) * 1e6, 1)},
+        "mb_per_s": round(rounds * 64 * 1024 / wall / 1e6, 1),
+        "sender_cpu_us_per_64k": round(cpu / rounds * 1e6, 2),
+        "ping_cpu_us": round((cpu1 - cpu0) / opts["pings"] * 1e6, 2),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Enlace entre dois processos no mesmo host: TCP loopback x memória compartilhada (saída JSON).")
+    ap.add_argument("--pings", type=int, default=2000, help="ida e volta medidas")
+    ap.add_argument("--warmup", type=int, default=200)
+    ap.add_argument("--ping-size", type=int, default=64, help="bytes de payload do ping")
+    ap.add_argument("--frames", type=int, default=100000, help="frames do teste de vazão")
+    ap.add_argument("--size", type=int, default=1024, help="bytes de payload por frame de vazão")
+    ap.add_argument("--ring-kb", type=int, default=1024, help="tamanho (KB) de cada anel")
+    ap.add_argument("--raw-mb", type=int, default=256, help="MB do teste de vazão só do transporte")
+    ap.add_argument("--port", type=int, default=7600)
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args()
+
+    opts = {k: getattr(args, k) for k in ("pings", "warmup", "ping_size", "frames", "size", "ring_kb", "raw_mb",
+                                          "port")}
+    report = {"config": opts, "host_id": host_id(), "cpus": os.cpu_count()}
+    # Só o transporte (sem decodificar frames) e depois o enlace entre dois PeerCore.
+    report["raw"] = {"tcp": run_raw(opts, False), "shm": run_raw(opts, True)}
+    report["tcp"] = run_mode(opts, False, args.port)
+    report["shm"] = run_mode(opts, True, args.port + 10)
+    raw, tcp, shm = report["raw"], report["tcp"], report["shm"]
+    report["gain"] = {
+        "raw_rtt_p50": round(raw["tcp"]["rtt_us"]["p50"] / raw["shm"]["rtt_us"]["p50"], 2),
+        "raw_mb_per_s": round(raw["shm"]["mb_per_s"] / raw["tcp"]["mb_per_s"], 2),
+    }
+    if shm["transport"] == "shm":
+        report["gain"]["node_rtt_p50"] = round(tcp["rtt_us"]["p50"] / shm["rtt_us"]["p50"], 2)
+        report["gain"]["node_frames_per_s"] = round(shm["throughput"]["frames_per_s"] /
+                                                    tcp["throughput"]["frames_per_s"], 2)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from dedup import make_dedup, DEDUP_KINDS  # noqa: E402
+from codec import NodeCodec, CODECS  # noqa: E402
+from peer_web import PeerCore  # noqa: E402
+from simnet import SimNetwork  # noqa: E402
+from bench_engines import rss_kb, percentile  # noqa: E402
+from bench_network import topology, cpu_s, TOPOLOGIES  # noqa: E402
+
+
+def node_host(i: int) -> str:
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+
+def run(opts: dict) -> dict:
+    """
+    Sobe `nodes` PeerCore numa SimNetwork, conecta pela topologia, origina
+    `messages` mensagens de nós sorteados a cada `interval` s (virtuais) e
+    mede cobertura, tempo de convergência (virtual), custo de repasse
+    (frames e CPU real por entrega) e memória do dedup.
+    """
+    n = opts["nodes"]
+    rng = random.Random(opts["seed"])
+    net = SimNetwork(seed=opts["seed"], latency=opts["latency"], jitter=opts["jitter"],
+                     bandwidth=opts["bandwidth"], loss=opts["loss"])
+    edges = topology(opts["topology"], n, opts["degree"], opts["seed"])
+    dials: List[List] = [[] for _ in range(n)]
+    for a, b in edges:
+        dials[b].append((node_host(a), opts["port"]))
+
+    sent_at: Dict[str, float] = {}
+    arrivals: Dict[str, List[float]] = {}
+
+    def on_message(msg: dict):
+        t = sent_at.get(msg.get("id"))
+        if t is not None:
+            arrivals[msg["id"]].append(net.now - t)
+
+    base_rss = rss_kb()
+    t0 = time.perf_counter()
+    nodes = []
+    for i in range(n):
+        nodes.append(PeerCore(node_host(i), opts["port"], dials[i], on_message=on_message,
+                              queue_size=opts["queue_size"],
+                              dedup=make_dedup(opts["dedup"], capacity=opts["dedup_capacity"]),
+                              codec=NodeCodec(opts["codec"]), dissemination=opts["dissemination"],
+                              graft_timeout=opts["graft_timeout"],
+                              node_id="%032x" % rng.getrandbits(128), transport=net.transport()))
+    nodes_rss = rss_kb() - base_rss
+    for core in nodes:
+        core.start()
+    links_ok = net.run_while(lambda: sum(len(c.connections) for c in nodes) < 2 * len(edges), timeout=30.0)
+    # Espera também os hello_ack: com bin1 a troca de codec precisa ter acontecido.
+    net.run(until=net.now + 4 * (opts["latency"] + opts["jitter"]) + 0.01)
+    setup_wall = time.perf_counter() - t0
+    setup_virtual = net.now
+
+    frames0, bytes0, events0 = net.frames, net.bytes, net.events
+    cpu0, wall0 = cpu_s(), time.perf_counter()
+    payload = "x" * opts["payload"]
+    start = net.now
+    senders = n if opts["senders"] <= 0 else min(n, opts["senders"])
+    for k in range(opts["messages"]):
+        origin = nodes[rng.randrange(senders)]
+        msg = {"id": "%032x" % rng.getrandbits(128), "type": "msg", "sender": origin.node_id[:8], "payload": payload}
+        net.call_at(start + k * opts["interval"], originate, net, origin, msg, sent_at, arrivals)
+    expected = opts["messages"] * (n - 1)
+    last_send = start + (opts["messages"] - 1) * opts["interval"]
+    net.run(until=last_send)
+    net.run_while(lambda: sum(len(a) for a in arrivals.values()) < expected, timeout=opts["timeout"])
+    # Repara o que falta (IHAVE/GRAFT) e deixa os controles do plumtree assentarem.
+    net.run(until=net.now + opts["settle"])
+    wall = time.perf_counter() - wall0
+    cpu = cpu_s() - cpu0
+    frames, nbytes = net.frames - frames0, net.bytes - bytes0
+
+    per_msg = []
+    lat = []
+    for msg_id, arr in arrivals.items():
+        lat.extend(arr)
+        per_msg.append((len(arr), max(arr) if arr else 0.0))
+    delivered = len(lat)
+    full = [t for count, t in per_msg if count == n - 1]
+    convergence = sorted(full)
+    dedup = [c.seen_msgs.stats() for c in nodes]
+    dis = [c.dissemination_stats() for c in nodes]
+    dups = sum(d["duplicates"] for d in dis)
+    trace = hashlib.sha256(json.dumps(sorted((k, sorted(round(x, 9) for x in v)) for k, v in arrivals.items())).encode())
+
+    report = {
+        "config": opts,
+        "edges": len(edges),
+        "links_up": sum(len(c.connections) for c in nodes) // 2,
+        "links_ok": links_ok,
+        "setup": {"wall_s": round(setup_wall, 3), "virtual_s": round(setup_virtual, 4), "node_rss_kb": nodes_rss,
+                  "rss_per_node_kb": round(nodes_rss / n, 1)},
+        "messages": opts["messages"],
+        "expected_deliveries": expected,
+        "deliveries": delivered,
+        "delivery_ratio": round(delivered / expected, 4) if expected else 0.0,
+        "fully_covered": len(full),
+        "convergence_ms": {
+            "p50": round(percentile(convergence, 50) * 1000, 3),
+            "p99": round(percentile(convergence, 99) * 1000, 3),
+            "max": round(convergence[-1] * 1000, 3) if convergence else 0.0,
+        },
+        "latency_ms": {
+            "p50": round(percentile(lat, 50) * 1000, 3),
+            "p99": round(percentile(lat, 99) * 1000, 3),
+            "mean": round(sum(lat) / len(lat) * 1000, 3) if lat else 0.0,
+        },
+        "forwarding": {
+            "frames": frames,
+            "bytes": nbytes,
+            "frames_per_message": round(frames / opts["messages"], 1) if opts["messages"] else 0.0,
+            "frames_per_delivery": round(frames / delivered, 3) if delivered else 0.0,
+            "duplicate_ratio": round(dups / delivered, 4) if delivered else 0.0,
+            "cpu_us_per_delivery": round(cpu / delivered * 1e6, 2) if delivered else 0.0,
+            "lost": net.lost,
+        },
+        "dedup": {
+            "kind": opts["dedup"],
+            "memory_bytes_total": sum(d["memory_bytes"] for d in dedup),
+            "memory_bytes_per_node": round(sum(d["memory_bytes"] for d in dedup) / n, 1),
+            "entries_per_node": round(sum(d["entries"] for d in dedup) / n, 1),
+        },
+        "simulator": {
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "virtual_s": round(net.now - start, 4),
+            "events": net.events - events0,
+            "events_per_s": round((net.events - events0) / wall, 1) if wall else 0.0,
+            "rss_delta_kb": rss_kb() - base_rss,
+        },
+        # Mesma semente e mesmas opções devem dar o mesmo hash.
+        "trace_sha256": trace.hexdigest()[:16],
+        "net": net.stats(),
+    }
+    for core in nodes:
+        core.stop()
+    return report
+
+
+# Regressão do plumtree: uma origem e mensagens a cada 2 ms com latência e
+# jitter de 1 ms. Com o jitter do tamanho do intervalo, cada nó recebe
+# primeiro por vizinhos diferentes e os PRUNE cruzam com GRAFT e payloads
+# em trânsito; uma árvore quebrada aparece como entregas que esperam o
+# graft_timeout e duplicados que não param.
+CHECK = {"nodes": 8, "topology": "random-regular", "degree": 3, "messages": 300, "senders": 1, "interval": 0.002,
+         "latency": 0.001, "jitter": 0.001, "bandwidth": 0.0, "loss": 0.0, "dissemination": "plumtree"}
+
+
+def check(opts: dict, seeds: int, max_repair_ms: float, max_duplicate_ratio: float) -> dict:
+    """Roda CHECK com as sementes seed..seed+seeds-1; ok se todas cobrem tudo dentro dos limites."""
+    runs = []
+    for seed in range(opts["seed"], opts["seed"] + seeds):
+        r = run(dict(opts, **CHECK, seed=seed))
+        runs.append({
+            "seed": seed,
+            "delivery_ratio": r["delivery_ratio"],
+            "repair_ms": r["convergence_ms"]["max"],
+            "latency_p99_ms": r["latency_ms"]["p99"],
+            "duplicate_ratio": r["forwarding"]["duplicate_ratio"],
+            "trace_sha256": r["trace_sha256"],
+        })
+    failed = [r["seed"] for r in runs if r["delivery_ratio"] < 1.0 or r["repair_ms"] > max_repair_ms
+              or r["duplicate_ratio"] > max_duplicate_ratio]
+    return {
+        "config": dict(opts, **CHECK, seeds=seeds),
+        "limits": {"repair_ms": max_repair_ms, "duplicate_ratio": max_duplicate_ratio},
+        "runs": runs,
+        "failed": failed,
+        "ok": not failed,
+    }
+
+
+def originate(net: SimNetwork, core: PeerCore, msg: dict, sent_at: Dict[str, float], arrivals: Dict[str, List[float]]):
+    sent_at[msg["id"]] = net.now
+    arrivals[msg["id"]] = []
+    core.seen_msgs.add(msg["id"])
+    core.metrics.originated.inc()
+    core.broadcast(msg)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Milhares de PeerCore numa rede simulada em memória, com relógio virtual (saída JSON).")
+    ap.add_argument("--nodes", "-n", type=int, default=1000)
+    ap.add_argument("--topology", choices=TOPOLOGIES, default="random-regular")
+    ap.add_argument("--degree", type=int, default=4, help="grau do random-regular")
+    ap.add_argument("--seed", type=int, default=1, help="semente da topologia, do escalonador e dos nós")
+    ap.add_argument("--messages", "-m", type=int, default=100, help="mensagens originadas por nós sorteados")
+    ap.add_argument("--senders", type=int, default=0, help="sorteia a origem entre os primeiros N nós (0 = todos)")
+    ap.add_argument("--interval", type=float, default=0.01, help="intervalo virtual (s) entre mensagens")
+    ap.add_argument("--payload", type=int, default=64, help="bytes de payload")
+    ap.add_argument("--latency", type=float, default=0.005, help="latência (s) de cada enlace")
+    ap.add_argument("--jitter", type=float, default=0.001, help="jitter máximo (s) somado à latência")
+    ap.add_argument("--bandwidth", type=float, default=0.0, help="bytes/s por sentido de enlace (0 = sem limite)")
+    ap.add_argument("--loss", type=float, default=0.0, help="probabilidade de perda de cada frame")
+    ap.add_argument("--dissemination", choices=["flood", "plumtree"], default="flood")
+    ap.add_argument("--graft-timeout", type=float, default=0.5, help="plumtree: espera (s) antes do GRAFT")
+    ap.add_argument("--codec", choices=CODECS, default="json")
+    ap.add_argument("--dedup", choices=DEDUP_KINDS, default="window")
+    ap.add_argument("--dedup-capacity", type=int, default=10000,
+                    help="ids por nó (o bloom aloca já: 1M ids = ~5 MB por nó)")
+    ap.add_argument("--queue-size", type=int, default=1024, help="frames em trânsito por enlace")
+    ap.add_argument("--port", type=int, default=7000)
+    ap.add_argument("--settle", type=float, default=1.0, help="tempo virtual (s) extra após a última entrega")
+    ap.add_argument("--timeout", type=float, default=60.0, help="tempo virtual (s) máximo esperando as entregas")
+    ap.add_argument("--check", action="store_true",
+                    help="regressão do plumtree (cenário CHECK, ignora topologia e tráfego); sai com 1 se falhar")
+    ap.add_argument("--seeds", type=int, default=20, help="--check: sementes a partir de --seed")
+    ap.add_argument("--max-repair-ms", type=float, default=50.0,
+                    help="--check: convergência máxima (ms) de qualquer mensagem")
+    ap.add_argument("--max-duplicate-ratio", type=float, default=0.05, help="--check: duplicados por entrega")
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args()
+
+    opts = {k: getattr(args, k) for k in ("nodes", "topology", "degree", "seed", "messages", "senders", "interval",
+                                          "payload", "latency", "jitter", "bandwidth", "loss", "dissemination",
+                                          "graft_timeout", "codec", "dedup", "dedup_capacity", "queue_size",
+                                          "port", "settle", "timeout")}
+    if args.check:
+        report = check(opts, args.seeds, args.max_repair_ms, args.max_duplicate_ratio)
+    else:
+        report = run(opts)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    if args.check and not report["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
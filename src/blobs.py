@@ -0,0 +1,681 @@
+import os
+import re
+import json
+import mmap
+import shutil
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from codec import BLOB_CHUNK, CHUNK_MAGIC
+from outbound import Frame, make_frame, BULK
+from transport import THREADS
+
+# Manifesto: mensagem comum (dedup, flood/plumtree, histórico), pequena.
+BLOB = "blob"
+# Frames de enlace da transferência (os pedaços vêm em frames binários, ver codec.py).
+BLOB_WANT = "blob_want"
+BLOB_MISS = "blob_miss"
+BLOB_TYPES = (BLOB_WANT, BLOB_MISS, BLOB_CHUNK)
+
+DEFAULT_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+# Índices por blob_want e pedidos estacionados por transferência.
+MAX_WANT = 64
+MAX_PARKED = 256
+
+_CHUNK = struct.Struct("!B16sI")
+_ROOT = re.compile(r"[0-9a-f]{32}\Z")
+
+
+def valid_root(root) -> bool:
+    """Id de blob bem formado (hex do blake2b de 16 bytes): nunca vira outro caminho do store."""
+    return isinstance(root, str) and _ROOT.match(root) is not None
+
+
+def chunk_digest(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def blob_root(size: int, chunk: int, hashes: List[str]) -> str:
+    """Id do blob: hash do tamanho, do tamanho de pedaço e dos hashes dos pedaços."""
+    h = hashlib.blake2b(struct.pack("!QI", size, chunk), digest_size=16)
+    for x in hashes:
+        h.update(bytes.fromhex(x))
+    return h.hexdigest()
+
+
+def check_manifest(payload) -> Optional[dict]:
+    """Manifesto normalizado, ou None se não fecha (tamanhos, hashes ou id)."""
+    if not isinstance(payload, dict):
+        return None
+    try:
+        size, chunk = int(payload["size"]), int(payload["chunk"])
+        hashes = [str(x) for x in payload["hashes"]]
+        root = str(payload["blob"])
+        if size < 0 or not 0 < chunk <= MAX_CHUNK or len(hashes) != -(-size // chunk):
+            return None
+        if blob_root(size, chunk, hashes) != root:
+            return None
+    except (KeyError, TypeError, ValueError):
+        return None
+    return {"blob": root, "name": str(payload.get("name") or root), "size": size, "chunk": chunk,
+            "hashes": hashes}
+
+
+def chunk_frame(raw_root: bytes, idx: int, data) -> Frame:
+    return make_frame(_CHUNK.pack(CHUNK_MAGIC, raw_root, idx) + data)
+
+
+def _sendfile_copy(src: str, dst: str):
+    """Cópia dentro do kernel (sendfile), sem passar os bytes pelo Python."""
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        size = os.fstat(fi.fileno()).st_size
+        off = 0
+        try:
+            while off < size:
+                n = os.sendfile(fo.fileno(), fi.fileno(), off, size - off)
+                if not n:
+                    break
+                off += n
+        except (AttributeError, OSError):
+            # Sem sendfile entre arquivos (Windows, alguns sistemas de arquivos).
+            fi.seek(off)
+            fo.seek(off)
+            shutil.copyfileobj(fi, fo, 1024 * 1024)
+
+
+class BlobStore:
+    """
+    Blobs no disco, endereçados pelo conteúdo: `<dir>/<id>` só existe
+    completo e conferido. Os em transferência ficam em `<id>.part`, do
+    tamanho final, e cada pedaço é gravado direto no mmap do arquivo: a
+    memória do processo não cresce com o tamanho do blob. O manifesto
+    fica ao lado, em `<id>.manifest`: é dele (nunca do pedido) que sai o
+    tamanho de pedaço ao servir um blob que já saiu da memória.
+    """
+    def __init__(self, path: str, open_files: int = 32):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.open_files = open_files
+        self._fds: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def final(self, root: str) -> str:
+        return os.path.join(self.path, root)
+
+    def part(self, root: str) -> str:
+        return os.path.join(self.path, root + ".part")
+
+    def manifest_path(self, root: str) -> str:
+        return os.path.join(self.path, root + ".manifest")
+
+    def has(self, root: str) -> bool:
+        return valid_root(root) and os.path.exists(self.final(root))
+
+    def save_manifest(self, m: dict):
+        """Grava o manifesto antes do blob ir para `<id>`: blob completo sempre tem o seu."""
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(m, f)
+            os.replace(tmp, self.manifest_path(m["blob"]))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def load_manifest(self, root: str) -> Optional[dict]:
+        """Manifesto conferido de um blob completo, ou None (ausente, corrompido ou de outro id)."""
+        if not self.has(root):
+            return None
+        try:
+            with open(self.manifest_path(root)) as f:
+                m = check_manifest(json.load(f))
+        except (OSError, ValueError):
+            return None
+        if m is None or m["blob"] != root or os.path.getsize(self.final(root)) != m["size"]:
+            return None
+        return m
+
+    def import_file(self, src: str, name: Optional[str] = None, chunk: int = DEFAULT_CHUNK) -> dict:
+        """Calcula o manifesto lendo um pedaço por vez e copia o arquivo para o store."""
+        hashes = []
+        size = 0
+        with open(src, "rb") as f:
+            while True:
+                data = f.read(chunk)
+                if not data:
+                    break
+                hashes.append(chunk_digest(data))
+                size += len(data)
+        root = blob_root(size, chunk, hashes)
+        m = {"blob": root, "name": name or os.path.basename(src), "size": size, "chunk": chunk,
+             "hashes": hashes}
+        if not self.has(root):
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            os.close(fd)
+            try:
+                _sendfile_copy(src, tmp)
+                self.save_manifest(m)
+                os.replace(tmp, self.final(root))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        return m
+
+    def read_chunk(self, root: str, idx: int, chunk: int) -> Optional[bytes]:
+        if not 0 < chunk <= MAX_CHUNK or idx < 0 or not valid_root(root):
+            return None
+        with self._lock:
+            fd = self._fds.get(root)
+            if fd is None:
+                try:
+                    fd = os.open(self.final(root), os.O_RDONLY)
+                except OSError:
+                    return None
+                self._fds[root] = fd
+                if len(self._fds) > self.open_files:
+                    os.close(self._fds.popitem(last=False)[1])
+            else:
+                self._fds.move_to_end(root)
+            return os.pread(fd, chunk, idx * chunk)
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+
+class _Transfer:
+    """Estado de um blob conhecido: o que temos, a quem pedir e o que está em voo."""
+    def __init__(self, m: dict):
+        self.manifest = m
+        self.root = m["blob"]
+        self.raw = bytes.fromhex(self.root)
+        self.size = m["size"]
+        self.chunk = m["chunk"]
+        self.hashes = m["hashes"]
+        self.n = len(self.hashes)
+        self.have = bytearray(self.n)
+        self.missing = self.n
+        self.complete = False
+        self.wanted = False
+        self.active = False
+        self.msg_ids: List[str] = []
+        # Vizinhos que anunciaram o manifesto, na ordem em que serão tentados.
+        self.holders: Dict[object, None] = {}
+        self.rr = 0
+        self.next = 0
+        self.retry: "deque[int]" = deque()
+        self.inflight: Dict[int, Tuple[object, float]] = {}
+        self.waiters: Dict[int, List] = {}
+        # Vizinhos que responderam não ter o pedaço (ainda): pedidos a outro.
+        self.skip: Dict[int, set] = {}
+        self.stalled: List[int] = []
+        self.parked = 0
+        self.fd: Optional[int] = None
+        self.mm: Optional[mmap.mmap] = None
+
+    def span(self, idx: int) -> Tuple[int, int]:
+        off = idx * self.chunk
+        return off, min(self.chunk, self.size - off)
+
+
+class BlobSync:
+    """
+    Transferência de payloads grandes em pedaços endereçados pelo conteúdo.
+
+    Quem publica manda pela malha só o manifesto (mensagem BLOB: id, nome,
+    tamanho e hash de cada pedaço). Cada nó que quer o blob, ou que recebe
+    um pedido dele, pede pedaços aos vizinhos que anunciaram o manifesto
+    (blob_want), até `window` pedaços em voo por transferência e até
+    `max_active` transferências ao mesmo tempo, distribuindo os pedidos
+    entre os vizinhos. Um pedido que um vizinho ainda não pode atender
+    fica estacionado com ele e sai assim que o pedaço chega (o blob passa
+    pelo relay sem esperar o fim); quem não conhece o blob responde
+    blob_miss. Pedido sem resposta em `timeout` vai para outro vizinho.
+
+    Cada pedaço atravessa cada enlace usado no máximo uma vez, então o
+    tráfego deixa de ser payload × arestas. Blobs de até `auto_fetch_bytes`
+    são buscados assim que o manifesto chega; os maiores só com fetch()
+    ou quando algum vizinho pede.
+
+    Como o HistorySync, trata enlaces como objetos opacos (os Outbound do
+    peer). `on_complete(manifesto, caminho)` é chamado com o arquivo já
+    conferido no store.
+    """
+    def __init__(self, store: BlobStore, send_ctrl: Callable[[object, str, dict], None],
+                 on_complete: Callable[[dict, str], None], window: int = 8, max_active: int = 4,
+                 auto_fetch_bytes: int = 64 * 1024 * 1024, timeout: float = 5.0, max_known: int = 256,
+                 metrics=None, runtime=None):
+        self.store = store
+        self.send_ctrl = send_ctrl
+        self.on_complete = on_complete
+        self.window = window
+        self.max_active = max_active
+        self.auto_fetch_bytes = auto_fetch_bytes
+        self.timeout = timeout
+        self.max_known = max_known
+        self.runtime = runtime or THREADS
+        self._known: "OrderedDict[str, _Transfer]" = OrderedDict()
+        self._by_msg: Dict[str, str] = {}
+        self._queue: "deque[str]" = deque()
+        self._active = 0
+        self._lock = threading.Lock()
+        self.published = 0
+        self.completed = 0
+        self.wants_sent = 0
+        self.chunks_requested = 0
+        self.chunks_received = 0
+        self.bytes_received = 0
+        self.chunks_sent = 0
+        self.bytes_sent = 0
+        self.duplicate_chunks = 0
+        self.bad_chunks = 0
+        self.misses = 0
+        self.timeouts = 0
+        self._ticker = self.runtime.every(max(timeout / 2, 0.05), self._tick)
+        if metrics is not None:
+            r = metrics.registry
+            r.gauge("p2p_blob_transfers_active", "Transferências de blob em andamento", lambda: self._active)
+            r.collector(self._samples)
+
+    def _samples(self):
+        yield "p2p_blob_chunks_received_total", "counter", "Pedaços de blob recebidos e conferidos", {}, self.chunks_received
+        yield "p2p_blob_bytes_received_total", "counter", "Bytes de blob recebidos", {}, self.bytes_received
+        yield "p2p_blob_chunks_sent_total", "counter", "Pedaços de blob enviados a vizinhos", {}, self.chunks_sent
+        yield "p2p_blob_bytes_sent_total", "counter", "Bytes de blob enviados a vizinhos", {}, self.bytes_sent
+        yield "p2p_blob_completed_total", "counter", "Blobs completos e conferidos", {}, self.completed
+        yield "p2p_blob_timeouts_total", "counter", "Pedidos de pedaço refeitos por timeout", {}, self.timeouts
+
+    def stop(self):
+        self._ticker.cancel()
+        with self._lock:
+            for t in self._known.values():
+                self._close_part(t)
+        self.store.close()
+
+    # ---- origem ----------------------------------------------------------
+
+    def publish(self, path: str, name: Optional[str] = None, chunk: int = DEFAULT_CHUNK) -> dict:
+        """Copia o arquivo para o store e devolve o manifesto a mandar como mensagem BLOB."""
+        m = self.store.import_file(path, name, chunk)
+        with self._lock:
+            t = self._transfer(m)
+            t.complete = True
+            t.missing = 0
+        self.published += 1
+        return m
+
+    # ---- manifestos ------------------------------------------------------
+
+    def _transfer(self, m: dict) -> _Transfer:
+        t = self._known.get(m["blob"])
+        if t is None:
+            t = self._known[m["blob"]] = _Transfer(m)
+            t.complete = self.store.has(t.root)
+            if t.complete:
+                t.missing = 0
+            while len(self._known) > self.max_known:
+                old = next((r for r, o in self._known.items() if not o.active), None)
+                if old is None:
+                    break
+                self._forget(self._known[old])
+        return t
+
+    def _forget(self, t: _Transfer):
+        self._close_part(t)
+        del self._known[t.root]
+        for msg_id in t.msg_ids:
+            self._by_msg.pop(msg_id, None)
+
+    def on_manifest(self, out, msg_id: Optional[str], payload) -> Optional[dict]:
+        """Manifesto novo recebido de `out` (já passou pelo dedup e foi repassado)."""
+        m = check_manifest(payload)
+        if m is None:
+            return None
+        with self._lock:
+            t = self._transfer(m)
+            if msg_id:
+                t.msg_ids.append(msg_id)
+                self._by_msg[msg_id] = t.root
+            if out is not None:
+                t.holders[out] = None
+            if not t.complete and (t.wanted or m["size"] <= self.auto_fetch_bytes):
+                self._want(t)
+        return m
+
+    def on_duplicate(self, out, msg_id: Optional[str]):
+        """O mesmo manifesto por outro vizinho: mais alguém de quem pedir."""
+        with self._lock:
+            root = self._by_msg.get(msg_id)
+            t = self._known.get(root) if root else None
+            if t is None or t.complete or out in t.holders:
+                return
+            t.holders[out] = None
+            if t.active:
+                self._pump(t)
+            elif t.wanted:
+                self._want(t)
+
+    def fetch(self, root: str) -> bool:
+        """Busca sob demanda um blob cujo manifesto já chegou. False se desconhecido."""
+        with self._lock:
+            t = self._known.get(root)
+            if t is None:
+                return False
+            if not t.complete:
+                self._want(t)
+            return True
+
+    def path(self, root: str) -> Optional[str]:
+        return self.store.final(root) if self.store.has(root) else None
+
+    # ---- quem busca ------------------------------------------------------
+
+    def _want(self, t: _Transfer):
+        t.wanted = True
+        if t.active or t.complete or not t.holders:
+            # Sem vizinho anunciante: o próximo anúncio (on_duplicate) retoma.
+            return
+        if self._active < self.max_active:
+            self._activate(t)
+        elif t.root not in self._queue:
+            self._queue.append(t.root)
+
+    def _activate(self, t: _Transfer):
+        if t.size == 0:
+            self.store.save_manifest(t.manifest)
+            open(self.store.final(t.root), "wb").close()
+            self._finish(t)
+            return
+        if t.mm is None:
+            fd = os.open(self.store.part(t.root), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, t.size)
+                t.mm = mmap.mmap(fd, t.size)
+            except OSError:
+                os.close(fd)
+                raise
+            t.fd = fd
+        t.active = True
+        self._active += 1
+        self._pump(t)
+
+    def _deactivate(self, t: _Transfer):
+        """Sem ninguém de quem pedir: libera a vaga e espera um novo anúncio."""
+        if t.active:
+            t.active = False
+            self._active -= 1
+            self._next_queued()
+
+    def _next_queued(self):
+        while self._queue and self._active < self.max_active:
+            t = self._known.get(self._queue.popleft())
+            if t is not None and not t.complete and not t.active and t.holders:
+                self._activate(t)
+
+    def _next_idx(self, t: _Transfer) -> Optional[int]:
+        while t.retry:
+            i = t.retry.popleft()
+            if not t.have[i] and i not in t.inflight:
+                return i
+        while t.next < t.n:
+            i = t.next
+            t.next += 1
+            if not t.have[i] and i not in t.inflight:
+                return i
+        return None
+
+    def _pump(self, t: _Transfer):
+        """Completa a janela de pedidos, alternando entre os vizinhos que têm o blob."""
+        if not t.active:
+            return
+        if not t.holders:
+            if not t.inflight:
+                self._deactivate(t)
+            return
+        holders = list(t.holders)
+        batches: Dict[object, List[int]] = {}
+        now = self.runtime.now()
+        while len(t.inflight) < self.window:
+            i = self._next_idx(t)
+            if i is None:
+                break
+            out = self._pick(t, i, holders)
+            if out is None:
+                # Ninguém tem ainda: tenta de novo no próximo tick.
+                t.stalled.append(i)
+                continue
+            t.inflight[i] = (out, now)
+            batches.setdefault(out, []).append(i)
+        for out, idxs in batches.items():
+            self.wants_sent += 1
+            self.chunks_requested += len(idxs)
+            self.send_ctrl(out, BLOB_WANT, {"blob": t.root, "idx": idxs})
+
+    @staticmethod
+    def _pick(t: _Transfer, i: int, holders: List):
+        """Próximo vizinho (rodízio) que não negou o pedaço nem espera por ele de nós."""
+        skip = t.skip.get(i, ())
+        parked = t.waiters.get(i, ())
+        for _ in range(len(holders)):
+            out = holders[t.rr % len(holders)]
+            t.rr += 1
+            if out not in skip and out not in parked:
+                return out
+        return None
+
+    def on_chunk(self, out, data):
+        """Pedaço recebido (memoryview do frame, válido só durante a chamada)."""
+        if len(data) < _CHUNK.size:
+            return
+        _, raw, idx = _CHUNK.unpack_from(data, 0)
+        body = data[_CHUNK.size:]
+        root = raw.hex()
+        t = self._known.get(root)
+        if t is None or idx >= t.n or t.have[idx] or t.mm is None:
+            self.duplicate_chunks += 1
+            return
+        off, n = t.span(idx)
+        # Conferência fora do lock: o hash é o trabalho caro do pedaço.
+        ok = len(body) == n and chunk_digest(body) == t.hashes[idx]
+        done = None
+        with self._lock:
+            if t.have[idx] or t.mm is None:
+                self.duplicate_chunks += 1
+                return
+            t.inflight.pop(idx, None)
+            if not ok:
+                self.bad_chunks += 1
+                t.holders.pop(out, None)
+                t.retry.append(idx)
+                self._pump(t)
+                return
+            t.mm[off:off + n] = body
+            t.have[idx] = 1
+            t.missing -= 1
+            t.skip.pop(idx, None)
+            self.chunks_received += 1
+            self.bytes_received += n
+            waiters = t.waiters.pop(idx, None)
+            if waiters:
+                t.parked -= len(waiters)
+                frame = chunk_frame(t.raw, idx, bytes(body))
+                for w in waiters:
+                    self._send_chunk(w, frame, n)
+            if t.missing == 0:
+                done = self._finish(t)
+            else:
+                self._pump(t)
+        if done is not None:
+            self.on_complete(t.manifest, done)
+
+    def _finish(self, t: _Transfer) -> str:
+        path = self.store.final(t.root)
+        if t.mm is not None:
+            self._close_part(t)
+            self.store.save_manifest(t.manifest)
+            os.replace(self.store.part(t.root), path)
+        t.complete = True
+        t.inflight.clear()
+        t.retry.clear()
+        t.skip.clear()
+        t.stalled.clear()
+        self.completed += 1
+        if t.active:
+            t.active = False
+            self._active -= 1
+        self._next_queued()
+        return path
+
+    @staticmethod
+    def _close_part(t: _Transfer):
+        if t.mm is not None:
+            t.mm.close()
+            t.mm = None
+        if t.fd is not None:
+            os.close(t.fd)
+            t.fd = None
+
+    def on_miss(self, out, payload: dict):
+        with self._lock:
+            t = self._known.get(str(payload.get("blob")))
+            if t is None:
+                return
+            self.misses += 1
+            partial = bool(payload.get("partial"))
+            if not partial:
+                # Não conhece o blob: não adianta pedir mais nada a ele.
+                t.holders.pop(out, None)
+            for i in payload.get("idx") or []:
+                ent = t.inflight.get(i)
+                if ent is not None and ent[0] is out:
+                    del t.inflight[i]
+                    t.retry.append(i)
+                    if partial:
+                        t.skip.setdefault(i, set()).add(out)
+            self._pump(t)
+
+    def _tick(self):
+        now = self.runtime.now()
+        with self._lock:
+            for t in list(self._known.values()):
+                if not t.active:
+                    continue
+                if t.stalled:
+                    for i in t.stalled:
+                        t.skip.pop(i, None)
+                    t.retry.extend(t.stalled)
+                    t.stalled = []
+                late = [i for i, (_, ts) in t.inflight.items() if now - ts > self.timeout]
+                for i in late:
+                    out, _ = t.inflight.pop(i)
+                    t.retry.append(i)
+                    self.timeouts += 1
+                    # Vizinho lento vai para o fim da fila de quem tentar.
+                    if out in t.holders:
+                        del t.holders[out]
+                        t.holders[out] = None
+                self._pump(t)
+
+    def remove_link(self, out):
+        with self._lock:
+            for t in list(self._known.values()):
+                t.holders.pop(out, None)
+                for i in [i for i, (o, _) in t.inflight.items() if o is out]:
+                    del t.inflight[i]
+                    t.retry.append(i)
+                for i, ws in list(t.waiters.items()):
+                    if out in ws:
+                        ws[:] = [w for w in ws if w is not out]
+                        t.parked = sum(len(x) for x in t.waiters.values())
+                        if not ws:
+                            del t.waiters[i]
+                self._pump(t)
+
+    # ---- quem serve ------------------------------------------------------
+
+    def _send_chunk(self, out, frame: Frame, n: int):
+        if out.enqueue(frame, BULK):
+            self.chunks_sent += 1
+            self.bytes_sent += n
+
+    def on_want(self, out, payload: dict):
+        root = payload.get("blob")
+        if not valid_root(root):
+            return
+        idxs = [i for i in (payload.get("idx") or [])[:MAX_WANT] if isinstance(i, int)]
+        with self._lock:
+            t = self._known.get(root)
+            if t is None:
+                # Completo no disco mas fora da memória (evicção, reinício): o
+                # tamanho de pedaço vem do manifesto gravado, nunca do pedido.
+                m = self.store.load_manifest(root)
+                if m is None:
+                    self.send_ctrl(out, BLOB_MISS, {"blob": root, "idx": idxs})
+                    return
+                t = self._transfer(m)
+            complete = t.complete
+            if not complete:
+                miss = []
+                for i in idxs:
+                    if not 0 <= i < t.n:
+                        continue
+                    if t.have[i] and t.mm is not None:
+                        off, n = t.span(i)
+                        self._send_chunk(out, chunk_frame(t.raw, i, t.mm[off:off + n]), n)
+                    elif t.inflight.get(i, (None,))[0] is out:
+                        # Pedimos a ele o mesmo pedaço: esperar um pelo outro travaria.
+                        miss.append(i)
+                    elif t.parked < MAX_PARKED:
+                        # Ainda não temos: atende quando o pedaço chegar.
+                        t.waiters.setdefault(i, []).append(out)
+                        t.parked += 1
+                    else:
+                        miss.append(i)
+                if miss:
+                    self.send_ctrl(out, BLOB_MISS, {"blob": root, "idx": miss, "partial": True})
+                # Alguém precisa do blob: passa a buscá-lo também.
+                self._want(t)
+                return
+        for i in idxs:
+            data = self.store.read_chunk(root, i, t.chunk) if 0 <= i < t.n else None
+            if data:
+                self._send_chunk(out, chunk_frame(bytes.fromhex(root), i, data), len(data))
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = [{"blob": t.root, "name": t.manifest["name"], "size": t.size,
+                       "done": round(1 - t.missing / t.n, 4) if t.n else 1.0,
+                       "inflight": len(t.inflight), "holders": len(t.holders), "parked": t.parked}
+                      for t in self._known.values() if t.active]
+            known = len(self._known)
+            complete = sum(1 for t in self._known.values() if t.complete)
+            queued = len(self._queue)
+        return {
+            "dir": self.store.path,
+            "known": known,
+            "complete": complete,
+            "queued": queued,
+            "active": active,
+            "window": self.window,
+            "max_active": self.max_active,
+            "auto_fetch_bytes": self.auto_fetch_bytes,
+            "published": self.published,
+            "completed": self.completed,
+            "wants_sent": self.wants_sent,
+            "chunks_requested": self.chunks_requested,
+            "chunks_received": self.chunks_received,
+            "bytes_received": self.bytes_received,
+            "chunks_sent": self.chunks_sent,
+            "bytes_sent": self.bytes_sent,
+            "duplicate_chunks": self.duplicate_chunks,
+            "bad_chunks": self.bad_chunks,
+            "misses": self.misses,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,360 @@
+import json
+import zlib
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from common import encode_body, route_fields, route_sender, DEFAULT_MAX_FRAME
+
+JSON = "json"
+BIN1 = "bin1"
+CODECS = (BIN1, JSON)  # ordem de preferência na negociação
+
+# Frames de controle do próprio enlace: nunca passam por dedup nem relay.
+HELLO = "hello"
+HELLO_ACK = "hello_ack"
+CONTROL_TYPES = {HELLO, HELLO_ACK}
+
+# O que decode_frame (e o .msg preguiçoso) levanta com um corpo malformado:
+# JSON/UTF-8 inválido, cabeçalho bin1 curto, zlib corrompido. Quem lê um
+# enlace descarta o frame e registra o erro, sem derrubar a conexão.
+DECODE_ERRORS = (ValueError, struct.error, IndexError, zlib.error)
+
+# Envelope binário v1 (big-endian):
+#   magic(1) flags(1) type(1) id(16) sender(2) payload_len(4) [type_str] payload
+# O corpo JSON sempre começa com '{', então o magic permite detectar o
+# formato frame a frame e os dois podem conviver na mesma conexão.
+MAGIC = 0xB1
+F_ZLIB = 0x01
+F_JSON_PAYLOAD = 0x02
+T_SENDER_DEF = 0
+T_EXT = 255  # tipo fora da tabela: vem como string (1 byte de tamanho) após o cabeçalho
+TYPE_CODES: Dict[str, int] = {"msg": 1}
+TYPE_NAMES: Dict[int, str] = {v: k for k, v in TYPE_CODES.items()}
+_HDR = struct.Struct("!BBB16sHI")
+_SENDER_OFF = 19
+_ENVELOPE_KEYS = {"id", "type", "sender", "payload"}
+
+# Pedaço de blob (ver blobs.py): magic(1) blob(16) índice(4) + bytes crus.
+# Frame de enlace; só vai a quem pediu com blob_want, então peers antigos
+# nunca o recebem.
+CHUNK_MAGIC = 0xB2
+BLOB_CHUNK = "blob_chunk"
+
+
+def is_binary(data) -> bool:
+    return len(data) > 0 and data[0] == MAGIC
+
+
+class SenderTable:
+    """
+    Tabela de remetentes internados do nó (nome -> índice de 2 bytes).
+    Os índices são do nó que codifica; cada conexão recebe a definição de
+    um índice uma única vez, antes do primeiro frame que o usa.
+    """
+    def __init__(self):
+        self._idx: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._lock = threading.Lock()
+
+    def intern(self, name: str) -> Optional[int]:
+        idx = self._idx.get(name)
+        if idx is not None:
+            return idx
+        with self._lock:
+            idx = self._idx.get(name)
+            if idx is None:
+                if len(self._names) >= 0xFFFF:
+                    return None
+                idx = len(self._names)
+                self._names.append(name)
+                self._idx[name] = idx
+            return idx
+
+    def name(self, idx: int) -> str:
+        return self._names[idx]
+
+
+class SenderDefiner:
+    """
+    Hook before_send do Outbound para conexões bin1: devolve o frame de
+    definição do remetente quando o índice ainda não foi enviado nesta conexão.
+    """
+    def __init__(self, table: SenderTable):
+        self.table = table
+        self._defined = set()
+
+    def __call__(self, body: bytes) -> Optional[bytes]:
+        if body[0] != MAGIC or body[2] == T_SENDER_DEF:
+            return None
+        idx = (body[_SENDER_OFF] << 8) | body[_SENDER_OFF + 1]
+        if idx in self._defined:
+            return None
+        self._defined.add(idx)
+        name = self.table.name(idx).encode("utf-8")
+        return _HDR.pack(MAGIC, 0, T_SENDER_DEF, bytes(16), idx, len(name)) + name
+
+
+class BinDecoder:
+    """Estado de leitura de uma conexão: índices de remetente definidos pelo outro lado."""
+    def __init__(self):
+        self.senders: Dict[int, str] = {}
+
+    def define(self, data):
+        _, _, _, _, idx, n = _HDR.unpack_from(data, 0)
+        self.senders[idx] = bytes(data[_HDR.size:_HDR.size + n]).decode("utf-8")
+
+
+class NodeCodec:
+    """Configuração de codec de um nó: formato preferido, compressão e tabela de remetentes."""
+    def __init__(self, preferred: str = JSON, compress_threshold: int = 1024, compress_level: int = 6):
+        if preferred not in CODECS:
+            raise ValueError(f"codec desconhecido: {preferred}")
+        self.preferred = preferred
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.senders = SenderTable()
+
+    def offered(self) -> List[str]:
+        return list(CODECS) if self.preferred == BIN1 else [JSON]
+
+    def choose(self, offered: List[str]) -> str:
+        """Melhor codec comum entre o que o outro lado oferece e o que aceitamos."""
+        for c in self.offered():
+            if c in offered:
+                return c
+        return JSON
+
+    def encode_bin(self, msg: dict) -> Optional[bytes]:
+        """Codifica em bin1, ou None se a mensagem não cabe no envelope (cai para JSON)."""
+        if not _ENVELOPE_KEYS.issuperset(msg):
+            return None
+        try:
+            raw_id = bytes.fromhex(msg["id"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if len(raw_id) != 16:
+            return None
+        idx = self.senders.intern(str(msg.get("sender", "")))
+        if idx is None:
+            return None
+        flags = 0
+        payload = msg.get("payload")
+        if isinstance(payload, str):
+            pdata = payload.encode("utf-8")
+        else:
+            pdata = json.dumps(payload).encode("utf-8")
+            flags |= F_JSON_PAYLOAD
+        if self.compress_threshold and len(pdata) >= self.compress_threshold:
+            z = zlib.compress(pdata, self.compress_level)
+            if len(z) < len(pdata):
+                pdata = z
+                flags |= F_ZLIB
+        mtype = msg.get("type", "")
+        code = TYPE_CODES.get(mtype)
+        if code is None:
+            tname = mtype.encode("utf-8")
+            return _HDR.pack(MAGIC, flags, T_EXT, raw_id, idx, len(pdata)) + bytes([len(tname)]) + tname + pdata
+        return _HDR.pack(MAGIC, flags, code, raw_id, idx, len(pdata)) + pdata
+
+    def rebase_bin(self, data, decoder: BinDecoder) -> Optional[bytes]:
+        """Troca o índice de remetente do vizinho pelo nosso, sem mexer no resto do frame."""
+        idx = (data[_SENDER_OFF] << 8) | data[_SENDER_OFF + 1]
+        name = decoder.senders.get(idx, "?")
+        ours = self.senders.intern(name)
+        if ours is None:
+            return None
+        return bytes(data[:_SENDER_OFF]) + struct.pack("!H", ours) + bytes(data[_SENDER_OFF + 2:])
+
+
+def bin_route(data) -> Tuple[str, str]:
+    """(id, type) de um frame bin1 lendo só o cabeçalho fixo."""
+    code = data[2]
+    msg_id = bytes(data[3:19]).hex()
+    if code == T_EXT:
+        n = data[_HDR.size]
+        return msg_id, bytes(data[_HDR.size + 1:_HDR.size + 1 + n]).decode("utf-8")
+    return msg_id, TYPE_NAMES.get(code, "")
+
+
+def decode_bin(data, decoder: BinDecoder, max_frame: int = DEFAULT_MAX_FRAME) -> dict:
+    _, flags, code, raw_id, idx, n = _HDR.unpack_from(data, 0)
+    off = _HDR.size
+    if code == T_EXT:
+        tlen = data[off]
+        mtype = bytes(data[off + 1:off + 1 + tlen]).decode("utf-8")
+        off += 1 + tlen
+    else:
+        mtype = TYPE_NAMES.get(code, "")
+    pdata = bytes(data[off:off + n])
+    if flags & F_ZLIB:
+        # Descomprimido também não passa de um frame: um payload pequeno que
+        # expande para gigabytes (zip bomb) é frame malformado, não memória.
+        d = zlib.decompressobj()
+        pdata = d.decompress(pdata, max_frame)
+        if d.unconsumed_tail or not d.eof:
+            raise ValueError(f"payload zlib excede {max_frame} bytes ou está truncado")
+    payload = json.loads(pdata) if flags & F_JSON_PAYLOAD else pdata.decode("utf-8")
+    return {"id": raw_id.hex(), "type": mtype, "sender": decoder.senders.get(idx, "?"), "payload": payload}
+
+
+class Envelope:
+    """
+    Mensagem em trânsito no nó. Guarda o corpo no formato em que chegou,
+    decodifica o dict só se alguém pedir (.msg) e gera cada formato de
+    saída uma única vez, compartilhado entre todos os vizinhos daquele codec.
+    """
+    __slots__ = ("msg_id", "msg_type", "_msg", "_bodies", "_bin_in", "_decoder")
+
+    def __init__(self, msg_id: Optional[str], msg_type: Optional[str]):
+        self.msg_id = msg_id
+        self.msg_type = msg_type
+        self._msg: Optional[dict] = None
+        self._bodies: Dict[str, Optional[bytes]] = {}
+        self._bin_in = None
+        self._decoder: Optional[BinDecoder] = None
+
+    @classmethod
+    def from_msg(cls, msg: dict) -> "Envelope":
+        env = cls(msg.get("id"), msg.get("type"))
+        env._msg = msg
+        return env
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "Envelope":
+        env = cls(*route_fields(data))
+        env._bodies[JSON] = data
+        return env
+
+    @classmethod
+    def from_bin(cls, data: bytes, decoder: BinDecoder) -> "Envelope":
+        env = cls(*bin_route(data))
+        env._bin_in = data
+        env._decoder = decoder
+        return env
+
+    @property
+    def raw(self):
+        """Corpo binário como chegou (frames bin1 e pedaços de blob)."""
+        return self._bin_in
+
+    @property
+    def sender(self) -> str:
+        """Remetente sem decodificar o payload: cabeçalho bin1 ou prefixo do JSON."""
+        if self._msg is None:
+            if self._bin_in is not None:
+                data = self._bin_in
+                return self._decoder.senders.get((data[_SENDER_OFF] << 8) | data[_SENDER_OFF + 1], "?")
+            name = route_sender(self._bodies[JSON])
+            if name is not None:
+                return name
+        return str(self.msg.get("sender", ""))
+
+    @property
+    def msg(self) -> dict:
+        if self._msg is None:
+            if self._bin_in is not None:
+                self._msg = decode_bin(self._bin_in, self._decoder)
+            else:
+                self._msg = json.loads(self._bodies[JSON])
+        return self._msg
+
+    def body(self, codec: str, node: NodeCodec) -> bytes:
+        if codec in self._bodies:
+            body = self._bodies[codec]
+        else:
+            body = None
+            if codec == BIN1:
+                if self._bin_in is not None:
+                    body = node.rebase_bin(self._bin_in, self._decoder)
+                else:
+                    body = node.encode_bin(self.msg)
+            self._bodies[codec] = body
+        if body is None:
+            # Não representável no codec pedido: JSON, que o outro lado sempre entende.
+            return self.body(JSON, node) if codec != JSON else self._json()
+        return body
+
+    def _json(self) -> bytes:
+        body = encode_body(self.msg)
+        self._bodies[JSON] = body
+        return body
+
+
+def decode_frame(data, decoder: BinDecoder) -> Optional[Envelope]:
+    """
+    Converte um corpo recebido (memoryview do FrameReader) num Envelope.
+    Frames de definição de remetente só atualizam o decoder e retornam None.
+    """
+    if len(data) and data[0] == CHUNK_MAGIC:
+        # Sem cópia: o handler grava o pedaço antes da próxima leitura.
+        env = Envelope(None, BLOB_CHUNK)
+        env._bin_in = data
+        return env
+    if is_binary(data):
+        if data[2] == T_SENDER_DEF:
+            decoder.define(data)
+            return None
+        return Envelope.from_bin(bytes(data), decoder)
+    return Envelope.from_json(bytes(data))
+
+
+def hello_body(node: NodeCodec, name: str, to: str, node_id: Optional[str] = None,
+               listen: Optional[str] = None, extra: Optional[Dict] = None) -> bytes:
+    """
+    Primeiro frame de quem disca. Vai sem id: um peer antigo o trata como
+    mensagem comum apenas na primeira vez (o id None fica no seen_msgs).
+    `to` evita que um hello repassado por um peer antigo seja aceito por outro nó.
+    `node_id`/`listen` identificam quem disca (ver connmgr.py); `extra`
+    leva campos do transporte (ex.: "shm", ver transport.py).
+    """
+    payload = {"codecs": node.offered(), "to": to}
+    if node_id:
+        payload["node"] = node_id
+        payload["listen"] = listen
+    if extra:
+        payload.update(extra)
+    return encode_body({"type": HELLO, "sender": name, "payload": payload})
+
+
+def ack_body(codec: str, node_id: Optional[str] = None, extra: Optional[Dict] = None) -> bytes:
+    payload = {"codec": codec}
+    if node_id:
+        payload["node"] = node_id
+    if extra:
+        payload.update(extra)
+    return encode_body({"type": HELLO_ACK, "payload": payload})
+
+
+def hello_identity(env: Envelope) -> Tuple[Optional[str], Optional[str]]:
+    """(id do nó, endereço em que escuta) de um hello/hello_ack; None em peers antigos."""
+    payload = env.msg.get("payload") or {}
+    node = payload.get("node")
+    return (str(node) if node else None), payload.get("listen")
+
+
+def negotiate(node: NodeCodec, env: Envelope, port: int,
+              node_id: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Trata um frame hello/hello_ack recebido numa conexão.
+    Retorna (corpo de resposta a enviar ou None, codec de saída a adotar ou None).
+    """
+    payload = env.msg.get("payload") or {}
+    if env.msg_type == HELLO:
+        to = str(payload.get("to", ""))
+        if to.rsplit(":", 1)[-1] != str(port):
+            return None, None
+        codec = node.choose(payload.get("codecs") or [])
+        return ack_body(codec, node_id), codec
+    if env.msg_type == HELLO_ACK:
+        codec = payload.get("codec")
+        if codec in node.offered():
+            return None, codec
+    return None, None
+
+
+def configure_outbound(out, codec: str, node: NodeCodec):
+    """Passa a conexão a escrever no codec negociado."""
+    # before_send antes do codec: nenhum frame bin1 sai sem o hook de remetentes.
+    out.before_send = SenderDefiner(node.senders) if codec == BIN1 else None
+    out.codec = codec
@@ -1,8 +1,23 @@
+import os
+import re
 import json
 import struct
 import socket
 import uuid
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Sequence, Tuple, Union
+
+# Prefixo produzido por json.dumps(generate_msg(...)): as chaves de roteamento
+# vêm sempre primeiro, então dá para lê-las sem decodificar o frame inteiro.
+_ROUTE_RE = re.compile(rb'\{"id": "([0-9a-f]{1,64})", "type": "([A-Za-z0-9_]{1,32})"')
+_SENDER_RE = re.compile(rb'\{"id": "[0-9a-f]{1,64}", "type": "[A-Za-z0-9_]{1,32}", "sender": "([^"\\]{0,256})"')
+
+# Limite de corpo aceito na leitura: um cabeçalho malicioso de 4 GB não
+# pode forçar uma alocação desse tamanho.
+DEFAULT_MAX_FRAME = 16 * 1024 * 1024
+
+
+class FrameTooLarge(ValueError):
+    """Cabeçalho anuncia um frame acima do limite configurado."""
 
 
 
@@ -11,41 +26,168 @@ def send_msg(sock: socket.socket, msg: Dict):
     Envia um dicionário como mensagem JSON via socket,
     usando framing (4 bytes big-endian com tamanho da mensagem).
     """
-    data = json.dumps(msg).encode("utf-8")
-    length = struct.pack("!I", len(data))
-    sock.sendall(length + data)
+    sock.sendall(encode_frame(msg))
 
 
-def recv_msg(sock: socket.socket) -> Optional[Dict]:
+def encode_frame(msg: Dict) -> bytes:
     """
-    Recebe mensagem com framing (4 bytes + JSON).
-    Retorna um dict ou None se a conexão for fechada.
+    Serializa a mensagem no formato de fio (4 bytes de tamanho + JSON).
+    Compartilhado entre o engine com threads e o engine asyncio.
+    """
+    data = encode_body(msg)
+    return struct.pack("!I", len(data)) + data
+
+
+def encode_body(msg: Dict) -> bytes:
+    """Só o corpo JSON do frame; o cabeçalho é montado na hora do envio."""
+    return json.dumps(msg).encode("utf-8")
+
+
+def frame_bytes(data: bytes) -> bytes:
+    """Acrescenta o cabeçalho de tamanho a um corpo já serializado."""
+    return struct.pack("!I", len(data)) + data
+
+
+def send_frame(sock: socket.socket, frame: bytes):
+    """Envia um frame já pronto (cabeçalho + corpo), sem reserializar."""
+    sock.sendall(frame)
+
+
+def recv_frame(sock: socket.socket, max_frame: int = DEFAULT_MAX_FRAME) -> Optional[bytes]:
+    """
+    Recebe um frame e devolve o corpo cru (bytes JSON), sem decodificar.
+    Retorna None se a conexão for fechada.
+    Para leitura contínua de uma conexão prefira FrameReader.
     """
     header = _recvall(sock, 4)
     if not header:
         return None
 
     length = struct.unpack("!I", header)[0]
+    if length > max_frame:
+        raise FrameTooLarge(f"frame de {length} bytes excede o limite de {max_frame}")
     data = _recvall(sock, length)
+    if data is None:
+        return None
+    return data
+
+
+def recv_msg(sock: socket.socket) -> Optional[Dict]:
+    """
+    Recebe mensagem com framing (4 bytes + JSON).
+    Retorna um dict ou None se a conexão for fechada.
+    """
+    data = recv_frame(sock)
     if not data:
         return None
 
     return json.loads(data.decode("utf-8"))
 
 
+def route_fields(data) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Extrai só (id, type) de um corpo JSON cru (bytes ou memoryview),
+    para o caminho de relay.
+    Usa o prefixo fixo gerado por send_msg; se o frame veio de outro
+    serializador, cai no json.loads completo. Corpo que não é um objeto
+    JSON dá (None, None).
+    """
+    m = _ROUTE_RE.match(data)
+    if m:
+        return m.group(1).decode("ascii"), m.group(2).decode("ascii")
+    try:
+        msg = json.loads(bytes(data))
+    except ValueError:
+        return None, None
+    if not isinstance(msg, dict):
+        return None, None
+    # Só strings: um id que não é string não entra no dedup nem é repassado.
+    msg_id, msg_type = msg.get("id"), msg.get("type")
+    return (msg_id if isinstance(msg_id, str) else None,
+            msg_type if isinstance(msg_type, str) else None)
+
+
+def route_sender(data) -> Optional[str]:
+    """
+    `sender` de um corpo JSON cru pelo mesmo prefixo fixo de route_fields.
+    None se o prefixo não bate (ou o nome tem escapes): quem chama decodifica.
+    """
+    m = _SENDER_RE.match(data)
+    return m.group(1).decode("utf-8") if m else None
+
+
 def _recvall(sock: socket.socket, n: int) -> Optional[bytes]:
     """Lê exatamente n bytes do socket, ou None se desconectar."""
-    buf = b""
-    while len(buf) < n:
-        chunk = sock.recv(n - len(buf))
-        if not chunk:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if not k:
             return None
-        buf += chunk
-    return buf
+        got += k
+    return bytes(buf)
 
 
+class FrameReader:
+    """
+    Leitor de frames reutilizável, um por conexão.
+    Usa um bytearray pré-alocado preenchido com recv_into, então vários
+    frames pequenos saem de um único recv e o buffer não é recopiado a
+    cada leitura parcial. read_frame devolve um memoryview do corpo, válido
+    só até a próxima chamada; quem precisa guardar o frame copia com bytes().
+    """
+    def __init__(self, sock: socket.socket, bufsize: int = 64 * 1024, max_frame: int = DEFAULT_MAX_FRAME):
+        self.sock = sock
+        self.max_frame = max_frame
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def read_frame(self) -> Optional[memoryview]:
+        """Próximo corpo de frame, ou None se a conexão fechou."""
+        while True:
+            avail = self._end - self._start
+            if avail >= 4:
+                length = struct.unpack_from("!I", self._buf, self._start)[0]
+                if length > self.max_frame:
+                    raise FrameTooLarge(f"frame de {length} bytes excede o limite de {self.max_frame}")
+                if avail >= 4 + length:
+                    body = self._start + 4
+                    self._start = body + length
+                    return self._view[body:body + length]
+                need = 4 + length
+            else:
+                need = 4
+            if not self._fill(need):
+                return None
+
+    def _fill(self, need: int) -> bool:
+        """Garante espaço para `need` bytes a partir de _start e faz um recv_into."""
+        avail = self._end - self._start
+        if avail == 0:
+            self._start = self._end = 0
+        elif len(self._buf) - self._start < need:
+            if need > len(self._buf):
+                # Frame maior que o buffer (mas dentro do limite): buffer novo,
+                # sem redimensionar o antigo que ainda pode ter views exportadas.
+                buf = bytearray(max(need, 2 * len(self._buf)))
+                buf[:avail] = self._view[self._start:self._end]
+                self._buf = buf
+                self._view = memoryview(buf)
+            else:
+                self._view[:avail] = self._view[self._start:self._end]
+            self._start, self._end = 0, avail
+        n = self.sock.recv_into(self._view[self._end:])
+        if not n:
+            return False
+        self._end += n
+        return True
+
 
-def generate_msg(msg_type: str, sender: str, payload: str) -> Dict:
+
+def generate_msg(msg_type: str, sender: str, payload: Union[str, Dict]) -> Dict:
     """
     Cria um envelope de mensagem padronizado com ID único.
     """
@@ -55,3 +197,13 @@ def generate_msg(msg_type: str, sender: str, payload: str) -> Dict:
         "sender": sender,
         "payload": payload
     }
+
+
+def generate_msgs(msg_type: str, sender: str, payloads: Sequence) -> List[Dict]:
+    """
+    generate_msg em lote: os ids saem de uma única leitura do urandom
+    (128 bits aleatórios cada, como o uuid4) em vez de um uuid4 por item.
+    """
+    ids = os.urandom(16 * len(payloads)).hex()
+    return [{"id": ids[32 * k:32 * k + 32], "type": msg_type, "sender": sender, "payload": p}
+            for k, p in enumerate(payloads)]
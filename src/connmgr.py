@@ -0,0 +1,316 @@
+import os
+import uuid
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from transport import THREADS
+
+Addr = Tuple[str, int]
+
+
+def load_node_id(path: Optional[str]) -> str:
+    """Id estável do nó: lido de `path` ou gerado e gravado lá na primeira vez."""
+    if not path:
+        return uuid.uuid4().hex
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            node_id = f.read().strip()
+        if node_id:
+            return node_id
+    except FileNotFoundError:
+        pass
+    node_id = uuid.uuid4().hex
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(node_id + "\n")
+    return node_id
+
+
+def parse_addr(s: str) -> Optional[Addr]:
+    host, _, port = str(s).rpartition(":")
+    try:
+        return host, int(port)
+    except ValueError:
+        return None
+
+
+def dialable(listen: Optional[str], peer_name: str) -> Optional[Addr]:
+    """Endereço anunciado no hello; host coringa vira o IP de onde a conexão veio."""
+    addr = parse_addr(listen) if listen else None
+    if addr is None:
+        return None
+    host, port = addr
+    if host in ("", "0.0.0.0", "::"):
+        host = peer_name.rpartition(":")[0] or host
+    return host, port
+
+
+class _Link:
+    __slots__ = ("addr", "node", "listen", "since")
+
+    def __init__(self, addr: Optional[Addr], since: float):
+        # addr só é preenchido em conexões que nós discamos.
+        self.addr = addr
+        self.node: Optional[str] = None
+        self.listen: Optional[Addr] = addr
+        self.since = since
+
+
+class _Target:
+    __slots__ = ("static", "node", "failures", "next_try", "dialing", "is_self")
+
+    def __init__(self, static: bool):
+        self.static = static
+        self.node: Optional[str] = None
+        self.failures = 0
+        self.next_try = 0.0
+        self.dialing = False
+        self.is_self = False
+
+
+class ConnectionManager:
+    """
+    Mantém as conexões do nó: uma por par de nós, religadas quando caem.
+
+    Cada enlace se identifica no hello (id estável do nó + endereço em que
+    ele escuta). Se dois nós acabam com duas conexões entre si (A disca B e
+    B disca A), fica a que foi discada pelo nó de menor id; os dois lados
+    chegam à mesma escolha sem trocar mais nada. Conexões com o próprio nó
+    são fechadas e o endereço não é mais discado.
+
+    Endereços estáticos (os --peer/--bootstrap) são mantidos sempre; os
+    aprendidos nos hellos só são discados para chegar a `target_degree`.
+    Acima de `max_degree` (0 = sem limite) os enlaces não estáticos mais
+    novos são fechados. Falhas de conexão (e enlaces que caem antes de
+    `backoff_max` segundos) esperam um backoff exponencial com jitter
+    (metade fixa + metade aleatória) entre `backoff_base` e `backoff_max`.
+
+    Como o Plumtree, trata enlaces como objetos opacos; quem disca e fecha
+    é o peer, via `dial(host, port) -> bool` e `close_link(link)`. Relógio,
+    timers e sorteios vêm do `runtime` do transporte (ver transport.py).
+    """
+    def __init__(self, node_id: str, dial: Callable[[str, int], bool], close_link: Callable[[object], None],
+                 listen: Optional[str] = None, target_degree: int = 0, max_degree: int = 0,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, interval: float = 0.5,
+                 on_log: Optional[Callable[[str], None]] = None, metrics=None, runtime=None):
+        self.node_id = node_id
+        self.dial = dial
+        self.close_link = close_link
+        self.listen = listen
+        self.target_degree = target_degree
+        self.max_degree = max_degree
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.interval = interval
+        self.on_log = on_log or (lambda s: None)
+        self.runtime = runtime or THREADS
+        # Avisado de cada tentativa de conexão: on_dial((host, port), ok).
+        self.on_dial: Optional[Callable[[Addr, bool], None]] = None
+        self._links: Dict[object, _Link] = {}
+        self._by_node: Dict[str, object] = {}
+        self._targets: Dict[Addr, _Target] = {}
+        self._lock = threading.Lock()
+        self._ticker = None
+        self.dials = 0
+        self.dial_failures = 0
+        self.duplicates_closed = 0
+        self.self_closed = 0
+        self.trimmed = 0
+        if metrics is not None:
+            metrics.registry.collector(self._samples)
+
+    def _samples(self):
+        yield "p2p_conn_dials_total", "counter", "Tentativas de conexão de saída", {}, self.dials
+        yield "p2p_conn_dial_failures_total", "counter", "Tentativas de conexão que falharam", {}, self.dial_failures
+        yield "p2p_conn_duplicates_closed_total", "counter", "Conexões redundantes fechadas no desempate", {}, self.duplicates_closed
+        yield "p2p_conn_trimmed_total", "counter", "Enlaces fechados para respeitar o grau máximo", {}, self.trimmed
+
+    def start(self):
+        self.tick(self.runtime.now())
+        self._ticker = self.runtime.every(self.interval, lambda: self.tick(self.runtime.now()))
+
+    def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+
+    def add_address(self, host: str, port: int, static: bool = True, node: Optional[str] = None):
+        with self._lock:
+            t = self._targets.get((host, port))
+            if t is None:
+                t = self._targets[(host, port)] = _Target(static)
+            t.static = t.static or static
+            if node is not None:
+                t.node = node
+                if node == self.node_id:
+                    t.is_self = True
+
+    # ---- eventos do peer -------------------------------------------------
+
+    def link_up(self, link, addr: Optional[Addr] = None):
+        with self._lock:
+            self._links[link] = _Link(addr, self.runtime.now())
+
+    def identify(self, link, node: str, listen: Optional[Addr] = None) -> bool:
+        """
+        Registra o id do outro lado. Retorna False se este enlace deve ser
+        fechado (conexão consigo mesmo ou perdedora do desempate).
+        """
+        close_other = None
+        with self._lock:
+            info = self._links.get(link)
+            if info is None:
+                return True
+            info.node = node
+            if listen is not None:
+                info.listen = listen
+            for addr in (info.addr, listen):
+                if addr is None:
+                    continue
+                t = self._targets.get(addr)
+                if t is None:
+                    t = self._targets[addr] = _Target(False)
+                t.node = node
+                if node == self.node_id:
+                    t.is_self = True
+            if node == self.node_id:
+                self.self_closed += 1
+                return False
+            other = self._by_node.get(node)
+            if other is None or other is link or other not in self._links:
+                self._by_node[node] = link
+                return True
+            self.duplicates_closed += 1
+            if self._keeps(link, other, node):
+                self._by_node[node] = link
+                close_other = other
+            else:
+                return False
+        self.on_log(f"[CONEXÃO] enlace duplicado com {node[:8]} fechado")
+        self.close_link(close_other)
+        return True
+
+    def _keeps(self, link, other, node: str) -> bool:
+        """True se `link` ganha de `other`: fica a conexão discada pelo menor id."""
+        def dialer(l):
+            return self.node_id if self._links[l].addr is not None else node
+        a, b = dialer(link), dialer(other)
+        if a != b:
+            return a < b
+        # Mesmo discador (ex.: dois endereços do mesmo nó): fica a mais antiga.
+        return self._links[link].since < self._links[other].since
+
+    def link_down(self, link):
+        now = self.runtime.now()
+        with self._lock:
+            info = self._links.pop(link, None)
+            if info is None:
+                return
+            if info.node is not None and self._by_node.get(info.node) is link:
+                del self._by_node[info.node]
+            # Enlace que cai logo depois de subir (ex.: aparado pelo outro lado
+            # por excesso de grau) conta como falha, então o backoff cresce em
+            # vez de ficar religando no mesmo ritmo. O jitter evita que os dois
+            # lados de um enlace que caiu disquem ao mesmo tempo.
+            stable = now - info.since >= self.backoff_max
+            for addr, t in self._targets.items():
+                if addr == info.addr or (info.node is not None and t.node == info.node):
+                    t.failures = 0 if stable else t.failures + 1
+                    t.next_try = max(t.next_try, now + self._delay(t.failures))
+
+    # ---- manutenção -------------------------------------------------------
+
+    def _delay(self, failures: int) -> float:
+        d = min(self.backoff_max, self.backoff_base * (2 ** failures))
+        return d / 2 + self.runtime.rng.uniform(0, d / 2)
+
+    def _connected(self, addr: Addr, t: _Target) -> bool:
+        if t.dialing:
+            return True
+        if t.node is not None and t.node in self._by_node:
+            return True
+        return any(info.addr == addr for info in self._links.values())
+
+    def tick(self, now: float):
+        """Disca o que falta (estáticos e, até o grau alvo, aprendidos) e apara o excesso."""
+        dial: List[Addr] = []
+        trim = []
+        with self._lock:
+            degree = len(self._links)
+            for addr, t in self._targets.items():
+                if t.is_self or now < t.next_try or self._connected(addr, t):
+                    continue
+                if t.static:
+                    dial.append(addr)
+                elif self.target_degree and degree + len(dial) < self.target_degree:
+                    dial.append(addr)
+            for addr in dial:
+                self._targets[addr].dialing = True
+            if self.max_degree and degree > self.max_degree:
+                static = {t.node for t in self._targets.values() if t.static and t.node}
+                spare = [(info.since, link) for link, info in self._links.items()
+                         if info.node is not None and info.node not in static]
+                spare.sort(key=lambda x: x[0], reverse=True)
+                trim = [link for _, link in spare[:degree - self.max_degree]]
+                self.trimmed += len(trim)
+        for link in trim:
+            self.close_link(link)
+        for addr in dial:
+            self.runtime.spawn(self._dial, addr)
+
+    def _dial(self, addr: Addr):
+        self.dials += 1
+        ok = False
+        try:
+            ok = self.dial(*addr)
+        finally:
+            with self._lock:
+                t = self._targets[addr]
+                t.dialing = False
+                if not ok:
+                    self.dial_failures += 1
+                    t.next_try = self.runtime.now() + self._delay(t.failures)
+                    t.failures += 1
+            if self.on_dial is not None:
+                self.on_dial(addr, ok)
+
+    def forget(self, host: str, port: int):
+        """Deixa de discar um endereço aprendido (os estáticos ficam)."""
+        with self._lock:
+            t = self._targets.get((host, port))
+            if t is not None and not t.static:
+                del self._targets[(host, port)]
+
+    def neighbours(self) -> List[Tuple[object, str, Optional[Addr]]]:
+        """(enlace, id do nó, endereço em que ele escuta) dos enlaces identificados."""
+        with self._lock:
+            return [(link, info.node, info.listen) for link, info in self._links.items() if info.node is not None]
+
+    def node_of(self, link) -> Optional[str]:
+        """Id do nó do outro lado do enlace (None antes do hello)."""
+        info = self._links.get(link)
+        return info.node if info is not None else None
+
+    def degree(self) -> int:
+        return len(self._links)
+
+    def stats(self) -> dict:
+        with self._lock:
+            links = list(self._links.values())
+            targets = list(self._targets.items())
+        return {
+            "node_id": self.node_id,
+            "degree": len(links),
+            "identified": sum(1 for l in links if l.node is not None),
+            "target_degree": self.target_degree,
+            "max_degree": self.max_degree,
+            "known": len(targets),
+            "static": sum(1 for _, t in targets if t.static),
+            "backing_off": sum(1 for _, t in targets if t.failures),
+            "dials": self.dials,
+            "dial_failures": self.dial_failures,
+            "duplicates_closed": self.duplicates_closed,
+            "self_closed": self.self_closed,
+            "trimmed": self.trimmed,
+        }
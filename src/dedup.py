@@ -0,0 +1,341 @@
+import sys
+import math
+import time
+import hashlib
+import threading
+import multiprocessing as mp
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from shmring import shared_memory, attach_segment
+
+# Objetos apontados por cada entrada (chave de 16 bytes + float do timestamp);
+# tabela e nós da lista do OrderedDict já entram no sys.getsizeof dele.
+_WINDOW_ENTRY_BYTES = sys.getsizeof(b"\0" * 16) + sys.getsizeof(0.0)
+
+
+def msg_key(msg_id: Optional[str]) -> bytes:
+    """
+    Converte o id da mensagem (uuid hex de 32 chars) em 16 bytes binários.
+    Ids fora desse formato são resumidos com blake2b para o mesmo tamanho.
+    """
+    if not msg_id:
+        return b"\0" * 16
+    if len(msg_id) == 32:
+        try:
+            return bytes.fromhex(msg_id)
+        except ValueError:
+            pass
+    return hashlib.blake2b(msg_id.encode("utf-8"), digest_size=16).digest()
+
+
+class TimeWindowDedup:
+    """
+    Conjunto exato de ids vistos com orçamento fixo: no máximo `capacity`
+    entradas, e entradas mais velhas que `ttl` segundos expiram.
+    A ordem de inserção é a ordem de expiração (LRU por chegada).
+    """
+    kind = "window"
+
+    def __init__(self, capacity: int = 1_000_000, ttl: float = 600.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._seen: "OrderedDict[bytes, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def check_and_add(self, msg_id: Optional[str]) -> bool:
+        """Retorna True se o id é novo (e o registra); False se é duplicata."""
+        return self._put(msg_id, True)
+
+    def _put(self, msg_id: Optional[str], check: bool) -> bool:
+        key = msg_key(msg_id)
+        now = time.monotonic()
+        with self._lock:
+            if check:
+                self.checks += 1
+            if key in self._seen:
+                if check:
+                    self.duplicates += 1
+                return False
+            self._seen[key] = now
+            self._expire(now)
+            return True
+
+    def _expire(self, now: float):
+        seen = self._seen
+        limit = now - self.ttl
+        while seen:
+            key, ts = next(iter(seen.items()))
+            if len(seen) <= self.capacity and ts >= limit:
+                break
+            seen.popitem(last=False)
+            self.evicted += 1
+
+    def add(self, msg_id: Optional[str]):
+        """Registra sem contar como verificação (mensagem originada neste nó)."""
+        self._put(msg_id, False)
+
+    def __contains__(self, msg_id: Optional[str]) -> bool:
+        with self._lock:
+            return msg_key(msg_id) in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = len(self._seen)
+            table = sys.getsizeof(self._seen)
+        return {
+            "kind": self.kind,
+            "entries": n,
+            "capacity": self.capacity,
+            "ttl": self.ttl,
+            "memory_bytes": table + n * _WINDOW_ENTRY_BYTES,
+            "fp_rate": 0.0,
+            "checks": self.checks,
+            "duplicates": self.duplicates,
+            "evicted": self.evicted,
+        }
+
+
+class RotatingBloomDedup:
+    """
+    Dois filtros de Bloom (atual + anterior) de tamanho fixo sobre ids
+    binários de 16 bytes. Quando o atual recebe `capacity` inserções ele
+    vira o anterior e um filtro zerado assume, então a memória nunca cresce
+    e cada id é lembrado por pelo menos `capacity` mensagens.
+    Pode dar falso positivo (mensagem nova tratada como repetida), nunca
+    falso negativo dentro da janela.
+    """
+    kind = "bloom"
+
+    def __init__(self, capacity: int = 1_000_000, fp_rate: float = 1e-4):
+        self.capacity = capacity
+        self.target_fp = fp_rate
+        self.m = max(64, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+        self._cur = bytearray((self.m + 7) // 8)
+        self._prev = bytearray((self.m + 7) // 8)
+        self._cur_n = 0
+        self._prev_n = 0
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.duplicates = 0
+        self.rotations = 0
+
+    def _positions(self, key: bytes):
+        # Double hashing (Kirsch-Mitzenmacher): os uuid4 já são aleatórios,
+        # então as duas metades do id servem de h1 e h2.
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:], "little") | 1
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    @staticmethod
+    def _test(bits: bytearray, positions) -> bool:
+        for p in positions:
+            if not (bits[p >> 3] >> (p & 7)) & 1:
+                return False
+        return True
+
+    def check_and_add(self, msg_id: Optional[str]) -> bool:
+        """Retorna True se o id é novo (e o registra); False se (provavelmente) é duplicata."""
+        return self._put(msg_id, True)
+
+    def _put(self, msg_id: Optional[str], check: bool) -> bool:
+        pos = self._positions(msg_key(msg_id))
+        with self._lock:
+            if check:
+                self.checks += 1
+            if self._test(self._cur, pos) or self._test(self._prev, pos):
+                if check:
+                    self.duplicates += 1
+                return False
+            bits = self._cur
+            for p in pos:
+                bits[p >> 3] |= 1 << (p & 7)
+            self._cur_n += 1
+            if self._cur_n >= self.capacity:
+                self._rotate()
+            return True
+
+    def _rotate(self):
+        self._prev = self._cur
+        self._prev_n = self._cur_n
+        self._cur = bytearray(len(self._prev))
+        self._cur_n = 0
+        self.rotations += 1
+
+    def add(self, msg_id: Optional[str]):
+        """Registra sem contar como verificação (mensagem originada neste nó)."""
+        self._put(msg_id, False)
+
+    def __contains__(self, msg_id: Optional[str]) -> bool:
+        pos = self._positions(msg_key(msg_id))
+        with self._lock:
+            return self._test(self._cur, pos) or self._test(self._prev, pos)
+
+    def __len__(self) -> int:
+        return self._cur_n + self._prev_n
+
+    def _gen_fp(self, n: int) -> float:
+        return (1.0 - math.exp(-self.k * n / self.m)) ** self.k
+
+    def stats(self) -> dict:
+        fp = 1.0 - (1.0 - self._gen_fp(self._cur_n)) * (1.0 - self._gen_fp(self._prev_n))
+        return {
+            "kind": self.kind,
+            "entries": self._cur_n + self._prev_n,
+            "capacity": self.capacity,
+            "bits": self.m,
+            "hashes": self.k,
+            "memory_bytes": len(self._cur) + len(self._prev),
+            "fp_rate": fp,
+            "checks": self.checks,
+            "duplicates": self.duplicates,
+            "rotations": self.rotations,
+        }
+
+
+class SharedDedup:
+    """
+    Tabela de ids vistos em memória compartilhada, para vários processos
+    do mesmo nó (workers do relay.py): cada id é aceito por um só deles.
+    Conjunto associativo: o id escolhe um balde de WAYS chaves de 16 bytes
+    e, com o balde cheio, a chave mais antiga dele é substituída (FIFO por
+    balde). Memória fixa, sem falso positivo; um id pode ser esquecido
+    depois de ~`capacity` inserções, como no window.
+
+    check_and_add é atômico entre processos com locks listrados (semáforos
+    POSIX do multiprocessing), criados por create() e herdados pelos
+    workers via handle()/attach(). __contains__ lê sem lock.
+    """
+    kind = "shm"
+    WAYS = 8
+    _SLOT = 16
+
+    def __init__(self, shm, capacity: int, locks, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.locks = locks
+        buckets = 1
+        while buckets * self.WAYS < capacity:
+            buckets <<= 1
+        self.capacity = buckets * self.WAYS
+        self._mask = buckets - 1
+        self._stripes = len(locks)
+        # Layout: inserções por listra (Q) | cursor por balde (B) | baldes.
+        self._counts = shm.buf[:8 * self._stripes].cast("Q")
+        self._cursor_off = 8 * self._stripes
+        self._slots_off = self._cursor_off + buckets
+        self._buf = shm.buf
+        self.checks = 0
+        self.duplicates = 0
+
+    @classmethod
+    def size_for(cls, capacity: int, stripes: int) -> int:
+        buckets = 1
+        while buckets * cls.WAYS < capacity:
+            buckets <<= 1
+        return 8 * stripes + buckets + buckets * cls.WAYS * cls._SLOT
+
+    @classmethod
+    def create(cls, capacity: int = 1_000_000, stripes: int = 64, ctx=None) -> "SharedDedup":
+        if shared_memory is None:
+            raise RuntimeError("sem memória compartilhada POSIX neste sistema")
+        ctx = ctx or mp.get_context("spawn")
+        shm = shared_memory.SharedMemory(create=True, size=cls.size_for(capacity, stripes))
+        # O segmento novo já vem zerado (ftruncate): balde vazio = chaves nulas.
+        return cls(shm, capacity, [ctx.Lock() for _ in range(stripes)], owner=True)
+
+    def handle(self) -> Tuple[str, int, list]:
+        """O que um worker recebe (nos argumentos do Process) para anexar a tabela."""
+        return self.shm.name, self.capacity, self.locks
+
+    @classmethod
+    def attach(cls, handle) -> "SharedDedup":
+        name, capacity, locks = handle
+        return cls(attach_segment(name), capacity, locks, owner=False)
+
+    def _find(self, off: int, key: bytes) -> bool:
+        bucket = bytes(self._buf[off:off + self.WAYS * self._SLOT])
+        i = bucket.find(key)
+        while i != -1 and i % self._SLOT:
+            i = bucket.find(key, i + 1)
+        return i != -1
+
+    def check_and_add(self, msg_id: Optional[str]) -> bool:
+        """Retorna True se o id é novo (e o registra); False se algum processo já o viu."""
+        return self._put(msg_id, True)
+
+    def _put(self, msg_id: Optional[str], check: bool) -> bool:
+        key = msg_key(msg_id)
+        b = int.from_bytes(key[:8], "little") & self._mask
+        off = self._slots_off + b * self.WAYS * self._SLOT
+        stripe = b % self._stripes
+        with self.locks[stripe]:
+            if check:
+                self.checks += 1
+            if self._find(off, key):
+                if check:
+                    self.duplicates += 1
+                return False
+            buf = self._buf
+            cur = buf[self._cursor_off + b]
+            pos = off + cur * self._SLOT
+            buf[pos:pos + self._SLOT] = key
+            buf[self._cursor_off + b] = (cur + 1) % self.WAYS
+            self._counts[stripe] += 1
+            return True
+
+    def add(self, msg_id: Optional[str]):
+        """Registra sem contar como verificação (mensagem originada neste worker)."""
+        self._put(msg_id, False)
+
+    def __contains__(self, msg_id: Optional[str]) -> bool:
+        key = msg_key(msg_id)
+        b = int.from_bytes(key[:8], "little") & self._mask
+        return self._find(self._slots_off + b * self.WAYS * self._SLOT, key)
+
+    def __len__(self) -> int:
+        return min(sum(self._counts), self.capacity)
+
+    def stats(self) -> dict:
+        inserted = sum(self._counts)
+        return {
+            "kind": self.kind,
+            "entries": min(inserted, self.capacity),
+            "capacity": self.capacity,
+            "memory_bytes": self.shm.size,
+            "fp_rate": 0.0,
+            "checks": self.checks,
+            "duplicates": self.duplicates,
+            "inserted": inserted,
+        }
+
+    def close(self):
+        self._counts.release()
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            self.owner = False
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+DEDUP_KINDS = ("window", "bloom")
+
+
+def make_dedup(kind: str = "window", capacity: int = 1_000_000, ttl: float = 600.0, fp_rate: float = 1e-4):
+    """Fábrica usada pelos peers a partir das flags --dedup*."""
+    if kind == "window":
+        return TimeWindowDedup(capacity=capacity, ttl=ttl)
+    if kind == "bloom":
+        return RotatingBloomDedup(capacity=capacity, fp_rate=fp_rate)
+    raise ValueError(f"dedup desconhecido: {kind}")
@@ -1,5 +1,18 @@
+import os
 import json
-from typing import List, Tuple
+import time
+import random
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from transport import THREADS
+
+Addr = Tuple[str, int]
+
+# Frames de enlace da troca de peers.
+PX_SHUFFLE = "px_shuffle"
+PX_REPLY = "px_reply"
+PX_TYPES = (PX_SHUFFLE, PX_REPLY)
 
 
 def load_peers_from_file(path: str) -> List[Tuple[str, int]]:
@@ -34,8 +47,295 @@ def save_peers_to_file(path: str, peers: List[Tuple[str, int]]):
     """
     try:
         data = [{"host": h, "port": p} for (h, p) in peers]
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        atomic_write(path, json.dumps(data, indent=2).encode("utf-8"))
         print(f"[DISCOVERY] Peers salvos em {path}")
     except Exception as e:
         print(f"[DISCOVERY] Erro ao salvar {path}: {e}")
+
+
+def atomic_write(path: str, data: bytes):
+    """Grava num temporário e renomeia: quem lê nunca vê o arquivo pela metade."""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _Entry:
+    __slots__ = ("node", "age", "last_seen", "failures")
+
+    def __init__(self, node: Optional[str], age: int, last_seen: float):
+        self.node = node
+        self.age = age
+        self.last_seen = last_seen
+        self.failures = 0
+
+
+class PeerCache:
+    """
+    Visão parcial de endereços conhecidos, no estilo do Cyclon: cada entrada
+    tem uma idade (rodadas de troca desde que alguém a viu viva) e o
+    horário em que foi vista viva pela última vez. Acima de `size`
+    entradas saem as mais velhas; endereços que falham `max_failures`
+    conexões seguidas são esquecidos.
+
+    O arquivo usa o formato do peers.json ({"host", "port"} + metadados),
+    então também serve de --bootstrap. `save()` só regrava (atomicamente)
+    quando o conteúdo mudou; last_seen vai arredondado a `save_granularity`
+    segundos para que um nó estável não reescreva o arquivo a cada rodada.
+    """
+    def __init__(self, path: Optional[str] = None, size: int = 64, max_failures: int = 3,
+                 save_granularity: float = 60.0):
+        self.path = path
+        self.size = size
+        self.max_failures = max_failures
+        self.save_granularity = save_granularity
+        self._entries: Dict[Addr, _Entry] = {}
+        self._lock = threading.Lock()
+        self._saved: Optional[bytes] = None
+        self.saves = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            data = json.loads(raw)
+        except (OSError, ValueError) as e:
+            print(f"[DISCOVERY] Erro ao ler {self.path}: {e}")
+            return
+        self._saved = raw
+        now = time.time()
+        for item in data:
+            try:
+                addr = (str(item["host"]), int(item["port"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            last_seen = float(item.get("last_seen") or 0)
+            # Sem rodadas registradas: a idade inicial vem de há quanto tempo foi visto.
+            age = int(min(1000, (now - last_seen) / 60)) if last_seen else 1000
+            self._entries[addr] = _Entry(item.get("node"), age, last_seen)
+        self._trim()
+
+    def addresses(self) -> List[Addr]:
+        """Do mais recente ao mais velho (ordem de discagem no bootstrap)."""
+        with self._lock:
+            return [a for a, _ in sorted(self._entries.items(), key=lambda kv: kv[1].age)]
+
+    def seen(self, addr: Addr, node: Optional[str] = None):
+        """Endereço confirmado vivo agora (enlace identificado ou conexão aceita)."""
+        with self._lock:
+            e = self._entries.get(addr)
+            if e is None:
+                e = self._entries[addr] = _Entry(node, 0, time.time())
+                self._trim()
+            e.age = 0
+            e.last_seen = time.time()
+            e.failures = 0
+            if node:
+                e.node = node
+
+    def failed(self, addr: Addr) -> bool:
+        """Registra uma falha de conexão; True se o endereço foi esquecido."""
+        with self._lock:
+            e = self._entries.get(addr)
+            if e is None:
+                return False
+            e.failures += 1
+            if e.failures >= self.max_failures:
+                del self._entries[addr]
+                return True
+            return False
+
+    def tick(self):
+        with self._lock:
+            for e in self._entries.values():
+                e.age += 1
+
+    def sample(self, n: int, exclude: Iterable[Addr] = (), rng=random) -> List[list]:
+        """Até n entradas aleatórias como [host, port, node, idade] para a troca."""
+        skip = set(exclude)
+        with self._lock:
+            items = [(a, e) for a, e in self._entries.items() if a not in skip]
+        picked = rng.sample(items, min(n, len(items)))
+        return [[a[0], a[1], e.node, e.age] for a, e in picked]
+
+    def merge(self, entries: Iterable[list], replaceable: Iterable[Addr] = ()) -> List[Tuple[Addr, Optional[str]]]:
+        """
+        Incorpora entradas recebidas, ficando com a idade menor quando o
+        endereço já é conhecido. Para abrir espaço saem primeiro as entradas
+        que acabamos de mandar ao outro lado (`replaceable`), como no Cyclon.
+        Retorna os endereços novos.
+        """
+        new = []
+        spare = [a for a in replaceable]
+        with self._lock:
+            for item in entries:
+                try:
+                    host, port, node, age = str(item[0]), int(item[1]), item[2], int(item[3])
+                except (IndexError, TypeError, ValueError):
+                    continue
+                addr = (host, port)
+                e = self._entries.get(addr)
+                if e is not None:
+                    if age < e.age:
+                        e.age = age
+                    if node:
+                        e.node = node
+                    continue
+                while len(self._entries) >= self.size and spare:
+                    self._entries.pop(spare.pop(), None)
+                self._entries[addr] = _Entry(node, age, 0.0)
+                new.append((addr, node))
+            self._trim()
+        return new
+
+    def _trim(self):
+        if len(self._entries) <= self.size:
+            return
+        by_age = sorted(self._entries.items(), key=lambda kv: kv[1].age)
+        self._entries = dict(by_age[:self.size])
+
+    def save(self) -> bool:
+        """Regrava o arquivo se algo mudou. Retorna True se gravou."""
+        if not self.path:
+            return False
+        g = self.save_granularity
+        with self._lock:
+            data = [{"host": a[0], "port": a[1], "node": e.node,
+                     "last_seen": int(e.last_seen // g * g) if e.last_seen else None}
+                    for a, e in sorted(self._entries.items())]
+        raw = json.dumps(data, indent=2).encode("utf-8")
+        if raw == self._saved:
+            return False
+        atomic_write(self.path, raw)
+        self._saved = raw
+        self.saves += 1
+        return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            ages = [e.age for e in self._entries.values()]
+        return {
+            "known": len(ages),
+            "size": self.size,
+            "fresh": sum(1 for a in ages if a == 0),
+            "max_age": max(ages, default=0),
+            "file": self.path,
+            "saves": self.saves,
+        }
+
+
+class PeerExchange:
+    """
+    Troca periódica de amostras da visão parcial (shuffle do Cyclon, sobre
+    os enlaces que já existem em vez de conexões novas). A cada `interval`
+    segundos envelhece o cache, marca os vizinhos identificados como vivos
+    e manda a um vizinho sorteado `shuffle_len` entradas, incluindo a si
+    mesmo com idade 0. Quem recebe responde com uma amostra própria e os
+    dois incorporam o que veio. Endereços novos viram candidatos (não
+    estáticos) do ConnectionManager, que os disca até o grau alvo.
+
+    Como o Plumtree, envia pelos callbacks do peer: send_ctrl(link, type, payload).
+    """
+    def __init__(self, cache: PeerCache, conns, send_ctrl: Callable, listen: Addr,
+                 interval: float = 5.0, shuffle_len: int = 8, metrics=None, runtime=None):
+        self.cache = cache
+        self.conns = conns
+        self.send_ctrl = send_ctrl
+        self.listen = listen
+        self.interval = interval
+        self.shuffle_len = shuffle_len
+        self.runtime = runtime or THREADS
+        self._sent: Dict[object, List[Addr]] = {}
+        self._lock = threading.Lock()
+        self._ticker = None
+        self.shuffles = 0
+        self.replies = 0
+        self.learned = 0
+        self.forgotten = 0
+        conns.on_dial = self.on_dial
+        if metrics is not None:
+            metrics.registry.gauge("p2p_px_known_peers", "Endereços no cache de peers", lambda: len(self.cache))
+            metrics.registry.collector(self._samples)
+
+    def _samples(self):
+        yield "p2p_px_shuffles_total", "counter", "Trocas de amostra iniciadas", {}, self.shuffles
+        yield "p2p_px_learned_total", "counter", "Endereços novos aprendidos por troca", {}, self.learned
+        yield "p2p_px_forgotten_total", "counter", "Endereços esquecidos por falhas de conexão", {}, self.forgotten
+
+    def bootstrap(self):
+        """Entrega o cache carregado do disco ao ConnectionManager como candidatos."""
+        for host, port in self.cache.addresses():
+            if (host, port) != self.listen:
+                self.conns.add_address(host, port, static=False)
+
+    def start(self):
+        self._ticker = self.runtime.every(self.interval, self.tick)
+
+    def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+        self.cache.save()
+
+    def _self_entry(self) -> list:
+        return [self.listen[0], self.listen[1], self.conns.node_id, 0]
+
+    def tick(self):
+        self.cache.tick()
+        neighbours = [(link, node, addr) for link, node, addr in self.conns.neighbours() if addr is not None]
+        for _, node, addr in neighbours:
+            self.cache.seen(addr, node)
+        if neighbours:
+            link, _, addr = self.runtime.rng.choice(neighbours)
+            sample = self.cache.sample(self.shuffle_len - 1, exclude=(addr,), rng=self.runtime.rng)
+            with self._lock:
+                self._sent[link] = [(h, p) for h, p, _, _ in sample]
+            self.shuffles += 1
+            self.send_ctrl(link, PX_SHUFFLE, {"peers": sample + [self._self_entry()]})
+        self.cache.save()
+
+    def on_control(self, link, msg_type: str, payload: dict, peer_name: str = ""):
+        peers = [self._fix_host(p, peer_name) for p in payload.get("peers") or [] if isinstance(p, list)]
+        peers = [p for p in peers if p and (p[0], p[1]) != self.listen]
+        if msg_type == PX_SHUFFLE:
+            reply = self.cache.sample(self.shuffle_len, exclude=[(p[0], p[1]) for p in peers], rng=self.runtime.rng)
+            self.replies += 1
+            self.send_ctrl(link, PX_REPLY, {"peers": reply})
+            sent = [(h, p) for h, p, _, _ in reply]
+        else:
+            with self._lock:
+                sent = self._sent.pop(link, [])
+        for (host, port), node in self.cache.merge(peers, replaceable=sent):
+            self.learned += 1
+            self.conns.add_address(host, port, static=False, node=node)
+
+    @staticmethod
+    def _fix_host(p: list, peer_name: str) -> Optional[list]:
+        if len(p) < 4:
+            return None
+        if p[0] in ("", "0.0.0.0", "::") and peer_name:
+            p = [peer_name.rpartition(":")[0]] + p[1:]
+        return p
+
+    def on_dial(self, addr: Addr, ok: bool):
+        if ok:
+            return
+        if self.cache.failed(addr):
+            self.forgotten += 1
+            self.conns.forget(*addr)
+
+    def stats(self) -> dict:
+        st = self.cache.stats()
+        st.update({"interval": self.interval, "shuffles": self.shuffles, "replies": self.replies,
+                   "learned": self.learned, "forgotten": self.forgotten})
+        return st
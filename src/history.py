@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import base64
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from common import encode_body
+from dedup import msg_key
+from outbound import make_frame, CONTROL, BULK
+from transport import THREADS
+
+# Frames de enlace da sincronização anti-entropia.
+SYNC_DIGEST = "sync_digest"
+SYNC_BATCH = "sync_batch"
+SYNC_TYPES = (SYNC_DIGEST, SYNC_BATCH)
+
+# Registro no arquivo: chave(16) ts(8) tamanho(4) + corpo JSON da mensagem.
+_REC = struct.Struct("!16sdI")
+# O digest leva só um prefixo da chave: 8 bytes bastam para não confundir ids.
+DIGEST_PREFIX = 8
+
+
+class MessageStore:
+    """
+    Histórico limitado das mensagens do nó, para reenviar a quem ficou de fora.
+
+    As `capacity` mais recentes ficam em memória (chave -> corpo JSON); com
+    `path`, toda mensagem também é acrescentada a um arquivo só de escrita
+    no fim, e as que saem da memória continuam legíveis de lá por offset.
+    O arquivo gira em `max_file_bytes / 2`: o anterior vira `<path>.old`
+    e o mais velho é apagado, então o disco fica limitado a `max_file_bytes`.
+    Ao abrir, os dois arquivos são relidos e o histórico sobrevive a restarts.
+    """
+    def __init__(self, capacity: int = 10000, path: Optional[str] = None,
+                 max_file_bytes: int = 32 * 1024 * 1024):
+        self.capacity = capacity
+        self.path = path
+        self.max_file_bytes = max_file_bytes
+        # Ordem de chegada de tudo o que está guardado: chave -> (ts, segmento, offset).
+        self._order: "OrderedDict[bytes, tuple[float, int, int]]" = OrderedDict()
+        self._ring: Dict[bytes, bytes] = {}
+        self._ring_keys: "OrderedDict[bytes, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._seg = 1
+        self._f = None
+        self._size = 0
+        self._flushed = 0
+        self.added = 0
+        self.spilled_reads = 0
+        if path:
+            d = os.path.dirname(path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._load()
+            self._f = open(path, "ab")
+            self._size = self._flushed = self._f.tell()
+
+    # ---- arquivo -------------------------------------------------------
+
+    def _seg_path(self, seg: int) -> Optional[str]:
+        if seg == self._seg:
+            return self.path
+        if seg == self._seg - 1:
+            return self.path + ".old"
+        return None
+
+    def _load(self):
+        for seg, p in ((0, self.path + ".old"), (1, self.path)):
+            if not os.path.exists(p):
+                continue
+            good = 0
+            with open(p, "rb") as f:
+                data = f.read()
+            while good + _REC.size <= len(data):
+                key, ts, n = _REC.unpack_from(data, good)
+                end = good + _REC.size + n
+                if end > len(data):
+                    break
+                self._order.pop(key, None)
+                self._order[key] = (ts, seg, good)
+                self._remember(key, data[good + _REC.size:end])
+                good = end
+            if good < len(data):
+                # Registro cortado no fim (queda no meio da escrita).
+                with open(p, "r+b") as f:
+                    f.truncate(good)
+
+    def _rotate(self):
+        self._f.close()
+        os.replace(self.path, self.path + ".old")
+        self._seg += 1
+        old = self._seg - 1
+        for key in [k for k, (_, seg, _) in self._order.items() if seg < old]:
+            del self._order[key]
+            if key in self._ring:
+                del self._ring[key]
+                del self._ring_keys[key]
+        self._f = open(self.path, "ab")
+        self._size = self._flushed = 0
+
+    def flush(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.flush()
+                self._flushed = self._size
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+    # ---- escrita -------------------------------------------------------
+
+    def _remember(self, key: bytes, body: bytes):
+        self._ring[key] = body
+        self._ring_keys[key] = None
+        if len(self._ring_keys) > self.capacity:
+            old, _ = self._ring_keys.popitem(last=False)
+            del self._ring[old]
+            if self.path is None:
+                # Sem arquivo, sair da memória é sair do histórico.
+                self._order.pop(old, None)
+
+    def add(self, msg_id: Optional[str], body: bytes, ts: Optional[float] = None):
+        """Guarda o corpo JSON da mensagem (uma vez por id)."""
+        key = msg_key(msg_id)
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            if key in self._order:
+                return
+            self.added += 1
+            off = 0
+            if self._f is not None:
+                if self._size + _REC.size + len(body) > self.max_file_bytes // 2 and self._size:
+                    self._rotate()
+                off = self._size
+                self._f.write(_REC.pack(key, ts, len(body)))
+                self._f.write(body)
+                self._size += _REC.size + len(body)
+            self._order[key] = (ts, self._seg, off)
+            self._remember(key, body)
+
+    # ---- leitura -------------------------------------------------------
+
+    def _read(self, key: bytes) -> Optional[bytes]:
+        body = self._ring.get(key)
+        if body is not None:
+            return body
+        ent = self._order.get(key)
+        if ent is None:
+            return None
+        _, seg, off = ent
+        p = self._seg_path(seg)
+        if p is None:
+            return None
+        if seg == self._seg and off >= self._flushed:
+            self._f.flush()
+            self._flushed = self._size
+        self.spilled_reads += 1
+        with open(p, "rb") as f:
+            f.seek(off)
+            hdr = f.read(_REC.size)
+            if len(hdr) < _REC.size:
+                return None
+            _, _, n = _REC.unpack(hdr)
+            return f.read(n)
+
+    def recent_keys(self, window: float, limit: int) -> List[bytes]:
+        """Chaves recebidas nos últimos `window` segundos, da mais nova à mais velha."""
+        since = time.time() - window
+        out = []
+        with self._lock:
+            for key in reversed(self._order):
+                if len(out) >= limit or self._order[key][0] < since:
+                    break
+                out.append(key)
+        return out
+
+    def bodies(self, keys: Iterable[bytes]) -> List[bytes]:
+        with self._lock:
+            found = [self._read(k) for k in keys]
+        return [b for b in found if b is not None]
+
+    def keys(self) -> List[bytes]:
+        with self._lock:
+            return list(self._order)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "stored": len(self._order),
+                "in_memory": len(self._ring),
+                "capacity": self.capacity,
+                "file": self.path,
+                "file_bytes": self._size,
+                "added": self.added,
+                "spilled_reads": self.spilled_reads,
+            }
+
+
+def pack_digest(keys: Iterable[bytes]) -> str:
+    return base64.b64encode(b"".join(k[:DIGEST_PREFIX] for k in keys)).decode("ascii")
+
+
+def unpack_digest(data: str) -> Set[bytes]:
+    raw = base64.b64decode(data or "")
+    return {raw[i:i + DIGEST_PREFIX] for i in range(0, len(raw) - DIGEST_PREFIX + 1, DIGEST_PREFIX)}
+
+
+def valid_body(body: bytes) -> bool:
+    """Corpo guardado que pode entrar num sync_batch: objeto JSON com id string."""
+    try:
+        msg = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(msg, dict) and isinstance(msg.get("id"), str) and bool(msg["id"])
+
+
+def batch_body(bodies: List[bytes]) -> bytes:
+    """
+    Frame sync_batch montado com os corpos guardados, sem reserializar.
+    Os corpos já passaram por valid_body: um só malformado perderia o lote.
+    """
+    return b'{"type": "' + SYNC_BATCH.encode() + b'", "payload": {"msgs": [' + b", ".join(bodies) + b"]}}"
+
+
+class HistorySync:
+    """
+    Anti-entropia na conexão: ao abrir um enlace, cada lado manda um digest
+    (prefixos dos ids que recebeu nos últimos `window` segundos, no máximo
+    `max_ids`). Quem recebe o digest responde só com as mensagens recentes
+    que faltam ao outro, em lotes de até `batch_bytes` e sem encher a fila
+    de saída do enlace (espera ela cair para metade antes do próximo lote).
+
+    Mensagens recuperadas passam pelo dedup e são entregues localmente, mas
+    não são repassadas: cada vizinho faz a própria sincronização, então um
+    nó que volta não inunda a malha inteira.
+
+    Como o Plumtree, trata enlaces como objetos opacos (os Outbound do peer).
+    `deliver(msg)` é chamado para cada mensagem recuperada nova, depois de
+    ela entrar no histórico local.
+    """
+    def __init__(self, store: MessageStore, dedup, deliver: Callable[[dict], None],
+                 window: float = 300.0, max_ids: int = 8192, batch_bytes: int = 256 * 1024,
+                 metrics=None, runtime=None):
+        self.store = store
+        self.dedup = dedup
+        self.deliver = deliver
+        self.window = window
+        self.max_ids = max_ids
+        self.batch_bytes = batch_bytes
+        self.runtime = runtime or THREADS
+        self.digests_sent = 0
+        self.batches_sent = 0
+        self.msgs_sent = 0
+        self.msgs_recovered = 0
+        self.msgs_duplicate = 0
+        self.bad_bodies = 0
+        # O que já está no histórico (ex.: relido do arquivo) não é entregue de novo.
+        for key in store.keys():
+            dedup.add(key.hex())
+        if metrics is not None:
+            r = metrics.registry
+            r.gauge("p2p_history_messages", "Mensagens no histórico local", lambda: len(self.store))
+            r.collector(self._samples)
+
+    def _samples(self):
+        yield "p2p_sync_messages_sent_total", "counter", "Mensagens reenviadas a vizinhos na sincronização", {}, self.msgs_sent
+        yield "p2p_sync_messages_recovered_total", "counter", "Mensagens que faltavam, recebidas na sincronização", {}, self.msgs_recovered
+        yield "p2p_sync_batches_sent_total", "counter", "Lotes sync_batch enviados", {}, self.batches_sent
+
+    def on_connect(self, out):
+        keys = self.store.recent_keys(self.window, self.max_ids)
+        self.digests_sent += 1
+        body = encode_body({"type": SYNC_DIGEST, "payload": {"window": self.window, "ids": pack_digest(keys)}})
+        out.enqueue(make_frame(body), CONTROL)
+
+    def on_digest(self, out, payload: dict):
+        have = unpack_digest(payload.get("ids", ""))
+        window = min(self.window, float(payload.get("window", self.window)))
+        keys = self.store.recent_keys(window, self.max_ids)
+        missing = [k for k in reversed(keys) if k[:DIGEST_PREFIX] not in have]
+        if missing:
+            self.runtime.spawn(self._replay, out, self._batches(missing))
+
+    def _batches(self, keys: List[bytes]) -> Iterator[List[bytes]]:
+        """
+        Lotes de corpos em ordem de chegada; os que saíram da memória vêm do
+        arquivo. Corpo malformado (frame JSON guardado como chegou, arquivo
+        corrompido) fica de fora.
+        """
+        for i in range(0, len(keys), 256):
+            batch, size = [], 0
+            for body in self.store.bodies(keys[i:i + 256]):
+                if not valid_body(body):
+                    self.bad_bodies += 1
+                    continue
+                if batch and size + len(body) > self.batch_bytes:
+                    yield batch
+                    batch, size = [], 0
+                batch.append(body)
+                size += len(body) + 2
+            if batch:
+                yield batch
+
+    def _replay(self, out, batches: Iterator[List[bytes]]):
+        """Envia um lote por vez na faixa bulk; com a fila acima da metade, volta em 5 ms."""
+        while out.depth() <= out.maxlen // 2:
+            batch = next(batches, None)
+            if batch is None or not out.enqueue(make_frame(batch_body(batch)), BULK):
+                return
+            self.batches_sent += 1
+            self.msgs_sent += len(batch)
+        self.runtime.call_later(0.005, self._replay, out, batches)
+
+    def on_batch(self, out, msgs: List[dict]):
+        for msg in msgs:
+            if not isinstance(msg, dict) or not isinstance(msg.get("id"), str) or not msg["id"]:
+                continue
+            if not self.dedup.check_and_add(msg.get("id")):
+                self.msgs_duplicate += 1
+                continue
+            self.msgs_recovered += 1
+            self.store.add(msg.get("id"), encode_body(msg))
+            self.deliver(msg)
+
+    def stats(self) -> dict:
+        st = self.store.stats()
+        st.update({
+            "window": self.window,
+            "digests_sent": self.digests_sent,
+            "batches_sent": self.batches_sent,
+            "msgs_sent": self.msgs_sent,
+            "msgs_recovered": self.msgs_recovered,
+            "msgs_duplicate": self.msgs_duplicate,
+            "bad_bodies": self.bad_bodies,
+        })
+        return st
@@ -0,0 +1,502 @@
+import os
+import re
+import sys
+import gzip
+import json
+import mmap
+import time
+import heapq
+import struct
+import hashlib
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dedup import msg_key
+
+# Índice lateral em <log>.idx/:
+#   meta.json   arquivos conhecidos, até onde cada um foi indexado, tipos e segmentos
+#   ids-N.bin   segmentos ordenados de (chave 16 bytes do id, nº do arquivo, offset);
+#               cada atualização grava um segmento novo, fundidos quando passam de MAX_ID_SEGMENTS
+#   blocks.bin  um registro por bloco de linhas: (ts mín, ts máx, máscara de tipos, arquivo, início, fim)
+_ID_REC = struct.Struct("!16sHQ")
+_BLOCK_REC = struct.Struct("!ddQHQQ")
+INDEX_VERSION = 1
+MAX_ID_SEGMENTS = 8
+DEFAULT_BLOCK_LINES = 256
+_OTHER_KIND_BIT = 63
+
+# Linha como o LoggerProcess escreve (json.dumps com as chaves nesta ordem);
+# o que não casar cai no json.loads.
+_LINE_RE = re.compile(
+    rb'\{"ts": ([-0-9.eE+]+), "peer": "(?:[^"\\]|\\.)*", "kind": "([A-Za-z0-9_]{1,32})", '
+    rb'"data": \{(?:"id": "([^"\\]{1,64})")?')
+_ROTATED_RE = re.compile(r"\.(\d+)(?:-(\d+))?\.jsonl(?:\.gz)?$")
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+
+def parse_line(line: bytes) -> Optional[Tuple[float, str, Optional[str]]]:
+    """(ts, kind, id da mensagem ou None) de uma linha do log, ou None se ilegível."""
+    m = _LINE_RE.match(line)
+    if m is not None:
+        msg_id = m.group(3)
+        return float(m.group(1)), m.group(2).decode("ascii"), msg_id.decode("utf-8") if msg_id else None
+    try:
+        evt = json.loads(line)
+        ts = float(evt.get("ts") or 0.0)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    data = evt.get("data")
+    msg_id = data.get("id") if isinstance(data, dict) else None
+    return ts, str(evt.get("kind", "")), msg_id if isinstance(msg_id, str) else None
+
+
+def log_files(log_path: str) -> List[str]:
+    """Arquivos rotacionados (.jsonl e .jsonl.gz) em ordem de rotação, seguidos do arquivo ativo."""
+    d, base = os.path.split(os.path.abspath(log_path))
+    rotated = []
+    try:
+        names = os.listdir(d)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.startswith(base + "."):
+            continue
+        m = _ROTATED_RE.fullmatch(name[len(base):])
+        if m is not None:
+            rotated.append((int(m.group(1)), int(m.group(2) or 0), name))
+    rotated.sort()
+    paths = [os.path.join(d, name) for _, _, name in rotated]
+    if os.path.exists(os.path.join(d, base)):
+        paths.append(os.path.join(d, base))
+    return paths
+
+
+def open_log(path: str):
+    """Abre um arquivo de log em modo binário, descomprimindo se for .gz."""
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def fingerprint(path: str) -> Optional[str]:
+    """
+    Identidade de um arquivo de log pelo conteúdo da primeira linha: sobrevive
+    à rotação (rename) e à compressão (.gz), que trocam nome e inode.
+    """
+    try:
+        with open_log(path) as f:
+            line = f.readline(64 * 1024)
+    except (OSError, EOFError):
+        return None
+    if not line.endswith(b"\n"):
+        return None
+    return hashlib.blake2b(line, digest_size=8).hexdigest()
+
+
+class _Source:
+    """Leitura por offset de um arquivo de log: mmap para .jsonl, GzipFile para .jsonl.gz."""
+    def __init__(self, path: str):
+        self.path = path
+        self.gz = path.endswith(".gz")
+        self._f = open_log(path)
+        self._mm = None
+        self._mm_len = 0
+
+    def _map(self, need: int) -> bool:
+        if self._mm is not None and need <= self._mm_len:
+            return True
+        size = os.fstat(self._f.fileno()).st_size
+        if size == 0 or need > size:
+            return False
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mm_len = size
+        return True
+
+    def lines(self, start: int, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+        """(offset, linha) das linhas completas a partir de `start` (até `end`, exclusivo)."""
+        if self.gz:
+            self._f.seek(start)
+            off = start
+            while end is None or off < end:
+                line = self._f.readline()
+                if not line.endswith(b"\n"):
+                    return
+                yield off, line
+                off += len(line)
+            return
+        if not self._map(start + 1):
+            return
+        mm = self._mm
+        limit = self._mm_len if end is None else min(end, self._mm_len)
+        off = start
+        while off < limit:
+            nl = mm.find(b"\n", off, self._mm_len)
+            if nl < 0:
+                return
+            yield off, mm[off:nl + 1]
+            off = nl + 1
+
+    def line_at(self, off: int) -> Optional[bytes]:
+        for _, line in self.lines(off):
+            return line
+        return None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._f.close()
+
+
+class LogIndex:
+    """
+    Índice incremental sobre os logs JSONL de um peer (arquivo ativo + rotacionados).
+    update() só lê o que foi acrescentado desde a última vez; find_id() faz
+    busca binária nos segmentos de ids e query() visita apenas os blocos cujo
+    intervalo de tempo e tipos podem conter o que foi pedido.
+    """
+    def __init__(self, log_path: str, index_dir: Optional[str] = None, block_lines: int = DEFAULT_BLOCK_LINES):
+        self.log_path = os.path.abspath(log_path)
+        self.index_dir = index_dir or self.log_path + ".idx"
+        self.block_lines = block_lines
+        self._sources: Dict[int, _Source] = {}
+        self._load()
+
+    # ---- persistência --------------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        self.meta = {"version": INDEX_VERSION, "files": [], "kinds": [], "segments": [],
+                     "blocks_len": 0, "next_segment": 0}
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") == INDEX_VERSION:
+                self.meta = meta
+        except (OSError, ValueError):
+            pass
+        self._by_fp = {entry["fp"]: i for i, entry in enumerate(self.meta["files"])}
+
+    def _save(self):
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._path("meta.json"))
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._path("lock"), "a") as lf:
+            if fcntl is not None:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def rebuild(self):
+        with self._locked():
+            for name in os.listdir(self.index_dir):
+                if name != "lock":
+                    os.remove(self._path(name))
+        self.close()
+        self._load()
+        return self.update()
+
+    # ---- indexação -----------------------------------------------------
+
+    def _kind_bit(self, kind: str) -> int:
+        kinds = self.meta["kinds"]
+        if kind not in kinds:
+            if len(kinds) >= _OTHER_KIND_BIT:
+                return 1 << _OTHER_KIND_BIT
+            kinds.append(kind)
+        return 1 << kinds.index(kind)
+
+    def update(self) -> dict:
+        """Indexa o que apareceu desde a última atualização. Retorna o que foi lido."""
+        t0 = time.perf_counter()
+        new_ids: List[Tuple[bytes, int, int]] = []
+        blocks: List[bytes] = []
+        read_bytes = 0
+        events = 0
+        with self._locked():
+            # Outro processo pode ter atualizado o índice enquanto esperávamos a trava.
+            self.close()
+            self._load()
+            before = json.dumps(self.meta)
+            active = self.log_path
+            seen = set()
+            done = {e["name"]: e["fp"] for e in self.meta["files"] if e["complete"]}
+            for path in log_files(self.log_path):
+                # Rotacionado já indexado por inteiro: nem abre (o nome inclui o timestamp).
+                fp = done.get(os.path.basename(path)) or fingerprint(path)
+                if fp is None or fp in seen:
+                    continue
+                seen.add(fp)
+                file_no = self._by_fp.get(fp)
+                if file_no is None:
+                    file_no = len(self.meta["files"])
+                    self.meta["files"].append({"fp": fp, "name": "", "indexed": 0, "complete": False,
+                                               "first_ts": None, "last_ts": None})
+                    self._by_fp[fp] = file_no
+                entry = self.meta["files"][file_no]
+                entry["name"] = os.path.basename(path)
+                if entry["complete"]:
+                    continue
+                n, nbytes = self._scan(path, file_no, entry, new_ids, blocks)
+                events += n
+                read_bytes += nbytes
+                if path != active:
+                    entry["complete"] = True
+
+            if blocks:
+                self._append_blocks(blocks)
+            if new_ids:
+                self._write_segment(sorted(new_ids))
+            if json.dumps(self.meta) != before:
+                self._save()
+                self._compact()
+        return {"events": events, "bytes": read_bytes, "blocks": len(blocks),
+                "ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+    def _scan(self, path: str, file_no: int, entry: dict, new_ids: list, blocks: list) -> Tuple[int, int]:
+        src = _Source(path)
+        start = entry["indexed"]
+        events = 0
+        end = start
+        block = None
+        try:
+            for off, line in src.lines(start):
+                end = off + len(line)
+                events += 1
+                parsed = parse_line(line)
+                if parsed is None:
+                    continue
+                ts, kind, msg_id = parsed
+                if msg_id is not None:
+                    new_ids.append((msg_key(msg_id), file_no, off))
+                if entry["first_ts"] is None:
+                    entry["first_ts"] = ts
+                entry["last_ts"] = ts
+                if block is None:
+                    block = [ts, ts, 0, off, 0, 0]
+                block[0] = min(block[0], ts)
+                block[1] = max(block[1], ts)
+                block[2] |= self._kind_bit(kind)
+                block[4] = end
+                block[5] += 1
+                if block[5] >= self.block_lines:
+                    blocks.append(_BLOCK_REC.pack(block[0], block[1], block[2], file_no, block[3], block[4]))
+                    block = None
+        finally:
+            src.close()
+        if block is not None:
+            blocks.append(_BLOCK_REC.pack(block[0], block[1], block[2], file_no, block[3], block[4]))
+        entry["indexed"] = end
+        return events, end - start
+
+    def _append_blocks(self, blocks: List[bytes]):
+        path = self._path("blocks.bin")
+        with open(path, "ab") as f:
+            # Sobra de uma atualização interrompida antes do meta.json: descarta.
+            f.truncate(self.meta["blocks_len"])
+            f.seek(self.meta["blocks_len"])
+            f.write(b"".join(blocks))
+            self.meta["blocks_len"] = f.tell()
+
+    def _write_segment(self, records: List[Tuple[bytes, int, int]]):
+        name = f"ids-{self.meta['next_segment']}.bin"
+        self.meta["next_segment"] += 1
+        with open(self._path(name), "wb") as f:
+            f.write(b"".join(_ID_REC.pack(*r) for r in records))
+        self.meta["segments"].append(name)
+
+    def _compact(self):
+        """Funde os segmentos de ids num só quando são muitos (merge de listas já ordenadas)."""
+        old = self.meta["segments"]
+        if len(old) <= MAX_ID_SEGMENTS:
+            return
+        maps = [self._map_file(name) for name in old]
+        merged = heapq.merge(*[_ID_REC.iter_unpack(m) for m in maps if m is not None])
+        name = f"ids-{self.meta['next_segment']}.bin"
+        self.meta["next_segment"] += 1
+        with open(self._path(name), "wb") as f:
+            for rec in merged:
+                f.write(_ID_REC.pack(*rec))
+        for m in maps:
+            if m is not None:
+                m.close()
+        self.meta["segments"] = [name]
+        self._save()
+        for n in old:
+            os.remove(self._path(n))
+
+    def _map_file(self, name: str, length: int = 0):
+        try:
+            with open(self._path(name), "rb") as f:
+                return mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # inexistente ou vazio
+            return None
+
+    # ---- consultas -----------------------------------------------------
+
+    def _source(self, file_no: int) -> Optional[_Source]:
+        src = self._sources.get(file_no)
+        if src is None:
+            name = self.meta["files"][file_no]["name"]
+            path = os.path.join(os.path.dirname(self.log_path), name)
+            # Um rotacionado pode ter sido comprimido depois da última atualização.
+            for candidate in (path, path + ".gz", path[:-3] if path.endswith(".gz") else None):
+                if candidate and os.path.exists(candidate):
+                    src = self._sources[file_no] = _Source(candidate)
+                    break
+        return src
+
+    def find_id(self, msg_id: str, raw: bool = False) -> list:
+        """Todas as linhas que citam o id, por busca binária em cada segmento."""
+        key = msg_key(msg_id)
+        hits = []
+        for name in self.meta["segments"]:
+            m = self._map_file(name)
+            if m is None:
+                continue
+            n = len(m) // _ID_REC.size
+            lo, hi = 0, n
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if m[mid * _ID_REC.size:mid * _ID_REC.size + 16] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            while lo < n:
+                k, file_no, off = _ID_REC.unpack_from(m, lo * _ID_REC.size)
+                if k != key:
+                    break
+                hits.append((file_no, off))
+                lo += 1
+            m.close()
+        out = []
+        for file_no, off in sorted(hits, key=lambda h: (self.meta["files"][h[0]]["first_ts"] or 0.0, h[1])):
+            src = self._source(file_no)
+            line = src.line_at(off) if src is not None else None
+            if line is not None:
+                out.append(bytes(line) if raw else json.loads(line))
+        return out
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None,
+              kinds: Optional[List[str]] = None, limit: Optional[int] = None, raw: bool = False) -> Iterator:
+        """Eventos com since <= ts <= until e kind em `kinds`, na ordem dos arquivos."""
+        lo = float("-inf") if since is None else since
+        hi = float("inf") if until is None else until
+        mask = ~0
+        wanted = None
+        if kinds:
+            wanted = set(kinds)
+            mask = 0
+            for k in wanted:
+                if k in self.meta["kinds"]:
+                    mask |= 1 << self.meta["kinds"].index(k)
+            if len(self.meta["kinds"]) >= _OTHER_KIND_BIT:
+                mask |= 1 << _OTHER_KIND_BIT
+            if not mask:
+                return
+        m = self._map_file("blocks.bin", self.meta["blocks_len"]) if self.meta["blocks_len"] else None
+        if m is None:
+            return
+        try:
+            selected = [(fno, start, end) for tmin, tmax, kmask, fno, start, end in _BLOCK_REC.iter_unpack(m)
+                        if tmax >= lo and tmin <= hi and kmask & mask]
+        finally:
+            m.close()
+        files = self.meta["files"]
+        selected.sort(key=lambda b: (files[b[0]]["first_ts"] or 0.0, b[0], b[1]))
+        count = 0
+        for fno, start, end in selected:
+            src = self._source(fno)
+            if src is None:
+                continue
+            for _, line in src.lines(start, end):
+                parsed = parse_line(line)
+                if parsed is None:
+                    continue
+                ts, kind, _ = parsed
+                if ts < lo or ts > hi or (wanted is not None and kind not in wanted):
+                    continue
+                yield bytes(line) if raw else json.loads(line)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    def stats(self) -> dict:
+        return {
+            "files": [{k: e[k] for k in ("name", "indexed", "complete", "first_ts", "last_ts")}
+                      for e in self.meta["files"]],
+            "kinds": self.meta["kinds"],
+            "id_segments": len(self.meta["segments"]),
+            "blocks": self.meta["blocks_len"] // _BLOCK_REC.size,
+        }
+
+    def close(self):
+        for src in self._sources.values():
+            src.close()
+        self._sources.clear()
+
+
+def parse_time(value: str) -> float:
+    """Epoch em segundos ou data ISO 8601 (hora local se não tiver fuso)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Consulta indexada aos logs JSONL de um peer (ativo + rotacionados).")
+    ap.add_argument("log", help="arquivo de log ativo, ex.: logs/peer_6000.jsonl")
+    ap.add_argument("--id", help="linhas que citam este id de mensagem")
+    ap.add_argument("--since", type=parse_time, help="início (epoch ou ISO 8601)")
+    ap.add_argument("--until", type=parse_time, help="fim (epoch ou ISO 8601)")
+    ap.add_argument("--kind", action="append", help="filtra por tipo de evento (repetível)")
+    ap.add_argument("--limit", type=int, help="máximo de linhas")
+    ap.add_argument("--no-update", action="store_true", help="consulta sem indexar o que foi acrescentado")
+    ap.add_argument("--rebuild", action="store_true", help="apaga e refaz o índice")
+    ap.add_argument("--stats", action="store_true", help="mostra o estado do índice e os tempos em stderr")
+    args = ap.parse_args(argv)
+
+    idx = LogIndex(args.log)
+    if args.rebuild:
+        upd = idx.rebuild()
+    elif not args.no_update:
+        upd = idx.update()
+    else:
+        upd = None
+    t0 = time.perf_counter()
+    n = 0
+    out = sys.stdout.buffer
+    try:
+        if args.id:
+            rows = idx.find_id(args.id, raw=True)[:args.limit]
+        elif args.since is not None or args.until is not None or args.kind:
+            rows = idx.query(args.since, args.until, args.kind, args.limit, raw=True)
+        else:
+            rows = []
+        for line in rows:
+            out.write(line)
+            n += 1
+        out.flush()
+    except BrokenPipeError:
+        pass
+    finally:
+        idx.close()
+    if args.stats:
+        print(json.dumps({"update": upd, "query_ms": round((time.perf_counter() - t0) * 1000, 2),
+                          "lines": n, "index": idx.stats()}, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
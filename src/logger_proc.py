@@ -1,39 +1,179 @@
-import json
 import os
+import gzip
+import json
 import time
+import shutil
+import threading
+from queue import Empty
 from multiprocessing import Process, Queue
-from typing import Optional
+from typing import Optional, List
+
+FSYNC_MODES = ("none", "batch", "interval")
+
+# Eventos de volume (um por mensagem): os primeiros a serem descartados
+# quando a fila passa do nível máximo.
+LOW_PRIORITY_KINDS = ("recv", "send", "dup", "throttle")
+
 
 class LoggerProcess(Process):
     """
     Processo dedicado a logging.
     Recebe eventos via multiprocessing.Queue (IPC) e escreve 1 evento por linha (JSONL).
+
+    Os eventos são drenados em lotes e gravados com um único writelines
+    (group commit). O flush acontece quando o lote atinge `flush_bytes` ou
+    quando o evento mais antigo pendente tem mais de `flush_interval` s.
+    fsync: "none" (só o flush), "batch" (a cada lote) ou "interval"
+    (no máximo um a cada `fsync_interval` s). Arquivos rotacionados são
+    comprimidos com gzip em uma thread de fundo.
     """
-    def __init__(self, queue: Queue, log_path: str, rotate_mb: int = 5):
+    def __init__(self, queue: Queue, log_path: str, rotate_mb: int = 5,
+                 batch_size: int = 1024, flush_interval: float = 0.2, flush_bytes: int = 256 * 1024,
+                 fsync: str = "none", fsync_interval: float = 1.0, compress_rotated: bool = True,
+                 high_water: int = 50000, low_priority=LOW_PRIORITY_KINDS):
         super().__init__(daemon=True)
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"fsync inválido: {fsync}")
         self.queue = queue
         self.log_path = log_path
         self.rotate_bytes = rotate_mb * 1024 * 1024
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compress_rotated = compress_rotated
+        self.high_water = high_water
+        self.low_priority = frozenset(low_priority)
+        # Lado produtor (processo do peer): contadores de descarte.
+        self.shed = 0
+        self._shed_pending = 0
         self._running = True
 
+    # ---- lado produtor -------------------------------------------------
+
+    def submit(self, evt: dict) -> bool:
+        """
+        Enfileira um evento sem bloquear. Acima de `high_water` eventos
+        pendentes, os de baixa prioridade são descartados e contados; quando
+        a fila volta ao normal, um evento "shed" registra quantos se perderam.
+        """
+        depth = self.depth()
+        if depth >= self.high_water and evt.get("kind") in self.low_priority:
+            self.shed += 1
+            self._shed_pending += 1
+            return False
+        try:
+            if self._shed_pending:
+                n, self._shed_pending = self._shed_pending, 0
+                self.queue.put_nowait({"ts": time.time(), "peer": evt.get("peer"), "kind": "shed", "data": {"count": n}})
+            self.queue.put_nowait(evt)
+        except Exception:
+            return False
+        return True
+
+    def depth(self) -> int:
+        """Eventos pendentes na fila (-1 onde qsize não é suportado, ex.: macOS)."""
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return -1
+
+    # ---- lado consumidor (processo de log) -----------------------------
+
     def run(self):
         os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
         f = open(self.log_path, "a", encoding="utf-8")
+        compressors: List[threading.Thread] = []
+        lines: List[str] = []
+        pending = 0
+        first_ts = 0.0
+        last_sync = time.monotonic()
+        stop = False
         try:
-            while self._running:
-                evt: Optional[dict] = self.queue.get()
-                if evt is None:
-                    break
-                line = json.dumps(evt, ensure_ascii=False)
-                f.write(line + "\n")
+            while not stop:
+                timeout = None
+                if lines:
+                    timeout = max(0.0, self.flush_interval - (time.monotonic() - first_ts))
+                try:
+                    evt: Optional[dict] = self.queue.get(timeout=timeout)
+                except Empty:
+                    evt = {}
+                while True:
+                    if evt is None:
+                        stop = True
+                        break
+                    if evt:
+                        if not lines:
+                            first_ts = time.monotonic()
+                        line = json.dumps(evt, ensure_ascii=False) + "\n"
+                        lines.append(line)
+                        pending += len(line)
+                    if len(lines) >= self.batch_size:
+                        break
+                    try:
+                        evt = self.queue.get_nowait()
+                    except Empty:
+                        break
+
+                if not lines:
+                    continue
+                if not stop and pending < self.flush_bytes and len(lines) < self.batch_size \
+                        and time.monotonic() - first_ts < self.flush_interval:
+                    continue
+
+                f.writelines(lines)
                 f.flush()
+                lines = []
+                pending = 0
+                now = time.monotonic()
+                if self.fsync == "batch" or (self.fsync == "interval" and now - last_sync >= self.fsync_interval):
+                    os.fsync(f.fileno())
+                    last_sync = now
+
+                # Tamanho em bytes do arquivo: com ensure_ascii=False, len(line)
+                # conta caracteres (pending só decide quando gravar o lote).
                 if f.tell() >= self.rotate_bytes:
                     f.close()
-                    ts = int(time.time())
-                    os.replace(self.log_path, f"{self.log_path}.{ts}.jsonl")
+                    rotated = self._rotate()
                     f = open(self.log_path, "a", encoding="utf-8")
+                    if self.compress_rotated:
+                        t = threading.Thread(target=compress_file, args=(rotated,), daemon=True)
+                        t.start()
+                        compressors.append(t)
+                        compressors = [c for c in compressors if c.is_alive()]
         finally:
             try:
+                if self.fsync != "none":
+                    os.fsync(f.fileno())
                 f.close()
             except Exception:
                 pass
+            for t in compressors:
+                t.join()
+
+    def _rotate(self) -> str:
+        ts = int(time.time())
+        rotated = f"{self.log_path}.{ts}.jsonl"
+        n = 0
+        # Várias rotações no mesmo segundo não podem sobrescrever a anterior.
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            n += 1
+            rotated = f"{self.log_path}.{ts}-{n}.jsonl"
+        os.replace(self.log_path, rotated)
+        return rotated
+
+
+def compress_file(path: str):
+    """gzip de um arquivo rotacionado; o original só some depois do .gz completo."""
+    tmp = path + ".gz.tmp"
+    try:
+        with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp, path + ".gz")
+        os.remove(path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
@@ -0,0 +1,332 @@
+import os
+import sys
+import time
+import heapq
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Limites (em segundos) dos histogramas de latência: de 1 µs a 1 s.
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1, 0.25, 1.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+# (nome, tipo, ajuda, rótulos, valor) produzido por um coletor na hora do scrape.
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+class Counter:
+    """
+    Contador monotônico sem lock: no caminho quente custa um `+=`.
+    Sob o GIL uma corrida rara pode perder um incremento, nunca voltar atrás.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+
+class Histogram:
+    """Histograma de baldes fixos (semântica `le` do Prometheus), também sem lock."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Limite superior do balde onde cai o quantil q (o último limite se passar dele)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class _Gauge:
+    __slots__ = ("fn",)
+
+    def __init__(self, fn: Callable[[], float]):
+        self.fn = fn
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas de um nó. Contadores e histogramas são objetos
+    atualizados direto no caminho quente; gauges e coletores são funções
+    chamadas só quando alguém lê /metrics.
+    """
+    def __init__(self):
+        # nome -> [tipo, ajuda, {rótulos: métrica}]
+        self._families: Dict[str, list] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, name: str, kind: str, help_text: str, labels: Dict[str, str], metric):
+        key: Labels = tuple(sorted(labels.items()))
+        with self._lock:
+            fam = self._families.setdefault(name, [kind, help_text, {}])
+            if fam[0] != kind:
+                raise ValueError(f"métrica {name} já registrada como {fam[0]}")
+            return fam[2].setdefault(key, metric)
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self._register(name, "counter", help_text, labels, Counter())
+
+    def histogram(self, name: str, help_text: str, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._register(name, "histogram", help_text, labels, Histogram(buckets))
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], float], **labels):
+        self._register(name, "gauge", help_text, labels, _Gauge(fn))
+
+    def collector(self, fn: Callable[[], Iterable[Sample]]):
+        """Função que gera amostras na hora do scrape (ex.: uma série por vizinho)."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        """Formato texto do Prometheus (version 0.0.4)."""
+        with self._lock:
+            families = [(name, fam[0], fam[1], list(fam[2].items())) for name, fam in self._families.items()]
+        lines: List[str] = []
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {_escape_help(help_text)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, m in metrics:
+                labels = dict(key)
+                if kind == "histogram":
+                    cumulative = 0
+                    for bound, n in zip(m.bounds + (float("inf"),), list(m.counts)):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_labels(labels, le=_num(bound))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_num(m.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {m.count}")
+                elif kind == "gauge":
+                    try:
+                        value = m.fn()
+                    except Exception:
+                        continue
+                    lines.append(f"{name}{_labels(labels)} {_num(value)}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {_num(m.value)}")
+        grouped: Dict[str, list] = {}
+        for fn in self._collectors:
+            try:
+                samples = list(fn())
+            except Exception:
+                continue
+            for name, kind, help_text, labels, value in samples:
+                grouped.setdefault(name, [kind, help_text, []])[2].append((labels, value))
+        for name, (kind, help_text, samples) in grouped.items():
+            lines.append(f"# HELP {name} {_escape_help(help_text)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class TimedLock:
+    """
+    threading.Lock que mede a espera: tenta sem bloquear e só cronometra
+    quando o lock está ocupado, então o caso sem disputa custa um acquire.
+    As aquisições disputadas também são somadas por ponto de chamada
+    (arquivo:linha função), para o relatório de stats().
+    """
+    MAX_SITES = 256
+
+    def __init__(self, registry: MetricsRegistry, name: str = "p2p_lock"):
+        self._lock = threading.Lock()
+        self.acquired = registry.counter(f"{name}_acquisitions_total", "Aquisições do lock do nó")
+        self.contended = registry.counter(f"{name}_contended_total", "Aquisições que encontraram o lock ocupado")
+        self.wait = registry.histogram(f"{name}_wait_seconds", "Espera pelo lock nas aquisições disputadas")
+        self.max_wait = 0.0
+        # "arquivo:linha função" -> [aquisições disputadas, segundos esperando]
+        self.sites: Dict[str, list] = {}
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        self.acquired.inc()
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        self.contended.inc()
+        t0 = time.perf_counter()
+        ok = self._lock.acquire(True, timeout)
+        waited = time.perf_counter() - t0
+        self.wait.observe(waited)
+        if waited > self.max_wait:
+            self.max_wait = waited
+        self._blame(sys._getframe(1), waited)
+        return ok
+
+    def _blame(self, frame, waited: float):
+        if frame.f_code is _ENTER_CODE:
+            frame = frame.f_back
+        code = frame.f_code
+        site = f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+        entry = self.sites.get(site)
+        if entry is None:
+            if len(self.sites) >= self.MAX_SITES:
+                return
+            entry = self.sites[site] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += waited
+
+    def stats(self, top: int = 10) -> dict:
+        """Disputa do lock: totais, espera (média, p99 por balde, máxima) e os pontos que mais esperaram."""
+        acquired, contended, w = self.acquired.value, self.contended.value, self.wait
+        sites = heapq.nlargest(top, list(self.sites.items()), key=lambda kv: kv[1][1])
+        return {
+            "acquisitions": acquired,
+            "contended": contended,
+            "contention_ratio": round(contended / acquired, 6) if acquired else 0.0,
+            "wait_total_s": round(w.sum, 6),
+            "wait_mean_us": round(w.sum / w.count * 1e6, 2) if w.count else 0.0,
+            "wait_p99_us": round(min(w.quantile(0.99), self.max_wait) * 1e6, 2),
+            "wait_max_us": round(self.max_wait * 1e6, 2),
+            "sites": [{"site": site, "contended": n, "wait_s": round(t, 6)} for site, (n, t) in sites],
+        }
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+_ENTER_CODE = TimedLock.__enter__.__code__
+
+
+class NodeMetrics:
+    """Métricas do caminho de uma mensagem, comuns a todos os engines de peer."""
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = r = registry or MetricsRegistry()
+        self.received = r.counter("p2p_messages_received_total", "Mensagens novas aceitas (após o dedup)")
+        self.duplicates = r.counter("p2p_messages_duplicate_total", "Mensagens descartadas pelo dedup")
+        self.forwarded = r.counter("p2p_messages_forwarded_total", "Frames de mensagem enfileirados para vizinhos")
+        self.originated = r.counter("p2p_messages_originated_total", "Mensagens criadas neste nó")
+        self.control = r.counter("p2p_control_frames_total", "Frames de enlace recebidos (hello, plumtree, ...)")
+        self.malformed = r.counter("p2p_frames_malformed_total", "Frames descartados por corpo malformado")
+        stage = "Tempo por etapa do processamento de um frame recebido"
+        self.decode = r.histogram("p2p_stage_seconds", stage, stage="decode")
+        self.dedup = r.histogram("p2p_stage_seconds", stage, stage="dedup")
+        self.broadcast = r.histogram("p2p_stage_seconds", stage, stage="broadcast")
+        self.on_message = r.histogram("p2p_stage_seconds", stage, stage="on_message")
+        self.store = r.histogram("p2p_stage_seconds", stage, stage="history")
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+def neighbour_samples(stats: List[dict]) -> Iterable[Sample]:
+    """Séries por vizinho a partir de neighbour_stats() (Outbound/AsyncOutbound)."""
+    for st in stats:
+        labels = {"peer": st["peer"]}
+        yield "p2p_neighbour_bytes_in_total", "counter", "Bytes recebidos do vizinho", labels, st.get("bytes_in", 0)
+        yield "p2p_neighbour_bytes_out_total", "counter", "Bytes enviados ao vizinho", labels, st["bytes_out"]
+        yield "p2p_neighbour_frames_in_total", "counter", "Frames recebidos do vizinho", labels, st.get("frames_in", 0)
+        yield "p2p_neighbour_frames_out_total", "counter", "Frames enviados ao vizinho", labels, st["sent"]
+        yield "p2p_neighbour_dropped_total", "counter", "Frames descartados na fila de saída", labels, st["dropped"]
+        yield "p2p_neighbour_queue_depth", "gauge", "Frames na fila de saída do vizinho", labels, st["depth"]
+        for lane, ls in (st.get("lanes") or {}).items():
+            ll = {"peer": st["peer"], "lane": lane}
+            yield "p2p_neighbour_lane_frames_out_total", "counter", "Frames enviados ao vizinho por faixa", ll, ls["sent"]
+            yield "p2p_neighbour_lane_dropped_total", "counter", "Frames descartados por faixa", ll, ls["dropped"]
+            yield "p2p_neighbour_lane_depth", "gauge", "Frames na faixa da fila de saída", ll, ls["depth"]
+
+
+def _labels(labels: Dict[str, str], **extra) -> str:
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in items) + "}"
+
+
+def _escape_label(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _escape_help(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
+
+
+def process_age() -> float:
+    """Segundos desde que o processo começou (Linux); 0 onde não dá para saber."""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+class StartupClock:
+    """
+    Marcos da subida do nó, em segundos desde o início do processo (então
+    o tempo de import entra na conta): init, listening, first_link, ready
+    e, na UI, http. `ready` é marcado quando o nó chega a `ready_links`
+    conexões abertas; wait_ready() bloqueia até isso ou até o timeout.
+    """
+    def __init__(self, registry: MetricsRegistry = None, ready_links: int = 1):
+        self.t0 = time.monotonic() - process_age()
+        self.ready_links = max(0, ready_links)
+        self.marks: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        if registry is not None:
+            registry.collector(self._samples)
+
+    def _samples(self):
+        for phase, t in list(self.marks.items()):
+            yield "p2p_startup_seconds", "gauge", "Segundos do início do processo até cada fase da subida", {"phase": phase}, t
+
+    def mark(self, phase: str):
+        with self._cond:
+            if phase not in self.marks:
+                self.marks[phase] = round(time.monotonic() - self.t0, 6)
+                self._cond.notify_all()
+
+    def linked(self, degree: int):
+        """Chamado a cada conexão aberta, com o número atual de conexões."""
+        if "first_link" not in self.marks:
+            self.mark("first_link")
+        if degree >= self.ready_links and "ready" not in self.marks:
+            self.mark("ready")
+
+    def wait_ready(self, timeout: float) -> bool:
+        if self.ready_links == 0:
+            self.mark("ready")
+        with self._cond:
+            return self._cond.wait_for(lambda: "ready" in self.marks, timeout)
+
+    def stats(self) -> dict:
+        return dict(self.marks)
@@ -0,0 +1,439 @@
+import time
+import struct
+import socket
+import threading
+from collections import deque
+from typing import Optional, Callable, Sequence, Tuple
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+# Cada frame ocupa dois iovecs (cabeçalho + corpo); IOV_MAX no Linux é 1024.
+MAX_BATCH_FRAMES = 512
+DEFAULT_BATCH_BYTES = 64 * 1024
+
+Frame = Tuple[bytes, bytes]
+
+# Faixas de prioridade da fila de saída, escalonadas por peso (ver Outbound._take).
+CONTROL, INTERACTIVE, BULK = 0, 1, 2
+LANES = ("control", "interactive", "bulk")
+DEFAULT_WEIGHTS = (8, 4, 1)
+# Crédito em bytes por unidade de peso a cada rodada do escalonador.
+LANE_QUANTUM = 4096
+# Corpos acima disto vão na faixa bulk (mensagens repassadas).
+DEFAULT_BULK_BYTES = 4096
+
+
+def peer_label(sock: socket.socket) -> str:
+    try:
+        h, p = sock.getpeername()[:2]
+        return f"{h}:{p}"
+    except (OSError, ValueError, TypeError):
+        return "?"
+
+
+def make_frame(body: bytes) -> Frame:
+    """(cabeçalho, corpo) sem concatenar; o mesmo par é compartilhado no fan-out."""
+    return struct.pack("!I", len(body)), body
+
+
+def parse_weights(text: str) -> Tuple[int, int, int]:
+    """"8,4,1" -> (8, 4, 1): pesos das faixas control, interactive e bulk."""
+    parts = [int(p) for p in text.split(",")]
+    if len(parts) != len(LANES) or min(parts) < 1:
+        raise ValueError(f"pesos inválidos: {text!r} (esperado três inteiros >= 1)")
+    return parts[0], parts[1], parts[2]
+
+
+def lane_for(body: bytes, bulk_bytes: int = DEFAULT_BULK_BYTES) -> int:
+    """Faixa de uma mensagem repassada: bulk se o corpo passa de `bulk_bytes`."""
+    return BULK if bulk_bytes and len(body) > bulk_bytes else INTERACTIVE
+
+
+def take_batch(q: "deque[Frame]", max_bytes: int,
+               before_send: Optional[Callable[[bytes], Optional[bytes]]] = None,
+               stop: Optional[Frame] = None) -> Tuple[list, int, int]:
+    """
+    Retira da fila o próximo lote como lista de iovecs [cab, corpo, cab, corpo, ...].
+    before_send pode devolver um corpo extra a ir imediatamente antes de um
+    frame (ex.: definição de remetente do codec bin1). O lote termina no
+    frame `stop`, se ele aparecer (ver Outbound.switch_sink).
+    Retorna (bufs, bytes dos frames da fila, número de frames da fila).
+    """
+    bufs = []
+    size = 0
+    n = 0
+    # Até 4 iovecs por volta (frame + eventual corpo extra), sem passar do IOV_MAX.
+    while q and len(bufs) + 4 <= 2 * MAX_BATCH_FRAMES:
+        frame = q[0]
+        hdr, body = frame
+        if n and size + 4 + len(body) > max_bytes:
+            break
+        q.popleft()
+        if before_send is not None:
+            extra = before_send(body)
+            if extra is not None:
+                bufs.append(struct.pack("!I", len(extra)))
+                bufs.append(extra)
+        bufs.append(hdr)
+        bufs.append(body)
+        size += 4 + len(body)
+        n += 1
+        if frame is stop:
+            break
+    return bufs, size, n
+
+
+class LaneQueue:
+    """
+    Faixas FIFO (control, interactive, bulk) esvaziadas por deficit round
+    robin: na sua vez cada faixa ocupada ganha weights[i] * LANE_QUANTUM
+    bytes de crédito e envia enquanto o crédito cobre o próximo frame;
+    faixa vazia perde o crédito. A vez e os créditos continuam entre
+    chamadas, então a divisão por peso vale mesmo com lotes pequenos.
+    Sem lock próprio: quem usa protege (Outbound._cond, laço do simulador).
+    """
+    def __init__(self, weights: Sequence[int] = DEFAULT_WEIGHTS):
+        self.weights = tuple(weights)
+        self.queues: Tuple["deque[Frame]", ...] = tuple(deque() for _ in LANES)
+        self.depth = 0
+        self.sent = [0] * len(LANES)
+        self.dropped = [0] * len(LANES)
+        self._deficit = [0] * len(LANES)
+        self._cur = 0
+        self._granted = False
+
+    def push(self, frame: Frame, lane: int):
+        self.queues[lane].append(frame)
+        self.depth += 1
+
+    def drop_oldest(self, lane: int) -> Frame:
+        self.depth -= 1
+        self.dropped[lane] += 1
+        return self.queues[lane].popleft()
+
+    def victim(self, lane: int) -> Optional[int]:
+        """
+        Faixa que cede o frame mais antigo quando um frame de `lane` chega
+        com a fila cheia: a menos prioritária ocupada, nunca uma mais
+        prioritária que `lane` (None: só há frames mais prioritários).
+        """
+        for i in range(len(self.queues) - 1, lane - 1, -1):
+            if self.queues[i]:
+                return i
+        return None
+
+    def sole(self) -> Optional[int]:
+        """Faixa que tem todos os frames, se só uma está ocupada (zera os créditos)."""
+        for i, q in enumerate(self.queues):
+            if q and len(q) == self.depth:
+                self._deficit = [0] * len(LANES)
+                self._granted = False
+                return i
+        return None
+
+    def next(self) -> Optional[int]:
+        """Faixa do próximo frame a sair (None com todas vazias); não retira."""
+        if not self.depth:
+            return None
+        sole = self.sole()
+        if sole is not None:
+            return sole
+        queues, deficit = self.queues, self._deficit
+        while True:
+            i = self._cur
+            q = queues[i]
+            if q:
+                if not self._granted:
+                    deficit[i] += self.weights[i] * LANE_QUANTUM
+                    self._granted = True
+                if 4 + len(q[0][1]) <= deficit[i]:
+                    return i
+            else:
+                deficit[i] = 0
+            self._cur = (i + 1) % len(queues)
+            self._granted = False
+
+    def pop(self, lane: int) -> Frame:
+        frame = self.queues[lane].popleft()
+        self.depth -= 1
+        self.sent[lane] += 1
+        d = self._deficit[lane] - 4 - len(frame[1])
+        self._deficit[lane] = d if d > 0 else 0
+        return frame
+
+    def clear(self):
+        for q in self.queues:
+            q.clear()
+        self.depth = 0
+
+    def stats(self) -> dict:
+        return {name: {"depth": len(q), "sent": self.sent[i], "dropped": self.dropped[i], "weight": self.weights[i]}
+                for i, (name, q) in enumerate(zip(LANES, self.queues))}
+
+
+class Outbound:
+    """
+    Fila de saída limitada + thread escritora dedicada para uma conexão.
+    O fan-out só faz append na fila; quem escreve no socket é a thread da
+    própria conexão, então um vizinho lento não trava os demais.
+
+    A escritora junta todos os frames pendentes (até `max_batch_bytes`) num
+    único sendmsg scatter-gather, sem concatenar cabeçalhos e corpos. Com
+    `linger_us` > 0 ela espera até esse tempo por mais frames antes de
+    enviar um lote ainda pequeno.
+
+    switch_sink() troca o destino da escrita (ex.: anel em memória
+    compartilhada, ver shmring.py) depois de um frame marcador; o socket
+    continua aberto e é ele que close() derruba.
+
+    A fila tem três faixas (control, interactive, bulk) que somam até
+    `maxlen` frames, esvaziadas com os pesos `weights` (ver LaneQueue):
+    rajadas de bulk não atrasam controle nem mensagens interativas mais do
+    que um quantum. Com uma faixa só ocupada o lote é o FIFO de sempre.
+
+    Política quando a fila enche:
+      - drop_oldest: descarta o frame mais antigo da faixa menos prioritária
+                     ocupada (ou o que está chegando, se todos os da fila
+                     são mais prioritários que ele)
+      - drop_newest: descarta o frame que está chegando
+      - disconnect:  derruba o consumidor lento
+    """
+    def __init__(self, sock: socket.socket, maxlen: int = 1024, policy: str = DROP_OLDEST,
+                 on_close: Optional[Callable[["Outbound", Optional[Exception]], None]] = None,
+                 max_batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 weights: Sequence[int] = DEFAULT_WEIGHTS):
+        if policy not in POLICIES:
+            raise ValueError(f"política inválida: {policy}")
+        self.sock = sock
+        self.maxlen = maxlen
+        self.policy = policy
+        self.max_batch_bytes = max_batch_bytes
+        self.linger = linger_us / 1e6
+        self.name = peer_label(sock)
+        self.on_close = on_close
+        # Definidos pelo peer após a negociação de codec (ver codec.py).
+        self.codec = "json"
+        self.before_send: Optional[Callable[[bytes], Optional[bytes]]] = None
+        self.sent = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.syscalls = 0
+        self.batches = 0
+        self.max_batch = 0
+        # Lado de leitura, atualizado pela thread leitora do peer.
+        self.frames_in = 0
+        self.bytes_in = 0
+        self._lanes = LaneQueue(weights)
+        self._queued_bytes = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._sink = None
+        self._switch: Optional[Tuple[Frame, object]] = None
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def enqueue(self, frame: Frame, lane: int = INTERACTIVE) -> bool:
+        """Não bloqueia. Retorna False se o frame foi descartado."""
+        with self._cond:
+            if self._closed:
+                return False
+            ok = self._push(frame, lane)
+            if ok:
+                self._cond.notify()
+        if ok is None:
+            self.close(OverflowError(f"fila de saída cheia ({self.maxlen})"))
+            return False
+        return ok
+
+    def enqueue_many(self, items: Sequence[Tuple[Frame, int]]) -> int:
+        """Vários (frame, faixa) com uma aquisição do lock e um aviso à escritora. Retorna quantos entraram."""
+        queued = 0
+        overflow = False
+        with self._cond:
+            if self._closed:
+                return 0
+            for frame, lane in items:
+                ok = self._push(frame, lane)
+                if ok is None:
+                    overflow = True
+                    break
+                queued += ok
+            if queued:
+                self._cond.notify()
+        if overflow:
+            self.close(OverflowError(f"fila de saída cheia ({self.maxlen})"))
+        return queued
+
+    def _push(self, frame: Frame, lane: int) -> Optional[bool]:
+        """Com _cond adquirido. True: na fila; False: descartado; None: fila cheia com policy disconnect."""
+        lanes = self._lanes
+        if lanes.depth >= self.maxlen:
+            self.dropped += 1
+            if self.policy == DISCONNECT:
+                return None
+            victim = lanes.victim(lane) if self.policy == DROP_OLDEST else None
+            if victim is None:
+                lanes.dropped[lane] += 1
+                return False
+            self._queued_bytes -= 4 + len(lanes.drop_oldest(victim)[1])
+        lanes.push(frame, lane)
+        self._queued_bytes += 4 + len(frame[1])
+        if lanes.depth > self.max_depth:
+            self.max_depth = lanes.depth
+        return True
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._lanes.depth and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                if self.linger > 0 and self._queued_bytes < self.max_batch_bytes:
+                    deadline = time.monotonic() + self.linger
+                    while not self._closed and self._queued_bytes < self.max_batch_bytes:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if self._closed:
+                        return
+                switch = self._switch
+                marker = switch[0] if switch is not None else None
+                bufs, size, n = self._take(marker)
+                self._queued_bytes -= size
+                switched = marker is not None and bufs[-1] is marker[1]
+                if switched:
+                    self._switch = None
+            try:
+                self._send_batch(bufs)
+            except OSError as e:
+                self.close(e)
+                return
+            if switched:
+                self._sink = switch[1]
+            self.sent += n
+            self.bytes_out += size
+            self.batches += 1
+            if n > self.max_batch:
+                self.max_batch = n
+
+    def _take(self, stop: Optional[Frame]) -> Tuple[list, int, int]:
+        """Próximo lote na ordem das faixas (ver LaneQueue). Chamado com self._cond."""
+        lanes = self._lanes
+        sole = lanes.sole()
+        if sole is not None:
+            # Uma faixa só (o caso comum): o lote FIFO de sempre.
+            bufs, size, n = take_batch(lanes.queues[sole], self.max_batch_bytes, self.before_send, stop)
+            lanes.depth -= n
+            lanes.sent[sole] += n
+            return bufs, size, n
+        bufs = []
+        size = 0
+        n = 0
+        before_send = self.before_send
+        while len(bufs) + 4 <= 2 * MAX_BATCH_FRAMES:
+            i = lanes.next()
+            if i is None:
+                break
+            hdr, body = lanes.queues[i][0]
+            if n and size + 4 + len(body) > self.max_batch_bytes:
+                break
+            frame = lanes.pop(i)
+            if before_send is not None:
+                extra = before_send(body)
+                if extra is not None:
+                    bufs.append(struct.pack("!I", len(extra)))
+                    bufs.append(extra)
+            bufs.append(hdr)
+            bufs.append(body)
+            size += 4 + len(body)
+            n += 1
+            if frame is stop:
+                break
+        return bufs, size, n
+
+    def switch_sink(self, marker: Frame, sink):
+        """
+        Enfileira `marker` (na faixa de controle) e, assim que ele sair
+        pelo socket, passa a escrever os frames seguintes em
+        sink.write(bufs), que devolve o número de syscalls feitas.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._switch = (marker, sink)
+            self._lanes.push(marker, CONTROL)
+            self._queued_bytes += 4 + len(marker[1])
+            self._cond.notify()
+
+    def _send_batch(self, bufs):
+        if self._sink is not None:
+            self.syscalls += self._sink.write(bufs)
+            return
+        sock = self.sock
+        if not hasattr(sock, "sendmsg"):
+            # Windows não tem sendmsg: uma cópia, mas ainda um só syscall por lote.
+            sock.sendall(b"".join(bufs))
+            self.syscalls += 1
+            return
+        i = 0
+        while i < len(bufs):
+            n = sock.sendmsg(bufs[i:] if i else bufs)
+            self.syscalls += 1
+            # Envio parcial: pula os buffers completos e recorta o primeiro restante.
+            while i < len(bufs) and n >= len(bufs[i]):
+                n -= len(bufs[i])
+                i += 1
+            if n:
+                bufs[i] = memoryview(bufs[i])[n:]
+
+    def close(self, err: Optional[Exception] = None):
+        """Encerra a escrita e acorda a thread leitora (shutdown do socket)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._lanes.clear()
+            self._queued_bytes = 0
+            self._cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.on_close is not None:
+            self.on_close(self, err)
+
+    def depth(self, lane: Optional[int] = None) -> int:
+        """Frames na fila (todas as faixas, ou só `lane`)."""
+        if lane is None:
+            return self._lanes.depth
+        return len(self._lanes.queues[lane])
+
+    def stats(self) -> dict:
+        return {
+            "peer": self.name,
+            "depth": self._lanes.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "bytes_out": self.bytes_out,
+            "frames_in": self.frames_in,
+            "bytes_in": self.bytes_in,
+            "dropped": self.dropped,
+            "policy": self.policy,
+            "codec": self.codec,
+            "transport": "shm" if self._sink is not None else "tcp",
+            "syscalls": self.syscalls,
+            "batches": self.batches,
+            "avg_batch": round(self.sent / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "msgs_per_syscall": round(self.sent / self.syscalls, 2) if self.syscalls else 0.0,
+            "lanes": self._lanes.stats(),
+        }
@@ -1,25 +1,123 @@
-import socket
-import threading
+import os
 import argparse
 import time
 from multiprocessing import Queue
-from common import send_msg, recv_msg, generate_msg
-from logger_proc import LoggerProcess
+from common import encode_body, generate_msg, DEFAULT_MAX_FRAME
+from logger_proc import LoggerProcess, FSYNC_MODES
+from outbound import (make_frame, lane_for, parse_weights, DROP_OLDEST, POLICIES, DEFAULT_BATCH_BYTES,
+                      CONTROL, DEFAULT_WEIGHTS, DEFAULT_BULK_BYTES)
+from transport import TcpTransport
+from dedup import make_dedup, DEDUP_KINDS
+from codec import (NodeCodec, BinDecoder, Envelope, CODECS, JSON, HELLO, HELLO_ACK,
+                   decode_frame, ack_body, hello_body, hello_identity, negotiate, configure_outbound)
+from plumtree import Plumtree, PLUMTREE_TYPES, flood_stats
+from metrics import NodeMetrics, TimedLock, StartupClock, neighbour_samples
+from connmgr import ConnectionManager, load_node_id, parse_addr, dialable
+from discovery import PeerCache, PeerExchange, PX_TYPES
+from history import MessageStore, HistorySync, SYNC_DIGEST, SYNC_TYPES
+from blobs import BlobStore, BlobSync, BLOB, BLOB_WANT, BLOB_MISS, BLOB_TYPES
+from ratelimit import Admission, SENDER
+from profiling import StageTracer, NodeProfiler, install_signal_handlers
 
 
 class Peer:
-    def __init__(self, host: str, port: int, known_peers=None, name: str = None):
+    def __init__(self, host: str, port: int, known_peers=None, name: str = None,
+                 queue_size: int = 1024, queue_policy: str = DROP_OLDEST, dedup=None,
+                 max_frame: int = DEFAULT_MAX_FRAME, batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 codec: NodeCodec = None, dissemination: str = "flood", graft_timeout: float = 0.5,
+                 log_fsync: str = "none", log_high_water: int = 50000,
+                 history: MessageStore = None, sync_window: float = 300.0,
+                 node_id: str = None, connect_timeout: float = 3.0,
+                 target_degree: int = 0, max_degree: int = 0,
+                 peer_cache: PeerCache = None, px_interval: float = 5.0,
+                 ready_links: int = 1, transport=None, log_dups: bool = True,
+                 blob_store: BlobStore = None, blob_window: int = 8, blob_transfers: int = 4,
+                 blob_auto_bytes: int = 64 * 1024 * 1024,
+                 sender_rate: float = 0.0, sender_burst: float = 0.0, link_rate: float = 0.0, link_burst: float = 0.0,
+                 lane_weights=DEFAULT_WEIGHTS, bulk_bytes: int = DEFAULT_BULK_BYTES,
+                 trace_rate: float = 0.0, profile_dir: str = "logs"):
         self.host = host
         self.port = port
         self.name = name or f"{host}:{port}"
         self.known_peers = known_peers if known_peers else []
-        self.connections = []
-        self.lock = threading.Lock()
-        self.seen_msgs = set()
+        # TCP por padrão; SimTransport (simnet.py) roda o mesmo nó numa rede simulada.
+        self.transport = transport or TcpTransport()
+        # conexão -> Outbound (fila de saída + thread escritora da conexão)
+        self.connections = {}
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.max_frame = max_frame
+        self.batch_bytes = batch_bytes
+        self.linger_us = linger_us
+        self.lane_weights = tuple(lane_weights)
+        self.bulk_bytes = bulk_bytes
+        self.codec = codec or NodeCodec()
+        self.metrics = NodeMetrics()
+        self.startup = StartupClock(self.metrics.registry, ready_links)
+        # Lock que mede a própria disputa (p2p_lock_* em /metrics).
+        self.lock = TimedLock(self.metrics.registry)
+        # Diagnóstico sob demanda: profiler, pilhas, disputa do lock, tempos por etapa (ver profiling.py).
+        self.tracer = StageTracer(trace_rate)
+        self.profiling = NodeProfiler(self.lock, self.tracer, profile_dir, tag=str(port))
+        # Qualquer objeto com check_and_add/add/stats (ver dedup.py).
+        self.seen_msgs = dedup if dedup is not None else make_dedup()
+        # Duplicados também vão para o log (kind "dup"): amplificação por enlace no propagation.py.
+        self.log_dups = log_dups
+        # Frames de enlace (não passam por dedup nem relay): tipo -> handler(out, env)
+        self.link_handlers = {HELLO: self._on_hello, HELLO_ACK: self._on_hello}
+        self.plumtree = None
+        if dissemination == "plumtree":
+            self.plumtree = Plumtree(self._send_env, self._send_ctrl, self.seen_msgs.__contains__,
+                                     graft_timeout=graft_timeout, runtime=self.transport)
+            for t in PLUMTREE_TYPES:
+                self.link_handlers[t] = self._on_plumtree
+        self.node_id = node_id or load_node_id(None)
+        self.connect_timeout = connect_timeout
+        self.conns = ConnectionManager(self.node_id, self.connect_to_peer, self._close_link,
+                                       listen=f"{host}:{port}", target_degree=target_degree, max_degree=max_degree,
+                                       on_log=lambda s: self.log("info", {"msg": s}), metrics=self.metrics,
+                                       runtime=self.transport)
+        self.px = None
+        if peer_cache is not None:
+            self.px = PeerExchange(peer_cache, self.conns, self._send_ctrl, (host, port),
+                                   interval=px_interval, metrics=self.metrics, runtime=self.transport)
+            for t in PX_TYPES:
+                self.link_handlers[t] = self._on_px
+        self.history = history
+        self.sync = None
+        if history is not None:
+            self.sync = HistorySync(history, self.seen_msgs, self._on_recovered,
+                                    window=sync_window, metrics=self.metrics, runtime=self.transport)
+            for t in SYNC_TYPES:
+                self.link_handlers[t] = self._on_sync
+        self.blobs = None
+        if blob_store is not None:
+            # Payloads grandes: a malha leva só o manifesto; os pedaços vêm sob demanda.
+            self.blobs = BlobSync(blob_store, self._send_ctrl, self._on_blob_complete, window=blob_window,
+                                  max_active=blob_transfers, auto_fetch_bytes=blob_auto_bytes,
+                                  metrics=self.metrics, runtime=self.transport)
+            for t in BLOB_TYPES:
+                self.link_handlers[t] = self._on_blob
+        self.admission = None
+        if sender_rate > 0 or link_rate > 0:
+            self.admission = Admission(sender_rate, sender_burst, link_rate, link_burst,
+                                       metrics=self.metrics, runtime=self.transport)
 
         self.log_q = Queue()
-        self.logger = LoggerProcess(self.log_q, log_path=f"logs/peer_{self.port}.jsonl")
+        self.logger = LoggerProcess(self.log_q, log_path=f"logs/peer_{self.port}.jsonl",
+                                    fsync=log_fsync, high_water=log_high_water)
         self.logger.start()
+        reg = self.metrics.registry
+        reg.gauge("p2p_neighbours", "Conexões abertas", lambda: len(self.connections))
+        reg.gauge("p2p_dedup_entries", "Ids lembrados pelo dedup", lambda: len(self.seen_msgs))
+        reg.gauge("p2p_logger_queue_depth", "Eventos esperando o processo de log", self.logger.depth)
+        reg.collector(self._logger_samples)
+        reg.collector(lambda: neighbour_samples(self.neighbour_stats()))
+        self._srv = None
+        self.startup.mark("init")
+
+    def _logger_samples(self):
+        yield "p2p_logger_shed_total", "counter", "Eventos de log descartados acima do nível máximo", {}, self.logger.shed
 
     def log(self, kind: str, payload: dict):
         evt = {
@@ -28,108 +126,368 @@ class Peer:
             "kind": kind,
             "data": payload
         }
-        try:
-            self.log_q.put_nowait(evt)
-        except Exception:
-            pass
+        # recv/send são descartados (e contados) se o logger ficar para trás.
+        self.logger.submit(evt)
 
-    def start(self):
-        threading.Thread(target=self._start_server, daemon=True).start()
-        for peer_host, peer_port in self.known_peers:
-            self.connect_to_peer(peer_host, peer_port)
+    def start(self, ready_timeout: float = 0.0):
+        self.start_network()
+        # Sem ninguém para discar (primeiro nó da rede) não há o que esperar.
+        if ready_timeout > 0 and (self.known_peers or (self.px is not None and len(self.px.cache))):
+            ok = self.wait_ready(ready_timeout)
+            print(f"[{'PRONTO' if ok else 'AVISO'}] {len(self.connections)} conexões; subida: {self.startup.stats()}")
+        self.log("info", {"msg": "startup", "ready": "ready" in self.startup.marks, **self.startup.stats()})
         self._input_loop()
         self.shutdown()
 
+    def start_network(self):
+        """Escuta e começa a discar, sem o prompt (benchmarks e simulador)."""
+        # Bind síncrono: porta ocupada falha aqui e "listening" é o instante real.
+        self._srv = self._listen()
+        for peer_host, peer_port in self.known_peers:
+            self.conns.add_address(peer_host, peer_port)
+        if self.px is not None:
+            # Endereços aprendidos em execuções anteriores completam o grau alvo.
+            self.px.bootstrap()
+            self.px.start()
+        # Discagens em paralelo, cada uma com --connect-timeout (ver connmgr.py).
+        self.conns.start()
+
+    def wait_ready(self, timeout):
+        """Espera até `ready_links` conexões abertas (ou o timeout)."""
+        return self.startup.wait_ready(timeout)
+
     def shutdown(self):
+        if self._srv is not None:
+            self._srv.close()
+            self._srv = None
+        self.conns.stop()
+        if self.px is not None:
+            self.px.stop()
+        if self.plumtree is not None:
+            self.plumtree.stop()
+        if self.history is not None:
+            self.history.close()
+        if self.blobs is not None:
+            self.blobs.stop()
         with self.lock:
-            for c in list(self.connections):
-                try:
-                    c.close()
-                except Exception:
-                    pass
+            outs = list(self.connections.items())
             self.connections.clear()
+        for c, out in outs:
+            out.close()
+            try:
+                c.close()
+            except Exception:
+                pass
         try:
             self.log_q.put_nowait(None)
         except Exception:
             pass
 
-    def _start_server(self):
-        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv.bind((self.host, self.port))
-        srv.listen()
+    def _listen(self):
+        srv = self.transport.listen(self.host, self.port, self._on_accept)
+        self.startup.mark("listening")
         print(f"[SERVIDOR] {self.name} ouvindo em {self.host}:{self.port}")
-        self.log("info", {"msg": "listening", "addr": f"{self.host}:{self.port}"})
+        self.log("info", {"msg": "listening", "addr": f"{self.host}:{self.port}", "node": self.node_id})
+        return srv
 
-        while True:
-            conn, addr = srv.accept()
-            print(f"[SERVIDOR] conexão de {addr}")
-            self.log("connect", {"from": f"{addr[0]}:{addr[1]}"})
-            with self.lock:
-                self.connections.append(conn)
-            threading.Thread(target=self._handle_peer, args=(conn,), daemon=True).start()
+    def _on_accept(self, conn, addr):
+        print(f"[SERVIDOR] conexão de {addr}")
+        self.log("connect", {"from": f"{addr[0]}:{addr[1]}"})
+        self._add_connection(conn)
 
     def connect_to_peer(self, host, port):
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((host, port))
+            s = self.transport.connect(host, port, self.connect_timeout)
             print(f"[CLIENTE] Conectado a {host}:{port}")
             self.log("connect", {"to": f"{host}:{port}"})
-            with self.lock:
-                self.connections.append(s)
-            threading.Thread(target=self._handle_peer, args=(s,), daemon=True).start()
+            self._add_connection(s, dialed=f"{host}:{port}")
+            return True
         except Exception as e:
             print(f"[ERRO] Não conectou a {host}:{port} -> {e}")
             self.log("error", {"op": "connect", "to": f"{host}:{port}", "err": str(e)})
+            return False
 
-    def _handle_peer(self, conn):
-        while True:
-            msg = recv_msg(conn)
-            if not msg:
-                break
-            msg_id = msg.get("id")
+    def _add_connection(self, conn, dialed=None):
+        out = self.transport.outbound(conn, self.queue_size, self.queue_policy, on_close=self._on_outbound_closed,
+                                      max_batch_bytes=self.batch_bytes, linger_us=self.linger_us,
+                                      weights=self.lane_weights)
+        with self.lock:
+            self.connections[conn] = out
+            degree = len(self.connections)
+        self.startup.linked(degree)
+        if dialed:
+            # Quem disca se identifica e oferece os codecs; até o hello_ack a conexão fala JSON.
+            out.enqueue(make_frame(hello_body(self.codec, self.name, dialed,
+                                              self.node_id, f"{self.host}:{self.port}",
+                                              self.transport.hello_extra(out))), CONTROL)
+        # Registrado antes da leitura começar: o hello_ack pode chegar logo.
+        self.conns.link_up(out, parse_addr(dialed) if dialed else None)
+        if self.plumtree is not None:
+            self.plumtree.add_link(out)
+        if self.sync is not None:
+            self.sync.on_connect(out)
+        decoder = BinDecoder()
+        self.transport.serve(conn, lambda data: self._on_frame(conn, out, decoder, data),
+                             lambda: self._on_closed(conn, out), max_frame=self.max_frame,
+                             on_error=self._on_read_error)
 
-            if msg_id in self.seen_msgs:
-                continue
+    def _on_outbound_closed(self, out, err):
+        if err is not None:
+            print(f"[ERRO envio] {out.name}: {err}")
+            self.log("error", {"op": "send", "to": out.name, "err": str(err), "dropped": out.dropped})
+
+    def _on_read_error(self, e):
+        print(f"[ERRO] {e}")
+        self.log("error", {"op": "recv", "err": str(e)})
+
+    def _on_frame(self, conn, out, decoder, data):
+        """Um frame recebido de `conn` (chamado pelo transporte, na ordem de chegada)."""
+        m = self.metrics
+        clock = time.perf_counter
+        # Fração amostrada (--trace-rate): tempos por etapa no StageTracer.
+        tracer = self.tracer
+        trace = tracer.rate > 0 and tracer.sample()
+        tr = clock() if trace else 0.0
+        out.frames_in += 1
+        out.bytes_in += 4 + len(data)
+        t0 = clock()
+        env = decode_frame(data, decoder)
+        t1 = clock()
+        m.decode.observe(t1 - t0)
+        if env is None:
+            return
+        handler = self.link_handlers.get(env.msg_type)
+        if handler is not None:
+            m.control.inc()
+            handler(out, env)
+            if trace:
+                tracer.record("ctrl", [("recv", t0 - tr), ("decode", t1 - t0), ("handler", clock() - t1)])
+            return
+        if env.msg_id is None:
+            # Sem id (corpo que não é um objeto JSON, id ausente): não entra no dedup nem é repassado.
+            return
+
+        seen = self.seen_msgs
+        if self.admission is not None and env.msg_id not in seen:
+            # Admissão antes de marcar como vista: uma cópia barrada pelo enlace
+            # não impede que a mesma mensagem entre por outro enlace dentro da taxa.
+            reason = self.admission.admit(out, env.sender)
+            if reason is not None:
+                # Acima da taxa do remetente ou do enlace: descartada aqui, sem repasse nem entrega.
+                if reason == SENDER:
+                    seen.add(env.msg_id)
+                self.log("throttle", {"id": env.msg_id, "from": self.conns.node_of(out) or out.name,
+                                      "reason": reason})
+                return
+        new = seen.check_and_add(env.msg_id)
+        t2 = clock()
+        m.dedup.observe(t2 - t1)
+        if not new:
+            m.duplicates.inc()
+            if trace:
+                tracer.record("dup", [("recv", t0 - tr), ("decode", t1 - t0), ("dedup", t2 - t1)])
+            if self.plumtree is not None:
+                self.plumtree.on_duplicate(out)
+            if self.blobs is not None and env.msg_type == BLOB:
+                self.blobs.on_duplicate(out, env.msg_id)
+            if self.log_dups:
+                self.log("dup", {"id": env.msg_id, "from": self.conns.node_of(out) or out.name})
+            return
+        m.received.inc()
 
-            self.seen_msgs.add(msg_id)
-            self.log("recv", {"id": msg_id, "sender": msg.get("sender"), "payload": msg.get("payload")})
-            print(f"[RECEBIDO] {msg}")
+        # Repassa os bytes recebidos antes de decodificar para o log/console.
+        if self.plumtree is not None:
+            self.plumtree.broadcast(env, origin=out)
+        else:
+            self.forward(env, exclude=conn)
+        t3 = clock()
+        m.broadcast.observe(t3 - t2)
+        if trace:
+            stages = [("recv", t0 - tr), ("decode", t1 - t0), ("dedup", t2 - t1), ("broadcast", t3 - t2)]
+        if self.history is not None:
+            self.history.add(env.msg_id, env.body(JSON, self.codec))
+            t4 = clock()
+            m.store.observe(t4 - t3)
+            if trace:
+                stages.append(("history", t4 - t3))
+            t3 = t4
+        if self.blobs is not None and env.msg_type == BLOB:
+            # Depois do repasse: o manifesto segue pela malha enquanto os pedaços são pedidos.
+            self.blobs.on_manifest(out, env.msg_id, env.msg.get("payload"))
 
-            self.broadcast(msg, exclude=conn)
+        msg = env.msg
+        tl = clock() if trace else 0.0
+        # "from" (nó de quem chegou primeiro) logo após o id: o propagation.py lê sem decodificar o payload.
+        self.log("recv", {"id": env.msg_id, "from": self.conns.node_of(out) or out.name,
+                          "sender": msg.get("sender"), "payload": msg.get("payload")})
+        tp = clock() if trace else 0.0
+        print(f"[RECEBIDO] {msg}")
+        t5 = clock()
+        m.on_message.observe(t5 - t3)
+        if trace:
+            stages += [("log", tp - tl), ("on_message", t5 - tp)]
+            self.tracer.record("msg", stages)
 
+    def _on_closed(self, conn, out):
+        with self.lock:
+            self.connections.pop(conn, None)
+        self.conns.link_down(out)
+        if self.plumtree is not None:
+            self.plumtree.remove_link(out)
+        if self.blobs is not None:
+            self.blobs.remove_link(out)
+        if self.admission is not None:
+            self.admission.remove_link(out)
+        out.close()
         try:
             conn.close()
-        finally:
-            with self.lock:
-                if conn in self.connections:
-                    self.connections.remove(conn)
+        except Exception:
+            pass
+
+    def _on_hello(self, out, env):
+        reply, codec = negotiate(self.codec, env, self.port, self.node_id)
+        if reply is None and codec is None:
+            return
+        node, listen = hello_identity(env)
+        if node is not None and not self.conns.identify(out, node, dialable(listen, out.name)):
+            # Conexão consigo mesmo ou par já ligado por outra conexão.
+            out.close()
+            return
+        # Mesmo host: quem aceitou oferece memória compartilhada no hello_ack.
+        extra = self.transport.on_hello(out, env.msg_type, env.msg.get("payload") or {})
+        if reply is not None:
+            if extra:
+                reply = ack_body(codec, self.node_id, extra)
+            out.enqueue(make_frame(reply), CONTROL)
+        if codec is not None and codec != out.codec:
+            configure_outbound(out, codec, self.codec)
+            self.log("info", {"msg": "codec", "peer": out.name, "codec": codec})
+
+    def _close_link(self, out):
+        out.close()
+
+    def _on_plumtree(self, out, env):
+        self.plumtree.on_control(out, env.msg_type, env.msg.get("payload") or {})
+
+    def _on_px(self, out, env):
+        self.px.on_control(out, env.msg_type, env.msg.get("payload") or {}, out.name)
+
+    def _on_sync(self, out, env):
+        payload = env.msg.get("payload") or {}
+        if env.msg_type == SYNC_DIGEST:
+            self.sync.on_digest(out, payload)
+        else:
+            self.sync.on_batch(out, payload.get("msgs") or [])
+
+    def _on_recovered(self, msg):
+        # Recuperada na sincronização: só entrega local, sem relay.
+        if self.blobs is not None and msg.get("type") == BLOB:
+            self.blobs.on_manifest(None, msg.get("id"), msg.get("payload"))
+        self.log("recv", {"id": msg.get("id"), "sync": True, "sender": msg.get("sender"), "payload": msg.get("payload")})
+        print(f"[RECUPERADO] {msg}")
+
+    def _on_blob(self, out, env):
+        if env.msg_type == BLOB_WANT:
+            self.blobs.on_want(out, env.msg.get("payload") or {})
+        elif env.msg_type == BLOB_MISS:
+            self.blobs.on_miss(out, env.msg.get("payload") or {})
+        else:
+            self.blobs.on_chunk(out, env.raw)
+
+    def _on_blob_complete(self, manifest, path):
+        print(f"[ARQUIVO] {manifest['name']} ({manifest['size']} bytes) em {path}")
+        self.log("info", {"msg": "blob", "blob": manifest["blob"], "name": manifest["name"],
+                          "size": manifest["size"], "path": path})
+
+    def _send_env(self, out, env):
+        self.metrics.forwarded.inc()
+        body = env.body(out.codec, self.codec)
+        out.enqueue(make_frame(body), lane_for(body, self.bulk_bytes))
+
+    def _send_ctrl(self, out, msg_type, payload):
+        out.enqueue(make_frame(encode_body({"type": msg_type, "payload": payload})), CONTROL)
 
     def _input_loop(self):
         while True:
-            text = input("Digite mensagem ('sair' para encerrar): ").strip()
+            text = input("Digite mensagem ('sair' para encerrar, '/stats' para filas, '/metrics', '/file <caminho>'): ").strip()
             if text.lower() == "sair":
                 break
-            msg = generate_msg("msg", self.name, text)
-            self.seen_msgs.add(msg["id"])
-            self.log("send", {"id": msg["id"], "payload": text})
-            self.broadcast(msg)
+            if text == "/stats":
+                for st in self.neighbour_stats():
+                    print(f"[FILA] {st}")
+                print(f"[DEDUP] {self.seen_msgs.stats()}")
+                print(f"[DISSEMINAÇÃO] {self.dissemination_stats()}")
+                print(f"[LOG] fila={self.logger.depth()} descartados={self.logger.shed}")
+                print(f"[CONEXÕES] {self.conns.stats()}")
+                if self.px is not None:
+                    print(f"[PEERS] {self.px.stats()}")
+                if self.sync is not None:
+                    print(f"[HISTÓRICO] {self.sync.stats()}")
+                if self.blobs is not None:
+                    print(f"[BLOBS] {self.blobs.stats()}")
+                if self.admission is not None:
+                    print(f"[ADMISSÃO] {self.admission.stats()}")
+                continue
+            if text == "/metrics":
+                print(self.metrics.render(), end="")
+                continue
+            if text.startswith("/file ") and self.blobs is not None:
+                path = text[6:].strip()
+                try:
+                    manifest = self.blobs.publish(path)
+                except OSError as e:
+                    print(f"[ERRO] {path}: {e}")
+                    continue
+                print(f"[ARQUIVO] {manifest['name']} -> {manifest['blob']} ({len(manifest['hashes'])} pedaços)")
+                self._originate(generate_msg(BLOB, self.name, manifest))
+                continue
+            if text.startswith("/get ") and self.blobs is not None:
+                root = text[5:].strip()
+                print(f"[ARQUIVO] {root}: {'buscando' if self.blobs.fetch(root) else 'desconhecido'}")
+                continue
+            self._originate(generate_msg("msg", self.name, text))
+
+    def _originate(self, msg):
+        self.seen_msgs.add(msg["id"])
+        self.metrics.originated.inc()
+        self.log("send", {"id": msg["id"], "payload": msg["payload"]})
+        if self.history is not None:
+            self.history.add(msg["id"], encode_body(msg))
+        self.broadcast(msg)
 
     def broadcast(self, msg, exclude=None):
+        """Serializa uma única vez por codec e repassa o mesmo frame a todos."""
+        env = Envelope.from_msg(msg)
+        if self.plumtree is not None and exclude is None:
+            self.plumtree.broadcast(env)
+        else:
+            self.forward(env, exclude=exclude)
+
+    def forward(self, env, exclude=None):
+        """Fan-out = um append por vizinho; o lock só protege a cópia da lista."""
         with self.lock:
-            for conn in list(self.connections):
-                if conn == exclude:
-                    continue
-                try:
-                    send_msg(conn, msg)
-                except Exception as e:
-                    print(f"[ERRO envio] {e}")
-                    self.log("error", {"op": "send", "id": msg.get("id"), "err": str(e)})
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
-                    self.connections.remove(conn)
+            outs = [out for conn, out in self.connections.items() if conn is not exclude]
+        self.metrics.forwarded.inc(len(outs))
+        # codec -> (frame, faixa): o mesmo par vai a todos os vizinhos daquele codec.
+        frames = {}
+        for out in outs:
+            entry = frames.get(out.codec)
+            if entry is None:
+                body = env.body(out.codec, self.codec)
+                entry = frames[out.codec] = (make_frame(body), lane_for(body, self.bulk_bytes))
+            out.enqueue(entry[0], entry[1])
+
+    def neighbour_stats(self):
+        """Profundidade da fila e descartes por vizinho."""
+        with self.lock:
+            outs = list(self.connections.values())
+        return [out.stats() for out in outs]
+
+    def dissemination_stats(self):
+        """Modo de disseminação e razão de duplicados recebidos / entregues."""
+        if self.plumtree is not None:
+            return self.plumtree.stats()
+        return flood_stats(self.seen_msgs)
 
 
 if __name__ == "__main__":
@@ -142,6 +500,47 @@ if __name__ == "__main__":
     parser.add_argument("--peer", action="append", help="host:port de peer conhecido")
     parser.add_argument("--bootstrap", help="arquivo JSON com peers")
     parser.add_argument("--name", help="apelido deste peer")
+    parser.add_argument("--queue-size", type=int, default=1024, help="frames na fila de saída por vizinho")
+    parser.add_argument("--queue-policy", choices=POLICIES, default=DROP_OLDEST, help="o que fazer com a fila cheia")
+    parser.add_argument("--dedup", choices=DEDUP_KINDS, default="window", help="window: exato com expiração | bloom: Bloom rotativo")
+    parser.add_argument("--dedup-capacity", type=int, default=1_000_000, help="ids lembrados (por geração no bloom)")
+    parser.add_argument("--dedup-ttl", type=float, default=600.0, help="expiração em segundos (window)")
+    parser.add_argument("--max-frame", type=int, default=DEFAULT_MAX_FRAME, help="tamanho máximo de frame aceito (bytes)")
+    parser.add_argument("--codec", choices=CODECS, default="json", help="formato preferido no fio (bin1 é negociado por conexão)")
+    parser.add_argument("--compress-threshold", type=int, default=1024, help="payloads bin1 a partir deste tamanho vão com zlib (0 desliga)")
+    parser.add_argument("--dissemination", choices=["flood", "plumtree"], default="flood", help="flood: repassa a todos | plumtree: árvore eager + IHAVE")
+    parser.add_argument("--graft-timeout", type=float, default=0.5, help="plumtree: espera (s) por um id anunciado antes do GRAFT")
+    parser.add_argument("--batch-bytes", type=int, default=DEFAULT_BATCH_BYTES, help="máximo de bytes por lote de envio")
+    parser.add_argument("--linger-us", type=int, default=0, help="espera (µs) por mais frames antes de enviar um lote pequeno")
+    parser.add_argument("--log-fsync", choices=FSYNC_MODES, default="none", help="fsync do log: none | batch (a cada lote) | interval (1/s)")
+    parser.add_argument("--log-high-water", type=int, default=50000, help="eventos pendentes no log a partir dos quais recv/send são descartados")
+    parser.add_argument("--node-id-file", help="arquivo com o id estável do nó (padrão: logs/node_<porta>.id)")
+    parser.add_argument("--connect-timeout", type=float, default=3.0, help="timeout (s) para abrir uma conexão")
+    parser.add_argument("--target-degree", type=int, default=5, help="disca peers aprendidos até ter este número de vizinhos (0 = só os conhecidos)")
+    parser.add_argument("--max-degree", type=int, default=0, help="fecha os enlaces excedentes acima deste grau (0 = sem limite)")
+    parser.add_argument("--peer-cache", help="cache de peers aprendidos (padrão: logs/peers_<porta>.json)")
+    parser.add_argument("--px-interval", type=float, default=5.0, help="intervalo (s) da troca de peers (0 desliga)")
+    parser.add_argument("--ready-links", type=int, default=1, help="conexões abertas para considerar o nó pronto")
+    parser.add_argument("--ready-timeout", type=float, default=2.0, help="espera máxima (s) por --ready-links antes do prompt (0 não espera)")
+    parser.add_argument("--history", type=int, default=10000, help="mensagens recentes mantidas em memória para sincronizar vizinhos (0 desliga)")
+    parser.add_argument("--history-file", help="arquivo do histórico (padrão: logs/history_<porta>.bin)")
+    parser.add_argument("--history-max-mb", type=int, default=32, help="limite em disco do histórico (MB)")
+    parser.add_argument("--sync-window", type=float, default=300.0, help="ao conectar, troca e recupera mensagens dos últimos N segundos")
+    parser.add_argument("--shm", choices=["auto", "off"], default="auto", help="auto: vizinhos no mesmo host trocam frames por memória compartilhada")
+    parser.add_argument("--shm-ring-kb", type=int, default=1024, help="tamanho (KB) de cada anel de memória compartilhada")
+    parser.add_argument("--log-dups", choices=["on", "off"], default="on", help="registra no log os duplicados recebidos (amplificação por enlace)")
+    parser.add_argument("--blob-dir", help="diretório dos blobs (padrão: logs/blobs_<porta>)")
+    parser.add_argument("--blob-auto-mb", type=int, default=64, help="busca sozinho blobs anunciados até este tamanho (MB); maiores com /get (0 = sempre sob demanda)")
+    parser.add_argument("--blob-window", type=int, default=8, help="pedaços de blob em voo por transferência")
+    parser.add_argument("--blob-transfers", type=int, default=4, help="transferências de blob simultâneas")
+    parser.add_argument("--sender-rate", type=float, default=0.0, help="mensagens novas/s aceitas por remetente antes do relay (0 desliga)")
+    parser.add_argument("--sender-burst", type=float, default=0.0, help="rajada por remetente (0 = um segundo de taxa)")
+    parser.add_argument("--link-rate", type=float, default=0.0, help="mensagens novas/s aceitas por conexão de entrada (0 desliga)")
+    parser.add_argument("--link-burst", type=float, default=0.0, help="rajada por conexão (0 = um segundo de taxa)")
+    parser.add_argument("--lane-weights", type=parse_weights, default=DEFAULT_WEIGHTS, help="pesos das faixas de saída control,interactive,bulk (ex.: 8,4,1)")
+    parser.add_argument("--trace-rate", type=float, default=0.0, help="fração das mensagens recebidas com tempo por etapa (0 desliga)")
+    parser.add_argument("--profile-dir", default="logs", help="onde SIGUSR1/SIGUSR2 gravam perfis, pilhas e traces")
+    parser.add_argument("--bulk-bytes", type=int, default=DEFAULT_BULK_BYTES, help="mensagens repassadas acima deste tamanho vão na faixa bulk (0 = nunca)")
     args = parser.parse_args()
 
     known_peers = []
@@ -157,9 +556,38 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"[ERRO] bootstrap: {e}")
 
-    peer = Peer(args.host, args.port, known_peers, name=args.name)
+    peer = Peer(args.host, args.port, known_peers, name=args.name,
+                queue_size=args.queue_size, queue_policy=args.queue_policy,
+                dedup=make_dedup(args.dedup, capacity=args.dedup_capacity, ttl=args.dedup_ttl),
+                max_frame=args.max_frame, batch_bytes=args.batch_bytes, linger_us=args.linger_us,
+                codec=NodeCodec(args.codec, compress_threshold=args.compress_threshold),
+                dissemination=args.dissemination, graft_timeout=args.graft_timeout,
+                log_fsync=args.log_fsync, log_high_water=args.log_high_water,
+                history=MessageStore(args.history, args.history_file or f"logs/history_{args.port}.bin",
+                                     max_file_bytes=args.history_max_mb * 1024 * 1024) if args.history > 0 else None,
+                sync_window=args.sync_window,
+                node_id=load_node_id(args.node_id_file or f"logs/node_{args.port}.id"),
+                connect_timeout=args.connect_timeout,
+                target_degree=args.target_degree, max_degree=args.max_degree,
+                peer_cache=PeerCache(args.peer_cache or f"logs/peers_{args.port}.json") if args.px_interval > 0 else None,
+                px_interval=args.px_interval, ready_links=args.ready_links, log_dups=args.log_dups == "on",
+                transport=TcpTransport(shm=args.shm == "auto", ring_bytes=args.shm_ring_kb * 1024),
+                blob_store=BlobStore(args.blob_dir or f"logs/blobs_{args.port}"),
+                blob_window=args.blob_window, blob_transfers=args.blob_transfers,
+                blob_auto_bytes=args.blob_auto_mb * 1024 * 1024,
+                sender_rate=args.sender_rate, sender_burst=args.sender_burst,
+                link_rate=args.link_rate, link_burst=args.link_burst,
+                lane_weights=args.lane_weights, bulk_bytes=args.bulk_bytes,
+                trace_rate=args.trace_rate, profile_dir=args.profile_dir)
+    def diag_log(s):
+        print(s)
+        peer.log("info", {"msg": s})
+
+    # Sem reiniciar o nó: kill -USR1 <pid> liga/desliga o profiler, kill -USR2 <pid> despeja pilhas/lock/trace.
+    if install_signal_handlers(peer.profiling, diag_log):
+        print(f"[DIAGNÓSTICO] pid {os.getpid()}: SIGUSR1 profiler, SIGUSR2 pilhas/lock/trace -> {args.profile_dir}")
     try:
-        peer.start()
+        peer.start(ready_timeout=args.ready_timeout)
     except KeyboardInterrupt:
         pass
     finally:
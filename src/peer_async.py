@@ -0,0 +1,343 @@
+import time
+import asyncio
+import struct
+import threading
+from collections import deque
+from typing import Dict, List, Tuple, Optional
+
+from common import generate_msg, generate_msgs, FrameTooLarge, DEFAULT_MAX_FRAME
+from outbound import make_frame, DROP_OLDEST, DROP_NEWEST, DISCONNECT, POLICIES, DEFAULT_BATCH_BYTES, take_batch
+from dedup import make_dedup
+from codec import (NodeCodec, BinDecoder, Envelope, CONTROL_TYPES, DECODE_ERRORS,
+                   decode_frame, hello_body, negotiate, configure_outbound)
+from metrics import NodeMetrics, StartupClock, neighbour_samples
+
+
+class AsyncOutbound:
+    """
+    Equivalente asyncio do outbound.Outbound: fila limitada por conexão,
+    esvaziada por uma task escritora que respeita o drain() do transporte.
+    Os frames pendentes saem num único writelines por lote (o asyncio já
+    liga TCP_NODELAY nos sockets TCP). Só deve ser usado de dentro do event loop.
+    """
+    def __init__(self, writer: asyncio.StreamWriter, maxlen: int = 1024, policy: str = DROP_OLDEST, on_close=None,
+                 max_batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0):
+        if policy not in POLICIES:
+            raise ValueError(f"política inválida: {policy}")
+        self.writer = writer
+        self.maxlen = maxlen
+        self.policy = policy
+        self.max_batch_bytes = max_batch_bytes
+        self.linger = linger_us / 1e6
+        peer = writer.get_extra_info("peername")
+        self.name = f"{peer[0]}:{peer[1]}" if peer else "?"
+        self.on_close = on_close
+        self.codec = "json"
+        self.before_send = None
+        self.sent = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.frames_in = 0
+        self.bytes_in = 0
+        self._q = deque()
+        self._queued_bytes = 0
+        self._wake = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def enqueue(self, frame) -> bool:
+        if self._closed:
+            return False
+        if len(self._q) >= self.maxlen:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return False
+            if self.policy == DISCONNECT:
+                self.close(OverflowError(f"fila de saída cheia ({self.maxlen})"))
+                return False
+            self._queued_bytes -= 4 + len(self._q.popleft()[1])
+        self._q.append(frame)
+        self._queued_bytes += 4 + len(frame[1])
+        if len(self._q) > self.max_depth:
+            self.max_depth = len(self._q)
+        self._wake.set()
+        return True
+
+    async def _run(self):
+        try:
+            while not self._closed:
+                if not self._q:
+                    self._wake.clear()
+                    await self._wake.wait()
+                    continue
+                if self.linger > 0 and self._queued_bytes < self.max_batch_bytes:
+                    await asyncio.sleep(self.linger)
+                while self._q:
+                    bufs, size, n = take_batch(self._q, self.max_batch_bytes, self.before_send)
+                    self._queued_bytes -= size
+                    self.writer.writelines(bufs)
+                    self.sent += n
+                    self.bytes_out += size
+                    self.batches += 1
+                    if n > self.max_batch:
+                        self.max_batch = n
+                await self.writer.drain()
+        except Exception as e:
+            self.close(e)
+
+    def close(self, err: Optional[Exception] = None):
+        if self._closed:
+            return
+        self._closed = True
+        self._q.clear()
+        self._queued_bytes = 0
+        self._wake.set()
+        self.writer.close()
+        if self.on_close is not None:
+            self.on_close(self, err)
+
+    def stats(self) -> dict:
+        return {
+            "peer": self.name,
+            "depth": len(self._q),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "bytes_out": self.bytes_out,
+            "frames_in": self.frames_in,
+            "bytes_in": self.bytes_in,
+            "dropped": self.dropped,
+            "policy": self.policy,
+            "codec": self.codec,
+            "batches": self.batches,
+            "avg_batch": round(self.sent / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+        }
+
+
+class AsyncPeerCore:
+    """
+    Engine alternativo ao PeerCore baseado em asyncio streams.
+    Todas as conexões são atendidas por um único event loop rodando numa
+    thread dedicada, em vez de uma thread bloqueante por socket.
+    Mantém o mesmo formato de fio (common.send_msg/recv_msg) e os mesmos
+    callbacks on_message/on_log do PeerCore.
+    """
+    def __init__(self, host: str, port: int, known_peers: Optional[List[Tuple[str, int]]] = None, on_message=None, on_log=None,
+                 queue_size: int = 1024, queue_policy: str = DROP_OLDEST, dedup=None,
+                 max_frame: int = DEFAULT_MAX_FRAME, batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 codec: Optional[NodeCodec] = None, connect_timeout: float = 3.0, ready_links: int = 1):
+        self.host = host
+        self.port = port
+        self.known_peers = known_peers or []
+        self.connections: Dict[asyncio.StreamWriter, AsyncOutbound] = {}
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.max_frame = max_frame
+        self.batch_bytes = batch_bytes
+        self.linger_us = linger_us
+        self.codec = codec or NodeCodec()
+        self.seen_msgs = dedup if dedup is not None else make_dedup()
+        self.on_message = on_message
+        self.on_log = on_log or (lambda s: None)
+        # Sem self.lock: tudo roda no event loop, então não há métricas de disputa.
+        self.metrics = NodeMetrics()
+        self.startup = StartupClock(self.metrics.registry, ready_links)
+        self.connect_timeout = connect_timeout
+        self.metrics.registry.gauge("p2p_neighbours", "Conexões abertas", lambda: len(self.connections))
+        self.metrics.registry.gauge("p2p_dedup_entries", "Ids lembrados pelo dedup", lambda: len(self.seen_msgs))
+        self.metrics.registry.collector(lambda: neighbour_samples(self.neighbour_stats()))
+        self._running = True
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.startup.mark("init")
+
+    def start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        threading.Thread(target=self._run_loop, args=(ready,), daemon=True).start()
+        ready.wait()
+        asyncio.run_coroutine_threadsafe(self._start_server(), self._loop).result()
+        # Bootstrap sem esperar: todas as conexões em paralelo, cada uma com timeout.
+        for peer_host, peer_port in self.known_peers:
+            asyncio.run_coroutine_threadsafe(self._connect(peer_host, peer_port), self._loop)
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Espera até `ready_links` conexões abertas (ou o timeout)."""
+        return self.startup.wait_ready(timeout)
+
+    def stop(self):
+        self._running = False
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_all(), self._loop).result(timeout=5)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run_loop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    async def _close_all(self):
+        if self._server is not None:
+            self._server.close()
+        for out in list(self.connections.values()):
+            out.close()
+        self.connections.clear()
+
+    async def _start_server(self):
+        self._server = await asyncio.start_server(self._on_accept, self.host, self.port, reuse_address=True)
+        self.startup.mark("listening")
+        self.on_log(f"[SERVIDOR] ouvindo em {self.host}:{self.port}")
+
+    async def _on_accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.on_log(f"[SERVIDOR] conexão de {writer.get_extra_info('peername')}")
+        self._add_connection(writer)
+        await self._handle_peer(reader, writer)
+
+    def connect_to_peer(self, host, port):
+        """Pode ser chamado de qualquer thread; bloqueia até conectar ou falhar."""
+        asyncio.run_coroutine_threadsafe(self._connect(host, port), self._loop).result()
+
+    async def _connect(self, host, port):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+        except Exception as e:
+            self.on_log(f"[ERRO] não conectou a {host}:{port} -> {e}")
+            return
+        self.on_log(f"[CLIENTE] conectado a {host}:{port}")
+        self._add_connection(writer, dialed=f"{host}:{port}")
+        self._loop.create_task(self._handle_peer(reader, writer))
+
+    def _add_connection(self, writer: asyncio.StreamWriter, dialed: Optional[str] = None):
+        out = AsyncOutbound(writer, self.queue_size, self.queue_policy,
+                            on_close=self._on_outbound_closed,
+                            max_batch_bytes=self.batch_bytes, linger_us=self.linger_us)
+        self.connections[writer] = out
+        self.startup.linked(len(self.connections))
+        if dialed and len(self.codec.offered()) > 1:
+            out.enqueue(make_frame(hello_body(self.codec, f"{self.host}:{self.port}", dialed)))
+
+    def _on_outbound_closed(self, out: AsyncOutbound, err: Optional[Exception]):
+        if err is not None:
+            self.on_log(f"[ERRO envio] {out.name}: {err}")
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        decoder = BinDecoder()
+        m = self.metrics
+        try:
+            while self._running:
+                header = await reader.readexactly(4)
+                length = struct.unpack("!I", header)[0]
+                if length > self.max_frame:
+                    raise FrameTooLarge(f"frame de {length} bytes excede o limite de {self.max_frame}")
+                data = await reader.readexactly(length)
+                out = self.connections.get(writer)
+                if out is not None:
+                    out.frames_in += 1
+                    out.bytes_in += 4 + length
+                try:
+                    self._on_frame(writer, decoder, data)
+                except DECODE_ERRORS as e:
+                    # Frame malformado (cabeçalho, ou o corpo decodificado só no
+                    # .msg do on_message): descartado sem derrubar a conexão.
+                    m.malformed.inc()
+                    self.on_log(f"[ERRO] {e}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.on_log(f"[ERRO leitura] {e}")
+        out = self.connections.pop(writer, None)
+        if out is not None:
+            out.close()
+        writer.close()
+
+    def _on_frame(self, writer: asyncio.StreamWriter, decoder: BinDecoder, data: bytes):
+        m = self.metrics
+        clock = time.perf_counter
+        t0 = clock()
+        env = decode_frame(data, decoder)
+        t1 = clock()
+        m.decode.observe(t1 - t0)
+        if env is None:
+            return
+        if env.msg_type in CONTROL_TYPES:
+            m.control.inc()
+            self._on_control(writer, env)
+            return
+        if env.msg_id is None:
+            return
+        new = self.seen_msgs.check_and_add(env.msg_id)
+        t2 = clock()
+        m.dedup.observe(t2 - t1)
+        if not new:
+            m.duplicates.inc()
+            return
+        m.received.inc()
+        self._forward(env, exclude=writer)
+        t3 = clock()
+        m.broadcast.observe(t3 - t2)
+        if self.on_message is not None:
+            self.on_message(env.msg)
+            m.on_message.observe(clock() - t3)
+
+    def _on_control(self, writer: asyncio.StreamWriter, env: Envelope):
+        out = self.connections.get(writer)
+        if out is None:
+            return
+        reply, codec = negotiate(self.codec, env, self.port)
+        if reply is not None:
+            out.enqueue(make_frame(reply))
+        if codec is not None:
+            configure_outbound(out, codec, self.codec)
+            self.on_log(f"[CODEC] {out.name} -> {codec}")
+
+    def send_text(self, text: str, sender_name: str):
+        msg = generate_msg("msg", sender_name, text)
+        self.seen_msgs.add(msg["id"])
+        self.metrics.originated.inc()
+        self.broadcast(msg)
+        if self.on_message is not None:
+            self.on_message(msg)
+
+    def send_many(self, texts: List[str], sender_name: str) -> List[str]:
+        """Lote de send_text: ids em lote e um único agendamento no event loop para todas."""
+        msgs = generate_msgs("msg", sender_name, texts)
+        for msg in msgs:
+            self.seen_msgs.add(msg["id"])
+        self.metrics.originated.inc(len(msgs))
+        self._loop.call_soon_threadsafe(self._forward_many, [Envelope.from_msg(msg) for msg in msgs])
+        if self.on_message is not None:
+            for msg in msgs:
+                self.on_message(msg)
+        return [msg["id"] for msg in msgs]
+
+    def _forward_many(self, envs: List[Envelope]):
+        for env in envs:
+            self._forward(env)
+
+    def broadcast(self, msg, exclude=None):
+        """Versão thread-safe: serializa uma vez e agenda o envio no event loop."""
+        self._loop.call_soon_threadsafe(self._forward, Envelope.from_msg(msg), exclude)
+
+    def _forward(self, env: Envelope, exclude=None):
+        frames = {}
+        for w, out in list(self.connections.items()):
+            if w is exclude:
+                continue
+            frame = frames.get(out.codec)
+            if frame is None:
+                frame = frames[out.codec] = make_frame(env.body(out.codec, self.codec))
+            self.metrics.forwarded.inc()
+            out.enqueue(frame)
+
+    def neighbour_stats(self) -> List[dict]:
+        """Profundidade da fila e descartes por vizinho."""
+        return [out.stats() for out in list(self.connections.values())]
@@ -1,115 +1,544 @@
-import socket
-import threading
+import os
+import json
 import argparse
+import tempfile
+import threading
 import time
-import json
-from queue import Queue, Empty
-from typing import List, Tuple, Optional
-from flask import Flask, Response, request, jsonify, render_template_string
+from collections import deque
+from typing import List, Tuple, Optional, Dict
+
+from common import encode_body, generate_msg, generate_msgs, DEFAULT_MAX_FRAME
+from outbound import (Outbound, make_frame, lane_for, parse_weights, DROP_OLDEST, POLICIES, DEFAULT_BATCH_BYTES,
+                      CONTROL, DEFAULT_WEIGHTS, DEFAULT_BULK_BYTES)
+from transport import TcpTransport
+from dedup import make_dedup, DEDUP_KINDS
+from codec import (NodeCodec, BinDecoder, Envelope, CODECS, JSON, HELLO, HELLO_ACK,
+                   decode_frame, ack_body, hello_body, hello_identity, negotiate, configure_outbound)
+from plumtree import Plumtree, PLUMTREE_TYPES, flood_stats
+from metrics import NodeMetrics, TimedLock, StartupClock, neighbour_samples
+from sse import SSEHub, SSE_POLICIES, DROP
+from connmgr import ConnectionManager, load_node_id, parse_addr, dialable
+from discovery import PeerCache, PeerExchange, PX_TYPES
+from history import MessageStore, HistorySync, SYNC_DIGEST, SYNC_TYPES
+from blobs import BlobStore, BlobSync, BLOB, BLOB_WANT, BLOB_MISS, BLOB_TYPES, valid_root
+from ratelimit import Admission, SENDER
+from profiling import StageTracer, NodeProfiler
+
+# send_many: intervalo entre tentativas de enfileirar um pedaço e espera máxima por pedaço.
+INGEST_RETRY = 0.005
+INGEST_MAX_WAIT = 1.0
 
-from common import send_msg, recv_msg, generate_msg
 
 class PeerCore:
-    def __init__(self, host: str, port: int, known_peers: Optional[List[Tuple[str, int]]] = None, on_message=None, on_log=None):
+    def __init__(self, host: str, port: int, known_peers: Optional[List[Tuple[str, int]]] = None, on_message=None, on_log=None,
+                 queue_size: int = 1024, queue_policy: str = DROP_OLDEST, dedup=None,
+                 max_frame: int = DEFAULT_MAX_FRAME, batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 codec: Optional[NodeCodec] = None, dissemination: str = "flood", graft_timeout: float = 0.5,
+                 history: Optional[MessageStore] = None, sync_window: float = 300.0,
+                 node_id: Optional[str] = None, connect_timeout: float = 3.0,
+                 target_degree: int = 0, max_degree: int = 0,
+                 peer_cache: Optional[PeerCache] = None, px_interval: float = 5.0,
+                 ready_links: int = 1, transport=None,
+                 blob_store: Optional[BlobStore] = None, blob_window: int = 8, blob_transfers: int = 4,
+                 blob_auto_bytes: int = 64 * 1024 * 1024,
+                 sender_rate: float = 0.0, sender_burst: float = 0.0, link_rate: float = 0.0, link_burst: float = 0.0,
+                 lane_weights=DEFAULT_WEIGHTS, bulk_bytes: int = DEFAULT_BULK_BYTES,
+                 trace_rate: float = 0.0, profile_dir: str = "logs"):
         self.host = host
         self.port = port
         self.known_peers = known_peers or []
-        self.connections: List[socket.socket] = []
-        self.lock = threading.Lock()
-        self.seen_msgs = set()
-        self.on_message = on_message or (lambda m: None)
+        # TCP por padrão; SimTransport (simnet.py) roda o mesmo nó numa rede simulada.
+        self.transport = transport or TcpTransport()
+        # conexão -> Outbound (fila de saída + thread escritora da conexão)
+        self.connections: Dict[object, Outbound] = {}
+        self.metrics = NodeMetrics()
+        self.startup = StartupClock(self.metrics.registry, ready_links)
+        # Lock que mede a própria disputa (p2p_lock_* em /metrics).
+        self.lock = TimedLock(self.metrics.registry)
+        # Diagnóstico sob demanda: profiler, pilhas, disputa do lock, tempos por etapa (ver profiling.py).
+        self.tracer = StageTracer(trace_rate)
+        self.profiling = NodeProfiler(self.lock, self.tracer, profile_dir, tag=str(port))
+        # Qualquer objeto com check_and_add/add/stats (ver dedup.py).
+        self.seen_msgs = dedup if dedup is not None else make_dedup()
+        # None = nenhum consumidor local; o relay nem decodifica o JSON.
+        self.on_message = on_message
         self.on_log = on_log or (lambda s: None)
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.max_frame = max_frame
+        self.batch_bytes = batch_bytes
+        self.linger_us = linger_us
+        self.lane_weights = tuple(lane_weights)
+        self.bulk_bytes = bulk_bytes
+        self.codec = codec or NodeCodec()
+        # Frames de enlace (não passam por dedup nem relay): tipo -> handler(out, env)
+        self.link_handlers = {HELLO: self._on_hello, HELLO_ACK: self._on_hello}
+        self.plumtree: Optional[Plumtree] = None
+        if dissemination == "plumtree":
+            self.plumtree = Plumtree(self._send_env, self._send_ctrl, self.seen_msgs.__contains__,
+                                     graft_timeout=graft_timeout, runtime=self.transport)
+            for t in PLUMTREE_TYPES:
+                self.link_handlers[t] = self._on_plumtree
+        self.node_id = node_id or load_node_id(None)
+        self.connect_timeout = connect_timeout
+        self.conns = ConnectionManager(self.node_id, self.connect_to_peer, self._close_link,
+                                       listen=f"{host}:{port}", target_degree=target_degree, max_degree=max_degree,
+                                       on_log=lambda s: self.on_log(s), metrics=self.metrics,
+                                       runtime=self.transport)
+        self.px: Optional[PeerExchange] = None
+        if peer_cache is not None:
+            self.px = PeerExchange(peer_cache, self.conns, self._send_ctrl, (host, port),
+                                   interval=px_interval, metrics=self.metrics, runtime=self.transport)
+            for t in PX_TYPES:
+                self.link_handlers[t] = self._on_px
+        self.history = history
+        self.sync: Optional[HistorySync] = None
+        if history is not None:
+            self.sync = HistorySync(history, self.seen_msgs, self._on_recovered,
+                                    window=sync_window, metrics=self.metrics, runtime=self.transport)
+            for t in SYNC_TYPES:
+                self.link_handlers[t] = self._on_sync
+        self.blobs: Optional[BlobSync] = None
+        if blob_store is not None:
+            # Payloads grandes: a malha leva só o manifesto; os pedaços vêm sob demanda.
+            self.blobs = BlobSync(blob_store, self._send_ctrl, self._on_blob_complete, window=blob_window,
+                                  max_active=blob_transfers, auto_fetch_bytes=blob_auto_bytes,
+                                  metrics=self.metrics, runtime=self.transport)
+            for t in BLOB_TYPES:
+                self.link_handlers[t] = self._on_blob
+        self.admission: Optional[Admission] = None
+        if sender_rate > 0 or link_rate > 0:
+            self.admission = Admission(sender_rate, sender_burst, link_rate, link_burst,
+                                       metrics=self.metrics, runtime=self.transport)
+        # Pedaços de send_many esperando espaço nas filas dos vizinhos (ver _feed).
+        self._ingest = deque()
+        self._ingest_pending = 0
+        self._ingest_active = False
+        self._ingest_lock = threading.Lock()
+        self.metrics.registry.gauge("p2p_ingest_pending", "Mensagens de send_many ainda fora das filas dos vizinhos",
+                                    lambda: self._ingest_pending)
+        self.metrics.registry.gauge("p2p_neighbours", "Conexões abertas", lambda: len(self.connections))
+        self.metrics.registry.gauge("p2p_dedup_entries", "Ids lembrados pelo dedup", lambda: len(self.seen_msgs))
+        self.metrics.registry.collector(lambda: neighbour_samples(self.neighbour_stats()))
         self._running = True
+        self._started = False
+        self._srv = None
+        self.startup.mark("init")
 
     def start(self):
-        threading.Thread(target=self._start_server, daemon=True).start()
+        if self._started:
+            return
+        self._started = True
+        # Bind síncrono: porta ocupada falha aqui e "listening" é o instante real.
+        self._srv = self._listen()
         for peer_host, peer_port in self.known_peers:
-            self.connect_to_peer(peer_host, peer_port)
+            self.conns.add_address(peer_host, peer_port)
+        if self.px is not None:
+            # Endereços aprendidos em execuções anteriores completam o grau alvo.
+            self.px.bootstrap()
+            self.px.start()
+        # Discagens em paralelo, cada uma com --connect-timeout (ver connmgr.py).
+        self.conns.start()
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Espera até `ready_links` conexões abertas (ou o timeout)."""
+        return self.startup.wait_ready(timeout)
 
     def stop(self):
         self._running = False
+        self.conns.stop()
+        if self.px is not None:
+            self.px.stop()
+        if self._srv is not None:
+            self._srv.close()
+        if self.plumtree is not None:
+            self.plumtree.stop()
+        if self.history is not None:
+            self.history.close()
+        if self.blobs is not None:
+            self.blobs.stop()
         with self.lock:
-            for c in self.connections:
-                try:
-                    c.shutdown(socket.SHUT_RDWR)
-                except Exception:
-                    pass
-                try:
-                    c.close()
-                except Exception:
-                    pass
+            outs = list(self.connections.items())
             self.connections.clear()
+        for c, out in outs:
+            out.close()
+            try:
+                c.close()
+            except Exception:
+                pass
 
-    def _start_server(self):
-        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv.bind((self.host, self.port))
-        srv.listen()
+    def _listen(self):
+        srv = self.transport.listen(self.host, self.port, self._on_accept)
+        self.startup.mark("listening")
         self.on_log(f"[SERVIDOR] ouvindo em {self.host}:{self.port}")
-        while self._running:
-            try:
-                conn, addr = srv.accept()
-            except OSError:
-                break
-            self.on_log(f"[SERVIDOR] conexão de {addr}")
-            with self.lock:
-                self.connections.append(conn)
-            threading.Thread(target=self._handle_peer, args=(conn,), daemon=True).start()
-        try:
-            srv.close()
-        except Exception:
-            pass
+        return srv
+
+    def _on_accept(self, conn, addr):
+        if not self._running:
+            conn.close()
+            return
+        self.on_log(f"[SERVIDOR] conexão de {addr}")
+        self._add_connection(conn)
 
-    def connect_to_peer(self, host, port):
+    def connect_to_peer(self, host, port) -> bool:
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((host, port))
+            s = self.transport.connect(host, port, self.connect_timeout)
             self.on_log(f"[CLIENTE] conectado a {host}:{port}")
-            with self.lock:
-                self.connections.append(s)
-            threading.Thread(target=self._handle_peer, args=(s,), daemon=True).start()
+            self._add_connection(s, dialed=f"{host}:{port}")
+            return True
         except Exception as e:
             self.on_log(f"[ERRO] não conectou a {host}:{port} -> {e}")
+            return False
 
-    def _handle_peer(self, conn):
-        while self._running:
-            msg = recv_msg(conn)
-            if not msg:
-                break
-            msg_id = msg.get("id")
-            if msg_id in self.seen_msgs:
-                continue
-            self.seen_msgs.add(msg_id)
-            self.broadcast(msg, exclude=conn)
-            self.on_message(msg)
+    def _add_connection(self, conn, dialed: Optional[str] = None):
+        out = self.transport.outbound(conn, self.queue_size, self.queue_policy, on_close=self._on_outbound_closed,
+                                      max_batch_bytes=self.batch_bytes, linger_us=self.linger_us,
+                                      weights=self.lane_weights)
+        with self.lock:
+            self.connections[conn] = out
+            degree = len(self.connections)
+        self.startup.linked(degree)
+        if dialed:
+            # Quem disca se identifica e oferece os codecs; até o hello_ack a conexão fala JSON.
+            out.enqueue(make_frame(hello_body(self.codec, f"{self.host}:{self.port}", dialed,
+                                              self.node_id, f"{self.host}:{self.port}",
+                                              self.transport.hello_extra(out))), CONTROL)
+        # Registrado antes da leitura começar: o hello_ack pode chegar logo.
+        self.conns.link_up(out, parse_addr(dialed) if dialed else None)
+        if self.plumtree is not None:
+            self.plumtree.add_link(out)
+        if self.sync is not None:
+            self.sync.on_connect(out)
+        decoder = BinDecoder()
+        self.transport.serve(conn, lambda data: self._on_frame(conn, out, decoder, data),
+                             lambda: self._on_closed(conn, out), max_frame=self.max_frame,
+                             on_error=lambda e: self.on_log(f"[ERRO] {e}"))
+
+    def _on_outbound_closed(self, out: Outbound, err: Optional[Exception]):
+        if err is not None:
+            self.on_log(f"[ERRO envio] {out.name}: {err}")
+
+    def _on_frame(self, conn, out: Outbound, decoder: BinDecoder, data):
+        """Um frame recebido de `conn` (chamado pelo transporte, na ordem de chegada)."""
+        m = self.metrics
+        clock = time.perf_counter
+        # Fração amostrada (--trace-rate): tempos por etapa no StageTracer.
+        tracer = self.tracer
+        trace = tracer.rate > 0 and tracer.sample()
+        tr = clock() if trace else 0.0
+        out.frames_in += 1
+        out.bytes_in += 4 + len(data)
+        t0 = clock()
+        env = decode_frame(data, decoder)
+        t1 = clock()
+        m.decode.observe(t1 - t0)
+        if env is None:
+            return
+        handler = self.link_handlers.get(env.msg_type)
+        if handler is not None:
+            m.control.inc()
+            handler(out, env)
+            if trace:
+                tracer.record("ctrl", [("recv", t0 - tr), ("decode", t1 - t0), ("handler", clock() - t1)])
+            return
+        if env.msg_id is None:
+            # Sem id (corpo que não é um objeto JSON, id ausente): não entra no dedup nem é repassado.
+            return
+        seen = self.seen_msgs
+        if self.admission is not None and env.msg_id not in seen:
+            # Admissão antes de marcar como vista: uma cópia barrada pelo enlace
+            # não impede que a mesma mensagem entre por outro enlace dentro da taxa.
+            reason = self.admission.admit(out, env.sender)
+            if reason is not None:
+                # Acima da taxa do remetente ou do enlace: descartada aqui, sem repasse nem entrega.
+                if reason == SENDER:
+                    seen.add(env.msg_id)
+                return
+        new = seen.check_and_add(env.msg_id)
+        t2 = clock()
+        m.dedup.observe(t2 - t1)
+        if not new:
+            m.duplicates.inc()
+            if trace:
+                tracer.record("dup", [("recv", t0 - tr), ("decode", t1 - t0), ("dedup", t2 - t1)])
+            if self.plumtree is not None:
+                self.plumtree.on_duplicate(out)
+            if self.blobs is not None and env.msg_type == BLOB:
+                self.blobs.on_duplicate(out, env.msg_id)
+            return
+        m.received.inc()
+        if self.plumtree is not None:
+            self.plumtree.broadcast(env, origin=out)
+        else:
+            # Relay: o mesmo buffer recebido vai para todos os vizinhos do mesmo codec.
+            self.forward(env, exclude=conn)
+        t3 = clock()
+        m.broadcast.observe(t3 - t2)
+        if trace:
+            stages = [("recv", t0 - tr), ("decode", t1 - t0), ("dedup", t2 - t1), ("broadcast", t3 - t2)]
+        if self.history is not None:
+            self.history.add(env.msg_id, env.body(JSON, self.codec))
+            t4 = clock()
+            m.store.observe(t4 - t3)
+            if trace:
+                stages.append(("history", t4 - t3))
+            t3 = t4
+        if self.blobs is not None and env.msg_type == BLOB:
+            # Depois do repasse: o manifesto segue pela malha enquanto os pedaços são pedidos.
+            self.blobs.on_manifest(out, env.msg_id, env.msg.get("payload"))
+        if self.on_message is not None:
+            self.on_message(env.msg)
+            t5 = clock()
+            m.on_message.observe(t5 - t3)
+            if trace:
+                stages.append(("on_message", t5 - t3))
+        if trace:
+            self.tracer.record("msg", stages)
+
+    def _on_closed(self, conn, out: Outbound):
+        with self.lock:
+            self.connections.pop(conn, None)
+        self.conns.link_down(out)
+        if self.plumtree is not None:
+            self.plumtree.remove_link(out)
+        if self.blobs is not None:
+            self.blobs.remove_link(out)
+        if self.admission is not None:
+            self.admission.remove_link(out)
+        out.close()
         try:
             conn.close()
         except Exception:
             pass
-        with self.lock:
-            if conn in self.connections:
-                self.connections.remove(conn)
+
+    def _on_hello(self, out: Outbound, env: Envelope):
+        reply, codec = negotiate(self.codec, env, self.port, self.node_id)
+        if reply is None and codec is None:
+            return
+        node, listen = hello_identity(env)
+        if node is not None and not self.conns.identify(out, node, dialable(listen, out.name)):
+            # Conexão consigo mesmo ou par já ligado por outra conexão.
+            out.close()
+            return
+        # Mesmo host: quem aceitou oferece memória compartilhada no hello_ack.
+        extra = self.transport.on_hello(out, env.msg_type, env.msg.get("payload") or {})
+        if reply is not None:
+            if extra:
+                reply = ack_body(codec, self.node_id, extra)
+            out.enqueue(make_frame(reply), CONTROL)
+        if codec is not None and codec != out.codec:
+            configure_outbound(out, codec, self.codec)
+            self.on_log(f"[CODEC] {out.name} -> {codec}")
+
+    def _close_link(self, out: Outbound):
+        out.close()
+
+    def _on_plumtree(self, out: Outbound, env: Envelope):
+        self.plumtree.on_control(out, env.msg_type, env.msg.get("payload") or {})
+
+    def _on_px(self, out: Outbound, env: Envelope):
+        self.px.on_control(out, env.msg_type, env.msg.get("payload") or {}, out.name)
+
+    def _on_sync(self, out: Outbound, env: Envelope):
+        payload = env.msg.get("payload") or {}
+        if env.msg_type == SYNC_DIGEST:
+            self.sync.on_digest(out, payload)
+        else:
+            self.sync.on_batch(out, payload.get("msgs") or [])
+
+    def _on_recovered(self, msg: dict):
+        # Recuperada na sincronização: só entrega local, sem relay.
+        if self.blobs is not None and msg.get("type") == BLOB:
+            self.blobs.on_manifest(None, msg.get("id"), msg.get("payload"))
+        if self.on_message is not None:
+            self.on_message(msg)
+
+    def _on_blob(self, out: Outbound, env: Envelope):
+        if env.msg_type == BLOB_WANT:
+            self.blobs.on_want(out, env.msg.get("payload") or {})
+        elif env.msg_type == BLOB_MISS:
+            self.blobs.on_miss(out, env.msg.get("payload") or {})
+        else:
+            self.blobs.on_chunk(out, env.raw)
+
+    def _on_blob_complete(self, manifest: dict, path: str):
+        self.on_log(f"[BLOB] {manifest['name']} ({manifest['size']} bytes) completo em {path}")
+
+    def _send_env(self, out: Outbound, env: Envelope):
+        self.metrics.forwarded.inc()
+        body = env.body(out.codec, self.codec)
+        out.enqueue(make_frame(body), lane_for(body, self.bulk_bytes))
+
+    def _send_ctrl(self, out: Outbound, msg_type: str, payload: dict):
+        out.enqueue(make_frame(encode_body({"type": msg_type, "payload": payload})), CONTROL)
 
     def send_text(self, text: str, sender_name: str):
-        msg = generate_msg("msg", sender_name, text)
+        self._originate(generate_msg("msg", sender_name, text))
+
+    def send_many(self, texts: List[str], sender_name: str) -> List[str]:
+        """
+        Origina várias mensagens numa passada: ids gerados em lote, cada
+        frame serializado uma vez por codec e um enqueue_many por vizinho
+        (um lock e um aviso à escritora). Não espera o envio; retorna os
+        ids na ordem de `texts`. Lote maior que as filas dos vizinhos entra
+        aos pedaços (ver _feed) em vez de descartar o próprio começo.
+        """
+        msgs = generate_msgs("msg", sender_name, texts)
+        seen = self.seen_msgs
+        for msg in msgs:
+            seen.add(msg["id"])
+        self.metrics.originated.inc(len(msgs))
+        if self.history is not None:
+            for msg in msgs:
+                self.history.add(msg["id"], encode_body(msg))
+        envs = [Envelope.from_msg(msg) for msg in msgs]
+        if self.plumtree is not None:
+            for env in envs:
+                self.plumtree.broadcast(env)
+        else:
+            self._feed(envs)
+        if self.on_message is not None:
+            for msg in msgs:
+                self.on_message(msg)
+        return [msg["id"] for msg in msgs]
+
+    def _feed(self, envs: List[Envelope]):
+        """
+        Enfileira originadas em pedaços de meia fila: cada pedaço só entra
+        quando cabe em todos os vizinhos; senão tenta de novo em
+        INGEST_RETRY. Um vizinho parado não segura o resto por mais de
+        INGEST_MAX_WAIT por pedaço (depois vale a policy da fila). A ordem
+        entre lotes é mantida: só um _feed_step anda por vez.
+        """
+        step = max(1, self.queue_size // 2)
+        with self._ingest_lock:
+            self._ingest.extend(envs[k:k + step] for k in range(0, len(envs), step))
+            self._ingest_pending += len(envs)
+            if self._ingest_active:
+                return
+            self._ingest_active = True
+        self._feed_step(self.transport.now())
+
+    def _feed_step(self, since: float):
+        while True:
+            with self._ingest_lock:
+                if not self._ingest or not self._running:
+                    self._ingest.clear()
+                    self._ingest_pending = 0
+                    self._ingest_active = False
+                    return
+                chunk = self._ingest[0]
+            with self.lock:
+                outs = list(self.connections.values())
+            room = self.queue_size - len(chunk)
+            now = self.transport.now()
+            if now - since < INGEST_MAX_WAIT and any(out.depth() > room for out in outs):
+                self.transport.call_later(INGEST_RETRY, self._feed_step, since)
+                return
+            with self._ingest_lock:
+                self._ingest.popleft()
+                self._ingest_pending -= len(chunk)
+            self.forward_many(chunk)
+            since = now
+
+    def send_file(self, path: str, sender_name: str, name: Optional[str] = None) -> dict:
+        """Publica um arquivo como blob: copia para o store e manda só o manifesto."""
+        if self.blobs is None:
+            raise RuntimeError("blobs desligados (sem blob_store)")
+        manifest = self.blobs.publish(path, name)
+        self._originate(generate_msg(BLOB, sender_name, manifest))
+        return manifest
+
+    def _originate(self, msg: dict):
         self.seen_msgs.add(msg["id"])
-        self.broadcast(msg)
-        self.on_message(msg)
+        self.metrics.originated.inc()
+        if self.history is not None:
+            self.history.add(msg["id"], encode_body(msg))
+        if self._ingest_active and self.plumtree is None:
+            # Lote de send_many ainda entrando: vai atrás dele, sem furar a fila.
+            self._feed([Envelope.from_msg(msg)])
+        else:
+            self.broadcast(msg)
+        if self.on_message is not None:
+            self.on_message(msg)
 
     def broadcast(self, msg, exclude=None):
+        """Serializa uma única vez por codec e repassa o mesmo frame a todos."""
+        env = Envelope.from_msg(msg)
+        if self.plumtree is not None and exclude is None:
+            self.plumtree.broadcast(env)
+        else:
+            self.forward(env, exclude=exclude)
+
+    def forward(self, env: Envelope, exclude=None):
+        """Fan-out = um append por vizinho; o lock só protege a cópia da lista."""
+        with self.lock:
+            outs = [out for conn, out in self.connections.items() if conn is not exclude]
+        self.metrics.forwarded.inc(len(outs))
+        # codec -> (frame, faixa): o mesmo par vai a todos os vizinhos daquele codec.
+        frames = {}
+        for out in outs:
+            entry = frames.get(out.codec)
+            if entry is None:
+                body = env.body(out.codec, self.codec)
+                entry = frames[out.codec] = (make_frame(body), lane_for(body, self.bulk_bytes))
+            out.enqueue(entry[0], entry[1])
+
+    def forward_many(self, envs: List[Envelope], exclude=None):
+        """forward() de uma lista: a lista de vizinhos é copiada uma vez e cada um recebe tudo num enqueue_many."""
         with self.lock:
-            for conn in list(self.connections):
-                if conn == exclude:
-                    continue
-                try:
-                    send_msg(conn, msg)
-                except Exception as e:
-                    self.on_log(f"[ERRO envio] {e}")
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
-                    self.connections.remove(conn)
+            outs = [out for conn, out in self.connections.items() if conn is not exclude]
+        self.metrics.forwarded.inc(len(outs) * len(envs))
+        # codec -> [(frame, faixa), ...] na ordem de envs
+        batches = {}
+        for out in outs:
+            batch = batches.get(out.codec)
+            if batch is None:
+                batch = batches[out.codec] = []
+                for env in envs:
+                    body = env.body(out.codec, self.codec)
+                    batch.append((make_frame(body), lane_for(body, self.bulk_bytes)))
+            out.enqueue_many(batch)
+
+    def neighbour_stats(self) -> List[dict]:
+        """Profundidade da fila e descartes por vizinho."""
+        with self.lock:
+            outs = list(self.connections.values())
+        return [out.stats() for out in outs]
+
+    def dissemination_stats(self) -> dict:
+        """Modo de disseminação e razão de duplicados recebidos / entregues."""
+        if self.plumtree is not None:
+            return self.plumtree.stats()
+        return flood_stats(self.seen_msgs)
+
+    def connection_stats(self) -> dict:
+        """Id do nó, grau e contadores do gerenciador de conexões."""
+        return self.conns.stats()
+
+    def discovery_stats(self) -> dict:
+        """Cache de peers e contadores da troca de amostras."""
+        if self.px is None:
+            return {"enabled": False}
+        return self.px.stats()
+
+    def history_stats(self) -> dict:
+        """Histórico local e contadores da sincronização na conexão."""
+        if self.sync is None:
+            return {"enabled": False}
+        return self.sync.stats()
+
+    def blob_stats(self) -> dict:
+        """Blobs conhecidos, transferências em andamento e contadores de pedaços."""
+        if self.blobs is None:
+            return {"enabled": False}
+        return self.blobs.stats()
+
+    def admission_stats(self) -> dict:
+        """Limites de taxa da admissão, descartes por motivo e os remetentes mais limitados."""
+        if self.admission is None:
+            return {"enabled": False}
+        return self.admission.stats()
 
 HTML = """<!doctype html>
 <html>
@@ -161,10 +590,13 @@ HTML = """<!doctype html>
         appendLine(data.payload, 'sys');
       } else if (data.type === 'msg') {
         appendLine(`[${data.sender}] ${data.payload}`, 'msg');
+      } else if (data.type === 'blob') {
+        const b = data.payload || {};
+        appendLine(`[${data.sender}] arquivo ${b.name} (${b.size} bytes) — /blobs/${b.blob}`, 'msg');
       }
     } catch (err) { console.error(err); }
   };
-  es.onerror = () => appendLine('[SISTEMA] conexão SSE caiu. Recarregue a página.', 'sys');
+  es.onerror = () => appendLine('[SISTEMA] conexão SSE caiu; reconectando e retomando do último evento...', 'sys');
 
   // Envio por POST
   const form = document.getElementById('form');
@@ -191,24 +623,86 @@ HTML = """<!doctype html>
 </html>
 """
 
-def create_app(core: PeerCore, ui_name: str, host: str, port: int, http_port: int):
-    app = Flask(__name__)
-    sse_clients: List[Queue] = []
-
-    def push_event(evt: dict):
-        for q in list(sse_clients):
-            try:
-                q.put_nowait(evt)
-            except Exception:
-                pass
+def attach_sse(core, hub: SSEHub):
+    """Liga os callbacks e as métricas do core ao hub SSE (não precisa do Flask)."""
     def on_message(m):
-        push_event(m)
+        hub.publish(m)
 
     def on_log(s):
-        push_event({"type": "log", "payload": s})
+        hub.publish({"type": "log", "payload": s})
 
     core.on_message = on_message
     core.on_log = on_log
+    registry = core.metrics.registry
+    registry.gauge("p2p_sse_clients", "Clientes SSE conectados", lambda: len(hub.lags()))
+    registry.gauge("p2p_sse_queue_depth", "Eventos pendentes somando os clientes SSE", lambda: sum(hub.lags()))
+    registry.gauge("p2p_sse_queue_max_depth", "Atraso do cliente SSE mais lento (eventos)",
+                   lambda: max(hub.lags(), default=0))
+    registry.collector(lambda: [
+        ("p2p_sse_events_total", "counter", "Eventos publicados no SSE", {}, hub.published),
+        ("p2p_sse_writes_total", "counter", "Escritas SSE (eventos próximos vão juntos)", {}, hub.writes),
+        ("p2p_sse_dropped_total", "counter", "Eventos pulados por clientes SSE lentos", {}, hub.dropped),
+        ("p2p_sse_disconnected_total", "counter", "Clientes SSE derrubados por atraso", {}, hub.disconnected),
+    ])
+
+
+# Linha NDJSON que não é JSON (vira um ack de erro, não derruba o lote).
+_BAD_JSON = object()
+
+
+def parse_batch(raw: bytes, ndjson: bool) -> Optional[List[Tuple[Optional[str], Optional[str]]]]:
+    """
+    Corpo do /send_batch -> [(texto, erro)] na ordem recebida, erro None
+    nos itens válidos. Array JSON (ou {"items": [...]}) ou NDJSON, um
+    item por linha; item é uma string ou {"text": ...}. None se o corpo
+    inteiro não é um lote.
+    """
+    if ndjson:
+        items = []
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(_BAD_JSON)
+    else:
+        try:
+            items = json.loads(raw)
+        except ValueError:
+            return None
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list):
+            return None
+    out = []
+    for item in items:
+        if item is _BAD_JSON:
+            out.append((None, "invalid json"))
+            continue
+        if isinstance(item, dict):
+            item = item.get("text")
+        if not isinstance(item, str):
+            out.append((None, "invalid item"))
+            continue
+        text = item.strip()
+        out.append((text, None) if text else (None, "empty"))
+    return out
+
+
+def create_app(core: PeerCore, ui_name: str, host: str, port: int, http_port: int, sse: Optional[SSEHub] = None,
+               max_batch: int = 10_000):
+    """
+    App Flask da UI. Com `sse`, o hub já deve ter sido ligado ao core por
+    attach_sse (o main faz isso e sobe o P2P antes de importar o Flask).
+    """
+    # Import adiado: o Flask sozinho é a maior parte do tempo de import do módulo.
+    from flask import Flask, Response, request, jsonify, render_template_string, send_file
+    app = Flask(__name__)
+    hub = sse
+    if hub is None:
+        hub = SSEHub()
+        attach_sse(core, hub)
     core.start()
 
     @app.route("/")
@@ -224,27 +718,160 @@ def create_app(core: PeerCore, ui_name: str, host: str, port: int, http_port: in
         core.send_text(text, ui_name)
         return jsonify({"ok": True})
 
-    @app.route("/stream")
-    def stream():
-        q = Queue()
-        sse_clients.append(q)
+    @app.route("/send_batch", methods=["POST"])
+    def send_batch():
+        # Integrações: muitos textos por requisição. Responde assim que tudo
+        # está nas filas dos vizinhos, com um ack por item na ordem do corpo.
+        ctype = request.mimetype or ""
+        items = parse_batch(request.get_data(cache=False), "ndjson" in ctype or "jsonl" in ctype)
+        if items is None:
+            return jsonify({"ok": False, "error": "expected a JSON array or NDJSON"}), 400
+        if len(items) > max_batch:
+            return jsonify({"ok": False, "error": f"batch above {max_batch} items"}), 413
+        texts = [text for text, err in items if err is None]
+        ids = iter(core.send_many(texts, ui_name) if texts else ())
+        acks = [{"ok": True, "id": next(ids)} if err is None else {"ok": False, "error": err}
+                for _, err in items]
+        return jsonify({"ok": True, "accepted": len(texts), "rejected": len(items) - len(texts), "acks": acks})
 
-        def gen():
-            hello = {"type": "log", "payload": f"[SSE] conectado — {ui_name}"}
-            yield f"data: {json.dumps(hello)}\n\n"
-            try:
-                while True:
-                    evt = q.get()
-                    yield f"data: {json.dumps(evt)}\n\n"
-            except GeneratorExit:
-                pass
-            finally:
-                try:
-                    sse_clients.remove(q)
-                except ValueError:
-                    pass
+    @app.route("/neighbours")
+    def neighbours():
+        return jsonify(core.neighbour_stats())
+
+    @app.route("/dedup")
+    def dedup_stats():
+        return jsonify(core.seen_msgs.stats())
 
-        return Response(gen(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    @app.route("/dissemination")
+    def dissemination():
+        return jsonify(core.dissemination_stats())
+
+    @app.route("/connections")
+    def connection_stats():
+        return jsonify(core.connection_stats())
+
+    @app.route("/peers")
+    def discovery_stats():
+        return jsonify(core.discovery_stats())
+
+    @app.route("/history")
+    def history_stats():
+        return jsonify(core.history_stats())
+
+    @app.route("/blobs", methods=["GET", "POST"])
+    def blobs():
+        if request.method == "GET":
+            return jsonify(core.blob_stats())
+        f = request.files.get("file")
+        if getattr(core, "blobs", None) is None or f is None:
+            return jsonify({"ok": False, "error": "no file" if f is None else "no blob store"}), 400
+        # Vai direto para o disco: o upload não fica inteiro na memória.
+        fd, tmp = tempfile.mkstemp(dir=core.blobs.store.path, suffix=".upload")
+        os.close(fd)
+        try:
+            f.save(tmp)
+            manifest = core.send_file(tmp, ui_name, name=f.filename or None)
+        finally:
+            os.unlink(tmp)
+        return jsonify({"ok": True, "blob": manifest["blob"], "size": manifest["size"],
+                        "chunks": len(manifest["hashes"])})
+
+    @app.route("/blobs/<root>")
+    def blob(root):
+        if getattr(core, "blobs", None) is None:
+            return jsonify({"ok": False, "error": "no blob store"}), 404
+        if not valid_root(root):
+            # Só ids de blob: `.part`, `.upload`, `..` e afins não chegam ao send_file.
+            return jsonify({"ok": False, "error": "bad blob id"}), 400
+        path = core.blobs.path(root)
+        if path is not None:
+            # send_file usa sendfile/wsgi.file_wrapper quando o servidor oferece.
+            return send_file(path, as_attachment=True, download_name=request.args.get("name") or root)
+        if not core.blobs.fetch(root):
+            return jsonify({"ok": False, "error": "unknown blob"}), 404
+        return jsonify({"ok": True, "status": "fetching"}), 202
+
+    @app.route("/throttle")
+    def throttle():
+        if getattr(core, "admission", None) is None:
+            return jsonify({"enabled": False})
+        return jsonify(core.admission_stats())
+
+    # ---- diagnóstico (profiling.py); a UI só escuta em 127.0.0.1 -------------
+
+    def profiling():
+        prof = getattr(core, "profiling", None)
+        if prof is None:
+            return None, (jsonify({"ok": False, "error": "no profiling in this engine"}), 404)
+        return prof, None
+
+    @app.route("/admin")
+    def admin():
+        prof, err = profiling()
+        return err or jsonify(prof.stats())
+
+    @app.route("/admin/profile/start", methods=["POST"])
+    def profile_start():
+        prof, err = profiling()
+        if err:
+            return err
+        try:
+            interval = float(request.args.get("interval", 0.01))
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid interval"}), 400
+        return jsonify(prof.start_profile(max(interval, 0.001)))
+
+    @app.route("/admin/profile/stop", methods=["POST"])
+    def profile_stop():
+        prof, err = profiling()
+        return err or jsonify(prof.stop_profile())
+
+    @app.route("/admin/stacks")
+    def stacks():
+        prof, err = profiling()
+        if err:
+            return err
+        dump = prof.dump_stacks()
+        return Response(dump["text"], mimetype="text/plain", headers={"X-Dump-Path": dump["path"]})
+
+    @app.route("/admin/lock")
+    def lock_report():
+        prof, err = profiling()
+        return err or jsonify(prof.lock_report())
+
+    @app.route("/admin/trace", methods=["GET", "POST"])
+    def trace():
+        prof, err = profiling()
+        if err:
+            return err
+        if request.method == "GET":
+            return jsonify(prof.tracer.stats())
+        try:
+            rate = float(request.args.get("rate", 0.01))
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid rate"}), 400
+        return jsonify(prof.set_trace_rate(rate))
+
+    @app.route("/admin/trace/dump", methods=["POST"])
+    def trace_dump():
+        prof, err = profiling()
+        return err or jsonify(prof.dump_trace())
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(core.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/sse")
+    def sse_stats():
+        return jsonify(hub.stats())
+
+    @app.route("/stream")
+    def stream():
+        # O EventSource reenvia o último id recebido ao reconectar.
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+        hello = {"type": "log", "payload": f"[SSE] conectado — {ui_name}"}
+        return Response(hub.stream(last_id, hello), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
     return app
 
@@ -257,6 +884,65 @@ def parse_args():
     ap.add_argument("--peer", action="append", help="host:port de peer conhecido")
     ap.add_argument("--bootstrap", help="arquivo JSON com peers (opcional)")
     ap.add_argument("--name", help="apelido exibido na UI")
+    ap.add_argument("--engine", choices=["thread", "asyncio"], default="thread",
+                    help="thread: uma thread por conexão | asyncio: event loop único")
+    ap.add_argument("--queue-size", type=int, default=1024, help="frames na fila de saída por vizinho")
+    ap.add_argument("--queue-policy", choices=POLICIES, default=DROP_OLDEST,
+                    help="o que fazer com a fila cheia")
+    ap.add_argument("--dedup", choices=DEDUP_KINDS, default="window",
+                    help="window: conjunto exato com expiração | bloom: filtros de Bloom rotativos")
+    ap.add_argument("--dedup-capacity", type=int, default=1_000_000, help="ids lembrados (por geração no bloom)")
+    ap.add_argument("--dedup-ttl", type=float, default=600.0, help="expiração em segundos (window)")
+    ap.add_argument("--max-frame", type=int, default=DEFAULT_MAX_FRAME, help="tamanho máximo de frame aceito (bytes)")
+    ap.add_argument("--codec", choices=CODECS, default="json",
+                    help="formato preferido no fio; bin1 é negociado por conexão e cai para JSON com peers antigos")
+    ap.add_argument("--compress-threshold", type=int, default=1024, help="payloads bin1 a partir deste tamanho vão com zlib (0 desliga)")
+    ap.add_argument("--dissemination", choices=["flood", "plumtree"], default="flood",
+                    help="flood: repassa a todos | plumtree: árvore eager + anúncios IHAVE (só engine thread)")
+    ap.add_argument("--graft-timeout", type=float, default=0.5, help="plumtree: espera (s) por um id anunciado antes do GRAFT")
+    ap.add_argument("--batch-bytes", type=int, default=DEFAULT_BATCH_BYTES, help="máximo de bytes por lote de envio")
+    ap.add_argument("--linger-us", type=int, default=0, help="espera (µs) por mais frames antes de enviar um lote pequeno")
+    ap.add_argument("--node-id-file", help="arquivo com o id estável do nó (padrão: logs/node_<porta>.id)")
+    ap.add_argument("--connect-timeout", type=float, default=3.0, help="timeout (s) para abrir uma conexão")
+    ap.add_argument("--target-degree", type=int, default=5,
+                    help="disca peers aprendidos até ter este número de vizinhos (0 = só os conhecidos)")
+    ap.add_argument("--max-degree", type=int, default=0, help="fecha os enlaces excedentes acima deste grau (0 = sem limite)")
+    ap.add_argument("--peer-cache", help="cache de peers aprendidos (padrão: logs/peers_<porta>.json)")
+    ap.add_argument("--px-interval", type=float, default=5.0, help="intervalo (s) da troca de peers (0 desliga)")
+    ap.add_argument("--ready-links", type=int, default=1, help="conexões abertas para considerar o nó pronto")
+    ap.add_argument("--ready-timeout", type=float, default=2.0, help="espera máxima (s) por --ready-links antes de subir a UI (0 não espera)")
+    ap.add_argument("--history", type=int, default=10000,
+                    help="mensagens recentes mantidas em memória para sincronizar vizinhos (0 desliga; só engine thread)")
+    ap.add_argument("--history-file", help="arquivo do histórico (padrão: logs/history_<porta>.bin)")
+    ap.add_argument("--history-max-mb", type=int, default=32, help="limite em disco do histórico (MB)")
+    ap.add_argument("--sync-window", type=float, default=300.0,
+                    help="ao conectar, troca e recupera mensagens dos últimos N segundos")
+    ap.add_argument("--shm", choices=["auto", "off"], default="auto",
+                    help="auto: vizinhos no mesmo host trocam frames por memória compartilhada (engine thread)")
+    ap.add_argument("--shm-ring-kb", type=int, default=1024, help="tamanho (KB) de cada anel de memória compartilhada")
+    ap.add_argument("--blob-dir", help="diretório dos blobs (padrão: logs/blobs_<porta>; só engine thread)")
+    ap.add_argument("--blob-auto-mb", type=int, default=64,
+                    help="busca sozinho blobs anunciados até este tamanho (MB); maiores só sob demanda (0 = sempre sob demanda)")
+    ap.add_argument("--blob-window", type=int, default=8, help="pedaços de blob em voo por transferência")
+    ap.add_argument("--blob-transfers", type=int, default=4, help="transferências de blob simultâneas")
+    ap.add_argument("--sender-rate", type=float, default=0.0,
+                    help="mensagens novas/s aceitas por remetente antes do relay (0 desliga; só engine thread)")
+    ap.add_argument("--sender-burst", type=float, default=0.0, help="rajada por remetente (0 = um segundo de taxa)")
+    ap.add_argument("--link-rate", type=float, default=0.0,
+                    help="mensagens novas/s aceitas por conexão de entrada (0 desliga; só engine thread)")
+    ap.add_argument("--link-burst", type=float, default=0.0, help="rajada por conexão (0 = um segundo de taxa)")
+    ap.add_argument("--lane-weights", type=parse_weights, default=DEFAULT_WEIGHTS,
+                    help="pesos das faixas de saída control,interactive,bulk (ex.: 8,4,1)")
+    ap.add_argument("--bulk-bytes", type=int, default=DEFAULT_BULK_BYTES,
+                    help="mensagens repassadas acima deste tamanho vão na faixa bulk (0 = nunca)")
+    ap.add_argument("--trace-rate", type=float, default=0.0,
+                    help="fração das mensagens recebidas com tempo por etapa (0 desliga; muda em POST /admin/trace)")
+    ap.add_argument("--profile-dir", default="logs", help="onde /admin grava perfis, pilhas e traces")
+    ap.add_argument("--max-batch", type=int, default=10_000, help="itens aceitos por requisição no /send_batch")
+    ap.add_argument("--sse-history", type=int, default=4096, help="eventos guardados para replay via Last-Event-ID")
+    ap.add_argument("--sse-buffer", type=int, default=1024, help="atraso máximo (eventos) de um cliente SSE")
+    ap.add_argument("--sse-policy", choices=SSE_POLICIES, default=DROP, help="cliente SSE lento: drop (pula eventos) | disconnect")
+    ap.add_argument("--sse-coalesce-ms", type=float, default=20.0, help="junta eventos próximos numa só escrita SSE")
     return ap.parse_args()
 
 
@@ -277,7 +963,50 @@ if __name__ == "__main__":
             print(f"[ERRO] bootstrap: {e}")
 
     ui_name = args.name or f"{args.host}:{args.port}"
-    core = PeerCore(args.host, args.port, known)
+    dedup = make_dedup(args.dedup, capacity=args.dedup_capacity, ttl=args.dedup_ttl)
+    codec = NodeCodec(args.codec, compress_threshold=args.compress_threshold)
+    history = None
+    if args.history > 0 and args.engine == "thread":
+        history = MessageStore(args.history, args.history_file or f"logs/history_{args.port}.bin",
+                               max_file_bytes=args.history_max_mb * 1024 * 1024)
+    if args.engine == "asyncio":
+        if args.dissemination != "flood":
+            print("[AVISO] engine asyncio só suporta --dissemination flood")
+        from peer_async import AsyncPeerCore
+        core = AsyncPeerCore(args.host, args.port, known,
+                             queue_size=args.queue_size, queue_policy=args.queue_policy, dedup=dedup,
+                             max_frame=args.max_frame, batch_bytes=args.batch_bytes, linger_us=args.linger_us,
+                             codec=codec, connect_timeout=args.connect_timeout, ready_links=args.ready_links)
+    else:
+        core = PeerCore(args.host, args.port, known,
+                        queue_size=args.queue_size, queue_policy=args.queue_policy, dedup=dedup,
+                        max_frame=args.max_frame, batch_bytes=args.batch_bytes, linger_us=args.linger_us,
+                        codec=codec, dissemination=args.dissemination, graft_timeout=args.graft_timeout,
+                        history=history, sync_window=args.sync_window,
+                        node_id=load_node_id(args.node_id_file or f"logs/node_{args.port}.id"),
+                        connect_timeout=args.connect_timeout,
+                        target_degree=args.target_degree, max_degree=args.max_degree,
+                        peer_cache=PeerCache(args.peer_cache or f"logs/peers_{args.port}.json") if args.px_interval > 0 else None,
+                        px_interval=args.px_interval, ready_links=args.ready_links,
+                        transport=TcpTransport(shm=args.shm == "auto", ring_bytes=args.shm_ring_kb * 1024),
+                        blob_store=BlobStore(args.blob_dir or f"logs/blobs_{args.port}"),
+                        blob_window=args.blob_window, blob_transfers=args.blob_transfers,
+                        blob_auto_bytes=args.blob_auto_mb * 1024 * 1024,
+                        sender_rate=args.sender_rate, sender_burst=args.sender_burst,
+                        link_rate=args.link_rate, link_burst=args.link_burst,
+                        lane_weights=args.lane_weights, bulk_bytes=args.bulk_bytes,
+                        trace_rate=args.trace_rate, profile_dir=args.profile_dir)
 
-    app = create_app(core, ui_name, args.host, args.port, args.http_port)
+    hub = SSEHub(history=args.sse_history, client_buffer=args.sse_buffer, policy=args.sse_policy,
+                 coalesce_ms=args.sse_coalesce_ms)
+    attach_sse(core, hub)
+    # P2P primeiro: a UI (e o import do Flask) só sobe com o nó já na malha.
+    core.start()
+    cached = getattr(core, "px", None) is not None and len(core.px.cache) > 0
+    if args.ready_timeout > 0 and (known or cached):
+        if not core.wait_ready(args.ready_timeout):
+            print(f"[AVISO] menos de {args.ready_links} conexões após {args.ready_timeout}s")
+    app = create_app(core, ui_name, args.host, args.port, args.http_port, sse=hub, max_batch=args.max_batch)
+    core.startup.mark("http")
+    print(f"[SUBIDA] {core.startup.stats()}")
     app.run(host="127.0.0.1", port=args.http_port, debug=False, threaded=True)
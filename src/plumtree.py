@@ -0,0 +1,236 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from transport import THREADS
+
+IHAVE = "ihave"
+GRAFT = "graft"
+PRUNE = "prune"
+PLUMTREE_TYPES = (IHAVE, GRAFT, PRUNE)
+
+
+class Plumtree:
+    """
+    Disseminação Plumtree (eager/lazy push, Leitão et al.).
+    O payload vai por push imediato só nos enlaces "eager", que formam uma
+    árvore geradora; os demais ("lazy") recebem apenas anúncios IHAVE com os
+    ids, agrupados a cada `ihave_interval`. Um duplicado num enlace eager
+    vira PRUNE (o enlace passa a lazy); um id anunciado que não chega em
+    `graft_timeout` gera GRAFT para quem anunciou, reparando a árvore. Se
+    nenhum payload novo chega por dois ticks depois do anúncio, o nó ficou
+    sem pai (todos os vizinhos o podaram ao mesmo tempo) e o GRAFT sai sem
+    esperar o timeout. O GRAFT para um enlace pede de uma vez tudo o que
+    ele anunciou e falta aqui.
+
+    Os enlaces são objetos opacos (os Outbound do peer); o envio é feito
+    pelos callbacks send_env(link, envelope) e send_ctrl(link, type, payload).
+    eager/lazy são dicts (ordem de inserção), não sets: a ordem de envio
+    não depende do endereço dos objetos e o simulador fica determinístico.
+    """
+    def __init__(self, send_env: Callable, send_ctrl: Callable, is_seen: Callable[[str], bool],
+                 cache_size: int = 10000, ihave_interval: float = 0.05,
+                 graft_timeout: float = 0.5, graft_retry: float = 0.25, runtime=None):
+        self.send_env = send_env
+        self.send_ctrl = send_ctrl
+        self.is_seen = is_seen
+        self.cache_size = cache_size
+        self.ihave_interval = ihave_interval
+        self.graft_timeout = graft_timeout
+        self.graft_retry = graft_retry
+        self.runtime = runtime or THREADS
+        self.eager: Dict[object, None] = {}
+        self.lazy: Dict[object, None] = {}
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._pending_ihave: Dict[object, List[str]] = {}
+        self._missing: Dict[str, List[object]] = {}
+        self._deadline: Dict[str, float] = {}
+        self._announced: Dict[str, float] = {}
+        # Ids pedidos por GRAFT -> tentativas. Chegam atrasados e os vizinhos
+        # eager quase sempre já os têm: empurrá-los viraria duplicado e PRUNE.
+        self._grafted: Dict[str, int] = {}
+        self._last_payload = self.runtime.now()
+        # RLock: um enqueue pode fechar o enlace e voltar aqui via remove_link.
+        self._lock = threading.RLock()
+        self.delivered = 0
+        self.duplicates = 0
+        self.ihave_sent = 0
+        self.ihave_ids_sent = 0
+        self.graft_sent = 0
+        self.prune_sent = 0
+        self.repaired = 0
+        self._ticker = self.runtime.every(ihave_interval, lambda: self.tick(self.runtime.now()))
+
+    def stop(self):
+        self._ticker.cancel()
+
+    def _eager(self, link):
+        self.lazy.pop(link, None)
+        self.eager[link] = None
+
+    def _lazy(self, link):
+        self.eager.pop(link, None)
+        self.lazy[link] = None
+
+    def add_link(self, link):
+        with self._lock:
+            self._eager(link)
+
+    def remove_link(self, link):
+        with self._lock:
+            self.eager.pop(link, None)
+            self.lazy.pop(link, None)
+            self._pending_ihave.pop(link, None)
+            for announcers in self._missing.values():
+                while link in announcers:
+                    announcers.remove(link)
+
+    def broadcast(self, env, origin=None):
+        """Mensagem nova (local ou recebida pela primeira vez de `origin`)."""
+        msg_id = env.msg_id
+        regraft = None
+        with self._lock:
+            self.delivered += 1
+            if origin is not None:
+                self._last_payload = self.runtime.now()
+            self._cache[msg_id] = env
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            grafted = self._grafted.pop(msg_id, None) is not None
+            if self._missing.pop(msg_id, None) is not None:
+                self._deadline.pop(msg_id, None)
+                self._announced.pop(msg_id, None)
+                self.repaired += 1
+            if origin is not None and origin not in self.eager:
+                # Quem nos entregou primeiro passa a ser aresta da árvore. O
+                # payload saiu de lá antes do nosso PRUNE chegar e o outro lado
+                # já nos marcou lazy: o GRAFT religa a aresta nos dois sentidos
+                # e pede o que ele anunciou enquanto estava podada.
+                self._eager(origin)
+                regraft = self._graft_ids(origin, self.runtime.now())
+                self.graft_sent += 1
+            eager = [link for link in self.eager if link is not origin]
+            announce = [link for link in self.lazy if link is not origin]
+            if grafted:
+                eager, announce = [], eager + announce
+            for link in announce:
+                self._pending_ihave.setdefault(link, []).append(msg_id)
+        if regraft is not None:
+            self.send_ctrl(origin, GRAFT, {"ids": regraft})
+        for link in eager:
+            self.send_env(link, env)
+
+    def on_duplicate(self, link):
+        """Payload repetido: o enlace é redundante para a árvore."""
+        with self._lock:
+            self.duplicates += 1
+            if link not in self.eager:
+                return
+            self._lazy(link)
+            self.prune_sent += 1
+        self.send_ctrl(link, PRUNE, {})
+
+    def on_control(self, link, msg_type: str, payload: dict):
+        ids = payload.get("ids") or []
+        if msg_type == PRUNE:
+            with self._lock:
+                if link in self.eager:
+                    self._lazy(link)
+        elif msg_type == IHAVE:
+            now = self.runtime.now()
+            with self._lock:
+                for msg_id in ids:
+                    if self.is_seen(msg_id):
+                        continue
+                    announcers = self._missing.setdefault(msg_id, [])
+                    self._announced.setdefault(msg_id, now)
+                    if link in self.eager:
+                        # Enlace eager só anuncia o que recebeu por GRAFT: o pai
+                        # está reparando e tem o payload, então pede já.
+                        announcers.insert(0, link)
+                        self._deadline[msg_id] = now
+                    else:
+                        announcers.append(link)
+                        self._deadline.setdefault(msg_id, now + self.graft_timeout)
+        elif msg_type == GRAFT:
+            with self._lock:
+                self._eager(link)
+                found = [self._cache[i] for i in ids if i in self._cache]
+            for env in found:
+                self.send_env(link, env)
+
+    def _graft_ids(self, link, now: float) -> List[str]:
+        """Ids que faltam e que `link` anunciou; passam a esperar o GRAFT. Chamar com o lock."""
+        ids = []
+        for msg_id, announcers in self._missing.items():
+            if link in announcers and msg_id not in self._grafted:
+                self._deadline[msg_id] = now + self.graft_retry
+                self._grafted[msg_id] = 1
+                ids.append(msg_id)
+        return ids
+
+    def tick(self, now: float):
+        """Envia os IHAVE acumulados e dispara GRAFT para ids que não chegaram a tempo."""
+        grafts: Dict[object, List[str]] = {}
+        with self._lock:
+            pending, self._pending_ihave = self._pending_ihave, {}
+            # Anúncio sem nenhum payload novo depois dele por dois ticks: sem pai.
+            quiet = now - 2 * self.ihave_interval
+            for msg_id, deadline in list(self._deadline.items()):
+                if deadline > now:
+                    announced = self._announced.get(msg_id, now)
+                    if announced > quiet or self._last_payload >= announced or msg_id in self._grafted:
+                        continue
+                announcers = self._missing.get(msg_id)
+                tries = self._grafted.pop(msg_id, 0)
+                # Cada um que anunciou tem duas chances (GRAFT ou payload perdido).
+                if self.is_seen(msg_id) or not announcers or tries >= 2 * len(announcers):
+                    self._missing.pop(msg_id, None)
+                    self._announced.pop(msg_id, None)
+                    del self._deadline[msg_id]
+                    continue
+                link = announcers.pop(0)
+                announcers.append(link)
+                self._deadline[msg_id] = now + self.graft_retry
+                self._grafted[msg_id] = tries + 1
+                grafts.setdefault(link, []).append(msg_id)
+            for link, ids in grafts.items():
+                self._eager(link)
+                ids.extend(self._graft_ids(link, now))
+            self.graft_sent += len(grafts)
+            self.ihave_sent += len(pending)
+            self.ihave_ids_sent += sum(len(ids) for ids in pending.values())
+        for link, ids in pending.items():
+            self.send_ctrl(link, IHAVE, {"ids": ids})
+        for link, ids in grafts.items():
+            self.send_ctrl(link, GRAFT, {"ids": ids})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": "plumtree",
+                "eager": len(self.eager),
+                "lazy": len(self.lazy),
+                "delivered": self.delivered,
+                "duplicates": self.duplicates,
+                "duplicate_ratio": round(self.duplicates / self.delivered, 4) if self.delivered else 0.0,
+                "ihave_sent": self.ihave_sent,
+                "ihave_ids_sent": self.ihave_ids_sent,
+                "graft_sent": self.graft_sent,
+                "prune_sent": self.prune_sent,
+                "repaired": self.repaired,
+                "missing": len(self._missing),
+                "cache": len(self._cache),
+            }
+
+
+def flood_stats(dedup) -> dict:
+    """Mesmas métricas de stats() para o modo flood, a partir do dedup."""
+    st = dedup.stats()
+    delivered = st["checks"] - st["duplicates"]
+    return {
+        "mode": "flood",
+        "delivered": delivered,
+        "duplicates": st["duplicates"],
+        "duplicate_ratio": round(st["duplicates"] / delivered, 4) if delivered else 0.0,
+    }
@@ -0,0 +1,269 @@
+import os
+import re
+import sys
+import time
+import random
+import signal
+import threading
+import traceback
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Etapas de um frame recebido, na ordem do caminho (cada engine mede as que tem).
+# recv é a contabilidade do frame na entrada do nó; a leitura do socket em si
+# fica na thread leitora e aparece no profiler. handler: frames de controle.
+STAGES = ("recv", "decode", "dedup", "broadcast", "history", "log", "on_message", "handler")
+
+# "Thread-12 (_read_loop)" -> "Thread (_read_loop)": as threads por conexão somam num nó só.
+_THREAD_NUM = re.compile(r"-\d+")
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _thread_names() -> Dict[int, str]:
+    return {t.ident: _THREAD_NUM.sub("", t.name).replace(";", ",") for t in threading.enumerate()}
+
+
+class SamplingProfiler:
+    """
+    Profiler por amostragem, em thread própria: a cada `interval` segundos
+    lê a pilha de todas as threads (sys._current_frames) e conta a pilha
+    colapsada "thread;arquivo:função;...". Não instrumenta nada, então o
+    custo é o de uma amostra por intervalo (~100 Hz no padrão) e existe
+    só enquanto está ligado. Saída no formato colapsado do flamegraph.pl
+    / speedscope: uma pilha por linha seguida do número de amostras.
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self.started = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.counts = {}
+        self.samples = 0
+        self.started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed = time.monotonic() - self.started
+
+    def _run(self):
+        me = threading.get_ident()
+        counts = self.counts
+        names = _thread_names()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(frames) != len(names) or any(i not in names for i in frames):
+                names = _thread_names()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "?"))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.counts.items()))
+
+    def top(self, n: int = 10) -> List[dict]:
+        """Funções mais vistas no topo da pilha (tempo próprio)."""
+        leaf: Dict[str, int] = {}
+        for stack, k in self.counts.items():
+            f = stack.rsplit(";", 1)[-1]
+            leaf[f] = leaf.get(f, 0) + k
+        total = sum(leaf.values()) or 1
+        best = sorted(leaf.items(), key=lambda kv: -kv[1])[:n]
+        return [{"frame": f, "samples": k, "share": round(k / total, 4)} for f, k in best]
+
+
+def dump_stacks() -> str:
+    """Pilha atual de todas as threads, como texto (uma seção por thread)."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    parts = []
+    for ident, frame in sorted(sys._current_frames().items(), key=lambda kv: names.get(kv[0], "")):
+        parts.append(f'--- thread "{names.get(ident, "?")}" ({ident})\n')
+        parts.append("".join(traceback.format_stack(frame)))
+    return "".join(parts)
+
+
+class StageTracer:
+    """
+    Tempos por etapa de uma fração `rate` das mensagens recebidas. O
+    engine sorteia no começo do frame (sample()) e, se saiu, manda as
+    durações medidas para record(); com rate 0 o caminho quente só lê um
+    atributo. Guarda as últimas `keep` amostras (para os percentis) e os
+    totais por etapa, que viram um arquivo colapsado "tipo;etapa µs".
+    """
+    def __init__(self, rate: float = 0.0, keep: int = 10000, rng=None):
+        self.rate = rate
+        self.rng = rng or random.Random()
+        self.traces = deque(maxlen=keep)
+        self.totals: Dict[Tuple[str, str], float] = {}
+        self.sampled = 0
+
+    def sample(self) -> bool:
+        return self.rng.random() < self.rate
+
+    def record(self, kind: str, stages: List[Tuple[str, float]]):
+        """kind: msg (nova) | dup (descartada no dedup) | ctrl; stages: [(etapa, segundos)]."""
+        self.sampled += 1
+        self.traces.append((kind, stages))
+        totals = self.totals
+        for stage, dt in stages:
+            key = (kind, stage)
+            totals[key] = totals.get(key, 0.0) + dt
+
+    def reset(self):
+        self.traces.clear()
+        self.totals = {}
+        self.sampled = 0
+
+    def stats(self) -> dict:
+        per: Dict[str, List[float]] = {}
+        for kind, stages in list(self.traces):
+            if kind != "msg":
+                continue
+            for stage, dt in stages:
+                per.setdefault(stage, []).append(dt)
+        out = {}
+        for stage in sorted(per, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            vals = sorted(per[stage])
+            out[stage] = {
+                "count": len(vals),
+                "p50_us": round(vals[len(vals) // 2] * 1e6, 2),
+                "p99_us": round(vals[min(len(vals) - 1, int(len(vals) * 0.99))] * 1e6, 2),
+                "max_us": round(vals[-1] * 1e6, 2),
+            }
+        return {"rate": self.rate, "sampled": self.sampled, "kept": len(self.traces), "stages": out}
+
+    def collapsed(self, root: str) -> str:
+        return "".join(f"{root};{kind};{stage} {max(1, round(t * 1e6))}\n"
+                       for (kind, stage), t in sorted(self.totals.items()))
+
+
+class NodeProfiler:
+    """
+    Superfície de diagnóstico de um nó vivo, usada pelas rotas /admin do
+    peer_web.py e pelos sinais do peer.py: profiler por amostragem,
+    despejo das pilhas, disputa do lock do nó (TimedLock.stats) e tempos
+    por etapa amostrados. Os arquivos vão para `out_dir` com o nome
+    <tipo>_<tag>_<data>.<ext>.
+    """
+    def __init__(self, lock, tracer: StageTracer, out_dir: str = "logs", tag: str = "node"):
+        self.lock = lock
+        self.tracer = tracer
+        self.out_dir = out_dir
+        self.tag = tag
+        self.profiler: Optional[SamplingProfiler] = None
+        self._mutex = threading.Lock()
+
+    def _path(self, kind: str, ext: str) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+        return os.path.join(self.out_dir, f"{kind}_{self.tag}_{stamp}.{ext}")
+
+    def _write(self, kind: str, ext: str, text: str) -> str:
+        path = self._path(kind, ext)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def start_profile(self, interval: float = 0.01) -> dict:
+        with self._mutex:
+            if self.profiler is not None:
+                return {"running": True, "interval": self.profiler.interval}
+            self.profiler = SamplingProfiler(interval)
+            self.profiler.start()
+            return {"running": True, "interval": interval}
+
+    def stop_profile(self) -> dict:
+        """Para o profiler e grava o arquivo colapsado (profile_<tag>_<data>.folded)."""
+        with self._mutex:
+            prof, self.profiler = self.profiler, None
+        if prof is None:
+            return {"running": False}
+        prof.stop()
+        return {"running": False, "path": self._write("profile", "folded", prof.collapsed()),
+                "samples": prof.samples, "seconds": round(prof.elapsed, 3), "top": prof.top()}
+
+    def toggle_profile(self) -> dict:
+        return self.stop_profile() if self.profiler is not None else self.start_profile()
+
+    def dump_stacks(self) -> dict:
+        text = dump_stacks()
+        return {"path": self._write("stacks", "txt", text), "threads": text.count('--- thread "'), "text": text}
+
+    def lock_report(self) -> dict:
+        return self.lock.stats()
+
+    def set_trace_rate(self, rate: float) -> dict:
+        self.tracer.rate = min(max(rate, 0.0), 1.0)
+        return self.tracer.stats()
+
+    def dump_trace(self) -> dict:
+        """Grava os totais por etapa (trace_<tag>_<data>.folded) e devolve os percentis."""
+        st = self.tracer.stats()
+        st["path"] = self._write("trace", "folded", self.tracer.collapsed(f"node_{self.tag}"))
+        return st
+
+    def stats(self) -> dict:
+        prof = self.profiler
+        return {
+            "profiling": prof is not None,
+            "profile_samples": prof.samples if prof is not None else 0,
+            "trace": self.tracer.stats(),
+            "lock": self.lock.stats(),
+            "out_dir": self.out_dir,
+        }
+
+
+def install_signal_handlers(prof: NodeProfiler, on_log: Callable[[str], None]) -> bool:
+    """
+    SIGUSR1 liga/desliga o profiler (ao desligar grava o .folded);
+    SIGUSR2 grava as pilhas de todas as threads, o relatório do lock e os
+    tempos por etapa. Só na thread principal e em sistemas com esses sinais.
+    """
+    if not hasattr(signal, "SIGUSR1") or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def on_usr1(signum, frame):
+        # Fora do handler: parar o profiler faz join e escreve em disco.
+        threading.Thread(target=lambda: on_log(f"[PROFILE] {prof.toggle_profile()}"), daemon=True).start()
+
+    def on_usr2(signum, frame):
+        def run():
+            stacks = prof.dump_stacks()
+            trace = prof.dump_trace()
+            on_log(f"[STACKS] {stacks['threads']} threads -> {stacks['path']}")
+            on_log(f"[LOCK] {prof.lock_report()}")
+            on_log(f"[TRACE] {trace}")
+        threading.Thread(target=run, daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_usr1)
+    signal.signal(signal.SIGUSR2, on_usr2)
+    return True
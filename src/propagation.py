@@ -0,0 +1,589 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import heapq
+import shutil
+import struct
+import hashlib
+import argparse
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dedup import msg_key
+from log_query import log_files, open_log, parse_time
+
+# Registro intermediário (fase 1 -> fase 2), um por evento de mensagem:
+#   ts, chave do id (16), chave de quem mandou (16; zeros = desconhecido), peer, tipo
+_REC = struct.Struct("!d16s16sHB")
+SEND, RECV, DUP, RECOVERED = range(4)
+_NO_KEY = b"\0" * 16
+_READ_BLOCK = _REC.size * 32768
+_SPILL_BYTES = 256 * 1024
+
+# Linhas send/recv/dup como o Peer escreve: id e "from" vêm antes do payload,
+# então a regex não precisa passar por ele. O resto cai no json.loads.
+_EVENT_RE = re.compile(
+    rb'\{"ts": ([-0-9.eE+]+), "peer": "(?:[^"\\]|\\.)*", "kind": "(send|recv|dup)", '
+    rb'"data": \{"id": "([^"\\]{1,64})"(?:, "from": "([^"\\]{1,96})")?(, "sync": true)?')
+_KINDS = {b"send": SEND, b"recv": RECV, b"dup": DUP}
+
+# Histograma de latência: baldes de 5% (erro relativo máximo ~2.5%), memória fixa.
+_BUCKET = math.log(1.05)
+
+
+def peer_key(label: str) -> bytes:
+    """Chave de 16 bytes de um nó: o id (hex) direto, outros rótulos (ip:porta) resumidos."""
+    return msg_key(label)
+
+
+def discover(paths: List[str]) -> List[str]:
+    """Logs ativos dos peers: arquivos dados e, em diretórios, todos os peer_*.jsonl (mesmo só rotacionados)."""
+    out = []
+    for path in paths:
+        if not os.path.isdir(path):
+            out.append(path)
+            continue
+        bases = set()
+        for name in os.listdir(path):
+            i = name.find(".jsonl")
+            if name.startswith("peer_") and i > 0:
+                bases.add(name[:i + 6])
+        out.extend(os.path.join(path, b) for b in sorted(bases))
+    return out
+
+
+# ---- fase 1: cada arquivo vira registros binários, separados por partição ----
+
+def split_file(path: str, peer: int, parts: int, spill_dir: str, only: Optional[bytes] = None,
+               since: Optional[float] = None, until: Optional[float] = None) -> dict:
+    """
+    Lê um arquivo de log (jsonl ou jsonl.gz) em streaming e grava um run
+    por partição (hash do id), na ordem do arquivo, que já é a do tempo.
+    """
+    lo = float("-inf") if since is None else since
+    hi = float("inf") if until is None else until
+    stem = os.path.join(spill_dir, f"{peer}-{hashlib.blake2b(path.encode(), digest_size=6).hexdigest()}")
+    bufs: List[List[bytes]] = [[] for _ in range(parts)]
+    sizes = [0] * parts
+    files: Dict[int, object] = {}
+    info = {"path": path, "peer": peer, "lines": 0, "events": 0, "bad": 0, "shed": 0,
+            "first_ts": None, "last_ts": None, "names": [], "node": None}
+    names = set()
+    keys: Dict[bytes, bytes] = {}
+
+    def flush(p: int):
+        f = files.get(p)
+        if f is None:
+            f = files[p] = open(f"{stem}.p{p}", "wb")
+        f.write(b"".join(bufs[p]))
+        bufs[p] = []
+        sizes[p] = 0
+
+    match = _EVENT_RE.match
+    pack = _REC.pack
+    with open_log(path) as f:
+        for line in f:
+            info["lines"] += 1
+            m = match(line)
+            if m is not None:
+                ts = float(m.group(1))
+                kind = _KINDS[m.group(2)]
+                msg_id = m.group(3)
+                frm = m.group(4)
+                if m.group(5):
+                    kind = RECOVERED
+            else:
+                try:
+                    evt = json.loads(line)
+                    ts = float(evt.get("ts") or 0.0)
+                    data = evt.get("data") or {}
+                except (ValueError, TypeError, AttributeError):
+                    info["bad"] += 1
+                    continue
+                k = evt.get("kind")
+                if k == "info" and isinstance(data, dict) and data.get("node"):
+                    info["node"] = data["node"]
+                if k == "shed" and isinstance(data, dict):
+                    info["shed"] += int(data.get("count") or 0)
+                if isinstance(evt.get("peer"), str):
+                    names.add(evt["peer"])
+                if k not in ("send", "recv", "dup") or not isinstance(data, dict) or not data.get("id"):
+                    _extend(info, ts)
+                    continue
+                kind = RECOVERED if data.get("sync") else _KINDS[k.encode()]
+                msg_id = str(data["id"]).encode()
+                frm = str(data["from"]).encode() if data.get("from") else None
+            _extend(info, ts)
+            if ts < lo or ts > hi:
+                continue
+            key = msg_key(msg_id.decode("utf-8", "replace"))
+            if only is not None and key != only:
+                continue
+            if frm:
+                fkey = keys.get(frm)
+                if fkey is None:
+                    fkey = keys[frm] = peer_key(frm.decode("utf-8", "replace"))
+            else:
+                fkey = _NO_KEY
+            p = key[0] % parts
+            rec = pack(ts, key, fkey, peer, kind)
+            bufs[p].append(rec)
+            sizes[p] += len(rec)
+            info["events"] += 1
+            if sizes[p] >= _SPILL_BYTES:
+                flush(p)
+    for p in range(parts):
+        if bufs[p]:
+            flush(p)
+    for fh in files.values():
+        fh.close()
+    info["names"] = sorted(names)
+    info["runs"] = {p: f"{stem}.p{p}" for p in files}
+    return info
+
+
+def _extend(info: dict, ts: float):
+    if info["first_ts"] is None or ts < info["first_ts"]:
+        info["first_ts"] = ts
+    if info["last_ts"] is None or ts > info["last_ts"]:
+        info["last_ts"] = ts
+
+
+# ---- fase 2: merge por tempo dos runs de uma partição e árvore por mensagem ----
+
+def read_run(path: str) -> Iterator[Tuple]:
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(_READ_BLOCK)
+            if not block:
+                return
+            yield from _REC.iter_unpack(block)
+
+
+class Hist:
+    """Histograma logarítmico (segundos); junta entre processos somando os baldes."""
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.n = 0
+        self.max = 0.0
+
+    def add(self, s: float):
+        # Relógios de hosts diferentes podem dar hop negativo: vai para o balde do zero.
+        b = int(math.floor(math.log(s * 1e6) / _BUCKET)) if s > 1e-6 else -1
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+        self.n += 1
+        if s > self.max:
+            self.max = s
+
+    def merge(self, d: dict):
+        for b, c in d["buckets"].items():
+            b = int(b)
+            self.buckets[b] = self.buckets.get(b, 0) + c
+            self.n += c
+        self.max = max(self.max, d.get("max", 0.0))
+
+    def percentile(self, p: float) -> float:
+        if not self.n:
+            return 0.0
+        rank = p / 100 * self.n
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return 0.0 if b < 0 else math.exp((b + 0.5) * _BUCKET) / 1e6
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {"buckets": self.buckets, "max": self.max}
+
+    def summary_ms(self) -> dict:
+        return {"n": self.n, "p50": round(self.percentile(50) * 1000, 3), "p90": round(self.percentile(90) * 1000, 3),
+                "p99": round(self.percentile(99) * 1000, 3), "max": round(self.max * 1000, 3)}
+
+
+class _Msg:
+    __slots__ = ("key", "first", "origin", "sent", "arrivals", "dups", "recovered")
+
+    def __init__(self, key: bytes, ts: float):
+        self.key = key
+        self.first = ts
+        self.origin = -1
+        self.sent = ts
+        # peer -> (ts da primeira chegada, peer de quem veio; -1 desconhecido)
+        self.arrivals: Dict[int, Tuple[float, int]] = {}
+        self.dups: List[Tuple[int, int]] = []
+        self.recovered: List[int] = []
+
+
+class _Analysis:
+    """Agregados de uma partição: tudo limitado por peers, enlaces e `top`."""
+    def __init__(self, n_peers: int, coverage: List[Tuple[float, float]], top: int, detail: bool):
+        self.n_peers = n_peers
+        self.coverage = coverage
+        self.top = top
+        self.detail = detail
+        self.messages = 0
+        self.no_origin = 0
+        self.deliveries = 0
+        self.duplicates = 0
+        self.recovered = 0
+        self.full = 0
+        self.with_missed = 0
+        self.orphans = 0
+        self.hop = Hist()
+        self.by_depth: Dict[int, Hist] = {}
+        self.total = Hist()
+        self.depths: Dict[int, int] = {}
+        self.missed: Dict[int, int] = {}
+        # (de, para) -> [arestas da árvore, duplicados]
+        self.links: Dict[Tuple[int, int], List[int]] = {}
+        self.slowest: List[Tuple[float, str, list]] = []
+        self.trees: List[dict] = []
+
+    def finish(self, m: _Msg):
+        self.messages += 1
+        at = {p: ts for p, (ts, _) in m.arrivals.items()}
+        if m.origin >= 0:
+            at[m.origin] = m.sent
+        else:
+            self.no_origin += 1
+        depth: Dict[int, int] = {m.origin: 0} if m.origin >= 0 else {}
+
+        def depth_of(p: int) -> int:
+            # Iterativo: caminhos longos numa cadeia não estouram a pilha.
+            start = p
+            chain = []
+            while p not in depth:
+                parent = m.arrivals[p][1]
+                if parent not in at or parent in chain or parent == p:
+                    # Pai fora dos logs (ou ciclo por relógio torto): conta como primeiro salto.
+                    depth[p] = 1
+                    break
+                chain.append(p)
+                p = parent
+            d = depth[p]
+            for q in reversed(chain):
+                d += 1
+                depth[q] = d
+            return depth[start]
+
+        for p, (ts, parent) in m.arrivals.items():
+            self.deliveries += 1
+            link = self.links.setdefault((parent, p), [0, 0])
+            link[0] += 1
+            if parent < 0 or parent not in at:
+                self.orphans += 1
+                continue
+            hop = ts - at[parent]
+            d = depth_of(p)
+            self.hop.add(hop)
+            h = self.by_depth.get(d)
+            if h is None:
+                h = self.by_depth[d] = Hist()
+            h.add(hop)
+        for frm, to in m.dups:
+            self.duplicates += 1
+            self.links.setdefault((frm, to), [0, 0])[1] += 1
+        self.recovered += len(m.recovered)
+        max_depth = max((depth_of(p) for p in m.arrivals), default=0)
+        self.depths[max_depth] = self.depths.get(max_depth, 0) + 1
+
+        got = set(m.arrivals) | set(m.recovered)
+        if m.origin >= 0:
+            got.add(m.origin)
+        missed = [p for p in range(self.n_peers)
+                  if p not in got and self.coverage[p][0] <= m.first <= self.coverage[p][1]]
+        for p in missed:
+            self.missed[p] = self.missed.get(p, 0) + 1
+        if missed:
+            self.with_missed += 1
+        elif m.origin >= 0:
+            self.full += 1
+
+        if m.origin >= 0 and m.arrivals:
+            leaf, (ts, _) = max(m.arrivals.items(), key=lambda kv: kv[1][0])
+            total = ts - m.sent
+            self.total.add(total)
+            if len(self.slowest) < self.top or total > self.slowest[0][0]:
+                path = []
+                p = leaf
+                while p >= 0 and p in at and len(path) <= self.n_peers:
+                    path.append([p, round((at[p] - m.sent) * 1000, 3)])
+                    p = m.arrivals[p][1] if p in m.arrivals else -1
+                entry = (total, m.key.hex(), path[::-1])
+                if len(self.slowest) < self.top:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heapreplace(self.slowest, entry)
+        if self.detail:
+            self.trees.append({
+                "id": m.key.hex(), "origin": m.origin, "sent": m.sent,
+                "arrivals": {p: [ts, parent, depth.get(p)] for p, (ts, parent) in m.arrivals.items()},
+                "duplicates": m.dups, "recovered": m.recovered, "missed": missed,
+            })
+
+    def as_dict(self) -> dict:
+        return {
+            "messages": self.messages, "no_origin": self.no_origin, "deliveries": self.deliveries,
+            "duplicates": self.duplicates, "recovered": self.recovered, "full": self.full,
+            "with_missed": self.with_missed, "orphans": self.orphans,
+            "hop": self.hop.as_dict(), "by_depth": {d: h.as_dict() for d, h in self.by_depth.items()},
+            "total": self.total.as_dict(), "depths": self.depths, "missed": self.missed,
+            "links": [[a, b, t, d] for (a, b), (t, d) in self.links.items()],
+            "slowest": self.slowest, "trees": self.trees,
+        }
+
+
+def analyze_partition(runs: List[str], nodes: Dict[bytes, int], coverage: List[Tuple[float, float]],
+                      horizon: float, top: int, detail: bool = False) -> dict:
+    """
+    k-way merge por ts dos runs (um por arquivo de cada peer). Uma mensagem
+    fica aberta até o merge passar `horizon` s do primeiro evento dela;
+    a memória é a das mensagens em voo nessa janela.
+    """
+    ana = _Analysis(len(coverage), coverage, top, detail)
+    open_msgs: "OrderedDict[bytes, _Msg]" = OrderedDict()
+    peak = 0
+    for ts, key, fkey, peer, kind in heapq.merge(*(read_run(p) for p in runs)):
+        while open_msgs:
+            first = next(iter(open_msgs.values()))
+            if ts - first.first <= horizon:
+                break
+            ana.finish(open_msgs.popitem(last=False)[1])
+        m = open_msgs.get(key)
+        if m is None:
+            m = open_msgs[key] = _Msg(key, ts)
+            if len(open_msgs) > peak:
+                peak = len(open_msgs)
+        frm = nodes.get(fkey, -1) if fkey != _NO_KEY else -1
+        if kind == SEND:
+            m.origin = peer
+            m.sent = ts
+        elif kind == RECV:
+            if peer not in m.arrivals:
+                m.arrivals[peer] = (ts, frm)
+            else:
+                m.dups.append((frm, peer))
+        elif kind == DUP:
+            m.dups.append((frm, peer))
+        else:
+            m.recovered.append(peer)
+    for m in open_msgs.values():
+        ana.finish(m)
+    out = ana.as_dict()
+    out["open_peak"] = peak
+    return out
+
+
+# ---- orquestração ------------------------------------------------------
+
+def analyze(logs: List[str], workers: int = 0, parts: int = 0, horizon: float = 30.0, top: int = 10,
+            msg_id: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+            spill_dir: Optional[str] = None) -> dict:
+    """Relatório de propagação a partir dos logs ativos dos peers (cada um com seus rotacionados)."""
+    t0 = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    parts = 1 if msg_id else (parts or workers)
+    only = msg_key(msg_id) if msg_id else None
+    tmp = tempfile.mkdtemp(prefix="p2p_trace_", dir=spill_dir)
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        jobs = []
+        for peer, log in enumerate(logs):
+            for path in log_files(log):
+                jobs.append((path, peer, parts, tmp, only, since, until))
+        # Maiores primeiro: o último arquivo grande não fica sozinho no fim.
+        jobs.sort(key=lambda j: -_size(j[0]))
+        if pool is not None:
+            infos = list(pool.map(split_file, *zip(*jobs))) if jobs else []
+        else:
+            infos = [split_file(*j) for j in jobs]
+        t1 = time.perf_counter()
+
+        peers = _peers(logs, infos)
+        # "from" dos recv/dup é o id do nó de origem do frame (ver Peer._on_frame).
+        nodes = {peer_key(p["node"]): i for i, p in enumerate(peers) if p["node"]}
+        coverage = [(p["first_ts"] if p["first_ts"] is not None else float("inf"),
+                     p["last_ts"] if p["last_ts"] is not None else float("-inf")) for p in peers]
+        runs: Dict[int, List[str]] = {}
+        for info in infos:
+            for p, path in info["runs"].items():
+                runs.setdefault(p, []).append(path)
+        args = [(runs[p], nodes, coverage, horizon, top, bool(msg_id)) for p in sorted(runs)]
+        if pool is not None and len(args) > 1:
+            results = list(pool.map(analyze_partition, *zip(*args)))
+        else:
+            results = [analyze_partition(*a) for a in args]
+        t2 = time.perf_counter()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = _report(peers, results, top)
+    if msg_id:
+        report["trees"] = [_tree(t, peers) for r in results for t in r["trees"]]
+    report["run"] = {
+        "files": len(infos), "bytes": sum(_size(j[0]) for j in jobs), "events": sum(i["events"] for i in infos),
+        "workers": workers, "partitions": parts, "horizon_s": horizon,
+        "open_messages_peak": max((r["open_peak"] for r in results), default=0),
+        "split_s": round(t1 - t0, 3), "analyze_s": round(t2 - t1, 3),
+    }
+    return report
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _peers(logs: List[str], infos: List[dict]) -> List[dict]:
+    peers = []
+    for i, log in enumerate(logs):
+        mine = [x for x in infos if x["peer"] == i]
+        names = sorted({n for x in mine for n in x["names"]})
+        node = next((x["node"] for x in mine if x["node"]), None)
+        firsts = [x["first_ts"] for x in mine if x["first_ts"] is not None]
+        lasts = [x["last_ts"] for x in mine if x["last_ts"] is not None]
+        peers.append({
+            "log": log, "name": names[0] if names else os.path.basename(log), "node": node,
+            "files": len(mine), "events": sum(x["events"] for x in mine), "bad_lines": sum(x["bad"] for x in mine),
+            "shed": sum(x["shed"] for x in mine),
+            "first_ts": min(firsts) if firsts else None, "last_ts": max(lasts) if lasts else None,
+        })
+    return peers
+
+
+def _report(peers: List[dict], results: List[dict], top: int) -> dict:
+    def name(i: int) -> str:
+        return peers[i]["name"] if i >= 0 else "?"
+
+    tot = {k: sum(r[k] for r in results) for k in ("messages", "no_origin", "deliveries", "duplicates", "recovered",
+                                                   "full", "with_missed", "orphans")}
+    hop, total = Hist(), Hist()
+    by_depth: Dict[int, Hist] = {}
+    depths: Dict[int, int] = {}
+    missed: Dict[int, int] = {}
+    links: Dict[Tuple[int, int], List[int]] = {}
+    slowest = []
+    for r in results:
+        hop.merge(r["hop"])
+        total.merge(r["total"])
+        for d, h in r["by_depth"].items():
+            by_depth.setdefault(int(d), Hist()).merge(h)
+        for d, c in r["depths"].items():
+            depths[int(d)] = depths.get(int(d), 0) + c
+        for p, c in r["missed"].items():
+            missed[int(p)] = missed.get(int(p), 0) + c
+        for a, b, t, d in r["links"]:
+            link = links.setdefault((a, b), [0, 0])
+            link[0] += t
+            link[1] += d
+        slowest.extend(r["slowest"])
+    slowest.sort(key=lambda e: (-e[0], e[1]))
+    frames = tot["deliveries"] + tot["duplicates"]
+    link_rows = [{"from": name(a), "to": name(b), "tree": t, "duplicates": d,
+                  "amplification": round((t + d) / t, 3) if t else None}
+                 for (a, b), (t, d) in links.items()]
+    link_rows.sort(key=lambda r: (-r["duplicates"], -r["tree"], r["from"], r["to"]))
+    return {
+        "peers": [{k: p[k] for k in ("name", "node", "log", "files", "events", "bad_lines", "shed", "first_ts",
+                                     "last_ts")} for p in peers],
+        "messages": tot["messages"],
+        "messages_without_origin": tot["no_origin"],
+        "fully_covered": tot["full"],
+        "with_missed_nodes": tot["with_missed"],
+        "deliveries": tot["deliveries"],
+        "recovered_by_sync": tot["recovered"],
+        "duplicates": tot["duplicates"],
+        "amplification": round(frames / tot["deliveries"], 3) if tot["deliveries"] else 0.0,
+        "orphan_arrivals": tot["orphans"],
+        "hop_latency_ms": {**hop.summary_ms(), "by_depth": {d: by_depth[d].summary_ms() for d in sorted(by_depth)}},
+        "propagation_ms": total.summary_ms(),
+        "tree_depth": {str(d): depths[d] for d in sorted(depths)},
+        "slowest_paths": [{"id": key, "total_ms": round(t * 1000, 3),
+                           "path": [{"peer": name(p), "at_ms": ms} for p, ms in path]}
+                          for t, key, path in slowest[:top]],
+        "missed_by_peer": {name(p): c for p, c in sorted(missed.items(), key=lambda kv: -kv[1])},
+        "links": link_rows[:top] if top else link_rows,
+    }
+
+
+def _tree(t: dict, peers: List[dict]) -> dict:
+    """Árvore de uma mensagem (--id), aninhada a partir da origem."""
+    def name(i: int) -> str:
+        return peers[i]["name"] if i >= 0 else "?"
+
+    arrivals = {int(p): v for p, v in t["arrivals"].items()}
+    children: Dict[int, List[int]] = {}
+    roots = []
+    for p, (_, parent, _) in arrivals.items():
+        if parent in arrivals or parent == t["origin"]:
+            children.setdefault(parent, []).append(p)
+        else:
+            roots.append(p)
+
+    def node(p: int, seen: set) -> dict:
+        seen.add(p)
+        ts = arrivals[p][0] if p in arrivals else t["sent"]
+        kids = sorted(children.get(p, []), key=lambda c: arrivals[c][0])
+        out = {"peer": name(p), "at_ms": round((ts - t["sent"]) * 1000, 3)}
+        if p in arrivals and arrivals[p][1] >= 0 and (arrivals[p][1] in arrivals or arrivals[p][1] == t["origin"]):
+            parent = arrivals[p][1]
+            pts = arrivals[parent][0] if parent in arrivals else t["sent"]
+            out["hop_ms"] = round((ts - pts) * 1000, 3)
+        out["children"] = [node(c, seen) for c in kids if c not in seen]
+        return out
+
+    seen: set = set()
+    tree = node(t["origin"], seen) if t["origin"] >= 0 else None
+    return {
+        "id": t["id"],
+        "origin": name(t["origin"]),
+        "tree": tree,
+        # Chegadas cujo pai não está nos logs (peer não analisado ou evento descartado).
+        "detached": [node(p, seen) for p in roots if p not in seen],
+        "duplicates": [{"from": name(a), "to": name(b)} for a, b in t["duplicates"]],
+        "recovered_by_sync": [name(p) for p in t["recovered"]],
+        "missed": [name(p) for p in t["missed"]],
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        description="Propagação das mensagens entre peers a partir dos logs JSONL de todos (ativos + rotacionados), saída JSON.")
+    ap.add_argument("logs", nargs="+", help="logs ativos dos peers (ex.: logs/peer_6000.jsonl) ou diretórios com peer_*.jsonl")
+    ap.add_argument("--id", help="mostra a árvore completa desta mensagem")
+    ap.add_argument("--since", type=parse_time, help="início (epoch ou ISO 8601)")
+    ap.add_argument("--until", type=parse_time, help="fim (epoch ou ISO 8601)")
+    ap.add_argument("--workers", type=int, default=0, help="processos (padrão: um por núcleo)")
+    ap.add_argument("--partitions", type=int, default=0, help="partições por id na segunda fase (padrão: --workers)")
+    ap.add_argument("--horizon", type=float, default=30.0,
+                    help="segundos após o primeiro evento de uma mensagem até fechá-la (limita a memória; "
+                         "recuperações pela sincronização depois disso contam como mensagem sem origem)")
+    ap.add_argument("--top", type=int, default=10, help="caminhos mais lentos e enlaces listados")
+    ap.add_argument("--spill-dir", help="onde gravar os arquivos intermediários (padrão: diretório temporário)")
+    ap.add_argument("--out", help="grava o JSON neste arquivo além de imprimir")
+    args = ap.parse_args(argv)
+
+    logs = discover(args.logs)
+    if not logs:
+        ap.error("nenhum log encontrado")
+    report = analyze(logs, workers=args.workers, parts=args.partitions, horizon=args.horizon, top=args.top,
+                     msg_id=args.id, since=args.since, until=args.until, spill_dir=args.spill_dir)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from transport import THREADS
+
+# Motivos de descarte na admissão (rótulo `reason` de p2p_throttled_total).
+SENDER = "sender"
+LINK = "link"
+REASONS = (SENDER, LINK)
+
+
+class TokenBucket:
+    """
+    Balde de fichas: enche a `rate` fichas/s até `burst`; cada mensagem
+    admitida consome uma. Sem lock próprio (ver Admission).
+    """
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def ready(self, now: float) -> bool:
+        """Repõe as fichas do tempo decorrido e diz se há uma para consumir."""
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.stamp = now
+        return self.tokens >= 1.0
+
+
+class Admission:
+    """
+    Controle de admissão das mensagens novas recebidas, antes do relay:
+    um balde por remetente (`sender` do envelope) e um por conexão de
+    entrada. Mensagem sem ficha em algum dos dois é descartada neste nó
+    (não é repassada nem entregue) e contada pelo motivo. O nó consulta a
+    admissão antes de marcar a mensagem no dedup: descartada por enlace
+    ela não fica como vista, e a cópia que chegar por outro enlace dentro
+    da taxa segue normalmente; descartada por remetente ela fica no dedup,
+    para as cópias seguintes não consumirem a cota do mesmo remetente.
+    Só consome ficha quando os dois baldes aceitam, então um descarte por
+    enlace não gasta a cota do remetente e vice-versa.
+
+    Taxa 0 desliga aquele balde; burst 0 vale um segundo de taxa. Os
+    remetentes ficam num LRU de até `max_senders` (um remetente esquecido
+    volta com o balde cheio); os enlaces saem em remove_link().
+    """
+    def __init__(self, sender_rate: float = 0.0, sender_burst: float = 0.0,
+                 link_rate: float = 0.0, link_burst: float = 0.0,
+                 max_senders: int = 100_000, metrics=None, runtime=None):
+        self.sender_rate = sender_rate
+        self.sender_burst = max(sender_burst or sender_rate, 1.0)
+        self.link_rate = link_rate
+        self.link_burst = max(link_burst or link_rate, 1.0)
+        self.max_senders = max_senders
+        self.runtime = runtime or THREADS
+        self._senders: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._links: Dict[object, TokenBucket] = {}
+        # Descartes por remetente / enlace, para o top em stats() (LRU, mesmo limite).
+        self._by_sender: "OrderedDict[str, int]" = OrderedDict()
+        self._by_link: Dict[object, int] = {}
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.throttled = {r: 0 for r in REASONS}
+        if metrics is not None:
+            r = metrics.registry
+            r.gauge("p2p_admission_senders", "Remetentes com balde de fichas ativo", lambda: len(self._senders))
+            r.collector(self._samples)
+
+    @property
+    def enabled(self) -> bool:
+        return self.sender_rate > 0 or self.link_rate > 0
+
+    def _samples(self):
+        yield "p2p_admitted_total", "counter", "Mensagens novas aceitas pela admissão", {}, self.admitted
+        for reason in REASONS:
+            yield ("p2p_throttled_total", "counter", "Mensagens novas descartadas por limite de taxa",
+                   {"reason": reason}, self.throttled[reason])
+
+    def admit(self, link, sender: str) -> Optional[str]:
+        """None se a mensagem segue; senão o motivo do descarte (sender | link)."""
+        now = self.runtime.now()
+        with self._lock:
+            lb = sb = None
+            if self.link_rate > 0:
+                lb = self._links.get(link)
+                if lb is None:
+                    lb = self._links[link] = TokenBucket(self.link_rate, self.link_burst, now)
+            if self.sender_rate > 0:
+                sb = self._senders.get(sender)
+                if sb is None:
+                    sb = self._senders[sender] = TokenBucket(self.sender_rate, self.sender_burst, now)
+                    if len(self._senders) > self.max_senders:
+                        self._senders.popitem(last=False)
+                else:
+                    self._senders.move_to_end(sender)
+            if lb is not None and not lb.ready(now):
+                reason = LINK
+                self._by_link[link] = self._by_link.get(link, 0) + 1
+            elif sb is not None and not sb.ready(now):
+                reason = SENDER
+                by = self._by_sender
+                by[sender] = by.get(sender, 0) + 1
+                by.move_to_end(sender)
+                if len(by) > self.max_senders:
+                    by.popitem(last=False)
+            else:
+                if lb is not None:
+                    lb.tokens -= 1.0
+                if sb is not None:
+                    sb.tokens -= 1.0
+                self.admitted += 1
+                return None
+            self.throttled[reason] += 1
+            return reason
+
+    def remove_link(self, link):
+        with self._lock:
+            self._links.pop(link, None)
+            self._by_link.pop(link, None)
+
+    def stats(self, top: int = 10) -> dict:
+        with self._lock:
+            senders = heapq.nlargest(top, self._by_sender.items(), key=lambda kv: kv[1])
+            links = heapq.nlargest(top, self._by_link.items(), key=lambda kv: kv[1])
+            tracked = len(self._senders)
+        return {
+            "sender_rate": self.sender_rate,
+            "sender_burst": self.sender_burst,
+            "link_rate": self.link_rate,
+            "link_burst": self.link_burst,
+            "admitted": self.admitted,
+            "throttled": dict(self.throttled),
+            "senders_tracked": tracked,
+            "top_senders": [{"sender": s, "throttled": n} for s, n in senders],
+            "top_links": [{"peer": getattr(link, "name", "?"), "throttled": n} for link, n in links],
+        }
@@ -0,0 +1,472 @@
+import os
+import sys
+import time
+import json
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from typing import List, Optional, Tuple
+
+from common import FrameReader, DEFAULT_MAX_FRAME
+from outbound import make_frame, parse_weights, DROP_OLDEST, POLICIES, DEFAULT_BATCH_BYTES, DEFAULT_WEIGHTS, DEFAULT_BULK_BYTES
+from transport import TcpTransport, TcpListener
+from dedup import SharedDedup
+from codec import NodeCodec, JSON, CODECS, BinDecoder, Envelope, decode_frame
+from connmgr import load_node_id
+from discovery import PeerCache
+from peer_web import PeerCore
+import shmring
+
+# Como as conexões chegam aos workers:
+#   reuseport: cada worker tem o seu socket na mesma porta (SO_REUSEPORT) e o kernel distribui
+#   pass-fds:  o processo pai aceita e passa o descritor a um worker (round-robin, SCM_RIGHTS)
+REUSEPORT = "reuseport"
+PASS_FDS = "pass-fds"
+ACCEPT_MODES = (REUSEPORT, PASS_FDS)
+
+
+class WorkerTransport(TcpTransport):
+    """
+    TcpTransport de um worker do relay: o listen devolve as conexões que
+    cabem a este processo. Em reuseport faz o bind com SO_REUSEPORT na
+    porta compartilhada; em pass-fds ignora host/porta e recebe os
+    descritores aceitos pelo pai pelo socket unix `fd_chan`.
+    """
+    def __init__(self, mode: str = REUSEPORT, fd_chan: Optional[socket.socket] = None, **kw):
+        super().__init__(**kw)
+        self.mode = mode
+        self.fd_chan = fd_chan
+
+    def listen(self, host: str, port: int, on_accept) -> TcpListener:
+        if self.mode == PASS_FDS:
+            self.spawn(self._recv_loop, self.fd_chan, on_accept)
+            return TcpListener(self.fd_chan)
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        srv.bind((host, port))
+        srv.listen()
+        self.spawn(self._accept_loop, srv, on_accept)
+        return TcpListener(srv)
+
+    @staticmethod
+    def _recv_loop(chan: socket.socket, on_accept):
+        while True:
+            try:
+                _, fds, _, _ = socket.recv_fds(chan, 64, 16)
+            except OSError:
+                break
+            if not fds:
+                break  # pai fechou o canal
+            for fd in fds:
+                conn = socket.socket(fileno=fd)
+                try:
+                    addr = conn.getpeername()
+                except OSError:
+                    conn.close()
+                    continue
+                on_accept(conn, addr)
+
+
+class WorkerRings:
+    """
+    Malha de anéis SPSC (shmring.ShmRing) entre os workers do relay: um
+    anel por par ordenado (i -> j), criados pelo pai antes dos workers.
+    publish() copia um frame para todos os anéis de saída; uma thread por
+    anel de entrada chama on_frame(data) na ordem de chegada (data só vale
+    durante a chamada, como no FrameReader).
+
+    Anel cheio bloqueia quem publica: o repasse entre workers tem a mesma
+    contrapressão de um enlace no mesmo host. O socket `lifeline` (ligado
+    ao pai) faz o papel do socket TCP do ShmLink: EOF nele solta leitores
+    e escritores presos quando o relay está parando.
+    """
+    def __init__(self, index: int, names: List[List[Optional[str]]], fifo_dir: str,
+                 lifeline: socket.socket, max_frame: int = DEFAULT_MAX_FRAME):
+        self.index = index
+        self.max_frame = max_frame
+        n = len(names)
+        self.tx = [shmring.ShmRing.attach(names[index][j], ring_fifo(fifo_dir, index, j), lifeline)
+                   for j in range(n) if j != index]
+        self.rx = [shmring.ShmRing.attach(names[j][index], ring_fifo(fifo_dir, j, index), lifeline)
+                   for j in range(n) if j != index]
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+
+    def start(self, on_frame, runtime):
+        for ring in self.rx:
+            runtime.spawn(self._read_loop, ring, on_frame)
+
+    def _read_loop(self, ring: shmring.ShmRing, on_frame):
+        reader = FrameReader(ring, max_frame=self.max_frame)
+        while True:
+            try:
+                data = reader.read_frame()
+            except (OSError, ValueError):
+                break
+            if data is None:
+                break
+            self.received += 1
+            on_frame(data)
+
+    def publish(self, body: bytes):
+        hdr, _ = make_frame(body)
+        for ring in self.tx:
+            try:
+                ring.write([hdr, body])
+            except (OSError, ValueError):
+                self.errors += 1
+        self.published += 1
+
+    def stats(self) -> dict:
+        return {"published": self.published, "received": self.received, "errors": self.errors,
+                "waits": sum(r.waits for r in self.tx), "kicks": sum(r.kicks for r in self.tx)}
+
+    def close(self):
+        for ring in self.tx + self.rx:
+            ring.close()
+
+
+def ring_fifo(fifo_dir: str, src: int, dst: int) -> str:
+    return os.path.join(fifo_dir, f"w{src}-{dst}")
+
+
+class RelayWorker(PeerCore):
+    """
+    Um worker do relay multi-core: PeerCore normal (flood) com as suas
+    próprias conexões, dedup compartilhado com os outros workers e os
+    anéis da malha para o fan-out entre eles.
+
+    Quem aceita o id no dedup compartilhado repassa aos seus vizinhos e
+    publica o corpo nos anéis; os outros workers repassam aos deles sem
+    consultar o dedup de novo. Assim cada mensagem sai uma vez por vizinho
+    do nó, qualquer que seja o worker que a recebeu primeiro.
+    """
+    def __init__(self, host: str, port: int, rings: WorkerRings, **kw):
+        super().__init__(host, port, **kw)
+        self.rings = rings
+        self.worker = rings.index
+        self._ring_decoder = BinDecoder()
+        self.metrics.registry.collector(self._ring_samples)
+
+    def _ring_samples(self):
+        yield "p2p_relay_ring_published_total", "counter", "Mensagens publicadas aos outros workers", {}, self.rings.published
+        yield "p2p_relay_ring_received_total", "counter", "Mensagens recebidas de outros workers", {}, self.rings.received
+
+    def start(self):
+        self.rings.start(self._on_ring, self.transport)
+        super().start()
+
+    def stop(self):
+        super().stop()
+        self.rings.close()
+
+    def forward(self, env: Envelope, exclude=None):
+        super().forward(env, exclude=exclude)
+        # JSON nos anéis: o BinDecoder de cada worker não conhece o estado do enlace de origem.
+        self.rings.publish(env.body(JSON, self.codec))
+
+    def forward_many(self, envs: List[Envelope], exclude=None):
+        super().forward_many(envs, exclude=exclude)
+        for env in envs:
+            self.rings.publish(env.body(JSON, self.codec))
+
+    def _on_ring(self, data):
+        env = decode_frame(data, self._ring_decoder)
+        if env is None:
+            return
+        PeerCore.forward(self, env)
+
+    def relay_stats(self) -> dict:
+        m = self.metrics
+        return {
+            "worker": self.worker,
+            "pid": os.getpid(),
+            "neighbours": len(self.connections),
+            "received": m.received.value,
+            "duplicates": m.duplicates.value,
+            "forwarded": m.forwarded.value,
+            "rings": self.rings.stats(),
+        }
+
+
+def worker_main(index: int, opts: dict, dedup_handle, names, fifo_dir: str,
+                lifeline: socket.socket, fd_chan: Optional[socket.socket], report):
+    # Quem para o relay é o pai (fechando o lifeline), não o Ctrl+C do terminal.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    n = opts["workers"]
+    rings = WorkerRings(index, names, fifo_dir, lifeline, max_frame=opts["max_frame"])
+    px = opts["px_interval"] > 0
+    core = RelayWorker(opts["host"], opts["port"], rings,
+                       known_peers=[tuple(p) for p in opts["known"][index::n]],
+                       queue_size=opts["queue_size"], queue_policy=opts["queue_policy"],
+                       dedup=SharedDedup.attach(dedup_handle), max_frame=opts["max_frame"],
+                       batch_bytes=opts["batch_bytes"], linger_us=opts["linger_us"],
+                       codec=NodeCodec(opts["codec"], compress_threshold=opts["compress_threshold"]),
+                       node_id=opts["node_id"], connect_timeout=opts["connect_timeout"],
+                       target_degree=-(-opts["target_degree"] // n), max_degree=-(-opts["max_degree"] // n),
+                       peer_cache=PeerCache(f"{opts['peer_cache']}_w{index}.json") if px else None,
+                       px_interval=opts["px_interval"],
+                       transport=WorkerTransport(opts["accept"], fd_chan, shm=opts["shm"],
+                                                 ring_bytes=opts["shm_ring_kb"] * 1024),
+                       history=None,
+                       sender_rate=opts["sender_rate"], sender_burst=opts["sender_burst"],
+                       link_rate=opts["link_rate"], link_burst=opts["link_burst"],
+                       lane_weights=opts["lane_weights"], bulk_bytes=opts["bulk_bytes"])
+    lock = threading.Lock()
+
+    def send(msg):
+        with lock:
+            report.send(msg)
+
+    core.start()
+    send(("ready", index))
+    ticker = core.transport.every(opts["stats_interval"], lambda: send(("stats", index, core.relay_stats())))
+    try:
+        # Bloqueia até o pai fechar a outra ponta.
+        while lifeline.recv(1):
+            pass
+    except OSError:
+        pass
+    ticker.cancel()
+    send(("stats", index, core.relay_stats()))
+    core.stop()
+
+
+class RelayCluster:
+    """
+    Processo pai do relay multi-core: cria o dedup compartilhado e a malha
+    de anéis, sobe `workers` processos (spawn) com RelayWorker e, em
+    pass-fds, aceita as conexões e as distribui. Junta as estatísticas
+    que os workers mandam pelo pipe de cada um. Um worker que morre
+    derruba o relay inteiro (as conexões dele não teriam para onde ir).
+    """
+    def __init__(self, opts: dict, on_log=print):
+        self.opts = opts
+        self.on_log = on_log
+        self.n = opts["workers"]
+        self.ctx = mp.get_context("spawn")
+        self.dedup: Optional[SharedDedup] = None
+        self.procs: List[mp.Process] = []
+        self.lifelines: List[socket.socket] = []
+        self.fd_chans: List[socket.socket] = []
+        self.reports = []
+        self.stats = {}
+        self._srv: Optional[socket.socket] = None
+        self._rings: List[shmring.ShmRing] = []
+        self._fifo_dir = None
+        self._stop = threading.Event()
+
+    def start(self, timeout: float = 30.0):
+        opts, n = self.opts, self.n
+        self.dedup = SharedDedup.create(opts["dedup_capacity"], ctx=self.ctx)
+        self._fifo_dir = tempfile.mkdtemp(prefix="p2p-relay-")
+        names: List[List[Optional[str]]] = [[None] * n for _ in range(n)]
+        for i in range(n):
+            for j in range(n):
+                if i != j:
+                    ring = shmring.ShmRing.create(opts["ring_kb"] * 1024, ring_fifo(self._fifo_dir, i, j), None)
+                    self._rings.append(ring)
+                    names[i][j] = ring.name
+        if opts["accept"] == PASS_FDS:
+            # Bind antes dos workers: porta ocupada falha aqui.
+            self._srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._srv.bind((opts["host"], opts["port"]))
+            self._srv.listen(1024)
+        for i in range(n):
+            mine, theirs = socket.socketpair()
+            chan = None
+            if opts["accept"] == PASS_FDS:
+                chan, worker_chan = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self.fd_chans.append(chan)
+            else:
+                worker_chan = None
+            recv, send = self.ctx.Pipe(duplex=False)
+            p = self.ctx.Process(target=worker_main, name=f"relay-w{i}", daemon=True,
+                                 args=(i, opts, self.dedup.handle(), names, self._fifo_dir,
+                                       theirs, worker_chan, send))
+            p.start()
+            # As pontas dos workers já foram duplicadas para o filho.
+            theirs.close()
+            if worker_chan is not None:
+                worker_chan.close()
+            send.close()
+            self.procs.append(p)
+            self.lifelines.append(mine)
+            self.reports.append(recv)
+        ready = set()
+        deadline = time.monotonic() + timeout
+        while len(ready) < n:
+            left = deadline - time.monotonic()
+            if left <= 0 or not all(p.is_alive() for p in self.procs):
+                self.stop()
+                raise RuntimeError(f"workers prontos: {len(ready)}/{n}")
+            for r in wait(self.reports, timeout=min(left, 0.5)):
+                msg = r.recv()
+                if msg[0] == "ready":
+                    ready.add(msg[1])
+        # Todos anexaram: os nomes (segmentos e FIFOs) já não são necessários.
+        for ring in self._rings:
+            ring.close()
+        self._rings = []
+        os.rmdir(self._fifo_dir)
+        if self._srv is not None:
+            threading.Thread(target=self._accept_loop, daemon=True).start()
+        self.on_log(f"[RELAY] {n} workers em {opts['host']}:{opts['port']} ({opts['accept']})")
+
+    def _accept_loop(self):
+        i = 0
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._srv.accept()
+            except OSError:
+                break
+            try:
+                socket.send_fds(self.fd_chans[i % self.n], [b"c"], [conn.fileno()])
+            except OSError as e:
+                self.on_log(f"[ERRO] repasse da conexão ao worker {i % self.n}: {e}")
+            conn.close()
+            i += 1
+
+    def poll(self, timeout: float) -> bool:
+        """Lê as estatísticas pendentes; False se algum worker morreu."""
+        for r in wait(self.reports, timeout=timeout):
+            try:
+                msg = r.recv()
+            except EOFError:
+                return False
+            if msg[0] == "stats":
+                self.stats[msg[1]] = msg[2]
+        return all(p.is_alive() for p in self.procs)
+
+    def totals(self) -> dict:
+        st = list(self.stats.values())
+        return {
+            "workers": self.n,
+            "neighbours": sum(s["neighbours"] for s in st),
+            "received": sum(s["received"] for s in st),
+            "duplicates": sum(s["duplicates"] for s in st),
+            "forwarded": sum(s["forwarded"] for s in st),
+            "ring_messages": sum(s["rings"]["received"] for s in st),
+            "dedup": self.dedup.stats() if self.dedup is not None else {},
+            "per_worker": sorted(st, key=lambda s: s["worker"]),
+        }
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._srv is not None:
+            TcpListener(self._srv).close()
+        for s in self.fd_chans + self.lifelines:
+            try:
+                s.close()
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        for r in self.reports:
+            # Últimas estatísticas que os workers mandam ao parar.
+            while r.poll(max(0.0, deadline - time.monotonic())):
+                try:
+                    msg = r.recv()
+                except EOFError:
+                    break
+                if msg[0] == "stats":
+                    self.stats[msg[1]] = msg[2]
+        for p in self.procs:
+            p.join(max(0.1, deadline - time.monotonic()))
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        for ring in self._rings:
+            ring.close()
+        if self._fifo_dir is not None and os.path.isdir(self._fifo_dir):
+            os.rmdir(self._fifo_dir)
+        if self.dedup is not None:
+            totals = self.totals()
+            self.dedup.close()
+            self.dedup = None
+            return totals
+        return self.totals()
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Relay P2P multi-core: vários processos na mesma porta, "
+                                             "dedup em memória compartilhada e fan-out entre eles por anéis.")
+    ap.add_argument("--host", default="127.0.0.1", help="host P2P")
+    ap.add_argument("--port", type=int, required=True, help="porta P2P (compartilhada pelos workers)")
+    ap.add_argument("--peer", action="append", help="host:port de peer conhecido (divididos entre os workers)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processos do relay (padrão: um por CPU)")
+    ap.add_argument("--accept", choices=ACCEPT_MODES, default=REUSEPORT,
+                    help="reuseport: o kernel distribui as conexões | pass-fds: o pai aceita e repassa")
+    ap.add_argument("--dedup-capacity", type=int, default=1_000_000, help="ids lembrados pelo dedup compartilhado")
+    ap.add_argument("--ring-kb", type=int, default=4096, help="tamanho (KB) de cada anel entre workers")
+    ap.add_argument("--queue-size", type=int, default=1024, help="frames na fila de saída por vizinho")
+    ap.add_argument("--queue-policy", choices=POLICIES, default=DROP_OLDEST, help="o que fazer com a fila cheia")
+    ap.add_argument("--max-frame", type=int, default=DEFAULT_MAX_FRAME, help="tamanho máximo de frame aceito (bytes)")
+    ap.add_argument("--codec", choices=CODECS, default="json", help="formato preferido no fio (bin1 negociado por conexão)")
+    ap.add_argument("--compress-threshold", type=int, default=1024, help="payloads bin1 a partir deste tamanho vão com zlib (0 desliga)")
+    ap.add_argument("--batch-bytes", type=int, default=DEFAULT_BATCH_BYTES, help="máximo de bytes por lote de envio")
+    ap.add_argument("--linger-us", type=int, default=0, help="espera (µs) por mais frames antes de enviar um lote pequeno")
+    ap.add_argument("--node-id-file", help="arquivo com o id estável do nó (padrão: logs/node_<porta>.id)")
+    ap.add_argument("--connect-timeout", type=float, default=3.0, help="timeout (s) para abrir uma conexão")
+    ap.add_argument("--target-degree", type=int, default=5, help="grau alvo do nó, dividido entre os workers (0 = só os conhecidos)")
+    ap.add_argument("--max-degree", type=int, default=0, help="grau máximo do nó, dividido entre os workers (0 = sem limite)")
+    ap.add_argument("--peer-cache", help="prefixo dos caches de peers (padrão: logs/peers_<porta>; um arquivo por worker)")
+    ap.add_argument("--px-interval", type=float, default=5.0, help="intervalo (s) da troca de peers (0 desliga)")
+    ap.add_argument("--shm", choices=["auto", "off"], default="auto", help="vizinhos no mesmo host por memória compartilhada")
+    ap.add_argument("--shm-ring-kb", type=int, default=1024, help="tamanho (KB) de cada anel com vizinhos no mesmo host")
+    ap.add_argument("--sender-rate", type=float, default=0.0, help="mensagens novas/s por remetente, por worker (0 desliga)")
+    ap.add_argument("--sender-burst", type=float, default=0.0, help="rajada por remetente (0 = um segundo de taxa)")
+    ap.add_argument("--link-rate", type=float, default=0.0, help="mensagens novas/s por conexão de entrada (0 desliga)")
+    ap.add_argument("--link-burst", type=float, default=0.0, help="rajada por conexão (0 = um segundo de taxa)")
+    ap.add_argument("--lane-weights", type=parse_weights, default=DEFAULT_WEIGHTS,
+                    help="pesos das faixas de saída control,interactive,bulk (ex.: 8,4,1)")
+    ap.add_argument("--bulk-bytes", type=int, default=DEFAULT_BULK_BYTES,
+                    help="mensagens repassadas acima deste tamanho vão na faixa bulk (0 = nunca)")
+    ap.add_argument("--stats-interval", type=float, default=10.0, help="intervalo (s) das estatísticas agregadas")
+    return ap.parse_args()
+
+
+def relay_opts(args) -> dict:
+    known: List[Tuple[str, int]] = []
+    for p in args.peer or []:
+        h, pr = p.split(":")
+        known.append((h, int(pr)))
+    opts = {k: getattr(args, k) for k in ("host", "port", "workers", "accept", "dedup_capacity", "ring_kb",
+                                          "queue_size", "queue_policy", "max_frame", "codec", "compress_threshold",
+                                          "batch_bytes", "linger_us", "connect_timeout", "target_degree",
+                                          "max_degree", "px_interval", "shm_ring_kb", "sender_rate", "sender_burst",
+                                          "link_rate", "link_burst", "lane_weights", "bulk_bytes", "stats_interval")}
+    opts["known"] = known
+    opts["shm"] = args.shm == "auto"
+    # Um nó só para a malha: todos os workers usam o mesmo id.
+    opts["node_id"] = load_node_id(args.node_id_file or f"logs/node_{args.port}.id")
+    opts["peer_cache"] = args.peer_cache or f"logs/peers_{args.port}"
+    return opts
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.workers < 1:
+        sys.exit("--workers precisa ser >= 1")
+    if args.accept == REUSEPORT and not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("SO_REUSEPORT indisponível neste sistema; use --accept pass-fds")
+    cluster = RelayCluster(relay_opts(args))
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    cluster.start()
+    last = time.monotonic()
+    while not stop.is_set():
+        if not cluster.poll(0.5):
+            print("[ERRO] um worker terminou; parando o relay")
+            break
+        if time.monotonic() - last >= args.stats_interval:
+            last = time.monotonic()
+            print(f"[RELAY] {json.dumps({k: v for k, v in cluster.totals().items() if k != 'per_worker'})}")
+    print(f"[RELAY] {json.dumps(cluster.stop())}")
@@ -0,0 +1,388 @@
+import os
+import re
+import mmap
+import stat
+import shutil
+import select
+import socket
+import secrets
+import tempfile
+import threading
+from typing import List, Optional
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # sem _posixshmem (ex.: alguns builds mínimos)
+    shared_memory = None
+
+from common import encode_body
+
+# Último frame de cada lado pelo TCP antes de passar a escrever no anel.
+SHM_SWITCH = encode_body({"type": "shm_switch"})
+
+HEADER = 64
+_HEAD, _TAIL, _SLEEPING, _WAITING = 0, 1, 2, 3
+DEFAULT_RING_BYTES = 1 << 20
+# Aviso perdido (o consumidor dorme no mesmo instante em que o produtor
+# publica) custa no máximo isto de latência.
+_WAIT_TIMEOUT = 0.01
+
+# Nomes dos segmentos e dos diretórios dos FIFOs de um enlace. A oferta
+# chega pela rede: quem anexa só aceita nomes neste formato (ver _check_offer).
+PREFIX = "p2p_shm_"
+_SEGMENT_NAME = re.compile(PREFIX + r"[0-9a-f]{16}\Z")
+_FIFO_NAMES = ("a2d", "d2a")
+
+def host_id() -> Optional[str]:
+    """
+    Identifica a máquina para decidir se um vizinho está no mesmo host:
+    boot_id do kernel + hostname (containers costumam ter /dev/shm e
+    hostname próprios). None onde não há memória compartilhada POSIX.
+    """
+    if shared_memory is None or not hasattr(os, "mkfifo"):
+        return None
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r", encoding="ascii") as f:
+            boot = f.read().strip()
+    except OSError:
+        return None
+    return f"{boot}/{socket.gethostname()}"
+
+
+class _Mapping:
+    """
+    Segmento anexado direto do /dev/shm, sem passar pelo resource_tracker
+    (o que SharedMemory faz antes do 3.13). O_NOFOLLOW e o dono conferido:
+    um link simbólico no lugar do segmento não vira escrita em outro arquivo.
+    """
+    def __init__(self, name: str):
+        fd = os.open(os.path.join("/dev/shm", name.lstrip("/")), os.O_RDWR | os.O_NOFOLLOW)
+        try:
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid():
+                raise ValueError(f"segmento inválido: {name}")
+            self.size = st.st_size
+            self._mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+
+def attach_segment(name: str):
+    if os.path.isdir("/dev/shm"):
+        # Antes do 3.13 anexar pelo SharedMemory registra o segmento no
+        # resource_tracker, que é compartilhado com processos filhos
+        # (spawn/forkserver) e apagaria o segmento de quem o criou.
+        return _Mapping(name)
+    return shared_memory.SharedMemory(name=name, track=False)
+
+
+class ShmRing:
+    """
+    Anel de bytes SPSC (um produtor, um consumidor) num segmento de
+    memória compartilhada, com a mesma sequência de bytes do TCP (frames
+    com cabeçalho de 4 bytes). Cabeçalho do segmento: total escrito,
+    total lido, "consumidor dormindo" e "produtor esperando espaço", cada
+    um uma palavra de 8 bytes alinhada, escrita por um lado só; os dados
+    vêm depois.
+
+    Sem lock entre processos: o produtor copia os bytes e só então publica
+    o total escrito. Quem precisa esperar (consumidor com o anel vazio,
+    produtor com ele cheio) marca a sua palavra, confere de novo e dorme
+    no seu FIFO (pipe nomeado); o outro lado só escreve no FIFO quando vê
+    a marca, então um fluxo contínuo não faz syscall nenhuma. Um aviso
+    que sobrar só causa uma volta a mais.
+    O socket TCP do enlace continua aberto só para detectar que o outro
+    lado caiu (EOF acorda os dois lados).
+    """
+    def __init__(self, shm, fifo_path: str, sock: socket.socket, owner: bool):
+        self.shm = shm
+        self.name = shm.name
+        self.fifo_path = fifo_path
+        self.sock = sock
+        self.owner = owner
+        self.capacity = shm.size - HEADER
+        self._hdr = shm.buf[:HEADER].cast("Q")
+        self._data = shm.buf[HEADER:HEADER + self.capacity]
+        # O_RDWR: abrir um FIFO assim nunca bloqueia nem falha por falta do outro lado.
+        # _fifo acorda o consumidor (chegaram dados); _space, o produtor (liberou espaço).
+        self._fifo = os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK | os.O_NOFOLLOW)
+        try:
+            self._space = os.open(fifo_path + ".space", os.O_RDWR | os.O_NONBLOCK | os.O_NOFOLLOW)
+        except OSError:
+            os.close(self._fifo)
+            raise
+        self._lock = threading.Lock()
+        self._closing = False
+        self._eof = False
+        self.closed = False
+        self.kicks = 0
+        self.waits = 0
+
+    @classmethod
+    def create(cls, size: int, fifo_path: str, sock: socket.socket) -> "ShmRing":
+        os.mkfifo(fifo_path, 0o600)
+        os.mkfifo(fifo_path + ".space", 0o600)
+        shm = shared_memory.SharedMemory(name=PREFIX + secrets.token_hex(8), create=True, size=HEADER + size)
+        shm.buf[:HEADER] = bytes(HEADER)
+        return cls(shm, fifo_path, sock, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, fifo_path: str, sock: socket.socket) -> "ShmRing":
+        return cls(attach_segment(name), fifo_path, sock, owner=False)
+
+    # ---- produtor ------------------------------------------------------
+
+    def write(self, bufs: List) -> int:
+        """Copia os buffers para o anel, esperando espaço se preciso. Retorna syscalls feitas."""
+        # Um join em C custa menos que uma volta do laço Python por iovec.
+        chunk = bufs[0] if len(bufs) == 1 else b"".join(bufs)
+        n = len(chunk)
+        with self._lock:
+            if self.closed:
+                raise BrokenPipeError("anel fechado")
+            hdr, data, cap = self._hdr, self._data, self.capacity
+            head = hdr[_HEAD]
+            calls = 0
+            if n <= cap - (head - hdr[_TAIL]) and head % cap + n <= cap:
+                # Caminho comum: cabe inteiro e sem dar a volta.
+                pos = head % cap
+                data[pos:pos + n] = chunk
+                head += n
+            else:
+                mv = memoryview(chunk)
+                off = 0
+                while off < n:
+                    free = cap - (head - hdr[_TAIL])
+                    if not free:
+                        hdr[_HEAD] = head
+                        if hdr[_SLEEPING]:
+                            calls += self._kick()
+                        calls += self._wait_space(head)
+                        continue
+                    k = min(free, n - off)
+                    pos = head % cap
+                    first = min(k, cap - pos)
+                    data[pos:pos + first] = mv[off:off + first]
+                    if k > first:
+                        data[:k - first] = mv[off + first:off + k]
+                    head += k
+                    off += k
+            hdr[_HEAD] = head
+            if hdr[_SLEEPING]:
+                calls += self._kick()
+            return calls
+
+    def _kick(self, fifo: Optional[int] = None) -> int:
+        try:
+            os.write(self._fifo if fifo is None else fifo, b"\0")
+        except BlockingIOError:
+            pass  # FIFO cheio: o consumidor já tem aviso pendente
+        self.kicks += 1
+        return 1
+
+    def _wait_space(self, head: int) -> int:
+        """Anel cheio: dorme no FIFO até o consumidor liberar espaço (ou o enlace cair)."""
+        self.waits += 1
+        hdr = self._hdr
+        hdr[_WAITING] = 1
+        try:
+            while self.capacity - (head - hdr[_TAIL]) == 0:
+                if self._closing:
+                    raise BrokenPipeError("anel fechado")
+                r, _, _ = select.select([self._space, self.sock], [], [], _WAIT_TIMEOUT)
+                if self._space in r:
+                    self._drain(self._space)
+                if self.sock in r and _sock_closed(self.sock):
+                    raise BrokenPipeError("vizinho desconectou")
+        finally:
+            hdr[_WAITING] = 0
+        return 1
+
+    @staticmethod
+    def _drain(fifo: int):
+        try:
+            os.read(fifo, 4096)
+        except BlockingIOError:
+            pass
+
+    # ---- consumidor ------------------------------------------------------
+
+    def recv_into(self, view) -> int:
+        """Mesma semântica do socket.recv_into: bloqueia até haver bytes; 0 quando o enlace fechou."""
+        hdr, data, cap = self._hdr, self._data, self.capacity
+        while True:
+            tail = hdr[_TAIL]
+            avail = hdr[_HEAD] - tail
+            if avail:
+                break
+            if self._eof or self.closed:
+                return 0
+            hdr[_SLEEPING] = 1
+            if hdr[_HEAD] != tail:
+                hdr[_SLEEPING] = 0
+                continue
+            r, _, _ = select.select([self._fifo, self.sock], [], [], _WAIT_TIMEOUT)
+            hdr[_SLEEPING] = 0
+            if self._fifo in r:
+                self._drain(self._fifo)
+            if self.sock in r and _sock_closed(self.sock):
+                # Ainda entrega o que ficou no anel antes do EOF.
+                self._eof = True
+        n = len(view)
+        if avail < n:
+            n = avail
+        pos = tail % cap
+        if pos + n <= cap:
+            view[:n] = data[pos:pos + n]
+        else:
+            first = cap - pos
+            view[:first] = data[pos:]
+            view[first:n] = data[:n - first]
+        hdr[_TAIL] = tail + n
+        if hdr[_WAITING]:
+            self._kick(self._space)
+        return n
+
+    # ---- ciclo de vida ---------------------------------------------------
+
+    def unlink(self):
+        """Apaga os nomes (segmento e FIFO); quem já abriu continua usando."""
+        if not self.owner:
+            return
+        self.owner = False
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        for path in (self.fifo_path, self.fifo_path + ".space"):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def __del__(self):
+        # Sem isto o SharedMemory reclama (BufferError) das views ainda abertas.
+        if not getattr(self, "closed", True):
+            self.close()
+
+    def close(self):
+        self._closing = True
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.unlink()
+            self._hdr.release()
+            self._data.release()
+            self.shm.close()
+            os.close(self._fifo)
+            os.close(self._space)
+
+
+def _check_fifo(path: str):
+    """
+    FIFO de uma oferta: tem de estar num diretório p2p_shm_* nosso e
+    fechado para os outros (o mkdtemp de quem aceitou, com o mesmo uid),
+    e ser de fato um FIFO. Qualquer outra coisa levanta ValueError.
+    """
+    if not isinstance(path, str) or not os.path.isabs(path) or os.path.normpath(path) != path:
+        raise ValueError(f"FIFO inválido: {path!r}")
+    tmpdir, base = os.path.split(path)
+    if base not in _FIFO_NAMES or not os.path.basename(tmpdir).startswith(PREFIX):
+        raise ValueError(f"FIFO inválido: {path!r}")
+    st = os.lstat(tmpdir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise ValueError(f"diretório do FIFO inválido: {tmpdir!r}")
+    for p in (path, path + ".space"):
+        st = os.lstat(p)
+        if not stat.S_ISFIFO(st.st_mode) or st.st_uid != os.getuid():
+            raise ValueError(f"FIFO inválido: {p!r}")
+
+
+def _check_offer(offer: dict):
+    """Valida a oferta do hello_ack; devolve (anéis, FIFOs). A oferta vem de um vizinho: não confiar."""
+    rings, fifos = offer.get("rings"), offer.get("fifos")
+    if not isinstance(rings, list) or not isinstance(fifos, list) or len(rings) != 2 or len(fifos) != 2:
+        raise ValueError("oferta shm malformada")
+    for name in rings:
+        if not isinstance(name, str) or not _SEGMENT_NAME.match(name):
+            raise ValueError(f"segmento inválido: {name!r}")
+    for path in fifos:
+        _check_fifo(path)
+    return rings, fifos
+
+
+def _sock_closed(sock: socket.socket) -> bool:
+    """True se o socket tem EOF/erro pendente (o outro lado fechou ou nós demos shutdown)."""
+    try:
+        r, _, _ = select.select([sock], [], [], 0)
+        if not r:
+            return False
+        return not sock.recv(1, socket.MSG_PEEK)
+    except (OSError, ValueError):
+        return True
+
+
+class ShmLink:
+    """
+    Os dois anéis de um enlace local (tx: nós escrevemos; rx: nós lemos).
+    Quem aceitou a conexão cria e oferece no hello_ack; quem discou anexa,
+    manda SHM_SWITCH pelo TCP e passa a escrever no anel. Quem aceitou,
+    ao ler o SHM_SWITCH, faz o mesmo e apaga os nomes (os dois lados já
+    abriram tudo). A oferta vem pela rede: attach() só aceita segmentos e
+    FIFOs com os nomes que create() gera (ver _check_offer).
+    """
+    def __init__(self, out, tx: ShmRing, rx: ShmRing, tmpdir: Optional[str] = None):
+        self.out = out
+        self.tx = tx
+        self.rx = rx
+        self.tmpdir = tmpdir
+
+    @classmethod
+    def create(cls, out, size: int = DEFAULT_RING_BYTES) -> "ShmLink":
+        tmpdir = tempfile.mkdtemp(prefix=PREFIX)
+        tx = rx = None
+        try:
+            tx = ShmRing.create(size, os.path.join(tmpdir, _FIFO_NAMES[0]), out.sock)
+            rx = ShmRing.create(size, os.path.join(tmpdir, _FIFO_NAMES[1]), out.sock)
+        except Exception:
+            for ring in (tx, rx):
+                if ring is not None:
+                    ring.close()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        return cls(out, tx, rx, tmpdir)
+
+    @classmethod
+    def attach(cls, out, offer: dict) -> "ShmLink":
+        (a2d, d2a), (f_a2d, f_d2a) = _check_offer(offer)
+        rx = ShmRing.attach(a2d, f_a2d, out.sock)
+        try:
+            tx = ShmRing.attach(d2a, f_d2a, out.sock)
+        except Exception:
+            rx.close()
+            raise
+        return cls(out, tx, rx)
+
+    def offer(self) -> dict:
+        return {"rings": [self.tx.name, self.rx.name], "fifos": [self.tx.fifo_path, self.rx.fifo_path]}
+
+    def unlink(self):
+        self.tx.unlink()
+        self.rx.unlink()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+    def close(self):
+        self.tx.close()
+        self.rx.close()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
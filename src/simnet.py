@@ -0,0 +1,443 @@
+import errno
+import heapq
+import random
+import itertools
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common import FrameTooLarge, DEFAULT_MAX_FRAME
+from outbound import Frame, LaneQueue, DROP_OLDEST, DISCONNECT, POLICIES, DEFAULT_BATCH_BYTES, DEFAULT_WEIGHTS, INTERACTIVE
+from transport import Ticker
+
+Addr = Tuple[str, int]
+
+
+class LinkSpec:
+    """Características de um sentido de enlace simulado."""
+    __slots__ = ("latency", "jitter", "bandwidth", "loss")
+
+    def __init__(self, latency: float = 0.005, jitter: float = 0.0, bandwidth: float = 0.0, loss: float = 0.0):
+        self.latency = latency      # s, propagação
+        self.jitter = jitter        # s, somado uniformemente em [0, jitter]
+        self.bandwidth = bandwidth  # bytes/s (0 = sem limite)
+        self.loss = loss            # probabilidade de um frame sumir
+
+    def as_dict(self) -> dict:
+        return {"latency": self.latency, "jitter": self.jitter, "bandwidth": self.bandwidth, "loss": self.loss}
+
+
+class SimNetwork:
+    """
+    Rede em memória com relógio virtual, para rodar milhares de PeerCore
+    num processo só.
+
+    Tudo acontece num escalonador de eventos (heap por tempo virtual e
+    ordem de agendamento) executado por uma única thread: entrega de
+    frames, accept, timers dos componentes e discagens. Com a mesma
+    semente, a mesma sequência de chamadas produz exatamente a mesma
+    execução, inclusive perdas e jitter.
+
+    Cada frame ocupa o sentido do enlace por tamanho / bandwidth
+    (serialização, em fila atrás dos anteriores), chega `latency` (+ um
+    jitter sorteado) depois e é entregue em ordem, como no TCP. Com
+    `loss` o frame some no caminho, sem retransmissão: é o que exercita
+    o reparo do Plumtree e a sincronização de histórico.
+    Os padrões valem para todos os enlaces; set_link() muda um par de nós.
+
+    Timers periódicos reagendam a si mesmos, então com eles ativos a fila
+    nunca esvazia: use run(until=...) ou run_while(...).
+    """
+    def __init__(self, seed: int = 0, latency: float = 0.005, jitter: float = 0.0,
+                 bandwidth: float = 0.0, loss: float = 0.0):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.default = LinkSpec(latency, jitter, bandwidth, loss)
+        self._links: Dict[Tuple[Optional[str], Optional[str]], LinkSpec] = {}
+        self._listeners: Dict[Addr, Callable] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._ports = itertools.count(40000)
+        self.now = 0.0
+        self.events = 0
+        self.frames = 0
+        self.bytes = 0
+        self.lost = 0
+        self.delivered = 0
+
+    # ---- topologia -----------------------------------------------------
+
+    def transport(self) -> "SimTransport":
+        """Transporte para um nó novo (cada um com o próprio gerador, derivado da semente)."""
+        return SimTransport(self, random.Random(self.rng.getrandbits(64)))
+
+    def link(self, a: Optional[str], b: Optional[str]) -> LinkSpec:
+        return self._links.get((a, b), self.default)
+
+    def set_link(self, a: str, b: str, latency: Optional[float] = None, jitter: Optional[float] = None,
+                 bandwidth: Optional[float] = None, loss: Optional[float] = None, both: bool = True):
+        """Sobrescreve o enlace entre os nós `a` e `b` ("host:porta" em que escutam)."""
+        base = self.link(a, b)
+        spec = LinkSpec(base.latency if latency is None else latency,
+                        base.jitter if jitter is None else jitter,
+                        base.bandwidth if bandwidth is None else bandwidth,
+                        base.loss if loss is None else loss)
+        self._links[(a, b)] = spec
+        if both:
+            self._links[(b, a)] = spec
+
+    # ---- escalonador ---------------------------------------------------
+
+    def call_at(self, t: float, fn: Callable, *args):
+        heapq.heappush(self._heap, (t, next(self._seq), fn, args))
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        self.call_at(self.now + max(0.0, delay), fn, *args)
+
+    def run(self, until: Optional[float] = None, max_events: Optional[int] = None) -> int:
+        """Processa eventos até o tempo virtual `until` (ou a fila esvaziar). Retorna quantos."""
+        heap = self._heap
+        n = 0
+        while heap and (max_events is None or n < max_events):
+            t = heap[0][0]
+            if until is not None and t > until:
+                break
+            _, _, fn, args = heapq.heappop(heap)
+            self.now = t
+            fn(*args)
+            n += 1
+        if until is not None and self.now < until and (max_events is None or n < max_events):
+            self.now = until
+        self.events += n
+        return n
+
+    def run_while(self, cond: Callable[[], bool], timeout: float, step: float = 0.01) -> bool:
+        """Avança em passos de `step` enquanto cond() for verdadeiro. False se estourou `timeout` (virtual)."""
+        deadline = self.now + timeout
+        while cond():
+            if self.now >= deadline:
+                return False
+            self.run(until=min(deadline, self.now + step))
+        return True
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> dict:
+        return {
+            "seed": self.seed,
+            "now": round(self.now, 6),
+            "events": self.events,
+            "pending": len(self._heap),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "delivered": self.delivered,
+            "lost": self.lost,
+            "listeners": len(self._listeners),
+            "default_link": self.default.as_dict(),
+        }
+
+
+class SimConn:
+    """Uma ponta de conexão simulada (o "socket" do SimTransport)."""
+    def __init__(self, net: SimNetwork, local: Optional[str], label: str):
+        self.net = net
+        self.local = local  # "host:porta" em que o dono escuta (chave do LinkSpec)
+        self.label = label  # como o outro lado aparece, igual ao peer_label do socket
+        self.peer: Optional["SimConn"] = None
+        self.on_frame: Optional[Callable] = None
+        self.on_closed: Optional[Callable[[], None]] = None
+        self.on_error: Optional[Callable[[Exception], None]] = None
+        self.max_frame = DEFAULT_MAX_FRAME
+        self.open = True
+        self.in_flight = 0
+        self._pending: List[bytes] = []
+        self._ended = False
+        self._busy_until = 0.0
+        self._last_arrival = 0.0
+
+    def _spec(self) -> LinkSpec:
+        return self.net.link(self.local, self.peer.local)
+
+    def send(self, body: bytes):
+        net = self.net
+        spec = self._spec()
+        size = 4 + len(body)
+        start = max(net.now, self._busy_until)
+        done = start + size / spec.bandwidth if spec.bandwidth else start
+        self._busy_until = done
+        arrival = done + spec.latency
+        if spec.jitter:
+            arrival += net.rng.uniform(0.0, spec.jitter)
+        # Entrega em ordem: o jitter não deixa um frame passar o anterior.
+        if arrival < self._last_arrival:
+            arrival = self._last_arrival
+        self._last_arrival = arrival
+        self.in_flight += 1
+        net.frames += 1
+        net.bytes += size
+        lost = spec.loss > 0 and net.rng.random() < spec.loss
+        if lost:
+            net.lost += 1
+        net.call_at(arrival, self._arrive, body, lost)
+
+    def _arrive(self, body: bytes, lost: bool):
+        self.in_flight -= 1
+        if not lost:
+            self.peer._receive(body)
+
+    def _receive(self, body: bytes):
+        if not self.open:
+            return
+        if self.on_frame is None:
+            # Chegou antes do accept ser processado.
+            self._pending.append(body)
+            return
+        if len(body) > self.max_frame:
+            if self.on_error is not None:
+                self.on_error(FrameTooLarge(f"frame de {len(body)} bytes acima do limite ({self.max_frame})"))
+            self.shutdown()
+            return
+        self.net.delivered += 1
+        self.on_frame(body)
+
+    def serve(self, on_frame, on_closed, max_frame: int, on_error):
+        self.on_frame, self.on_closed = on_frame, on_closed
+        self.max_frame, self.on_error = max_frame, on_error
+        # Na hora, não agendado: outro frame pode já estar marcado para este instante.
+        pending, self._pending = self._pending, []
+        for body in pending:
+            self._receive(body)
+        if self._ended:
+            self._ended = False
+            self.net.call_later(0.0, self._end)
+
+    def shutdown(self):
+        """Fecha os dois sentidos: o leitor local termina já, o outro lado vê EOF após a latência."""
+        if not self.open:
+            return
+        self.open = False
+        self._pending.clear()
+        net = self.net
+        net.call_later(0.0, self._end)
+        peer = self.peer
+        if peer is not None and peer.open:
+            net.call_at(max(net.now + self._spec().latency, self._last_arrival), peer._end)
+
+    def _end(self):
+        if self._ended:
+            return
+        self._ended = True
+        if self.on_closed is not None:
+            self.on_closed()
+
+    def close(self):
+        self.shutdown()
+
+
+class SimOutbound:
+    """
+    Mesma interface do Outbound sobre uma SimConn, sem thread escritora:
+    com o enlace livre o frame vai direto para a rede simulada; enquanto
+    ele serializa um frame anterior (banda limitada) os próximos esperam
+    nas faixas (ver outbound.LaneQueue) e saem um a um, na ordem dos
+    pesos, quando o enlace libera. A "fila" são esses frames mais os
+    ainda em trânsito (limitados a `maxlen`); drop_oldest e drop_newest
+    descartam o que chega.
+    """
+    def __init__(self, conn: SimConn, maxlen: int = 1024, policy: str = DROP_OLDEST,
+                 on_close: Optional[Callable[["SimOutbound", Optional[Exception]], None]] = None,
+                 max_batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 weights=DEFAULT_WEIGHTS):
+        if policy not in POLICIES:
+            raise ValueError(f"política inválida: {policy}")
+        self.conn = conn
+        self.maxlen = maxlen
+        self.policy = policy
+        self.name = conn.label
+        self.on_close = on_close
+        self.codec = "json"
+        self.before_send: Optional[Callable[[bytes], Optional[bytes]]] = None
+        self.sent = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.frames_in = 0
+        self.bytes_in = 0
+        self._closed = False
+        self._lanes = LaneQueue(weights)
+        self._draining = False
+
+    def enqueue(self, frame: Frame, lane: int = INTERACTIVE) -> bool:
+        if self._closed:
+            return False
+        conn = self.conn
+        lanes = self._lanes
+        if conn.in_flight + lanes.depth >= self.maxlen:
+            self.dropped += 1
+            lanes.dropped[lane] += 1
+            if self.policy == DISCONNECT:
+                self.close(OverflowError(f"fila de saída cheia ({self.maxlen})"))
+            return False
+        if lanes.depth or conn._busy_until > conn.net.now:
+            lanes.push(frame, lane)
+            if not self._draining:
+                self._draining = True
+                conn.net.call_at(conn._busy_until, self._drain)
+        else:
+            lanes.sent[lane] += 1
+            self._send(frame[1])
+        depth = conn.in_flight + lanes.depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def enqueue_many(self, items) -> int:
+        return sum(self.enqueue(frame, lane) for frame, lane in items)
+
+    def _send(self, body: bytes):
+        conn = self.conn
+        if self.before_send is not None:
+            extra = self.before_send(body)
+            if extra is not None:
+                conn.send(extra)
+        conn.send(body)
+        self.sent += 1
+        self.bytes_out += 4 + len(body)
+
+    def _drain(self):
+        """Enlace livre: manda o próximo frame das faixas e volta quando ele terminar de sair."""
+        self._draining = False
+        if self._closed:
+            return
+        conn = self.conn
+        lane = self._lanes.next()
+        if lane is None:
+            return
+        self._send(self._lanes.pop(lane)[1])
+        if self._lanes.depth:
+            self._draining = True
+            conn.net.call_at(conn._busy_until, self._drain)
+
+    def close(self, err: Optional[Exception] = None):
+        if self._closed:
+            return
+        self._closed = True
+        self._lanes.clear()
+        self.conn.shutdown()
+        if self.on_close is not None:
+            self.on_close(self, err)
+
+    def depth(self, lane: Optional[int] = None) -> int:
+        if lane is None:
+            return self.conn.in_flight + self._lanes.depth
+        return len(self._lanes.queues[lane])
+
+    def stats(self) -> dict:
+        return {
+            "peer": self.name,
+            "depth": self.conn.in_flight + self._lanes.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "bytes_out": self.bytes_out,
+            "frames_in": self.frames_in,
+            "bytes_in": self.bytes_in,
+            "dropped": self.dropped,
+            "policy": self.policy,
+            "codec": self.codec,
+            "transport": "sim",
+            "lanes": self._lanes.stats(),
+        }
+
+
+class _SimListener:
+    def __init__(self, net: SimNetwork, addr: Addr):
+        self.net = net
+        self.addr = addr
+
+    def close(self):
+        self.net._listeners.pop(self.addr, None)
+
+
+class SimTransport:
+    """
+    Transporte de um nó na SimNetwork: a interface do TcpTransport (ver
+    transport.py) mais o relógio, os timers e o gerador aleatório do
+    runtime, todos virtuais. Discar não bloqueia: a conexão volta na hora
+    e o accept do outro lado acontece uma latência depois.
+    """
+    def __init__(self, net: SimNetwork, rng: random.Random):
+        self.net = net
+        self.rng = rng
+        self.addr: Optional[str] = None
+
+    # ---- runtime -------------------------------------------------------
+
+    def now(self) -> float:
+        return self.net.now
+
+    def spawn(self, fn: Callable, *args):
+        self.net.call_later(0.0, fn, *args)
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        self.net.call_later(delay, fn, *args)
+
+    def every(self, interval: float, fn: Callable[[], None]) -> Ticker:
+        ticker = Ticker()
+        net = self.net
+
+        def fire():
+            if ticker.cancelled:
+                return
+            fn()
+            if not ticker.cancelled:
+                net.call_later(interval, fire)
+        # Fase sorteada: milhares de nós não disparam todos no mesmo instante.
+        net.call_later(interval * (0.5 + self.rng.random()), fire)
+        return ticker
+
+    # ---- transporte ----------------------------------------------------
+
+    def listen(self, host: str, port: int, on_accept: Callable[[object, Addr], None]) -> _SimListener:
+        if (host, port) in self.net._listeners:
+            raise OSError(errno.EADDRINUSE, f"endereço em uso (simulado): {host}:{port}")
+        self.net._listeners[(host, port)] = on_accept
+        self.addr = f"{host}:{port}"
+        return _SimListener(self.net, (host, port))
+
+    def connect(self, host: str, port: int, timeout: float) -> SimConn:
+        net = self.net
+        on_accept = net._listeners.get((host, port))
+        if on_accept is None:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, f"conexão recusada (simulada): {host}:{port}")
+        remote = f"{host}:{port}"
+        spec = net.link(self.addr, remote)
+        if spec.loss >= 1.0:
+            raise TimeoutError("timed out")
+        local_host = self.addr.rpartition(":")[0] if self.addr else "sim"
+        eph = next(net._ports)
+        local = SimConn(net, self.addr, remote)
+        far = SimConn(net, remote, f"{local_host}:{eph}")
+        local.peer, far.peer = far, local
+        net.call_later(spec.latency, self._accept, (host, port), on_accept, far, (local_host, eph))
+        return local
+
+    def _accept(self, key: Addr, on_accept, conn: SimConn, addr: Addr):
+        if self.net._listeners.get(key) is not on_accept:
+            # O nó parou de escutar antes do accept: quem discou vê EOF.
+            conn.shutdown()
+            return
+        on_accept(conn, addr)
+
+    def outbound(self, conn: SimConn, maxlen: int = 1024, policy: str = DROP_OLDEST,
+                 on_close=None, max_batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 weights=DEFAULT_WEIGHTS) -> SimOutbound:
+        return SimOutbound(conn, maxlen, policy, on_close=on_close, weights=weights)
+
+    def serve(self, conn: SimConn, on_frame: Callable, on_closed: Callable[[], None],
+              max_frame: int = DEFAULT_MAX_FRAME, on_error: Optional[Callable[[Exception], None]] = None):
+        conn.serve(on_frame, on_closed, max_frame, on_error)
+
+    def hello_extra(self, out: SimOutbound) -> dict:
+        return {}
+
+    def on_hello(self, out: SimOutbound, msg_type: str, payload: dict) -> Optional[dict]:
+        return None
@@ -0,0 +1,157 @@
+import json
+import time
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+DROP = "drop"
+DISCONNECT = "disconnect"
+SSE_POLICIES = (DROP, DISCONNECT)
+
+
+class _Client:
+    __slots__ = ("cursor",)
+
+    def __init__(self, cursor: int):
+        self.cursor = cursor
+
+
+class SSEHub:
+    """
+    Fan-out de Server-Sent Events para muitos clientes.
+
+    Cada evento é serializado uma única vez e guardado num anel de histórico
+    compartilhado (slot = id % history); um cliente é só um cursor nesse
+    anel. Quem publica nunca disputa lock com os clientes: grava o slot,
+    avança o id e sinaliza a thread despachante, que acorda os clientes no
+    máximo uma vez a cada `coalesce_ms`; cada um manda tudo o que chegou
+    nesse intervalo numa única escrita.
+
+    Um cliente que fica mais de `client_buffer` eventos atrás pula os mais
+    antigos (drop) ou é desconectado (disconnect). Reconexões com
+    Last-Event-ID retomam de onde pararam enquanto o id estiver no histórico.
+    """
+    def __init__(self, history: int = 4096, client_buffer: int = 1024, policy: str = DROP,
+                 coalesce_ms: float = 20.0, keepalive: float = 15.0):
+        if policy not in SSE_POLICIES:
+            raise ValueError(f"política inválida: {policy}")
+        self.history = history
+        # Folga de meio anel: um slot lido nunca está sendo sobrescrito.
+        self.client_buffer = max(1, min(client_buffer, history // 2))
+        self.policy = policy
+        self.coalesce = coalesce_ms / 1000.0
+        self.keepalive = keepalive
+        self._ring: List[Optional[Tuple[int, bytes]]] = [None] * history
+        self._last_id = 0
+        self._pub_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending = threading.Event()
+        self._clients = set()
+        self.published = 0
+        self.writes = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self.resumed = 0
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _dispatch(self):
+        while True:
+            self._pending.wait()
+            if self.coalesce > 0:
+                time.sleep(self.coalesce)
+            self._pending.clear()
+            with self._cond:
+                self._cond.notify_all()
+
+    def publish(self, evt: dict) -> int:
+        """Serializa e publica o evento para todos os clientes. Retorna o id."""
+        data = json.dumps(evt)
+        with self._pub_lock:
+            eid = self._last_id + 1
+            self._ring[eid % self.history] = (eid, f"id: {eid}\ndata: {data}\n\n".encode("utf-8"))
+            self._last_id = eid
+            self.published += 1
+        if not self._pending.is_set():
+            self._pending.set()
+        return eid
+
+    def stream(self, last_event_id: Optional[str] = None, hello: Optional[dict] = None) -> Iterator[bytes]:
+        """Gerador de corpo de resposta para um cliente (um bytes por escrita)."""
+        head = self._last_id
+        cursor = head
+        if last_event_id:
+            try:
+                cursor = max(0, min(int(last_event_id), head))
+                self.resumed += 1
+            except ValueError:
+                pass
+        client = _Client(cursor)
+        with self._cond:
+            self._clients.add(client)
+        # O cliente entra no hub já aqui, não na primeira iteração do gerador.
+        return self._run(client, hello)
+
+    def _run(self, client: _Client, hello: Optional[dict]) -> Iterator[bytes]:
+        try:
+            if hello is not None:
+                yield _unnamed(hello)
+            while True:
+                if self._last_id <= client.cursor:
+                    with self._cond:
+                        if self._last_id <= client.cursor:
+                            self._cond.wait(self.keepalive)
+                if self._last_id <= client.cursor:
+                    yield b": keepalive\n\n"
+                    continue
+                chunk = self._take(client)
+                if chunk is None:
+                    return
+                self.writes += 1
+                yield chunk
+        finally:
+            with self._cond:
+                self._clients.discard(client)
+
+    def _take(self, client: _Client) -> Optional[bytes]:
+        """Tudo o que o cliente ainda não recebeu, aplicando o limite de atraso."""
+        head = self._last_id
+        first = client.cursor + 1
+        if head - client.cursor > self.client_buffer:
+            if self.policy == DISCONNECT:
+                self.disconnected += 1
+                return None
+            first = head - self.client_buffer + 1
+        chunks = []
+        ring = self._ring
+        for eid in range(first, head + 1):
+            slot = ring[eid % self.history]
+            if slot is not None and slot[0] == eid:
+                chunks.append(slot[1])
+        gap = (head - client.cursor) - len(chunks)
+        client.cursor = head
+        if gap:
+            self.dropped += gap
+            chunks.insert(0, _unnamed({"type": "log", "payload": f"[SSE] {gap} eventos descartados (cliente lento)"}))
+        return b"".join(chunks)
+
+    def lags(self) -> List[int]:
+        head = self._last_id
+        with self._cond:
+            return [head - c.cursor for c in self._clients]
+
+    def stats(self) -> dict:
+        lags = self.lags()
+        return {
+            "clients": len(lags),
+            "published": self.published,
+            "writes": self.writes,
+            "dropped": self.dropped,
+            "disconnected": self.disconnected,
+            "resumed": self.resumed,
+            "max_lag": max(lags, default=0),
+            "policy": self.policy,
+        }
+
+
+def _unnamed(evt: dict) -> bytes:
+    """Evento fora do histórico (sem id, não entra no replay)."""
+    return f"data: {json.dumps(evt)}\n\n".encode("utf-8")
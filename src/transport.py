@@ -0,0 +1,225 @@
+import time
+import random
+import socket
+import threading
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import shmring
+from codec import HELLO, HELLO_ACK, DECODE_ERRORS
+from common import FrameReader, FrameTooLarge, DEFAULT_MAX_FRAME
+from outbound import Outbound, DROP_OLDEST, DEFAULT_BATCH_BYTES, DEFAULT_WEIGHTS, make_frame
+
+Addr = Tuple[str, int]
+
+
+class Ticker:
+    """Timer periódico devolvido por every(); cancel() encerra."""
+    __slots__ = ("cancelled",)
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ThreadRuntime:
+    """
+    Relógio, timers e aleatoriedade dos componentes do nó (Plumtree,
+    ConnectionManager, PeerExchange, HistorySync). Aqui é o de verdade:
+    time.monotonic e threads daemon. O simulador (simnet.py) troca por
+    tempo virtual e um gerador com semente, sem mudar os componentes.
+    """
+    rng = random
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def spawn(self, fn: Callable, *args):
+        threading.Thread(target=fn, args=args, daemon=True).start()
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        def run():
+            time.sleep(delay)
+            fn(*args)
+        self.spawn(run)
+
+    def every(self, interval: float, fn: Callable[[], None]) -> Ticker:
+        ticker = Ticker()
+
+        def run():
+            while not ticker.cancelled:
+                time.sleep(interval)
+                if not ticker.cancelled:
+                    fn()
+        self.spawn(run)
+        return ticker
+
+
+THREADS = ThreadRuntime()
+
+
+class TcpListener:
+    def __init__(self, srv: socket.socket):
+        self.srv = srv
+
+    def close(self):
+        # shutdown acorda o accept() bloqueado; só close() não libera a porta.
+        try:
+            self.srv.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.srv.close()
+
+
+class TcpTransport(ThreadRuntime):
+    """
+    Transporte padrão dos peers: sockets TCP, uma thread leitora por
+    conexão e um Outbound (fila + thread escritora) por vizinho.
+
+    Interface usada por PeerCore e Peer (a mesma do SimTransport):
+      listen(host, port, on_accept) -> objeto com close()
+      connect(host, port, timeout) -> conexão (levanta OSError)
+      outbound(conn, ...) -> Outbound
+      serve(conn, on_frame, on_closed, max_frame, on_error)
+    on_frame(data) recebe o corpo de cada frame; on_closed() é chamado
+    uma vez quando a leitura termina (EOF, erro ou close do Outbound).
+
+    Vizinho no mesmo host: hello_extra(out) vai no hello de quem disca e
+    on_hello(out, tipo, payload) trata hello/hello_ack. Com os dois lados
+    na mesma máquina (e `shm` ligado) o enlace passa para um par de anéis
+    em memória compartilhada (ver shmring.py) logo após o handshake; os
+    frames são os mesmos do TCP e o socket fica aberto só para detectar
+    queda. Se algo falhar no caminho, a conexão segue no TCP.
+    """
+    def __init__(self, shm: bool = True, ring_bytes: int = shmring.DEFAULT_RING_BYTES):
+        self.host_id = shmring.host_id() if shm else None
+        self.ring_bytes = ring_bytes
+        self._links: Dict[object, shmring.ShmLink] = {}
+        # Conexões em que pedimos shm no hello: só nelas um hello_ack com oferta vale.
+        self._offered: Set[object] = set()
+        self._links_lock = threading.Lock()
+
+    def listen(self, host: str, port: int, on_accept: Callable[[object, Addr], None]) -> TcpListener:
+        # Bind síncrono: porta ocupada falha aqui, não na thread de accept.
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind((host, port))
+        srv.listen()
+        self.spawn(self._accept_loop, srv, on_accept)
+        return TcpListener(srv)
+
+    @staticmethod
+    def _accept_loop(srv: socket.socket, on_accept):
+        while True:
+            try:
+                conn, addr = srv.accept()
+            except OSError:
+                break
+            on_accept(conn, addr)
+        try:
+            srv.close()
+        except Exception:
+            pass
+
+    def connect(self, host: str, port: int, timeout: float) -> socket.socket:
+        s = socket.create_connection((host, port), timeout=timeout)
+        s.settimeout(None)
+        return s
+
+    def outbound(self, conn: socket.socket, maxlen: int = 1024, policy: str = DROP_OLDEST,
+                 on_close=None, max_batch_bytes: int = DEFAULT_BATCH_BYTES, linger_us: int = 0,
+                 weights=DEFAULT_WEIGHTS) -> Outbound:
+        return Outbound(conn, maxlen, policy, on_close=on_close,
+                        max_batch_bytes=max_batch_bytes, linger_us=linger_us, weights=weights)
+
+    def serve(self, conn: socket.socket, on_frame: Callable, on_closed: Callable[[], None],
+              max_frame: int = DEFAULT_MAX_FRAME, on_error: Optional[Callable[[Exception], None]] = None):
+        self.spawn(self._read_loop, conn, on_frame, on_closed, max_frame, on_error)
+
+    def _read_loop(self, conn, on_frame, on_closed, max_frame, on_error):
+        reader = FrameReader(conn, max_frame=max_frame)
+        marker = shmring.SHM_SWITCH
+        try:
+            while True:
+                try:
+                    data = reader.read_frame()
+                except FrameTooLarge as e:
+                    if on_error is not None:
+                        on_error(e)
+                    break
+                except OSError:
+                    break
+                if not data:
+                    break
+                if self._links and len(data) == len(marker) and data == marker:
+                    link = self._links.get(conn)
+                    if link is not None:
+                        # Daqui em diante o outro lado escreve no anel.
+                        reader = FrameReader(link.rx, max_frame=max_frame)
+                        if link.tmpdir is not None:
+                            link.out.switch_sink(make_frame(marker), link.tx)
+                            link.unlink()
+                        continue
+                try:
+                    on_frame(data)
+                except DECODE_ERRORS as e:
+                    # Frame malformado: descartado; a conexão e os próximos frames seguem.
+                    if on_error is not None:
+                        on_error(e)
+        finally:
+            # Primeiro o nó fecha o Outbound (acorda uma escrita presa no anel cheio).
+            on_closed()
+            with self._links_lock:
+                link = self._links.pop(conn, None)
+                self._offered.discard(conn)
+            if link is not None:
+                link.close()
+
+    # ---- memória compartilhada -------------------------------------------
+
+    def hello_extra(self, out: Outbound) -> dict:
+        """Campos do transporte no hello de quem disca (em `out`)."""
+        if not self.host_id:
+            return {}
+        with self._links_lock:
+            self._offered.add(out.sock)
+        return {"shm": self.host_id}
+
+    def on_hello(self, out: Outbound, msg_type: str, payload: dict) -> Optional[dict]:
+        """
+        hello (quem aceitou): se quem discou está no mesmo host, cria os
+        anéis e devolve a oferta para o hello_ack. hello_ack (quem discou):
+        anexa os anéis oferecidos e troca a escrita para eles, se pediu shm
+        nesta conexão e a oferta passa na validação do shmring; senão
+        segue no TCP.
+        """
+        if not self.host_id:
+            return None
+        offer = payload.get("shm")
+        try:
+            if msg_type == HELLO and offer == self.host_id:
+                link = shmring.ShmLink.create(out, self.ring_bytes)
+                self._register(out.sock, link)
+                return {"shm": link.offer()}
+            if msg_type == HELLO_ACK and isinstance(offer, dict):
+                with self._links_lock:
+                    if out.sock not in self._offered:
+                        return None
+                    self._offered.discard(out.sock)
+                link = shmring.ShmLink.attach(out, offer)
+                self._register(out.sock, link)
+                out.switch_sink(make_frame(shmring.SHM_SWITCH), link.tx)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _register(self, conn, link: shmring.ShmLink):
+        with self._links_lock:
+            old = self._links.pop(conn, None)
+            self._links[conn] = link
+        if old is not None:
+            old.close()
+
+    def shm_links(self) -> int:
+        return len(self._links)